@@ -0,0 +1,16 @@
+-- Допустимые значения sonar_api_calls.status
+-- replayed     - ответ из кассеты (AI_CASSETTE_MODE=replay/hybrid), реального вызова API
+--                не было: в расходы (creditsTracker) не входит
+-- server_error - HTTP 5xx (SonarApiClient пишет его давно, но исходный CHECK его не пускал)
+
+ALTER TABLE sonar_api_calls
+DROP CONSTRAINT IF EXISTS sonar_api_calls_status_check;
+
+ALTER TABLE sonar_api_calls
+ADD CONSTRAINT sonar_api_calls_status_check
+CHECK (status IN ('success', 'rate_limited', 'error', 'timeout', 'server_error', 'replayed'));
+
+-- Реальные вызовы без воспроизведенных
+-- SELECT stage, status, COUNT(*) FROM sonar_api_calls
+-- WHERE status <> 'replayed'
+-- GROUP BY stage, status;
@@ -0,0 +1,18 @@
+-- Поэтапные тайминги HTTP запросов к Sonar API
+-- phase_timings: { reused, queued, dns, connect, tls, ttfb, download, parse, total } в мс
+-- connection_reused: запрос ушел по уже открытому keep-alive соединению
+
+ALTER TABLE sonar_api_calls
+ADD COLUMN IF NOT EXISTS phase_timings JSONB;
+
+ALTER TABLE sonar_api_calls
+ADD COLUMN IF NOT EXISTS connection_reused BOOLEAN;
+
+-- Сравнение latency новых и переиспользованных соединений
+-- SELECT connection_reused,
+--        COUNT(*) AS calls,
+--        AVG((phase_timings->>'ttfb')::float) AS avg_ttfb_ms,
+--        AVG((phase_timings->>'total')::float) AS avg_total_ms
+-- FROM sonar_api_calls
+-- WHERE phase_timings IS NOT NULL
+-- GROUP BY connection_reused;
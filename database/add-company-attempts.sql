@@ -0,0 +1,26 @@
+-- Журнал попыток поиска сайта (Stage 2) и email (Stage 3)
+-- RetryScheduler по журналу решает, кого и каким провайдером повторять в
+-- Stage2Retry / Stage3Retry: пауза после неудачи, бюджет попыток, канал,
+-- который еще не пробовали. Повторный запуск Retry больше не тратит вызовы
+-- на компании, которые не нашлись час назад.
+
+CREATE TABLE IF NOT EXISTS company_attempts (
+  attempt_id BIGSERIAL PRIMARY KEY,
+  company_id UUID NOT NULL REFERENCES pending_companies(company_id) ON DELETE CASCADE,
+  stage VARCHAR(20) NOT NULL,          -- stage2 | stage3
+  provider VARCHAR(20) NOT NULL,       -- sonar | deepseek
+  strategy INTEGER NOT NULL DEFAULT 0, -- 0 - основной проход, 1/2 - промпты Retry
+  outcome VARCHAR(20) NOT NULL,        -- found | not_found | error
+  failure_class VARCHAR(30),           -- no_result | invalid_result | timeout | rate_limited | server_error | error
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- История компаний при планировании (WHERE stage = ? AND company_id IN (...) ORDER BY created_at)
+CREATE INDEX IF NOT EXISTS idx_company_attempts_company_stage
+  ON company_attempts(company_id, stage, created_at);
+
+-- Доля успехов канала (count по stage, provider, strategy, outcome)
+CREATE INDEX IF NOT EXISTS idx_company_attempts_channel
+  ON company_attempts(stage, provider, strategy, outcome);
+
+COMMENT ON TABLE company_attempts IS 'Попытки поиска сайта/email по компаниям (Stage 2/3 и Retry)';
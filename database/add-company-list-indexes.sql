@@ -0,0 +1,29 @@
+-- Индексы для списка компаний (GET /api/debug/companies, GET /api/companies)
+-- Keyset пагинация идет по (created_at, company_id), фильтры выполняются в БД -
+-- страница читается по индексу, без полного прохода по таблице
+
+-- Порядок страниц: WHERE (created_at, company_id) > (курсор) ORDER BY created_at, company_id
+CREATE INDEX IF NOT EXISTS idx_pending_companies_created_id
+  ON pending_companies(created_at, company_id);
+
+-- То же внутри сессии (results.html, тестовые скрипты с session_id)
+CREATE INDEX IF NOT EXISTS idx_pending_companies_session_created_id
+  ON pending_companies(session_id, created_at, company_id);
+
+-- has_website=true / has_email=true: частичные индексы по заполненным контактам
+CREATE INDEX IF NOT EXISTS idx_pending_companies_with_website
+  ON pending_companies(created_at, company_id)
+  WHERE website IS NOT NULL AND website <> '';
+
+CREATE INDEX IF NOT EXISTS idx_pending_companies_with_email
+  ON pending_companies(created_at, company_id)
+  WHERE email IS NOT NULL AND email <> '';
+
+-- min_score / max_score
+CREATE INDEX IF NOT EXISTS idx_pending_companies_validation_score
+  ON pending_companies(validation_score)
+  WHERE validation_score IS NOT NULL;
+
+-- GET /api/companies: порядок date_added DESC, record_id DESC
+CREATE INDEX IF NOT EXISTS idx_company_records_date_added_id
+  ON company_records(date_added DESC, record_id DESC);
@@ -0,0 +1,42 @@
+-- Персистентные задания для global Stage 2/3/4
+-- Курсор и журнал компаний переживают редеплой Railway / OOM,
+-- POST /api/sessions/global/jobs/:id/resume продолжает с места остановки
+
+CREATE TABLE IF NOT EXISTS global_jobs (
+  job_id UUID PRIMARY KEY,
+  stage VARCHAR(20) NOT NULL,                      -- stage2, stage3, stage4
+  status VARCHAR(20) NOT NULL DEFAULT 'running',   -- running, completed, failed, interrupted
+  total INTEGER NOT NULL DEFAULT 0,
+  completed INTEGER NOT NULL DEFAULT 0,
+  failed INTEGER NOT NULL DEFAULT 0,
+  current_company TEXT,
+  result JSONB,
+  last_error TEXT,
+  resume_count INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  heartbeat_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  finished_at TIMESTAMP WITH TIME ZONE
+);
+
+CREATE INDEX IF NOT EXISTS idx_global_jobs_stage_status ON global_jobs(stage, status);
+CREATE INDEX IF NOT EXISTS idx_global_jobs_created_at ON global_jobs(created_at DESC);
+
+-- Журнал компаний задания: снимок на момент запуска + отметки завершения
+CREATE TABLE IF NOT EXISTS global_job_items (
+  job_id UUID NOT NULL REFERENCES global_jobs(job_id) ON DELETE CASCADE,
+  company_id UUID NOT NULL,
+  status VARCHAR(20) NOT NULL DEFAULT 'pending',   -- pending, in_flight, completed, failed
+  attempts INTEGER NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+  PRIMARY KEY (job_id, company_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_global_job_items_status ON global_job_items(job_id, status);
+
+COMMENT ON TABLE global_jobs IS 'Задания global обработки Stage 2/3/4 (курсор для resume)';
+COMMENT ON COLUMN global_jobs.status IS 'running, completed, failed, interrupted (процесс упал - heartbeat устарел)';
+COMMENT ON COLUMN global_jobs.heartbeat_at IS 'Обновляется после каждого батча; устаревший heartbeat у running = прерванное задание';
+COMMENT ON COLUMN global_jobs.result IS 'Итог stage.execute() после завершения';
+COMMENT ON TABLE global_job_items IS 'Компании задания: pending -> in_flight -> completed/failed (идемпотентные отметки)';
+COMMENT ON COLUMN global_job_items.status IS 'failed = stage отработал, но ничего не нашел (кандидат для Retry)';
@@ -0,0 +1,26 @@
+-- Настройки структурированного логирования (src/services/Logger.js)
+-- level        - уровень по умолчанию: error | warn | info | debug
+-- level_<mod>  - уровень отдельного модуля (пусто = как level)
+-- sample_<mod> - доля info/debug строк модуля, 0..1 (пусто = все строки)
+-- Изменения применяются на лету через settings_version (add-settings-version.sql)
+
+INSERT INTO system_settings (category, key, value, description) VALUES
+  ('logging', 'level', 'info', 'Default log level (error, warn, info, debug)'),
+  ('logging', 'level_sonar', '', 'Log level for Perplexity Sonar client'),
+  ('logging', 'level_deepseek', '', 'Log level for DeepSeek client'),
+  ('logging', 'level_queue', '', 'Log level for global API queue'),
+  ('logging', 'level_db', '', 'Log level for database layer'),
+  ('logging', 'level_progress', '', 'Log level for global progress emitter'),
+  ('logging', 'level_stage1', '', 'Log level for Stage 1 (company search)'),
+  ('logging', 'level_stage2', '', 'Log level for Stage 2 (websites)'),
+  ('logging', 'level_stage3', '', 'Log level for Stage 3 (contacts)'),
+  ('logging', 'level_stage2-retry', '', 'Log level for Stage 2 Retry'),
+  ('logging', 'level_stage3-retry', '', 'Log level for Stage 3 Retry'),
+  ('logging', 'level_stage4', '', 'Log level for Stage 4 (AI validation)'),
+  ('logging', 'level_translation-worker', '', 'Log level for translation worker'),
+  ('logging', 'sample_queue', '', 'Sampling rate of info/debug queue logs (0..1)'),
+  ('logging', 'sample_db', '', 'Sampling rate of info/debug database logs (0..1)')
+ON CONFLICT (category, key) DO NOTHING;
+
+-- Проверка
+SELECT * FROM system_settings WHERE category = 'logging';
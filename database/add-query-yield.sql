@@ -0,0 +1,20 @@
+-- Результат выполнения поисковых запросов Stage 1
+-- QuerySimilarityIndex сравнивает новые запросы с историей: похожий запрос,
+-- который раньше почти не принес новых компаний, не отправляется в Sonar повторно
+
+ALTER TABLE session_queries
+  ADD COLUMN IF NOT EXISTS companies_found INTEGER,   -- компаний в ответах Sonar (до дедупликации)
+  ADD COLUMN IF NOT EXISTS new_companies INTEGER,     -- из них новых (после дедупликации и проверки БД)
+  ADD COLUMN IF NOT EXISTS executed_at TIMESTAMP WITH TIME ZONE;
+
+-- Дельта для индекса: новые запросы и новые результаты с прошлой загрузки
+CREATE INDEX IF NOT EXISTS idx_session_queries_created_at
+  ON session_queries(created_at);
+
+CREATE INDEX IF NOT EXISTS idx_session_queries_executed_at
+  ON session_queries(executed_at)
+  WHERE executed_at IS NOT NULL;
+
+COMMENT ON COLUMN session_queries.companies_found IS 'Компаний в ответах Sonar по запросу (Stage 1, последний запуск)';
+COMMENT ON COLUMN session_queries.new_companies IS 'Новых компаний по запросу после дедупликации (Stage 1, последний запуск)';
+COMMENT ON COLUMN session_queries.executed_at IS 'Когда запрос выполнялся в Stage 1 последний раз';
@@ -0,0 +1,22 @@
+-- Сжатое content-addressed хранилище сырых ответов AI
+-- stage1/2/3_raw_data в pending_companies хранят ссылку (*_ref = hash),
+-- полный текст ответа - здесь, один раз на одинаковый текст
+-- Перенос существующих строк: node scripts/migrate-raw-payloads.js
+
+CREATE TABLE IF NOT EXISTS raw_payloads (
+  hash CHAR(64) PRIMARY KEY,                 -- sha256 исходного текста (hex)
+  encoding VARCHAR(10) NOT NULL,             -- br | gzip
+  data TEXT NOT NULL,                        -- сжатые байты в base64
+  original_bytes INTEGER NOT NULL,
+  compressed_bytes INTEGER NOT NULL,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+COMMENT ON TABLE raw_payloads IS 'Сжатые сырые ответы AI (Stage 1-3), ключ - sha256 текста';
+COMMENT ON COLUMN raw_payloads.hash IS 'sha256 исходного текста, на него ссылаются поля *_ref в stageN_raw_data';
+
+-- GIN индексы по raw_data строились по полному тексту ответа AI.
+-- После переноса в raw_payloads поиск по содержимому ответа не используется
+DROP INDEX IF EXISTS idx_pending_companies_stage1_raw;
+DROP INDEX IF EXISTS idx_pending_companies_stage2_raw;
+DROP INDEX IF EXISTS idx_pending_companies_stage3_raw;
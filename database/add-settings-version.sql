@@ -0,0 +1,29 @@
+-- Версия настроек для межпроцессных уведомлений об изменениях
+-- SettingsManager каждую секунду читает settings_version.version и
+-- перечитывает снимок настроек только когда версия изменилась
+
+CREATE TABLE IF NOT EXISTS settings_version (
+  id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+INSERT INTO settings_version (id, version) VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
+
+-- Увеличивать версию на каждое изменение system_settings (одна операция = +1)
+CREATE OR REPLACE FUNCTION bump_settings_version()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE settings_version SET version = version + 1, updated_at = NOW() WHERE id = 1;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bump_settings_version_trigger ON system_settings;
+CREATE TRIGGER bump_settings_version_trigger
+  AFTER INSERT OR UPDATE OR DELETE ON system_settings
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_settings_version();
+
+-- Проверка
+SELECT * FROM settings_version;
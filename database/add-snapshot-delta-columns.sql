@@ -0,0 +1,26 @@
+-- Дельта для быстрого старта HybridDatabase (снимок на диске + изменения из Supabase)
+-- Строки, измененные после снимка, выбираются по updated_at >= high-water mark.
+-- У session_queries колонки updated_at не было - без нее таблица перечитывается целиком
+
+ALTER TABLE session_queries
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT NOW();
+
+-- Функция из supabase-schema.sql (на случай базы без нее)
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS update_session_queries_updated_at ON session_queries;
+CREATE TRIGGER update_session_queries_updated_at BEFORE UPDATE ON session_queries
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Запрос дельты: WHERE updated_at >= $hwm ORDER BY updated_at, <ключ>
+CREATE INDEX IF NOT EXISTS idx_search_sessions_updated_at ON search_sessions(updated_at);
+CREATE INDEX IF NOT EXISTS idx_session_queries_updated_at ON session_queries(updated_at);
+CREATE INDEX IF NOT EXISTS idx_pending_companies_updated_at ON pending_companies(updated_at);
+CREATE INDEX IF NOT EXISTS idx_found_companies_updated_at ON found_companies(updated_at);
+CREATE INDEX IF NOT EXISTS idx_processing_progress_updated_at ON processing_progress(updated_at);
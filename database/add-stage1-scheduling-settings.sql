@@ -0,0 +1,17 @@
+-- Порядок и ранняя остановка запросов Stage 1 (src/utils/QueryYieldScheduler.js)
+-- stage1_adaptive_queries   - запросы по прогнозу выхода новых компаний + ранняя остановка
+-- stage1_target_companies   - сколько новых компаний достаточно (0 - target_count сессии,
+--                             если он больше числа запросов)
+-- stage1_min_marginal_yield - остановка, если последние запросы дают меньше новых компаний
+-- stage1_yield_window       - по скольким последним запросам считается выход
+-- Прогноз берется из session_queries.new_companies (add-query-yield.sql)
+
+INSERT INTO system_settings (category, key, value, description) VALUES
+  ('processing_stages', 'stage1_adaptive_queries', 'true', 'Order Stage 1 queries by predicted yield and stop early'),
+  ('processing_stages', 'stage1_target_companies', '0', 'Stop Stage 1 after this many new companies (0 = session target_count)'),
+  ('processing_stages', 'stage1_min_marginal_yield', '1', 'Stop Stage 1 when recent queries yield fewer new companies per query'),
+  ('processing_stages', 'stage1_yield_window', '5', 'Number of recent queries for the marginal yield')
+ON CONFLICT (category, key) DO NOTHING;
+
+-- Проверка
+SELECT * FROM system_settings WHERE category = 'processing_stages' AND key LIKE 'stage1_%';
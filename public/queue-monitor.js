@@ -1,18 +1,36 @@
 /**
  * API Queue Monitor Widget
  * Показывает текущую длину очереди AI запросов в реальном времени
- * 
+ * и состояние global заданий Stage 2/3/4
+ *
  * Использование:
  * 1. Добавить CSS стили (скопировать из этого файла)
  * 2. Добавить HTML бейдж куда нужно
  * 3. Подключить этот скрипт: <script src="/queue-monitor.js"></script>
  * 4. Вызвать: startQueueMonitoring();
+ *
+ * Переживает рестарт сервера: при ошибках опрос замедляется (до 30с),
+ * последнее известное состояние хранится в localStorage. После рестарта
+ * задания, которые были running, приходят как interrupted - виджет
+ * отправляет событие 'globalJobInterrupted' (продолжить: QueueMonitor.resumeJob(id)).
  */
 
 // Глобальные переменные для мониторинга
 window.queuePollingInterval = null;
 window.queueMonitorActive = false;
 
+const QUEUE_MONITOR_STORAGE_KEY = 'queueMonitor.lastState';
+const QUEUE_MONITOR_MAX_BACKOFF = 30000;
+const QUEUE_MONITOR_JOBS_EVERY = 5; // Задания опрашиваются на каждом 5-м тике
+
+const queueMonitorState = {
+  updateInterval: 1000,
+  failures: 0,
+  tick: 0,
+  jobs: [],
+  lastStatus: null
+};
+
 /**
  * Запустить мониторинг очереди
  * @param {number} updateInterval - Интервал обновления в миллисекундах (по умолчанию 1000мс)
@@ -25,12 +43,14 @@ function startQueueMonitoring(updateInterval = 1000) {
 
   console.log('Starting queue monitoring...');
   window.queueMonitorActive = true;
-  
-  // Первое обновление сразу
-  updateQueueStatus();
-  
-  // Затем по интервалу
-  window.queuePollingInterval = setInterval(updateQueueStatus, updateInterval);
+  queueMonitorState.updateInterval = updateInterval;
+  queueMonitorState.failures = 0;
+
+  // Показать последнее известное состояние до первого ответа сервера
+  restoreQueueMonitorState();
+
+  // Первое обновление сразу, затем по интервалу (с backoff при ошибках)
+  scheduleQueueUpdate(0);
 }
 
 /**
@@ -38,70 +58,76 @@ function startQueueMonitoring(updateInterval = 1000) {
  */
 function stopQueueMonitoring() {
   if (window.queuePollingInterval) {
-    clearInterval(window.queuePollingInterval);
+    clearTimeout(window.queuePollingInterval);
     window.queuePollingInterval = null;
+  }
+  if (window.queueMonitorActive) {
     window.queueMonitorActive = false;
     console.log('Queue monitoring stopped');
   }
 }
 
+/**
+ * Запланировать следующее обновление
+ */
+function scheduleQueueUpdate(delay) {
+  window.queuePollingInterval = setTimeout(async () => {
+    await updateQueueStatus();
+    if (!window.queueMonitorActive) return;
+
+    // 1с, 2с, 4с ... 30с пока сервер недоступен (рестарт / редеплой)
+    const nextDelay = queueMonitorState.failures === 0
+      ? queueMonitorState.updateInterval
+      : Math.min(queueMonitorState.updateInterval * Math.pow(2, queueMonitorState.failures), QUEUE_MONITOR_MAX_BACKOFF);
+    scheduleQueueUpdate(nextDelay);
+  }, delay);
+}
+
 /**
  * Обновить статус очереди
  */
 async function updateQueueStatus() {
   try {
     const response = await fetch('/api/debug/queue-status');
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
     const data = await response.json();
 
     if (data.success && data.queues) {
+      const reconnected = queueMonitorState.failures > 0;
+      queueMonitorState.failures = 0;
+      queueMonitorState.tick++;
+
+      // Задания: сразу после восстановления связи и затем раз в несколько тиков
+      if (reconnected || queueMonitorState.tick % QUEUE_MONITOR_JOBS_EVERY === 1 || (data.global_jobs || []).length > 0) {
+        await updateGlobalJobs();
+      }
+
       const sonarPro = data.queues.sonar_pro;
       const sonarBasic = data.queues.sonar_basic;
-      
+
       // Calculate total queue length
       let totalQueue = 0;
       let inProgress = false;
-      
+
       if (sonarPro) {
         totalQueue += sonarPro.queueLength;
         inProgress = inProgress || sonarPro.inProgress;
       }
-      
+
       if (sonarBasic) {
         totalQueue += sonarBasic.queueLength;
         inProgress = inProgress || sonarBasic.inProgress;
       }
-      
-      // Update badge
-      const queueBadge = document.getElementById('queueBadge');
-      const queueCount = document.getElementById('queueCount');
-      
-      if (!queueBadge || !queueCount) {
-        console.warn('Queue badge elements not found in DOM');
+
+      queueMonitorState.lastStatus = { totalQueue, inProgress, sonarPro, sonarBasic, timestamp: Date.now() };
+      saveQueueMonitorState();
+
+      if (!renderQueueBadge(queueMonitorState.lastStatus, false)) {
         return;
       }
-      
-      queueCount.textContent = totalQueue;
-      
-      // Update badge style based on queue length
-      queueBadge.classList.remove('idle', 'busy', 'overloaded', 'loading');
-      
-      if (totalQueue === 0 && !inProgress) {
-        queueBadge.classList.add('idle');
-      } else if (totalQueue > 0 && totalQueue <= 5) {
-        queueBadge.classList.add('busy');
-      } else if (totalQueue > 5) {
-        queueBadge.classList.add('overloaded');
-      } else if (inProgress) {
-        queueBadge.classList.add('busy');
-      }
-      
-      // Add tooltip with details
-      const tooltipText = `Sonar Pro: ${sonarPro?.queueLength || 0} в очереди${sonarPro?.inProgress ? ' (обработка)' : ''}\n` +
-                         `Sonar Basic: ${sonarBasic?.queueLength || 0} в очереди${sonarBasic?.inProgress ? ' (обработка)' : ''}\n` +
-                         `Последнее обновление: ${new Date().toLocaleTimeString()}`;
-      
-      queueBadge.title = tooltipText;
-      
+
       // Dispatch custom event for other scripts
       window.dispatchEvent(new CustomEvent('queueStatusUpdated', {
         detail: {
@@ -109,24 +135,146 @@ async function updateQueueStatus() {
           inProgress,
           sonarPro,
           sonarBasic,
+          jobs: queueMonitorState.jobs,
+          reconnected,
           timestamp: Date.now()
         }
       }));
     }
   } catch (error) {
-    console.error('Error updating queue status:', error);
-    
-    // Update badge to show error state
-    const queueBadge = document.getElementById('queueBadge');
-    const queueCount = document.getElementById('queueCount');
-    
-    if (queueCount) {
-      queueCount.textContent = '?';
+    queueMonitorState.failures++;
+    if (queueMonitorState.failures === 1) {
+      console.error('Error updating queue status:', error);
     }
-    
-    if (queueBadge) {
-      queueBadge.title = 'Ошибка подключения к API';
+
+    // Показать последнее известное состояние с пометкой "нет связи"
+    renderQueueBadge(queueMonitorState.lastStatus, true);
+  }
+}
+
+/**
+ * Обновить список global заданий
+ * Задание, которое было running, а стало interrupted (сервер перезапустился) -
+ * событие 'globalJobInterrupted'
+ */
+async function updateGlobalJobs() {
+  try {
+    const response = await fetch('/api/sessions/global/jobs?limit=10');
+    const data = await response.json();
+    if (!data.success) return;
+
+    const previous = new Map(queueMonitorState.jobs.map(job => [job.job_id, job.status]));
+    queueMonitorState.jobs = data.jobs.filter(job => job.status === 'running' || job.resumable);
+
+    queueMonitorState.jobs.forEach(job => {
+      if (job.status === 'interrupted' && previous.get(job.job_id) === 'running') {
+        window.dispatchEvent(new CustomEvent('globalJobInterrupted', { detail: job }));
+      }
+    });
+
+    window.dispatchEvent(new CustomEvent('globalJobsUpdated', {
+      detail: { jobs: queueMonitorState.jobs, timestamp: Date.now() }
+    }));
+  } catch (error) {
+    // Задания - дополнительная информация, ошибку показывает основной опрос
+  }
+}
+
+/**
+ * Отрисовать бейдж
+ * @returns {boolean} false если элементов бейджа нет на странице
+ */
+function renderQueueBadge(status, offline) {
+  const queueBadge = document.getElementById('queueBadge');
+  const queueCount = document.getElementById('queueCount');
+
+  if (!queueBadge || !queueCount) {
+    console.warn('Queue badge elements not found in DOM');
+    return false;
+  }
+
+  const totalQueue = status ? status.totalQueue : 0;
+  const inProgress = status ? status.inProgress : false;
+  const runningJobs = queueMonitorState.jobs.filter(job => job.status === 'running');
+  const interruptedJobs = queueMonitorState.jobs.filter(job => job.status === 'interrupted');
+
+  queueCount.textContent = status ? totalQueue : '?';
+
+  // Update badge style based on queue length
+  queueBadge.classList.remove('idle', 'busy', 'overloaded', 'loading', 'offline', 'interrupted');
+
+  if (offline) {
+    queueBadge.classList.add('offline');
+  } else if (interruptedJobs.length > 0 && runningJobs.length === 0) {
+    queueBadge.classList.add('interrupted');
+  } else if (totalQueue === 0 && !inProgress) {
+    queueBadge.classList.add('idle');
+  } else if (totalQueue > 0 && totalQueue <= 5) {
+    queueBadge.classList.add('busy');
+  } else if (totalQueue > 5) {
+    queueBadge.classList.add('overloaded');
+  } else if (inProgress) {
+    queueBadge.classList.add('busy');
+  }
+
+  // Add tooltip with details
+  const sonarPro = status?.sonarPro;
+  const sonarBasic = status?.sonarBasic;
+  let tooltipText = '';
+
+  if (offline) {
+    tooltipText += `Нет связи с сервером (попытка ${queueMonitorState.failures}), показано последнее известное состояние\n`;
+  }
+
+  tooltipText += `Sonar Pro: ${sonarPro?.queueLength || 0} в очереди${sonarPro?.inProgress ? ' (обработка)' : ''}\n` +
+                 `Sonar Basic: ${sonarBasic?.queueLength || 0} в очереди${sonarBasic?.inProgress ? ' (обработка)' : ''}\n`;
+
+  queueMonitorState.jobs.forEach(job => {
+    const done = (job.completed || 0) + (job.failed || 0);
+    tooltipText += `${job.stage}: ${done}/${job.total} (${job.status === 'running' ? 'выполняется' : 'прервано, можно продолжить'})\n`;
+  });
+
+  tooltipText += `Последнее обновление: ${new Date(status?.timestamp || Date.now()).toLocaleTimeString()}`;
+
+  queueBadge.title = tooltipText;
+  return true;
+}
+
+/**
+ * Продолжить прерванное global задание
+ * @param {string} jobId
+ * @returns {Promise<Object>} ответ API
+ */
+async function resumeGlobalJob(jobId) {
+  const response = await fetch(`/api/sessions/global/jobs/${jobId}/resume`, { method: 'POST' });
+  const data = await response.json();
+  await updateGlobalJobs();
+  return data;
+}
+
+function saveQueueMonitorState() {
+  try {
+    localStorage.setItem(QUEUE_MONITOR_STORAGE_KEY, JSON.stringify({
+      lastStatus: queueMonitorState.lastStatus,
+      jobs: queueMonitorState.jobs
+    }));
+  } catch (error) {
+    // localStorage недоступен (приватный режим) - работаем без него
+  }
+}
+
+function restoreQueueMonitorState() {
+  try {
+    const saved = JSON.parse(localStorage.getItem(QUEUE_MONITOR_STORAGE_KEY) || 'null');
+    if (!saved) return;
+
+    queueMonitorState.lastStatus = saved.lastStatus || null;
+    queueMonitorState.jobs = saved.jobs || [];
+    if (queueMonitorState.lastStatus) {
+      renderQueueBadge(queueMonitorState.lastStatus, false);
     }
+  } catch (error) {
+    // Поврежденное состояние - просто начинаем с нуля
   }
 }
 
@@ -138,16 +286,17 @@ async function getQueueStatus() {
   try {
     const response = await fetch('/api/debug/queue-status');
     const data = await response.json();
-    
+
     if (data.success) {
       return {
         success: true,
         sonarPro: data.queues.sonar_pro,
         sonarBasic: data.queues.sonar_basic,
+        globalJobs: data.global_jobs || [],
         timestamp: data.timestamp
       };
     }
-    
+
     return { success: false, error: 'Invalid response' };
   } catch (error) {
     return { success: false, error: error.message };
@@ -181,8 +330,9 @@ window.QueueMonitor = {
   start: startQueueMonitoring,
   stop: stopQueueMonitoring,
   update: updateQueueStatus,
-  getStatus: getQueueStatus
+  getStatus: getQueueStatus,
+  getJobs: () => queueMonitorState.jobs,
+  resumeJob: resumeGlobalJob
 };
 
 console.log('Queue Monitor Widget loaded successfully');
-
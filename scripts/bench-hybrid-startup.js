@@ -0,0 +1,149 @@
+#!/usr/bin/env node
+
+/**
+ * Бенчмарк старта HybridDatabase: полная загрузка против снимка + дельты
+ *
+ * Режимы (все читают из Supabase из .env, ничего не пишут в БД):
+ *   legacy - как было: directSelect всех 5 таблиц по очереди до готовности
+ *            (без пагинации - PostgREST отдает не больше max-rows строк на таблицу)
+ *   cold   - HybridDatabase без снимка: полная постраничная загрузка + запись снимка
+ *   warm   - HybridDatabase со снимком из cold: снимок + дельта по updated_at
+ * Для cold/warm печатается время до готовности (небольшие таблицы) и до загрузки
+ * всех таблиц (ленивые таблицы при первом обращении).
+ *
+ * Снимки пишутся во временную папку (--dir), рабочие data/snapshots не трогаются.
+ *
+ * Запуск:
+ *   node scripts/bench-hybrid-startup.js
+ *   node scripts/bench-hybrid-startup.js --runs 5 --output bench-startup.json
+ */
+
+const os = require('os');
+const path = require('path');
+const fs = require('fs');
+require('dotenv').config({ path: path.join(__dirname, '../.env') });
+
+const HybridDatabase = require('../src/database/HybridDatabase');
+
+const TABLES = ['search_sessions', 'session_queries', 'pending_companies', 'found_companies', 'processing_progress'];
+
+function parseArgs(argv) {
+  const options = { runs: 3, output: null, dir: path.join(os.tmpdir(), `hybrid-bench-${process.pid}`) };
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i] === '--runs') options.runs = parseInt(argv[++i]) || options.runs;
+    if (argv[i] === '--output') options.output = argv[++i];
+    if (argv[i] === '--dir') options.dir = argv[++i];
+  }
+  return options;
+}
+
+function median(values) {
+  const sorted = values.slice().sort((a, b) => a - b);
+  return sorted[Math.floor(sorted.length / 2)];
+}
+
+async function runLegacy() {
+  const db = new HybridDatabase({ useSnapshots: false });
+  const started = Date.now();
+  await db.supabase.initialize();
+
+  let rows = 0;
+  for (const table of TABLES) {
+    try {
+      rows += (await db.supabase.directSelect(table)).length;
+    } catch (error) {
+      console.error(`   ❌ ${table}: ${error.message}`);
+    }
+  }
+
+  const ms = Date.now() - started;
+  return { readyMs: ms, allTablesMs: ms, rows };
+}
+
+async function runHybrid(dir) {
+  const db = new HybridDatabase({ snapshotDir: dir });
+  const started = Date.now();
+  await db.initialize();
+  const readyMs = Date.now() - started;
+
+  // Ленивые таблицы - как при первом запросе к ним
+  await Promise.all(TABLES.map(table => db.ensureTable(table)));
+  const allTablesMs = Date.now() - started;
+
+  const readiness = db.getReadiness();
+  // Снимок для следующего (теплого) старта
+  await db.saveSnapshots({ all: true });
+  await db.end();
+
+  const tables = {};
+  Object.entries(readiness.tables).forEach(([table, status]) => {
+    tables[table] = { rows: status.rows, source: status.source, deltaRows: status.deltaRows, loadMs: status.loadMs };
+  });
+
+  return {
+    readyMs,
+    allTablesMs,
+    rows: Object.values(readiness.tables).reduce((sum, status) => sum + status.rows, 0),
+    tables
+  };
+}
+
+function printRow(name, result) {
+  console.log(`   ${name.padEnd(8)} ready ${String(result.readyMs).padStart(7)} ms   all tables ${String(result.allTablesMs).padStart(7)} ms   rows ${result.rows}`);
+}
+
+async function main() {
+  const options = parseArgs(process.argv.slice(2));
+  fs.rmSync(options.dir, { recursive: true, force: true });
+
+  console.log('\n⏱  HybridDatabase startup benchmark\n');
+
+  const report = { runs: options.runs, legacy: [], cold: null, warm: [] };
+
+  for (let i = 0; i < options.runs; i++) {
+    report.legacy.push(await runLegacy());
+  }
+  report.cold = await runHybrid(options.dir);
+  for (let i = 0; i < options.runs; i++) {
+    report.warm.push(await runHybrid(options.dir));
+  }
+
+  const summary = (results) => ({
+    readyMs: median(results.map(result => result.readyMs)),
+    allTablesMs: median(results.map(result => result.allTablesMs)),
+    rows: results[results.length - 1].rows
+  });
+  report.summary = {
+    legacy: summary(report.legacy),
+    cold: summary([report.cold]),
+    warm: summary(report.warm)
+  };
+  report.summary.speedup = report.summary.warm.readyMs
+    ? +(report.summary.legacy.readyMs / report.summary.warm.readyMs).toFixed(1)
+    : null;
+
+  console.log(`   Медиана из ${options.runs} запусков (cold - один запуск):\n`);
+  printRow('legacy', report.summary.legacy);
+  printRow('cold', report.summary.cold);
+  printRow('warm', report.summary.warm);
+  console.log('');
+  Object.entries(report.warm[report.warm.length - 1].tables).forEach(([table, status]) => {
+    console.log(`   ${table.padEnd(20)} ${String(status.rows).padStart(7)} строк  ${String(status.source).padEnd(15)} delta ${String(status.deltaRows).padStart(5)}  ${status.loadMs} ms`);
+  });
+  if (report.summary.legacy.rows < report.summary.warm.rows) {
+    console.log(`\n   ⚠️  legacy загрузил ${report.summary.legacy.rows} из ${report.summary.warm.rows} строк (ограничение max-rows без пагинации)`);
+  }
+  console.log(`\n   Готовность: в ${report.summary.speedup}x быстрее legacy\n`);
+
+  if (options.output) {
+    fs.writeFileSync(options.output, JSON.stringify(report, null, 2));
+    console.log(`✅ Report saved to ${options.output}\n`);
+  }
+
+  fs.rmSync(options.dir, { recursive: true, force: true });
+}
+
+main().catch(error => {
+  console.error('❌ Benchmark failed:', error.message);
+  process.exit(1);
+});
@@ -0,0 +1,119 @@
+#!/usr/bin/env node
+
+/**
+ * Бенчмарк ParsePool: лаг event loop при разборе больших ответов AI
+ *
+ * Генерирует синтетические ответы Sonar (```json блок + рассуждения) и
+ * таблицы компаний, разбирает / сериализует их дважды:
+ *   inline - все в основном потоке (как было до ParsePool, PARSE_POOL_SIZE=0)
+ *   pool   - через потоки ParsePool с порогом PARSE_POOL_INLINE_BYTES
+ * и печатает лаг event loop (p50/p99/max) и время прогона для каждого режима.
+ *
+ * Запуск:
+ *   node scripts/bench-parse-pool.js
+ *   node scripts/bench-parse-pool.js --responses 200 --companies 400 --rows 20000
+ */
+
+const { monitorEventLoopDelay } = require('perf_hooks');
+const parsePool = require('../src/services/ParsePool');
+
+function parseArgs(argv) {
+  const options = { responses: 100, companies: 300, rows: 10000, concurrency: 8 };
+  for (let i = 0; i < argv.length; i++) {
+    const key = argv[i].replace(/^--/, '');
+    if (key in options) options[key] = parseInt(argv[++i]) || options[key];
+  }
+  return options;
+}
+
+function makeResponse(companies) {
+  const list = Array.from({ length: companies }, (_, i) => ({
+    name: `深圳市精密制造有限公司 ${i}`,
+    website: `https://company-${i}.com.cn`,
+    email: `info@company-${i}.com.cn`,
+    brief_description: 'CNC turning, milling, 5-axis machining, anodizing, stainless steel SS304, small batch 小批量 定制 '.repeat(3),
+    likely_domain_extension: '.cn'
+  }));
+  return `Reasoning about suppliers...\n\n\`\`\`json\n${JSON.stringify({ companies: list, total: companies }, null, 2)}\n\`\`\`\n`;
+}
+
+function makeTable(rows) {
+  return Array.from({ length: rows }, (_, i) => ({
+    company_id: `00000000-0000-0000-0000-${String(i).padStart(12, '0')}`,
+    company_name: `公司 ${i}`,
+    website: `https://company-${i}.cn`,
+    email: `sales@company-${i}.cn`,
+    description: 'Precision CNC machining and surface treatment '.repeat(4),
+    tags: ['ЧПУ обработка', 'алюминий', 'мелкосерийное']
+  }));
+}
+
+async function runMode(mode, inputs, options) {
+  const histogram = monitorEventLoopDelay({ resolution: 10 });
+  histogram.enable();
+  const started = process.hrtime.bigint();
+
+  // Конкурентные задачи как при global прогоне: несколько компаний одновременно
+  let next = 0;
+  const worker = async () => {
+    while (next < inputs.responses.length) {
+      // Ответы AI приходят по сети - между ними event loop свободен
+      const response = inputs.responses[next++];
+      await new Promise(resolve => setImmediate(resolve));
+      const parsed = await parsePool.parseResponse(response, { stripFences: true });
+      const first = parsed.data.companies[0];
+      await parsePool.extractContacts(response);
+      await parsePool.extractTags(first.brief_description);
+    }
+  };
+  await Promise.all(Array.from({ length: options.concurrency }, worker));
+  await parsePool.serializeTable(inputs.table, { space: 2 });
+  await parsePool.serializeTable(inputs.table, { format: 'csv' });
+
+  const elapsedMs = Number(process.hrtime.bigint() - started) / 1e6;
+  // Последняя блокировка фиксируется на следующем тике таймера
+  await new Promise(resolve => setTimeout(resolve, 20));
+  histogram.disable();
+
+  // Гистограмма включает сам интервал таймера (resolution) - вычитаем его
+  const lagMs = ns => Math.max(0, ns / 1e6 - 10).toFixed(2) * 1;
+  return {
+    mode,
+    elapsed_ms: Math.round(elapsedMs),
+    lag_p50_ms: lagMs(histogram.percentile(50)),
+    lag_p99_ms: lagMs(histogram.percentile(99)),
+    lag_max_ms: lagMs(histogram.max)
+  };
+}
+
+async function main() {
+  const options = parseArgs(process.argv.slice(2));
+  const inputs = {
+    responses: Array.from({ length: options.responses }, () => makeResponse(options.companies)),
+    table: makeTable(options.rows)
+  };
+
+  console.log('Parse pool benchmark', {
+    ...options,
+    response_kb: Math.round(inputs.responses[0].length / 1024),
+    threads: parsePool.size,
+    inline_bytes: parsePool.inlineBytes
+  });
+
+  // inline = PARSE_POOL_SIZE=0
+  const poolSize = parsePool.size;
+  const results = [];
+  parsePool.size = 0;
+  results.push(await runMode('inline', inputs, options));
+  parsePool.size = poolSize;
+  results.push(await runMode('pool', inputs, options));
+
+  console.table(results);
+  console.log(JSON.stringify({ options, results, stats: parsePool.getStats() }, null, 2));
+  await parsePool.close();
+}
+
+main().catch((error) => {
+  console.error('Benchmark failed:', error);
+  process.exit(1);
+});
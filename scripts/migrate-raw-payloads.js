@@ -0,0 +1,227 @@
+#!/usr/bin/env node
+
+/**
+ * Перенос сырых ответов AI из pending_companies в raw_payloads
+ *
+ * Для каждой строки с stage1/2/3_raw_data большие текстовые поля
+ * (full_response и т.п.) сжимаются и сохраняются в raw_payloads,
+ * в строке остается ссылка *_ref. Повторный запуск безопасен:
+ * уже перенесенные поля пропускаются, одинаковые тексты не дублируются.
+ *
+ * Перед запуском: database/add-raw-payload-store.sql
+ *
+ * Запуск:
+ *   node scripts/migrate-raw-payloads.js --dry-run            # только отчет "до/после"
+ *   node scripts/migrate-raw-payloads.js                      # перенос + отчет
+ *   node scripts/migrate-raw-payloads.js --output report.json
+ */
+
+const path = require('path');
+const zlib = require('zlib');
+const crypto = require('crypto');
+require('dotenv').config({ path: path.join(__dirname, '../.env') });
+
+const SupabaseClient = require('../src/database/SupabaseClient');
+const rawPayloadStore = require('../src/services/RawPayloadStore');
+
+const PAGE_SIZE = 200;
+
+function parseArgs(argv) {
+  const options = { dryRun: false, output: null };
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i] === '--dry-run') options.dryRun = true;
+    if (argv[i] === '--output') options.output = argv[++i];
+  }
+  return options;
+}
+
+function jsonBytes(value) {
+  return value == null ? 0 : Buffer.byteLength(JSON.stringify(value), 'utf8');
+}
+
+function formatBytes(bytes) {
+  if (bytes >= 1024 * 1024) return `${(bytes / 1024 / 1024).toFixed(1)} MB`;
+  if (bytes >= 1024) return `${(bytes / 1024).toFixed(1)} KB`;
+  return `${bytes} B`;
+}
+
+/**
+ * Оценка для --dry-run: что получилось бы после переноса, без записи
+ */
+function estimatePack(payload, uniqueTexts) {
+  if (!payload || typeof payload !== 'object') return payload;
+
+  const packed = { ...payload };
+  for (const [field, value] of Object.entries(payload)) {
+    if (typeof value !== 'string' || value.length < rawPayloadStore.minBytes) continue;
+    const hash = crypto.createHash('sha256').update(value).digest('hex');
+    if (!uniqueTexts.has(hash)) {
+      const original = Buffer.from(value, 'utf8');
+      const compressed = rawPayloadStore.encoding === 'gzip' ? zlib.gzipSync(original) : zlib.brotliCompressSync(original);
+      uniqueTexts.set(hash, { original: original.length, compressed: compressed.length });
+    }
+    packed[`${field}_ref`] = hash;
+    packed[field] = null;
+  }
+  return packed;
+}
+
+async function migrate(options) {
+  const db = new SupabaseClient();
+  await db.initialize();
+  rawPayloadStore.init(db);
+
+  const columns = rawPayloadStore.rawColumns;
+  const report = {
+    dry_run: options.dryRun,
+    encoding: rawPayloadStore.encoding,
+    min_bytes: rawPayloadStore.minBytes,
+    rows_scanned: 0,
+    rows_with_raw_data: 0,
+    rows_updated: 0,
+    rows_failed: 0,
+    inline_bytes_before: 0,
+    inline_bytes_after: 0,
+    by_column: {}
+  };
+  columns.forEach(column => {
+    report.by_column[column] = { rows: 0, before: 0, after: 0 };
+  });
+
+  const uniqueTexts = new Map(); // только для --dry-run
+  let lastId = null;
+
+  console.log(`\n📦 Raw payload migration${options.dryRun ? ' (dry run)' : ''}...\n`);
+
+  for (;;) {
+    // Keyset пагинация по company_id - стабильна при обновлении строк
+    let query = db.supabase
+      .from('pending_companies')
+      .select(`company_id, ${columns.join(', ')}`)
+      .order('company_id', { ascending: true })
+      .limit(PAGE_SIZE);
+    if (lastId) query = query.gt('company_id', lastId);
+
+    const { data: rows, error } = await query;
+    if (error) throw new Error(`Failed to read pending_companies: ${error.message}`);
+    if (!rows || rows.length === 0) break;
+
+    for (const row of rows) {
+      report.rows_scanned++;
+      const update = {};
+      let hasRaw = false;
+
+      for (const column of columns) {
+        const payload = row[column];
+        if (!payload) continue;
+        hasRaw = true;
+
+        const before = jsonBytes(payload);
+        const packed = options.dryRun
+          ? estimatePack(payload, uniqueTexts)
+          : await rawPayloadStore.pack(payload);
+        const after = jsonBytes(packed);
+
+        report.by_column[column].rows++;
+        report.by_column[column].before += before;
+        report.by_column[column].after += after;
+        report.inline_bytes_before += before;
+        report.inline_bytes_after += after;
+
+        if (after !== before) update[column] = packed;
+      }
+
+      if (hasRaw) report.rows_with_raw_data++;
+      if (options.dryRun || Object.keys(update).length === 0) continue;
+
+      const { error: updateError } = await db.supabase
+        .from('pending_companies')
+        .update(update)
+        .eq('company_id', row.company_id);
+
+      if (updateError) {
+        report.rows_failed++;
+        console.error(`   ❌ ${row.company_id}: ${updateError.message}`);
+      } else {
+        report.rows_updated++;
+      }
+    }
+
+    lastId = rows[rows.length - 1].company_id;
+    console.log(`   ... ${report.rows_scanned} rows scanned, ${report.rows_updated} updated`);
+  }
+
+  // Объем хранилища: из статистики записей (или оценки при --dry-run)
+  let storeOriginal = 0;
+  let storeCompressed = 0;
+  let storeTexts = 0;
+  if (options.dryRun) {
+    uniqueTexts.forEach(({ original, compressed }) => {
+      storeOriginal += original;
+      storeCompressed += compressed;
+    });
+    storeTexts = uniqueTexts.size;
+  } else {
+    const stats = rawPayloadStore.getStats();
+    storeOriginal = stats.originalBytes;
+    storeCompressed = stats.compressedBytes;
+    storeTexts = stats.puts;
+    report.dedup_hits = stats.dedupHits;
+    report.inline_fallbacks = stats.inlineFallbacks;
+  }
+
+  report.store = {
+    texts: storeTexts,
+    original_bytes: storeOriginal,
+    compressed_bytes: storeCompressed,
+    // base64 в колонке TEXT: +33% к сжатому размеру
+    stored_bytes: Math.ceil(storeCompressed / 3) * 4,
+    compression_ratio: storeCompressed ? +(storeOriginal / storeCompressed).toFixed(2) : null
+  };
+  report.total_bytes_after = report.inline_bytes_after + report.store.stored_bytes;
+  report.saved_percent = report.inline_bytes_before
+    ? +(100 * (1 - report.total_bytes_after / report.inline_bytes_before)).toFixed(1)
+    : 0;
+  report.row_payload_saved_percent = report.inline_bytes_before
+    ? +(100 * (1 - report.inline_bytes_after / report.inline_bytes_before)).toFixed(1)
+    : 0;
+
+  return report;
+}
+
+function printReport(report) {
+  console.log('\n╔════════════════════════════════════════════════════════════════╗');
+  console.log('║              RAW PAYLOADS: РАЗМЕР ДО / ПОСЛЕ                   ║');
+  console.log('╚════════════════════════════════════════════════════════════════╝\n');
+  console.log(`   Строк просмотрено:           ${report.rows_scanned}`);
+  console.log(`   Строк с raw_data:            ${report.rows_with_raw_data}`);
+  console.log(`   Строк обновлено:             ${report.rows_updated}${report.dry_run ? ' (dry run)' : ''}`);
+  if (report.rows_failed) console.log(`   Ошибок обновления:           ${report.rows_failed}`);
+  console.log('');
+  Object.entries(report.by_column).forEach(([column, stats]) => {
+    console.log(`   ${column.padEnd(18)} ${String(stats.rows).padStart(6)} строк  ${formatBytes(stats.before).padStart(10)} -> ${formatBytes(stats.after)}`);
+  });
+  console.log('');
+  console.log(`   В строках pending_companies: ${formatBytes(report.inline_bytes_before)} -> ${formatBytes(report.inline_bytes_after)} (-${report.row_payload_saved_percent}%)`);
+  console.log(`   raw_payloads:                ${report.store.texts} уникальных текстов, ${formatBytes(report.store.original_bytes)} -> ${formatBytes(report.store.compressed_bytes)} (x${report.store.compression_ratio})`);
+  console.log(`   Всего:                       ${formatBytes(report.inline_bytes_before)} -> ${formatBytes(report.total_bytes_after)} (-${report.saved_percent}%)\n`);
+}
+
+async function main() {
+  const options = parseArgs(process.argv.slice(2));
+
+  try {
+    const report = await migrate(options);
+    printReport(report);
+
+    if (options.output) {
+      require('fs').writeFileSync(options.output, JSON.stringify(report, null, 2));
+      console.log(`✅ Report saved to ${options.output}\n`);
+    }
+  } catch (error) {
+    console.error('❌ Migration failed:', error.message);
+    process.exit(1);
+  }
+}
+
+main();
@@ -0,0 +1,542 @@
+#!/usr/bin/env node
+
+/**
+ * Stub AI Server - Локальная заглушка Perplexity Sonar и DeepSeek API
+ *
+ * Отвечает по протоколу POST /chat/completions (и /v1/chat/completions),
+ * который используют SonarApiClient и DeepSeekClient. Позволяет гонять
+ * полные сессии без реальных ключей и без расхода кредитов:
+ * - настраиваемое распределение задержек (fixed / uniform / lognormal) по модели
+ * - инъекция 429 / 5xx и "зависаний" (для проверки таймаутов)
+ * - ограничение requests/min по модели (настоящие 429 как у Perplexity)
+ * - подсчет токенов в usage
+ * - готовые ответы для каждого этапа: под-запросы, компании, сайты, email, валидация
+ *
+ * Запуск:
+ *   node scripts/stub-ai-server.js --port 8787
+ *   node scripts/stub-ai-server.js --config stub.json --latency lognormal:1500:0.6 --error-429 0.05
+ *
+ * Подключение приложения:
+ *   SONAR_BASE_URL=http://127.0.0.1:8787 DEEPSEEK_BASE_URL=http://127.0.0.1:8787/v1 npm start
+ *
+ * Служебные endpoints:
+ *   GET  /health       - проверка
+ *   GET  /stats        - счетчики запросов (по моделям и типам ответов), перцентили задержек
+ *   POST /stats/reset  - сбросить счетчики
+ */
+
+const http = require('http');
+const fs = require('fs');
+const crypto = require('crypto');
+
+const DEFAULT_CONFIG = {
+  port: 8787,
+  host: '127.0.0.1',
+  seed: 42,
+  // Задержки (ms) по модели; default - для всех остальных
+  latency: {
+    default: { dist: 'lognormal', median: 800, sigma: 0.5 },
+    'sonar-pro': { dist: 'lognormal', median: 2500, sigma: 0.5 },
+    sonar: { dist: 'lognormal', median: 1500, sigma: 0.5 },
+    'deepseek-chat': { dist: 'lognormal', median: 1200, sigma: 0.4 },
+    'deepseek-reasoner': { dist: 'lognormal', median: 6000, sigma: 0.4 }
+  },
+  errors: {
+    rate429: 0,       // Доля случайных 429
+    rate5xx: 0,       // Доля случайных 500/502/503
+    hangRate: 0,      // Доля запросов, которые отвечают только через hangMs
+    hangMs: 130000,
+    retryAfterSeconds: 2
+  },
+  // Лимит requests/min по модели (0 = без лимита)
+  rateLimitPerMin: {},
+  tokens: {
+    charsPerToken: 4
+  },
+  payloads: {
+    companiesPerQuery: 10,
+    websiteHitRate: 0.8,   // Stage 2: доля компаний с найденным сайтом
+    emailHitRate: 0.6,     // Stage 3: доля сайтов с найденным email
+    duplicateRate: 0.1,    // Stage 1: доля компаний, уже выданных другими запросами
+    relevanceMin: 55,
+    relevanceMax: 98
+  }
+};
+
+// ============================================
+// Конфигурация
+// ============================================
+
+function parseArgs(argv) {
+  const args = {};
+  for (let i = 0; i < argv.length; i++) {
+    if (!argv[i].startsWith('--')) continue;
+    const key = argv[i].substring(2);
+    const next = argv[i + 1];
+    if (next === undefined || next.startsWith('--')) {
+      args[key] = true;
+    } else {
+      args[key] = next;
+      i++;
+    }
+  }
+  return args;
+}
+
+function mergeDeep(target, source) {
+  Object.entries(source || {}).forEach(([key, value]) => {
+    if (value && typeof value === 'object' && !Array.isArray(value)) {
+      target[key] = mergeDeep({ ...(target[key] || {}) }, value);
+    } else {
+      target[key] = value;
+    }
+  });
+  return target;
+}
+
+/**
+ * "lognormal:800:0.5" | "uniform:200:900" | "fixed:500"
+ */
+function parseLatencySpec(spec) {
+  const [dist, a, b] = String(spec).split(':');
+  if (dist === 'fixed') return { dist, value: parseFloat(a) };
+  if (dist === 'uniform') return { dist, min: parseFloat(a), max: parseFloat(b) };
+  if (dist === 'lognormal') return { dist, median: parseFloat(a), sigma: parseFloat(b ?? 0.5) };
+  throw new Error(`Unknown latency distribution: ${spec}`);
+}
+
+function loadConfig(argv) {
+  const args = parseArgs(argv);
+  const config = mergeDeep({}, DEFAULT_CONFIG);
+
+  if (args.config) {
+    mergeDeep(config, JSON.parse(fs.readFileSync(args.config, 'utf8')));
+  }
+
+  if (args.port) config.port = parseInt(args.port);
+  if (args.host) config.host = args.host;
+  if (args.seed) config.seed = parseInt(args.seed);
+  if (args.latency) {
+    // Одна спецификация для всех моделей
+    const spec = parseLatencySpec(args.latency);
+    config.latency = { default: spec };
+  }
+  if (args['error-429']) config.errors.rate429 = parseFloat(args['error-429']);
+  if (args['error-5xx']) config.errors.rate5xx = parseFloat(args['error-5xx']);
+  if (args['hang-rate']) config.errors.hangRate = parseFloat(args['hang-rate']);
+  if (args['rate-limit']) config.rateLimitPerMin = { default: parseInt(args['rate-limit']) };
+  if (args['companies-per-query']) config.payloads.companiesPerQuery = parseInt(args['companies-per-query']);
+
+  return config;
+}
+
+// ============================================
+// Детерминированный генератор случайных чисел
+// ============================================
+
+function mulberry32(seed) {
+  let a = seed >>> 0;
+  return () => {
+    a = (a + 0x6D2B79F5) >>> 0;
+    let t = a;
+    t = Math.imul(t ^ (t >>> 15), t | 1);
+    t ^= t + Math.imul(t ^ (t >>> 7), t | 61);
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296;
+  };
+}
+
+function hashOf(text) {
+  return crypto.createHash('md5').update(text).digest('hex');
+}
+
+// ============================================
+// Ответы по этапам
+// ============================================
+
+const CITIES = ['深圳市', '东莞市', '苏州市', '宁波市', '广州市', '佛山市', '无锡市', '厦门市'];
+const KINDS = ['精密', '五金', '数控', '机械', '模具', '金属'];
+const SERVICES = ['CNC加工', '车削加工', '铣削加工', '精密零件加工', '钣金加工', '铝合金加工'];
+
+class PayloadFactory {
+  constructor(config) {
+    this.config = config;
+    this.random = mulberry32(config.seed);
+    this.companySeq = 0;
+    this.querySeq = 0;
+    this.issuedCompanies = [];
+  }
+
+  /**
+   * Определить тип запроса по тексту промпта
+   */
+  classify(prompt) {
+    if (prompt.includes('query_cn')) return 'query_expansion';
+    if (prompt.startsWith('Переведи') || prompt.includes('Переведи на русский')) return 'translation';
+    if (prompt.includes('relevance_score')) return 'company_validation';
+    if (prompt.includes('You are analyzing a company for relevance')) return 'stage4';
+    if (prompt.includes('"companies"') || prompt.includes('Chinese manufacturing companies')) return 'stage1';
+    if (prompt.includes('"emails"')) return 'stage3';
+    if (prompt.includes('EMAIL-АДРЕС')) return 'stage3_retry';
+    if (prompt.includes('"website"')) return 'stage2';
+    return 'generic';
+  }
+
+  build(kind, prompt) {
+    switch (kind) {
+      case 'query_expansion': return this._queries(prompt);
+      case 'translation': return 'Услуги ЧПУ обработки';
+      case 'company_validation': return this._validation();
+      case 'stage4': return this._stage4(prompt);
+      case 'stage1': return this._companies();
+      case 'stage2': return this._website(prompt);
+      case 'stage3': return this._emails(prompt);
+      case 'stage3_retry': return this._retryEmail(prompt);
+      default: return JSON.stringify({ result: 'ok' });
+    }
+  }
+
+  _pick(list) {
+    return list[Math.floor(this.random() * list.length)];
+  }
+
+  _domainFor(text) {
+    return `stub-${hashOf(text).substring(0, 10)}.cn`;
+  }
+
+  _queries(prompt) {
+    const match = prompt.match(/(?:создай|ещё)\s+(\d+)/i);
+    const count = match ? parseInt(match[1]) : 5;
+    const queries = [];
+
+    for (let i = 0; i < count; i++) {
+      this.querySeq++;
+      const service = this._pick(SERVICES);
+      queries.push({
+        query_cn: `${this._pick(CITIES)}${service}服务 ${this.querySeq}`,
+        query_ru: `Услуги ${service} ${this.querySeq}`,
+        relevance: Math.round(70 + this.random() * 28)
+      });
+    }
+
+    return JSON.stringify({ queries });
+  }
+
+  _companies() {
+    const { companiesPerQuery, duplicateRate } = this.config.payloads;
+    const companies = [];
+
+    for (let i = 0; i < companiesPerQuery; i++) {
+      // Часть компаний повторяется между запросами - нагрузка на дедупликацию
+      if (this.issuedCompanies.length > 0 && this.random() < duplicateRate) {
+        companies.push(this._pick(this.issuedCompanies));
+        continue;
+      }
+
+      this.companySeq++;
+      const name = `${this._pick(CITIES)}${this._pick(KINDS)}${this.companySeq}制造有限公司`;
+      const domain = this._domainFor(name);
+      const company = {
+        name,
+        website: this.random() < 0.3 ? `https://www.${domain}` : null,
+        email: null,
+        brief_description: `专业从事${this._pick(SERVICES)}服务，小批量定制`,
+        likely_domain_extension: '.cn'
+      };
+      this.issuedCompanies.push(company);
+      companies.push(company);
+    }
+
+    return JSON.stringify({ companies, total: companies.length, note: 'stub data' });
+  }
+
+  _companyName(prompt) {
+    const match = prompt.match(/(?:КОМПАНИЯ|Название):\s*(.+)/);
+    return match ? match[1].trim() : `company-${hashOf(prompt).substring(0, 6)}`;
+  }
+
+  _website(prompt) {
+    const name = this._companyName(prompt);
+    if (this.random() >= this.config.payloads.websiteHitRate) {
+      return JSON.stringify({ website: null, email: null, description: null, source: null });
+    }
+
+    const domain = this._domainFor(name);
+    return JSON.stringify({
+      website: `https://www.${domain}`,
+      email: this.random() < 0.3 ? `info@${domain}` : null,
+      description: `Токарная и фрезерная обработка на станках ЧПУ (${name})`,
+      source: 'stub',
+      confidence: 'high'
+    });
+  }
+
+  _emails(prompt) {
+    const siteMatch = prompt.match(/https?:\/\/(?:www\.)?([^\s/]+)/);
+    const domain = siteMatch ? siteMatch[1] : this._domainFor(prompt);
+
+    if (this.random() >= this.config.payloads.emailHitRate) {
+      return JSON.stringify({ emails: [], note: 'stub: email not found' });
+    }
+
+    return JSON.stringify({
+      emails: [`sales@${domain}`],
+      source: 'contact us',
+      found_in: 'internet search',
+      note: 'stub'
+    });
+  }
+
+  _retryEmail(prompt) {
+    const name = this._companyName(prompt);
+    const found = this.random() < this.config.payloads.emailHitRate / 2;
+    return JSON.stringify({
+      email: found ? `info@${this._domainFor(name)}` : null,
+      website: null,
+      source: 'stub directory',
+      confidence: found ? 'medium' : 'low'
+    });
+  }
+
+  _validation() {
+    const { relevanceMin, relevanceMax } = this.config.payloads;
+    const score = Math.round(relevanceMin + this.random() * (relevanceMax - relevanceMin));
+    return JSON.stringify({
+      is_relevant: score >= 60,
+      relevance_score: score,
+      matching_aspects: ['CNC обработка'],
+      non_matching_aspects: [],
+      reason: 'stub validation',
+      recommendation: score >= 80 ? 'accept' : (score >= 60 ? 'review' : 'reject')
+    });
+  }
+
+  _stage4() {
+    const { relevanceMin, relevanceMax } = this.config.payloads;
+    const relevance = Math.round(relevanceMin + this.random() * (relevanceMax - relevanceMin));
+    return JSON.stringify({
+      relevance,
+      confidence: 85,
+      description: 'Мелкосерийная обработка металлов на станках ЧПУ',
+      services: 'токарная обработка, фрезерная обработка, шлифовка',
+      tags: ['ЧПУ', 'токарная обработка', 'фрезеровка', 'алюминий', 'нержавеющая сталь'],
+      reason: 'stub analysis',
+      website: null,
+      email: null
+    });
+  }
+}
+
+// ============================================
+// Сервер
+// ============================================
+
+class StubAiServer {
+  constructor(config) {
+    this.config = config;
+    this.payloads = new PayloadFactory(config);
+    this.random = mulberry32(config.seed + 1);
+    this.windows = new Map(); // model -> timestamps за последнюю минуту
+    this.resetStats();
+  }
+
+  resetStats() {
+    this.stats = {
+      startedAt: new Date().toISOString(),
+      requests: 0,
+      byModel: {},
+      byKind: {},
+      injected429: 0,
+      injected5xx: 0,
+      rateLimited: 0,
+      hung: 0,
+      promptTokens: 0,
+      completionTokens: 0,
+      latencies: []
+    };
+  }
+
+  getStats() {
+    const sorted = [...this.stats.latencies].sort((a, b) => a - b);
+    const pct = (p) => sorted.length === 0
+      ? null
+      : sorted[Math.min(sorted.length - 1, Math.floor((p / 100) * sorted.length))];
+    const { latencies, ...rest } = this.stats;
+
+    return {
+      ...rest,
+      latencyMs: { count: sorted.length, p50: pct(50), p95: pct(95), p99: pct(99) }
+    };
+  }
+
+  listen() {
+    this.server = http.createServer((req, res) => this._handle(req, res));
+    // Keep-alive как у настоящих API - чтобы HttpAgentPool переиспользовал сокеты
+    this.server.keepAliveTimeout = 65000;
+
+    return new Promise(resolve => {
+      this.server.listen(this.config.port, this.config.host, () => resolve(this.server));
+    });
+  }
+
+  async _handle(req, res) {
+    if (req.method === 'GET' && req.url === '/health') {
+      return this._json(res, 200, { status: 'ok' });
+    }
+    if (req.method === 'GET' && req.url === '/stats') {
+      return this._json(res, 200, this.getStats());
+    }
+    if (req.method === 'POST' && req.url === '/stats/reset') {
+      this.resetStats();
+      return this._json(res, 200, { success: true });
+    }
+    if (req.method !== 'POST' || !req.url.endsWith('/chat/completions')) {
+      return this._json(res, 404, { error: { message: 'Not found' } });
+    }
+
+    let body;
+    try {
+      body = JSON.parse(await this._readBody(req));
+    } catch (error) {
+      return this._json(res, 400, { error: { message: 'Invalid JSON body' } });
+    }
+
+    const model = body.model || 'unknown';
+    const messages = body.messages || [];
+    const prompt = messages.filter(m => m.role === 'user').map(m => m.content).join('\n');
+    const kind = this.payloads.classify(prompt);
+
+    this.stats.requests++;
+    this.stats.byModel[model] = (this.stats.byModel[model] || 0) + 1;
+    this.stats.byKind[kind] = (this.stats.byKind[kind] || 0) + 1;
+
+    const started = Date.now();
+    const { errors } = this.config;
+
+    if (this._overRateLimit(model)) {
+      this.stats.rateLimited++;
+      return this._error(res, 429, 'Rate limit exceeded', errors.retryAfterSeconds);
+    }
+
+    const roll = this.random();
+    if (roll < errors.rate429) {
+      this.stats.injected429++;
+      await this._sleep(this._sampleLatency(model) / 4);
+      return this._error(res, 429, 'Too many requests (injected)', errors.retryAfterSeconds);
+    }
+    if (roll < errors.rate429 + errors.rate5xx) {
+      this.stats.injected5xx++;
+      await this._sleep(this._sampleLatency(model) / 2);
+      return this._error(res, this.payloads._pick([500, 502, 503]), 'Upstream error (injected)');
+    }
+    if (roll < errors.rate429 + errors.rate5xx + errors.hangRate) {
+      this.stats.hung++;
+      await this._sleep(errors.hangMs);
+    } else {
+      await this._sleep(this._sampleLatency(model));
+    }
+
+    const content = this.payloads.build(kind, prompt);
+    const promptTokens = Math.ceil(messages.reduce((sum, m) => sum + (m.content || '').length, 0)
+      / this.config.tokens.charsPerToken);
+    const completionTokens = Math.ceil(content.length / this.config.tokens.charsPerToken);
+
+    this.stats.promptTokens += promptTokens;
+    this.stats.completionTokens += completionTokens;
+    this.stats.latencies.push(Date.now() - started);
+
+    const response = {
+      id: `stub-${this.stats.requests}`,
+      object: 'chat.completion',
+      created: Math.floor(Date.now() / 1000),
+      model,
+      choices: [{
+        index: 0,
+        finish_reason: 'stop',
+        message: { role: 'assistant', content }
+      }],
+      usage: {
+        prompt_tokens: promptTokens,
+        completion_tokens: completionTokens,
+        total_tokens: promptTokens + completionTokens
+      }
+    };
+    if (model.startsWith('sonar')) {
+      response.citations = [];
+    }
+
+    return this._json(res, 200, response);
+  }
+
+  _overRateLimit(model) {
+    const limits = this.config.rateLimitPerMin || {};
+    const limit = limits[model] ?? limits.default ?? 0;
+    if (!limit) return false;
+
+    const now = Date.now();
+    const window = (this.windows.get(model) || []).filter(ts => now - ts < 60000);
+    this.windows.set(model, window);
+
+    if (window.length >= limit) return true;
+    window.push(now);
+    return false;
+  }
+
+  _sampleLatency(model) {
+    const spec = this.config.latency[model] || this.config.latency.default;
+    if (!spec) return 0;
+
+    if (spec.dist === 'fixed') return spec.value;
+    if (spec.dist === 'uniform') return spec.min + this.random() * (spec.max - spec.min);
+
+    // lognormal: медиана * exp(sigma * N(0,1)), N(0,1) по Box-Muller
+    const u1 = Math.max(this.random(), 1e-12);
+    const u2 = this.random();
+    const normal = Math.sqrt(-2 * Math.log(u1)) * Math.cos(2 * Math.PI * u2);
+    return spec.median * Math.exp(spec.sigma * normal);
+  }
+
+  _error(res, status, message, retryAfter = null) {
+    const headers = retryAfter ? { 'Retry-After': String(retryAfter) } : {};
+    return this._json(res, status, { error: { message, type: 'stub_error', code: status } }, headers);
+  }
+
+  _json(res, status, payload, headers = {}) {
+    const body = JSON.stringify(payload);
+    res.writeHead(status, {
+      'Content-Type': 'application/json',
+      'Content-Length': Buffer.byteLength(body),
+      ...headers
+    });
+    res.end(body);
+  }
+
+  _readBody(req) {
+    return new Promise((resolve, reject) => {
+      const chunks = [];
+      req.on('data', chunk => chunks.push(chunk));
+      req.on('end', () => resolve(Buffer.concat(chunks).toString('utf8')));
+      req.on('error', reject);
+    });
+  }
+
+  _sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, Math.max(0, ms)));
+  }
+}
+
+if (require.main === module) {
+  const config = loadConfig(process.argv.slice(2));
+  const stub = new StubAiServer(config);
+
+  stub.listen().then(() => {
+    console.log(`🧪 Stub AI server listening on http://${config.host}:${config.port}`);
+    console.log(`   Sonar:    SONAR_BASE_URL=http://${config.host}:${config.port}`);
+    console.log(`   DeepSeek: DEEPSEEK_BASE_URL=http://${config.host}:${config.port}/v1`);
+    console.log(`   Errors:   429=${config.errors.rate429} 5xx=${config.errors.rate5xx} hang=${config.errors.hangRate}`);
+  });
+
+  process.on('SIGINT', () => process.exit(0));
+  process.on('SIGTERM', () => process.exit(0));
+}
+
+module.exports = { StubAiServer, PayloadFactory, loadConfig };
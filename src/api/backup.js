@@ -4,6 +4,7 @@
 
 const express = require('express');
 const router = express.Router();
+const parsePool = require('../services/ParsePool');
 
 // Временное хранилище для backup данных (в памяти)
 const backupStorage = new Map();
@@ -23,7 +24,8 @@ router.post('/create', async (req, res) => {
       'pending_companies',
       'pending_companies_ru',
       'search_sessions',
-      'system_settings'
+      'system_settings',
+      'raw_payloads' // Сжатые ответы AI, на которые ссылаются stageN_raw_data
     ];
 
     const backupData = {
@@ -66,7 +68,9 @@ router.post('/create', async (req, res) => {
 
     // 3. Создать JSON файл
     const filename = `backup_${new Date().toISOString().replace(/[:.]/g, '-')}.json`;
-    const jsonContent = JSON.stringify(backupData, null, 2);
+    // Сериализация всех таблиц - в потоке ParsePool (порог - по числу строк)
+    const totalRows = Object.values(backupData.data).reduce((sum, table) => sum + table.rows.length, 0);
+    const jsonContent = await parsePool.serializeTable(backupData, { space: 2, rows: totalRows });
     
     // 4. Статистика
     const stats = {
@@ -74,6 +78,7 @@ router.post('/create', async (req, res) => {
       translations: backupData.data.pending_companies_ru?.count || 0,
       sessions: backupData.data.search_sessions?.count || 0,
       settings: backupData.data.system_settings?.count || 0,
+      raw_payloads: backupData.data.raw_payloads?.count || 0,
       size: Buffer.byteLength(jsonContent, 'utf8')
     };
 
@@ -182,7 +187,8 @@ router.post('/restore', async (req, res) => {
             onConflict: tableName === 'pending_companies' ? 'company_id' :
                        tableName === 'pending_companies_ru' ? 'company_id' :
                        tableName === 'search_sessions' ? 'session_id' :
-                       tableName === 'system_settings' ? 'category,key' : null
+                       tableName === 'system_settings' ? 'category,key' :
+                       tableName === 'raw_payloads' ? 'hash' : null
           });
 
         if (error) {
@@ -1,72 +1,125 @@
 const express = require('express');
 const router = express.Router();
+const parsePool = require('../services/ParsePool');
+const listQuery = require('../utils/ListQuery');
 
 /**
  * GET /api/companies
  * Получить список компаний
+ *
+ * Порядок - новые первыми (date_added, record_id), следующая страница по next_cursor:
+ *   limit (<= 1000), cursor, fields, count=estimated|exact|planned|none
+ * Фильтры (в БД): session_id, has_email, has_website, search
+ * offset оставлен для старых клиентов (без cursor)
+ * Без supabase-js (MockDatabase) - SQL через req.db.query, страницы только по offset
  */
 router.get('/', async (req, res) => {
   try {
-    const {
-      session_id,
-      limit = 100,
-      offset = 0,
-      search,
-      has_email,
-      has_website
-    } = req.query;
-    
-    let query = 'SELECT * FROM company_records WHERE 1=1';
-    const params = [];
-    let paramIndex = 1;
-    
-    if (session_id) {
-      query += ` AND session_id = $${paramIndex}`;
-      params.push(session_id);
-      paramIndex++;
+    const { session_id, offset, search, has_email, has_website } = req.query;
+    const keyColumns = ['date_added', 'record_id'];
+    const { limit, cursor, fields, count } = listQuery.parseListParams(req.query, {
+      defaultLimit: 100,
+      maxLimit: 1000,
+      keyColumns
+    });
+
+    const supabase = listQuery.supabaseClient(req.db);
+    if (!supabase) {
+      return listQuery.sendWithETag(req, res, await listCompaniesSql(req.db, req.query, { limit, fields, count }));
     }
-    
-    if (has_email === 'true') {
-      query += ` AND email IS NOT NULL AND email != ''`;
+
+    let query = supabase
+      .from('company_records')
+      .select(fields ? fields.join(', ') : '*', { count: count || undefined, head: limit === 0 });
+
+    if (session_id) query = query.eq('session_id', session_id);
+    query = listQuery.applyPresence(query, 'email', has_email);
+    query = listQuery.applyPresence(query, 'website', has_website);
+
+    if (search) {
+      const pattern = listQuery.quote(`%${search}%`);
+      query = query.or(`company_name_cn.ilike.${pattern},company_name_ru.ilike.${pattern},email.ilike.${pattern}`);
     }
-    
-    if (has_website === 'true') {
-      query += ` AND website IS NOT NULL AND website != ''`;
+
+    query = listQuery.applyKeyset(query, cursor, keyColumns, { ascending: false });
+    if (limit > 0) {
+      query = query
+        .order('date_added', { ascending: false })
+        .order('record_id', { ascending: false });
+      const start = !cursor && offset ? Math.max(0, parseInt(offset) || 0) : 0;
+      query = query.range(start, start + limit - 1);
     }
-    
-    if (search) {
-      query += ` AND (company_name_cn ILIKE $${paramIndex} OR company_name_ru ILIKE $${paramIndex} OR email ILIKE $${paramIndex})`;
-      params.push(`%${search}%`);
-      paramIndex++;
+
+    const { data, count: total, error } = await query;
+    if (error) {
+      if (error.code === '42703') error.statusCode = 400;
+      throw error;
     }
-    
-    query += ` ORDER BY date_added DESC LIMIT $${paramIndex} OFFSET $${paramIndex + 1}`;
-    params.push(parseInt(limit), parseInt(offset));
-    
-    const result = await req.db.query(query, params);
-    
-    // Получить общее количество
-    const countQuery = query.replace(/ORDER BY.*$/, '').replace(/LIMIT.*$/, '');
-    const countResult = await req.db.query(
-      countQuery.replace(/SELECT \*/, 'SELECT COUNT(*) as total'),
-      params.slice(0, -2)
-    );
-    
-    res.json({
+
+    const rows = data || [];
+    listQuery.sendWithETag(req, res, {
       success: true,
-      count: result.rows.length,
-      total: parseInt(countResult.rows[0]?.total || 0),
-      data: result.rows
+      count: rows.length,
+      total: total ?? null,
+      next_cursor: listQuery.nextCursor(rows, limit, keyColumns),
+      data: rows
     });
   } catch (error) {
     req.logger.error('Failed to get companies', { error: error.message });
-    res.status(500).json({
+    res.status(error.statusCode || 500).json({
       success: false,
       error: error.message
     });
   }
 });
 
+/**
+ * Список компаний через req.db.query (как до keyset пагинации)
+ */
+async function listCompaniesSql(db, { session_id, offset, search, has_email, has_website }, { limit, fields, count }) {
+  let where = ' WHERE 1=1';
+  const params = [];
+
+  if (session_id) {
+    params.push(session_id);
+    where += ` AND session_id = $${params.length}`;
+  }
+  if (has_email === 'true') {
+    where += ` AND email IS NOT NULL AND email != ''`;
+  }
+  if (has_website === 'true') {
+    where += ` AND website IS NOT NULL AND website != ''`;
+  }
+  if (search) {
+    params.push(`%${search}%`);
+    where += ` AND (company_name_cn ILIKE $${params.length} OR company_name_ru ILIKE $${params.length} OR email ILIKE $${params.length})`;
+  }
+
+  let rows = [];
+  if (limit > 0) {
+    const start = Math.max(0, parseInt(offset) || 0);
+    const result = await db.query(
+      `SELECT ${fields ? fields.join(', ') : '*'} FROM company_records${where} ORDER BY date_added DESC LIMIT $${params.length + 1} OFFSET $${params.length + 2}`,
+      [...params, limit, start]
+    );
+    rows = result.rows;
+  }
+
+  let total = null;
+  if (count) {
+    const countResult = await db.query(`SELECT COUNT(*) as total FROM company_records${where}`, params);
+    total = parseInt(countResult.rows[0]?.total ?? countResult.rows[0]?.count ?? 0);
+  }
+
+  return {
+    success: true,
+    count: rows.length,
+    total,
+    next_cursor: null,
+    data: rows
+  };
+}
+
 /**
  * GET /api/companies/:id
  * Получить детали компании
@@ -159,34 +212,25 @@ router.post('/export', async (req, res) => {
       return data;
     });
     
+    // Большие выгрузки сериализуются в потоке ParsePool
     if (format === 'csv') {
       // Простой CSV экспорт
-      const headers = Object.keys(exportData[0] || {});
-      const csvRows = [
-        headers.join(','),
-        ...exportData.map(row => 
-          headers.map(header => {
-            const value = row[header];
-            if (Array.isArray(value)) {
-              return `"${value.join('; ')}"`;
-            }
-            return `"${String(value || '').replace(/"/g, '""')}"`;
-          }).join(',')
-        )
-      ];
+      const csv = await parsePool.serializeTable(exportData, { format: 'csv' });
       
       res.setHeader('Content-Type', 'text/csv; charset=utf-8');
       res.setHeader('Content-Disposition', `attachment; filename=companies_${Date.now()}.csv`);
-      res.send(csvRows.join('\n'));
+      res.send(csv);
     } else {
       // JSON экспорт
-      res.json({
+      const json = await parsePool.serializeTable({
         success: true,
         format: 'json',
         count: exportData.length,
         exported_at: new Date().toISOString(),
         data: exportData
-      });
+      }, { rows: exportData.length });
+      
+      res.type('json').send(json);
     }
   } catch (error) {
     req.logger.error('Failed to export companies', { error: error.message });
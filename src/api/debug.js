@@ -241,17 +241,64 @@ router.post('/test-fallback', async (req, res) => {
 /**
  * GET /api/debug/companies
  * Получить список компаний с фильтрацией (и переводами если доступны)
+ *
+ * Страница в порядке (created_at, company_id), следующая - по next_cursor:
+ *   limit (<= 1000), cursor, fields=company_id,website,email, count=estimated|exact|planned|none
+ * Фильтры (выполняются в БД):
+ *   session_id, stage, current_stage, has_website, has_email, min_score, max_score
+ * limit=0 - только total (например ?has_email=true&limit=0&count=exact)
+ * include_raw_data=true - подставить полные ответы AI из raw_payloads
+ * (по умолчанию в stageN_raw_data только ссылки *_ref)
+ * Без supabase-js (MockDatabase) - все строки через directSelect / db.query, фильтры и
+ * страница в памяти, без переводов
  */
 router.get('/companies', async (req, res) => {
   try {
-    const { session_id, limit = 1000, include_translations = 'true' } = req.query;
+    const { include_translations = 'true', include_raw_data = 'false' } = req.query;
+    const rawPayloadStore = require('../services/RawPayloadStore');
+    const listQuery = require('../utils/ListQuery');
+
+    const keyColumns = ['created_at', 'company_id'];
+    const { limit, cursor, fields, count } = listQuery.parseListParams(req.query, {
+      defaultLimit: 1000,
+      maxLimit: 1000,
+      keyColumns
+    });
+
+    const { session_id, stage, current_stage, has_website, has_email, min_score, max_score } = req.query;
+
+    const supabase = listQuery.supabaseClient(req.db);
+    if (!supabase) {
+      const rows = req.db.directSelect
+        ? await req.db.directSelect('pending_companies', session_id ? { session_id } : {})
+        : (await req.db.query('SELECT * FROM pending_companies')).rows;
+      const present = (value) => value !== null && value !== undefined && value !== '';
+      const matching = rows.filter(row =>
+        (!session_id || row.session_id === session_id) &&
+        (!stage || row.stage === stage) &&
+        (!current_stage || row.current_stage === parseInt(current_stage)) &&
+        (has_website === undefined || present(row.website) === (has_website === 'true')) &&
+        (has_email === undefined || present(row.email) === (has_email === 'true')) &&
+        (min_score === undefined || row.validation_score >= parseFloat(min_score)) &&
+        (max_score === undefined || row.validation_score <= parseFloat(max_score))
+      );
+      const companies = listQuery.pageRows(matching, { limit, cursor, fields, keyColumns });
+      if (include_raw_data === 'true' && companies.length > 0) {
+        await rawPayloadStore.resolveRows(companies);
+      }
+      return listQuery.sendWithETag(req, res, {
+        success: true,
+        count: companies.length,
+        total: count ? matching.length : null,
+        next_cursor: listQuery.nextCursor(companies, limit, keyColumns),
+        companies
+      });
+    }
 
-    // Если запрошены переводы, используем Supabase с JOIN
+    const columns = [fields ? fields.join(', ') : '*'];
+    // Переводы - JOIN с pending_companies_ru (и темой сессии)
     if (include_translations === 'true') {
-      let query = req.db.supabase
-        .from('pending_companies')
-        .select(`
-          *,
+      columns.push(`
           search_sessions!inner (
             topic_description
           ),
@@ -268,45 +315,52 @@ router.get('/companies', async (req, res) => {
             translation_status,
             translated_at
           )
-        `)
-        .limit(parseInt(limit));
-
-      if (session_id) {
-        query = query.eq('session_id', session_id);
-      }
+        `);
+    }
 
-      const { data: companies, error } = await query;
+    let query = supabase
+      .from('pending_companies')
+      .select(columns.join(','), { count: count || undefined, head: limit === 0 });
+
+    if (session_id) query = query.eq('session_id', session_id);
+    if (stage) query = query.eq('stage', stage);
+    if (current_stage) query = query.eq('current_stage', parseInt(current_stage));
+    query = listQuery.applyPresence(query, 'website', has_website);
+    query = listQuery.applyPresence(query, 'email', has_email);
+    if (min_score !== undefined) query = query.gte('validation_score', parseFloat(min_score));
+    if (max_score !== undefined) query = query.lte('validation_score', parseFloat(max_score));
+
+    query = listQuery.applyKeyset(query, cursor, keyColumns);
+    if (limit > 0) {
+      query = query
+        .order('created_at', { ascending: true })
+        .order('company_id', { ascending: true })
+        .limit(limit);
+    }
 
-      if (error) throw error;
+    const { data, count: total, error } = await query;
 
-      return res.json({
-        success: true,
-        count: companies?.length || 0,
-        total: companies?.length || 0,
-        companies: companies || []
-      });
+    if (error) {
+      // 42703 - нет такой колонки (опечатка в fields / фильтре)
+      if (error.code === '42703') error.statusCode = 400;
+      throw error;
     }
 
-    // Без переводов - используем directSelect
-    let companies;
-    if (session_id) {
-      companies = await req.db.directSelect('pending_companies', { session_id });
-    } else {
-      companies = await req.db.directSelect('pending_companies');
+    const companies = data || [];
+    if (include_raw_data === 'true' && companies.length > 0) {
+      await rawPayloadStore.resolveRows(companies);
     }
 
-    // Применяем limit
-    const limitedCompanies = companies.slice(0, parseInt(limit));
-
-    res.json({
+    listQuery.sendWithETag(req, res, {
       success: true,
-      count: limitedCompanies.length,
-      total: companies.length,
-      companies: limitedCompanies
+      count: companies.length,
+      total: total ?? null,
+      next_cursor: listQuery.nextCursor(companies, limit, keyColumns),
+      companies
     });
   } catch (error) {
     req.logger.error('Error fetching companies:', error);
-    res.status(500).json({
+    res.status(error.statusCode || 500).json({
       success: false,
       error: error.message
     });
@@ -509,8 +563,26 @@ router.delete('/translations/:companyId', async (req, res) => {
 router.get('/queue-status', async (req, res) => {
   try {
     const globalQueue = require('../services/GlobalApiQueue');
+    const httpAgentPool = require('../services/HttpAgentPool');
+    const logManager = require('../services/Logger');
+    const apiCassette = require('../services/ApiCassette');
+    const globalJobManager = require('../services/GlobalJobManager');
+    const clusterStore = require('../services/ClusterStore');
+    const parsePool = require('../services/ParsePool');
+    const rawPayloadStore = require('../services/RawPayloadStore');
+    const querySimilarityIndex = require('../services/QuerySimilarityIndex');
+    const retryScheduler = require('../services/RetryScheduler');
     const globalStatus = globalQueue.getStatus();
 
+    // Распределенный режим: очереди stage worker'ов
+    const cluster = { mode: clusterStore.mode };
+    if (clusterStore.isDistributed()) {
+      cluster.queues = {};
+      for (const queue of ['stage1', 'stage2', 'stage3', 'stage4', 'translation']) {
+        cluster.queues[queue] = await clusterStore.queueStats(queue);
+      }
+    }
+
     res.json({
       success: true,
       timestamp: Date.now(),
@@ -519,6 +591,20 @@ router.get('/queue-status', async (req, res) => {
         isProcessing: globalStatus.isProcessing,
         lastRequestTime: globalStatus.lastRequestTime
       },
+      // Keep-alive пулы соединений к AI API
+      http_pools: httpAgentPool.getStats(),
+      // Потоки разбора ответов AI / сериализации таблиц
+      parse_pool: parsePool.getStats(),
+      raw_payloads: rawPayloadStore.getStats(),
+      // Индекс похожих поисковых запросов (QueryExpander / Stage 1)
+      query_index: querySimilarityIndex.getStats(),
+      // Журнал попыток и планировщик Stage 2/3 Retry
+      retry_scheduler: retryScheduler.getStats(),
+      logging: logManager.getConfig(),
+      cassette: apiCassette.getStats(),
+      // Global задания Stage 2/3/4 этого процесса (история - /api/sessions/global/jobs)
+      global_jobs: globalJobManager.getRunning(),
+      cluster,
       // Для обратной совместимости с frontend
       queues: {
         sonar_pro: {
@@ -2,6 +2,7 @@ const express = require('express');
 const { v4: uuidv4 } = require('uuid');
 const router = express.Router();
 const globalProgressEmitter = require('../services/GlobalProgressEmitter');
+const globalJobManager = require('../services/GlobalJobManager');
 
 /**
  * GET /api/sessions/global/progress-stream
@@ -1120,7 +1121,8 @@ router.post('/retry-email-search', async (req, res) => {
       req.db,
       req.logger,
       req.settingsManager,
-      deepseek
+      deepseek,
+      req.sonarBasicClient
     );
     
     const result = await stage3Retry.execute();
@@ -1198,77 +1200,147 @@ router.post('/:id/stage1', async (req, res) => {
 });
 
 /**
- * POST /api/sessions/global/stage2
- * Глобальный запуск Stage 2 для всех готовых компаний
+ * Запустить stage для global задания (новое или resume)
  */
-router.post('/global/stage2', async (req, res) => {
-  try {
-    req.logger.info('Starting global Stage 2');
-    
-    // Получить компании для обработки
-    const { data: companies, error: fetchError } = await req.db.supabase
-      .from('pending_companies')
-      .select('*')
-      .is('website', null);
-    
-    const totalCompanies = companies?.length || 0;
-    
-    // Инициализировать прогресс
-    globalProgressEmitter.startStage('stage2', totalCompanies);
-    
-    // Callback для обновления прогресса (с методом updateTotal для retry)
-    const progressCallback = (processed, current) => {
-      globalProgressEmitter.updateStage('stage2', processed, current);
-    };
-    // Добавить метод updateTotal для Stage2Retry
-    progressCallback.updateTotal = (newTotal) => {
-      globalProgressEmitter.updateTotal('stage2', newTotal);
-    };
-    
+async function executeGlobalStage(req, job, progressCallback) {
+  if (job.stage === 'stage2') {
     // Используем orchestrator если доступен
     if (req.orchestrator) {
-      const result = await req.orchestrator.runStage2Only('global', progressCallback);
-      
-      globalProgressEmitter.finishStage('stage2');
-      
-      return res.json({
-        success: true,
-        total: result.total || 0,
-        found: result.found || 0,
-        notFound: result.notFound || 0
-      });
+      return req.orchestrator.runStage2Only('global', progressCallback, job);
     }
-    
+
     // Fallback: прямой вызов без orchestrator
     const Stage2FindWebsites = require('../stages/Stage2FindWebsites');
-    
     const stage2 = new Stage2FindWebsites(
       req.sonarBasicClient,
       req.settingsManager,
       req.db,
       req.logger
     );
-    
-    // Установить callback для прогресса
     stage2.setGlobalProgressCallback(progressCallback);
-    
-    // Запустить без sessionId = обработать ВСЕ компании
-    const result = await stage2.execute();
-    
-    globalProgressEmitter.finishStage('stage2');
-    
-    res.json({
+    stage2.setJob(job);
+    return stage2.execute();
+  }
+
+  if (job.stage === 'stage3') {
+    const Stage3AnalyzeContacts = require('../stages/Stage3AnalyzeContacts');
+    // Использовать уже инициализированный Sonar Basic client (с API ключом)
+    const stage3 = new Stage3AnalyzeContacts(
+      req.sonarBasicClient,
+      req.settingsManager,
+      req.db,
+      req.logger
+    );
+    stage3.setGlobalProgressCallback(progressCallback);
+    stage3.setJob(job);
+    return stage3.execute();
+  }
+
+  const Stage4AnalyzeServices = require('../stages/Stage4AnalyzeServices');
+  // Использовать уже инициализированный DeepSeek client
+  const stage4 = new Stage4AnalyzeServices(
+    req.deepseekClient,
+    req.settingsManager,
+    req.db,
+    req.logger
+  );
+  stage4.setGlobalProgressCallback(progressCallback);
+  stage4.setJob(job);
+  return stage4.execute();
+}
+
+/**
+ * Выполнить global задание: прогресс (SSE) + статус задания в БД
+ * После resume прогресс продолжается с уже обработанных компаний (job.offset)
+ */
+async function runGlobalJob(req, job, total) {
+  const stage = job.stage;
+
+  // Инициализировать прогресс
+  globalProgressEmitter.startStage(stage, total);
+
+  // Callback для обновления прогресса (с методом updateTotal для retry)
+  const progressCallback = (processed, current) => {
+    globalProgressEmitter.updateStage(stage, job.offset + processed, current);
+  };
+  progressCallback.updateTotal = (newTotal) => {
+    globalProgressEmitter.updateTotal(stage, job.offset + newTotal);
+  };
+
+  try {
+    const result = await executeGlobalStage(req, job, progressCallback);
+    await globalJobManager.finishJob(job, result);
+    return result;
+  } catch (error) {
+    req.logger.error(`Global ${stage} failed`, { jobId: job.jobId, error: error.message });
+    await globalJobManager.failJob(job, error);
+    throw error;
+  } finally {
+    globalProgressEmitter.finishStage(stage);
+  }
+}
+
+/**
+ * Создать задание и выполнить его
+ * По умолчанию ответ после завершения (как раньше), ?async=true - сразу 202 с job_id
+ */
+async function startGlobalJob(req, res, stage, total) {
+  const job = await globalJobManager.createJob(stage);
+  const run = runGlobalJob(req, job, total);
+
+  if (req.query.async === 'true') {
+    run.catch(() => {}); // Ошибка уже записана в задание
+    return res.status(202).json({
       success: true,
-      ...result
+      job_id: job.jobId,
+      stage,
+      status: 'running'
     });
+  }
+
+  const result = await run;
+  res.json({
+    success: true,
+    job_id: job.jobId,
+    ...result
+  });
+}
+
+/**
+ * Ответ на ошибку global задания
+ */
+function sendGlobalJobError(req, res, stage, error) {
+  req.logger.error(`Global ${stage} request failed`, { error: error.message });
+
+  const status = error.code === 'EJOBNOTFOUND' ? 404
+    : (error.code === 'EJOBRUNNING' || error.code === 'EJOBDONE') ? 409
+    : 500;
+
+  res.status(status).json({
+    success: false,
+    error: error.message,
+    job_id: error.jobId
+  });
+}
+
+/**
+ * POST /api/sessions/global/stage2
+ * Глобальный запуск Stage 2 для всех готовых компаний
+ */
+router.post('/global/stage2', async (req, res) => {
+  try {
+    req.logger.info('Starting global Stage 2');
+    
+    // Получить компании для обработки
+    const { data: companies, error: fetchError } = await req.db.supabase
+      .from('pending_companies')
+      .select('*')
+      .is('website', null);
+    
+    await startGlobalJob(req, res, 'stage2', companies?.length || 0);
     
   } catch (error) {
-    req.logger.error('Global Stage 2 failed', { error: error.message });
-    globalProgressEmitter.finishStage('stage2');
-    res.status(500).json({
-      success: false,
-      error: error.message
-    });
+    sendGlobalJobError(req, res, 'stage2', error);
   }
 });
 
@@ -1287,50 +1359,10 @@ router.post('/global/stage3', async (req, res) => {
       .not('website', 'is', null)
       .or('email.is.null,email.eq.""');
     
-    const totalCompanies = companies?.length || 0;
-    
-    // Инициализировать прогресс
-    globalProgressEmitter.startStage('stage3', totalCompanies);
-    
-    // Callback для обновления прогресса (с методом updateTotal для retry)
-    const progressCallback = (processed, current) => {
-      globalProgressEmitter.updateStage('stage3', processed, current);
-    };
-    // Добавить метод updateTotal для Stage3Retry
-    progressCallback.updateTotal = (newTotal) => {
-      globalProgressEmitter.updateTotal('stage3', newTotal);
-    };
-    
-    const Stage3AnalyzeContacts = require('../stages/Stage3AnalyzeContacts');
-    
-    // Использовать уже инициализированный Sonar Basic client (с API ключом)
-    const stage3 = new Stage3AnalyzeContacts(
-      req.sonarBasicClient,
-      req.settingsManager,
-      req.db,
-      req.logger
-    );
-    
-    // Установить callback для прогресса
-    stage3.setGlobalProgressCallback(progressCallback);
-    
-    // Запустить без sessionId = обработать ВСЕ компании
-    const result = await stage3.execute();
-    
-    globalProgressEmitter.finishStage('stage3');
-    
-    res.json({
-      success: true,
-      ...result
-    });
+    await startGlobalJob(req, res, 'stage3', companies?.length || 0);
     
   } catch (error) {
-    req.logger.error('Global Stage 3 failed', { error: error.message });
-    globalProgressEmitter.finishStage('stage3');
-    res.status(500).json({
-      success: false,
-      error: error.message
-    });
+    sendGlobalJobError(req, res, 'stage3', error);
   }
 });
 
@@ -1349,45 +1381,83 @@ router.post('/global/stage4', async (req, res) => {
       .gte('current_stage', 3)
       .is('stage4_status', null);
     
-    const totalCompanies = companies?.length || 0;
-    
-    // Инициализировать прогресс
-    globalProgressEmitter.startStage('stage4', totalCompanies);
-    
-    // Callback для обновления прогресса
-    const progressCallback = (processed, current) => {
-      globalProgressEmitter.updateStage('stage4', processed, current);
-    };
-    
-    const Stage4AnalyzeServices = require('../stages/Stage4AnalyzeServices');
-    
-    // Использовать уже инициализированный DeepSeek client
-    const stage4 = new Stage4AnalyzeServices(
-      req.deepseekClient,
-      req.settingsManager,
-      req.db,
-      req.logger
-    );
-    
-    // Установить callback для прогресса
-    stage4.setGlobalProgressCallback(progressCallback);
-    
-    // Запустить без sessionId = обработать ВСЕ компании
-    const result = await stage4.execute();
-    
-    globalProgressEmitter.finishStage('stage4');
+    await startGlobalJob(req, res, 'stage4', companies?.length || 0);
     
+  } catch (error) {
+    sendGlobalJobError(req, res, 'stage4', error);
+  }
+});
+
+/**
+ * GET /api/sessions/global/jobs
+ * Последние global задания (?stage=stage2&status=interrupted&limit=20)
+ */
+router.get('/global/jobs', async (req, res) => {
+  try {
+    const jobs = await globalJobManager.listJobs({
+      stage: req.query.stage || null,
+      status: req.query.status || null,
+      limit: Math.min(parseInt(req.query.limit) || 20, 100)
+    });
+
+    res.json({ success: true, jobs });
+  } catch (error) {
+    sendGlobalJobError(req, res, 'jobs', error);
+  }
+});
+
+/**
+ * GET /api/sessions/global/jobs/:jobId
+ * Статус задания: total / completed / failed / remaining, resumable
+ */
+router.get('/global/jobs/:jobId', async (req, res) => {
+  try {
+    const job = await globalJobManager.getJob(req.params.jobId);
+
+    if (!job) {
+      return res.status(404).json({ success: false, error: 'Job not found' });
+    }
+
     res.json({
       success: true,
-      ...result
+      job,
+      progress: globalProgressEmitter.getProgress(job.stage)
     });
-    
   } catch (error) {
-    req.logger.error('Global Stage 4 failed', { error: error.message });
-    res.status(500).json({
-      success: false,
-      error: error.message
+    sendGlobalJobError(req, res, 'jobs', error);
+  }
+});
+
+/**
+ * POST /api/sessions/global/jobs/:jobId/resume
+ * Продолжить прерванное задание с места остановки (в фоне, 202)
+ * ?wait=true - ответ после завершения
+ */
+router.post('/global/jobs/:jobId/resume', async (req, res) => {
+  try {
+    const job = await globalJobManager.resumeJob(req.params.jobId);
+    req.logger.info('Resuming global job', { jobId: job.jobId, stage: job.stage });
+
+    const run = runGlobalJob(req, job, job.total);
+
+    if (req.query.wait !== 'true') {
+      run.catch(() => {}); // Ошибка уже записана в задание
+      return res.status(202).json({
+        success: true,
+        job_id: job.jobId,
+        stage: job.stage,
+        status: 'running'
+      });
+    }
+
+    const result = await run;
+    res.json({
+      success: true,
+      job_id: job.jobId,
+      ...result
     });
+  } catch (error) {
+    sendGlobalJobError(req, res, 'resume', error);
   }
 });
 
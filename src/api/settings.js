@@ -8,8 +8,11 @@ const router = express.Router();
 router.get('/', async (req, res) => {
   try {
     const settings = await req.settingsManager.getAllSettings();
+    const snapshot = req.settingsManager.getSnapshot();
     res.json({
       success: true,
+      version: snapshot?.version || null,
+      loadedAt: snapshot ? new Date(snapshot.loadedAt).toISOString() : null,
       data: settings
     });
   } catch (error) {
@@ -78,7 +78,8 @@ router.post('/', async (req, res) => {
         session_id: sessionId,
         main_topic: result.main_topic,
         queries: result.queries,
-        total: result.total
+        total: result.total,
+        near_duplicates: result.nearDuplicates
       }
     });
 
@@ -71,6 +71,7 @@ app.get('/api', (req, res) => {
     version: '1.3.0',
     endpoints: {
       health: '/health',
+      metrics: '/metrics',
       settings: '/api/settings',
       sessions: '/api/sessions',
       companies: '/api/companies',
@@ -126,6 +127,13 @@ app.get('/health', (req, res) => {
   });
 });
 
+// Prometheus метрики (очередь, AI API, БД, event loop, стадии)
+app.get('/metrics', (req, res) => {
+  const metrics = require('./services/Metrics');
+  res.set('Content-Type', metrics.contentType);
+  res.send(metrics.render());
+});
+
 // Version endpoint (public, no auth required)
 app.get('/api/version', (req, res) => {
   const { execSync } = require('child_process');
@@ -174,15 +182,11 @@ try {
   // Инициализация Supabase Database (только Supabase, без MockDatabase)
   const SupabaseClient = require('./database/SupabaseClient');
   const SettingsManager = require('./services/SettingsManager');
-  const winston = require('winston');
+  const logManager = require('./services/Logger');
   
   console.log('✓ [INIT] Required modules loaded');
   
-  logger = winston.createLogger({
-    level: 'info',
-    format: winston.format.simple(),
-    transports: [new winston.transports.Console()]
-  });
+  logger = logManager.child('app');
   
   console.log('✓ [INIT] Logger created');
   
@@ -194,6 +198,28 @@ try {
   settingsManager = new SettingsManager(pool, logger);
   console.log('✓ [INIT] SettingsManager created');
   
+  // Global задания Stage 2/3/4: running задания упавшего процесса -> interrupted
+  const globalJobManager = require('./services/GlobalJobManager');
+  globalJobManager.init(pool);
+  globalJobManager.recoverInterrupted();
+  // Сжатое хранилище сырых ответов AI (stageN_raw_data -> raw_payloads)
+  require('./services/RawPayloadStore').init(pool);
+  // Индекс похожих поисковых запросов (история session_queries + выход компаний)
+  require('./services/QuerySimilarityIndex').init(pool);
+  // Журнал попыток Stage 2/3 и планировщик Retry (company_attempts)
+  require('./services/RetryScheduler').init(pool);
+  
+  // Снимок настроек + опрос settings_version (изменения из других процессов)
+  // Уровни логирования берутся из категории 'logging' и обновляются вместе со снимком
+  settingsManager.on('change', (snapshot) => {
+    logManager.configureFromSettings(snapshot.settings.logging);
+  });
+  settingsManager.startWatching()
+    .then(() => logManager.configureFromSettings(settingsManager.getSnapshot()?.settings.logging))
+    .catch(error => {
+      console.error('❌ [INIT] Settings watcher failed to start:', error.message);
+    });
+  
   // Инициализация API клиентов
   const DeepSeekClient = require('./services/DeepSeekClient');
   const SonarApiClient = require('./services/SonarApiClient');
@@ -11,6 +11,7 @@ require('dotenv').config();
 const SettingsManager = require('./services/SettingsManager');
 const SonarApiClient = require('./services/SonarApiClient');
 const MockDatabase = require('./database/MockDatabase');
+const HybridDatabase = require('./database/HybridDatabase');
 
 // Создание приложения
 const app = express();
@@ -47,11 +48,16 @@ if (process.env.LOG_TO_FILE === 'true') {
 
 // Подключение к базе данных
 // Используем Mock БД для быстрого старта (замените на PostgreSQL для production)
-const USE_MOCK_DB = !process.env.DATABASE_URL || process.env.USE_MOCK_DB === 'true';
+// USE_HYBRID_DB=true - MockDatabase + Supabase (снимок на диске + дельта, ленивые таблицы)
+const USE_HYBRID_DB = process.env.USE_HYBRID_DB === 'true';
+const USE_MOCK_DB = !USE_HYBRID_DB && (!process.env.DATABASE_URL || process.env.USE_MOCK_DB === 'true');
 
 let pool;
 
-if (USE_MOCK_DB) {
+if (USE_HYBRID_DB) {
+  logger.info('Using Hybrid Database (in-memory + Supabase)');
+  pool = new HybridDatabase();
+} else if (USE_MOCK_DB) {
   logger.info('Using Mock Database (in-memory)');
   pool = new MockDatabase();
   
@@ -107,6 +113,12 @@ let sonarApiClient;
 async function initializeServices() {
   try {
     logger.info('Initializing services...');
+
+    // Hybrid: до готовности загружаются только небольшие таблицы, остальные - лениво
+    if (USE_HYBRID_DB) {
+      await pool.initialize();
+      logger.info('✅ Hybrid Database initialized', { startupMs: pool.getReadiness().startupMs });
+    }
     
     // Инициализация SettingsManager
     settingsManager = new SettingsManager(pool, logger);
@@ -211,6 +223,8 @@ app.get('/health', async (req, res) => {
       status: 'OK',
       timestamp: new Date().toISOString(),
       database: 'connected',
+      // Hybrid: загрузка таблиц (снимок + дельта, ленивые таблицы)
+      database_readiness: pool.getReadiness ? pool.getReadiness() : undefined,
       settings_loaded: Object.keys(settings).length > 0,
       uptime: process.uptime()
     });
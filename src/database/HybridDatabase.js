@@ -1,77 +1,426 @@
+const fs = require('fs').promises;
+const path = require('path');
+const zlib = require('zlib');
+const { promisify } = require('util');
 const MockDatabase = require('./MockDatabase');
 const SupabaseClient = require('./SupabaseClient');
+const metrics = require('../services/Metrics');
+const log = require('../services/Logger').child('db');
+const { describeQuery } = SupabaseClient;
+
+const gzip = promisify(zlib.gzip);
+const gunzip = promisify(zlib.gunzip);
+
+// Таблицы, которые держит MockDatabase: первичный ключ и колонка дельты
+const TABLES = {
+  search_sessions: { key: 'session_id', column: 'updated_at' },
+  session_queries: { key: 'query_id', column: 'updated_at' },
+  pending_companies: { key: 'company_id', column: 'updated_at' },
+  found_companies: { key: 'company_id', column: 'updated_at' },
+  processing_progress: { key: 'progress_id', column: 'updated_at' }
+};
+// Небольшие таблицы загружаются до готовности, остальные - при первом обращении
+const EAGER_TABLES = ['search_sessions', 'session_queries', 'processing_progress'];
+const PAGE_SIZE = 1000;
+const SNAPSHOT_VERSION = 1;
+
+const dbQuerySeconds = metrics.histogram(
+  'db_query_duration_seconds', 'Database query latency', ['backend', 'table', 'operation']
+);
+const syncBacklog = metrics.gauge(
+  'db_sync_queue_length', 'Operations waiting in HybridDatabase sync queue to Supabase'
+);
+const syncTotal = metrics.counter(
+  'db_sync_operations_total', 'HybridDatabase sync operations by outcome', ['outcome']
+);
+const tableLoadSeconds = metrics.histogram(
+  'db_table_load_duration_seconds', 'HybridDatabase table load time', ['table', 'source']
+);
 
 /**
  * HybridDatabase - Гибридный подход
  * - MockDatabase для быстрого доступа (in-memory)
  * - Supabase для постоянного хранения (cloud)
  * - Автоматическая синхронизация
+ *
+ * Быстрый старт:
+ * - снимок таблицы на диске (NDJSON + gzip, HYBRID_SNAPSHOT_DIR) + дельта из Supabase
+ *   по updated_at >= high-water mark снимка (с запасом HYBRID_DELTA_OVERLAP_SECONDS);
+ *   удаленные строки дельта не видит - при расхождении количества строк таблица
+ *   перечитывается целиком
+ * - до готовности загружаются только EAGER_TABLES (HYBRID_EAGER_TABLES), остальные -
+ *   при первом обращении (ensureTable) или в фоне после старта (HYBRID_WARM_COLD_TABLES)
+ * - снимки измененных таблиц пишутся раз в HYBRID_SNAPSHOT_INTERVAL_MINUTES и в end()
+ * - состояние загрузки - getReadiness() (GET /health)
  */
 class HybridDatabase {
-  constructor() {
+  constructor(options = {}) {
     this.mock = new MockDatabase();
     this.supabase = new SupabaseClient();
     this.syncEnabled = true;
     this.syncQueue = [];
     this.isSyncing = false;
+
+    this.snapshotDir = options.snapshotDir || process.env.HYBRID_SNAPSHOT_DIR || path.join(__dirname, '../../data/snapshots');
+    this.useSnapshots = options.useSnapshots ?? process.env.HYBRID_SNAPSHOTS !== 'false';
+    this.eagerTables = options.eagerTables || (process.env.HYBRID_EAGER_TABLES
+      ? process.env.HYBRID_EAGER_TABLES.split(',').map(table => table.trim()).filter(table => TABLES[table])
+      : EAGER_TABLES);
+    this.warmColdTables = options.warmColdTables ?? process.env.HYBRID_WARM_COLD_TABLES === 'true';
+    this.snapshotMaxAgeMs = (parseFloat(process.env.HYBRID_SNAPSHOT_MAX_AGE_HOURS) || 24) * 3600 * 1000;
+    this.snapshotIntervalMs = (parseFloat(process.env.HYBRID_SNAPSHOT_INTERVAL_MINUTES) || 10) * 60 * 1000;
+    this.deltaOverlapMs = (parseFloat(process.env.HYBRID_DELTA_OVERLAP_SECONDS) || 300) * 1000;
+
+    this.tables = {};
+    Object.keys(TABLES).forEach(table => {
+      this.tables[table] = { state: 'cold', rows: 0, source: null, loadMs: null, deltaRows: 0, highWaterMark: null, dirty: false, error: null };
+    });
+    this.loading = new Map();
+    this.startedAt = null;
+    this.readyAt = null;
+    this.snapshotTimer = null;
+    this.savingSnapshots = null;
   }
 
   async initialize() {
-    console.log('🔧 Initializing Hybrid Database...');
+    log.info('Initializing Hybrid Database');
+    this.startedAt = Date.now();
     
     // Попытка подключения к Supabase
     try {
       await this.supabase.initialize();
-      console.log('✅ Supabase connected - sync enabled');
-      
-      // Загрузить данные из Supabase в MockDatabase
-      await this.loadFromSupabase();
+      log.info('Supabase connected - sync enabled');
     } catch (error) {
-      console.warn('⚠️  Supabase connection failed - running in offline mode');
-      console.warn('   Error:', error.message);
+      log.warn('Supabase connection failed - running in offline mode', { error: error.message });
       this.syncEnabled = false;
     }
+
+    // До готовности - только небольшие таблицы, параллельно (снимок + дельта)
+    await Promise.all(this.eagerTables.map(table => this.ensureTable(table)));
+    this.readyAt = Date.now();
+
+    if (this.useSnapshots) {
+      this.snapshotTimer = setInterval(() => {
+        this.saveSnapshots().catch(error => log.warn('Snapshot save failed', { error: error.message }));
+      }, this.snapshotIntervalMs);
+      this.snapshotTimer.unref();
+      // Первый снимок после старта - не задерживает готовность
+      setImmediate(() => {
+        this.saveSnapshots().catch(error => log.warn('Snapshot save failed', { error: error.message }));
+      });
+    }
+
+    if (this.warmColdTables) {
+      Object.keys(TABLES)
+        .filter(table => !this.eagerTables.includes(table))
+        .forEach(table => this.ensureTable(table).catch(() => {}));
+    }
     
-    console.log('✅ Hybrid Database initialized');
+    log.info('Hybrid Database initialized', {
+      startupMs: this.readyAt - this.startedAt,
+      tables: this.eagerTables.map(table => `${table}:${this.tables[table].source}`)
+    });
+  }
+
+  /**
+   * Загрузить таблицу в MockDatabase, если еще не загружена (повторные вызовы ждут ту же загрузку)
+   */
+  async ensureTable(table) {
+    const status = this.tables[table];
+    if (!status || status.state === 'ready') return;
+
+    if (!this.loading.has(table)) {
+      this.loading.set(table, this._loadTable(table).finally(() => this.loading.delete(table)));
+    }
+    return this.loading.get(table);
   }
 
+  /**
+   * Полная перезагрузка всех таблиц из Supabase (без снимков)
+   */
   async loadFromSupabase() {
     if (!this.syncEnabled) return;
 
-    try {
-      console.log('📥 Loading data from Supabase...');
-      
-      const tables = [
-        'search_sessions',
-        'session_queries',
-        'pending_companies',
-        'found_companies',
-        'processing_progress'
-      ];
-
-      for (const table of tables) {
+    log.info('Loading data from Supabase');
+    for (const table of Object.keys(TABLES)) {
+      await this._loadTable(table, { full: true });
+    }
+    log.info('Data loaded from Supabase');
+  }
+
+  /**
+   * Состояние загрузки для health check
+   */
+  getReadiness() {
+    const tables = {};
+    Object.entries(this.tables).forEach(([table, status]) => {
+      tables[table] = {
+        state: status.state,
+        lazy: !this.eagerTables.includes(table),
+        rows: status.rows,
+        source: status.source,
+        loadMs: status.loadMs,
+        deltaRows: status.deltaRows,
+        error: status.error
+      };
+    });
+
+    const failed = Object.values(this.tables).some(status => status.state === 'failed');
+    return {
+      status: !this.readyAt ? 'starting' : (failed || !this.syncEnabled ? 'degraded' : 'ready'),
+      ready: !!this.readyAt,
+      mode: this.syncEnabled ? 'hybrid' : 'offline',
+      startupMs: this.readyAt ? this.readyAt - this.startedAt : null,
+      pendingSync: this.syncQueue.length,
+      tables
+    };
+  }
+
+  /**
+   * Записать снимки измененных таблиц (all - всех загруженных)
+   */
+  async saveSnapshots({ all = false } = {}) {
+    if (!this.useSnapshots) return;
+    if (this.savingSnapshots) return this.savingSnapshots;
+
+    this.savingSnapshots = (async () => {
+      for (const [table, status] of Object.entries(this.tables)) {
+        if (status.state !== 'ready' || (!status.dirty && !all)) continue;
+        status.dirty = false;
         try {
-          const data = await this.supabase.directSelect(table);
-          if (data && data.length > 0) {
-            this.mock.data[table] = data;
-            console.log(`   ✅ Loaded ${data.length} records from ${table}`);
-          }
+          await this._writeSnapshot(table);
         } catch (error) {
-          console.warn(`   ⚠️  Failed to load ${table}:`, error.message);
+          status.dirty = true;
+          log.warn('Failed to write snapshot', { table, error: error.message });
         }
       }
-      
-      console.log('✅ Data loaded from Supabase');
+    })().finally(() => { this.savingSnapshots = null; });
+
+    return this.savingSnapshots;
+  }
+
+  /**
+   * Снимок + дельта, без снимка (или при расхождении) - полная загрузка
+   */
+  async _loadTable(table, { full = false } = {}) {
+    const { key } = TABLES[table];
+    const status = this.tables[table];
+    const started = Date.now();
+    status.state = 'loading';
+
+    try {
+      let rows = null;
+      let source = null;
+      let deltaRows = 0;
+      let highWaterMark = null;
+
+      const snapshot = full || !this.useSnapshots ? null : await this._readSnapshot(table);
+      if (snapshot && !this.syncEnabled) {
+        ({ rows, highWaterMark } = snapshot);
+        source = 'snapshot';
+      } else if (snapshot) {
+        const delta = await this._fetchDelta(table, snapshot.highWaterMark);
+        if (delta) {
+          rows = this._merge(snapshot.rows, delta, key);
+          const total = await this._count(table);
+          if (total === null || total === rows.length) {
+            deltaRows = delta.length;
+            highWaterMark = this._highWaterMark(delta, table) || snapshot.highWaterMark;
+            source = 'snapshot+delta';
+          } else {
+            log.info('Snapshot row count mismatch, full reload', { table, snapshot: rows.length, supabase: total });
+            rows = null;
+          }
+        }
+      }
+
+      if (!rows && this.syncEnabled) {
+        rows = await this._fetchAll(table);
+        highWaterMark = this._highWaterMark(rows, table);
+        source = 'supabase';
+      }
+
+      this.mock.data[table] = rows || [];
+      Object.assign(status, {
+        state: 'ready',
+        rows: this.mock.data[table].length,
+        source: source || 'empty',
+        loadMs: Date.now() - started,
+        deltaRows,
+        highWaterMark,
+        // Новый снимок нужен, если данные пришли не только из него
+        dirty: source === 'supabase' || deltaRows > 0,
+        error: null
+      });
+      tableLoadSeconds.observe({ table, source: status.source }, status.loadMs / 1000);
+      log.info('Loaded table', { table, rows: status.rows, source: status.source, deltaRows, ms: status.loadMs });
     } catch (error) {
-      console.error('❌ Failed to load from Supabase:', error.message);
+      Object.assign(status, { state: 'failed', loadMs: Date.now() - started, error: error.message });
+      log.warn('Failed to load table', { table, error: error.message });
     }
   }
 
+  async _fetchAll(table) {
+    const { key } = TABLES[table];
+    const rows = [];
+    let last = null;
+
+    // Keyset по первичному ключу: PostgREST отдает не больше max-rows строк за запрос
+    for (;;) {
+      let query = this.supabase.supabase
+        .from(table)
+        .select('*')
+        .order(key, { ascending: true })
+        .limit(PAGE_SIZE);
+      if (last !== null) query = query.gt(key, last);
+
+      const { data, error } = await query;
+      if (error) throw new Error(`Supabase query error: ${error.message}`);
+      rows.push(...(data || []));
+      if (!data || data.length < PAGE_SIZE) return rows;
+      last = data[data.length - 1][key];
+    }
+  }
+
+  /**
+   * Строки, измененные после high-water mark снимка; null - дельта невозможна
+   */
+  async _fetchDelta(table, highWaterMark) {
+    const { key, column } = TABLES[table];
+    if (!highWaterMark) return null;
+
+    // Запас на расхождение часов и транзакции, закоммиченные позже отметки
+    const since = new Date(Date.parse(highWaterMark) - this.deltaOverlapMs).toISOString();
+    const rows = [];
+
+    for (let from = 0; ; from += PAGE_SIZE) {
+      const { data, error } = await this.supabase.supabase
+        .from(table)
+        .select('*')
+        .gte(column, since)
+        .order(column, { ascending: true })
+        .order(key, { ascending: true })
+        .range(from, from + PAGE_SIZE - 1);
+
+      if (error) {
+        // Например, нет колонки updated_at (database/add-snapshot-delta-columns.sql не применен)
+        log.warn('Delta query failed, full reload', { table, error: error.message });
+        return null;
+      }
+      rows.push(...(data || []));
+      if (!data || data.length < PAGE_SIZE) return rows;
+    }
+  }
+
+  async _count(table) {
+    const { error, count } = await this.supabase.supabase
+      .from(table)
+      .select(TABLES[table].key, { count: 'exact', head: true });
+    return error || typeof count !== 'number' ? null : count;
+  }
+
+  _merge(rows, updates, key) {
+    if (updates.length === 0) return rows;
+    const byKey = new Map(rows.map(row => [row[key], row]));
+    updates.forEach(row => byKey.set(row[key], row));
+    return Array.from(byKey.values());
+  }
+
+  _highWaterMark(rows, table) {
+    const { column } = TABLES[table];
+    let max = null;
+    rows.forEach(row => {
+      const value = row[column] || row.created_at;
+      if (value && (!max || Date.parse(value) > Date.parse(max))) max = new Date(value).toISOString();
+    });
+    return max;
+  }
+
+  _snapshotPath(table) {
+    return path.join(this.snapshotDir, `${table}.ndjson.gz`);
+  }
+
+  /**
+   * Снимок: первая строка - заголовок { __snapshot: {...} }, дальше по строке JSON на запись
+   */
+  async _readSnapshot(table) {
+    let buffer;
+    try {
+      buffer = await fs.readFile(this._snapshotPath(table));
+    } catch (error) {
+      return null; // Снимка еще нет
+    }
+
+    try {
+      const lines = (await gunzip(buffer)).toString('utf8').split('\n');
+      const header = JSON.parse(lines[0]).__snapshot;
+      if (!header || header.version !== SNAPSHOT_VERSION || header.table !== table) return null;
+
+      if (Date.now() - Date.parse(header.savedAt) > this.snapshotMaxAgeMs) {
+        log.info('Snapshot too old, full reload', { table, savedAt: header.savedAt });
+        return null;
+      }
+
+      const rows = [];
+      for (let i = 1; i < lines.length; i++) {
+        if (lines[i]) rows.push(JSON.parse(lines[i]));
+      }
+      if (rows.length !== header.rows) return null; // Недописанный файл
+
+      return { rows, highWaterMark: header.highWaterMark, savedAt: header.savedAt };
+    } catch (error) {
+      log.warn('Snapshot unreadable, full reload', { table, error: error.message });
+      return null;
+    }
+  }
+
+  async _writeSnapshot(table) {
+    const rows = this.mock.data[table] || [];
+    const header = {
+      __snapshot: {
+        version: SNAPSHOT_VERSION,
+        table,
+        rows: rows.length,
+        // Отметка по данным из Supabase, а не по локальным записям (у них локальные часы)
+        highWaterMark: this.tables[table].highWaterMark,
+        savedAt: new Date().toISOString()
+      }
+    };
+
+    const lines = [JSON.stringify(header)];
+    rows.forEach(row => lines.push(JSON.stringify(row)));
+    const compressed = await gzip(Buffer.from(lines.join('\n'), 'utf8'));
+
+    // Запись через временный файл: прерванная запись не портит прошлый снимок
+    await fs.mkdir(this.snapshotDir, { recursive: true });
+    const file = this._snapshotPath(table);
+    await fs.writeFile(`${file}.tmp`, compressed);
+    await fs.rename(`${file}.tmp`, file);
+    log.debug('Snapshot written', { table, rows: rows.length, bytes: compressed.length });
+  }
+
+  _tablesIn(text) {
+    return Object.keys(TABLES).filter(table => text.includes(table));
+  }
+
   /**
    * Основной query метод - работает с MockDatabase + fallback на Supabase
    */
   async query(text, params = []) {
+    const endTimer = dbQuerySeconds.startTimer({ backend: 'hybrid', ...describeQuery(text) });
+    try {
+      return await this._query(text, params);
+    } finally {
+      endTimer();
+    }
+  }
+
+  async _query(text, params) {
     const operation = text.trim().toUpperCase();
+
+    // Ленивые таблицы загружаются при первом обращении
+    const tables = this._tablesIn(text);
+    await Promise.all(tables.map(table => this.ensureTable(table)));
     
     // Для SELECT - проверяем MockDatabase, если пусто - читаем из Supabase
     if (operation.startsWith('SELECT')) {
@@ -83,7 +432,7 @@ class HybridDatabase {
           const supabaseResult = await this.supabase.query(text, params);
           return supabaseResult;
         } catch (error) {
-          console.warn('⚠️  Supabase SELECT failed, using MockDatabase:', error.message);
+          log.warn('Supabase SELECT failed, using MockDatabase', { error: error.message });
           return mockResult;
         }
       }
@@ -93,6 +442,7 @@ class HybridDatabase {
     
     // Для INSERT/UPDATE/DELETE - выполняем в MockDatabase
     const result = await this.mock.query(text, params);
+    tables.forEach(table => { this.tables[table].dirty = true; });
     
     // Синхронизировать с Supabase в фоне (не ждем)
     if (this.syncEnabled) {
@@ -114,6 +464,7 @@ class HybridDatabase {
         operation.startsWith('DELETE')) {
       
       this.syncQueue.push({ text, params, result, timestamp: Date.now() });
+      syncBacklog.set({}, this.syncQueue.length);
       
       // Запустить синхронизацию если не запущена
       if (!this.isSyncing) {
@@ -129,17 +480,18 @@ class HybridDatabase {
     if (this.isSyncing || this.syncQueue.length === 0) return;
     
     this.isSyncing = true;
-    console.log(`🔄 Processing ${this.syncQueue.length} sync operations...`);
+    log.debug('Processing sync queue', { pending: this.syncQueue.length });
     
     while (this.syncQueue.length > 0) {
       const item = this.syncQueue.shift();
+      syncBacklog.set({}, this.syncQueue.length);
       
       try {
-        console.log(`  📤 Syncing: ${item.text.substring(0, 80)}...`);
         await this.supabase.query(item.text, item.params);
-        console.log(`  ✅ Synced successfully`);
+        syncTotal.inc({ outcome: 'success' });
       } catch (error) {
-        console.error(`  ❌ Supabase sync failed: ${error.message}`);
+        syncTotal.inc({ outcome: 'error' });
+        log.error('Supabase sync failed', { query: item.text.substring(0, 80), error: error.message });
         // Не добавляем обратно в очередь, чтобы не зациклиться
       }
       
@@ -148,7 +500,7 @@ class HybridDatabase {
     }
     
     this.isSyncing = false;
-    console.log('✅ Sync queue processed');
+    log.debug('Sync queue processed');
   }
 
   /**
@@ -156,13 +508,13 @@ class HybridDatabase {
    */
   async forceSync() {
     if (!this.syncEnabled) {
-      console.log('⚠️  Sync disabled - skipping');
+      log.warn('Sync disabled - skipping');
       return;
     }
 
-    console.log(`📤 Force syncing ${this.syncQueue.length} operations...`);
+    log.info('Force syncing', { pending: this.syncQueue.length });
     await this.processSyncQueue();
-    console.log('✅ Sync completed');
+    log.info('Sync completed');
   }
 
   /**
@@ -172,6 +524,7 @@ class HybridDatabase {
     if (!this.syncEnabled) return;
 
     try {
+      await this.ensureTable('search_sessions');
       const session = this.mock.data.search_sessions?.find(s => s.session_id === sessionId);
       if (session) {
         // Попытка UPDATE, если не существует - INSERT
@@ -183,10 +536,10 @@ class HybridDatabase {
           await this.supabase.directInsert('search_sessions', session);
         }
         
-        console.log(`✅ Synced session ${sessionId}`);
+        log.debug('Synced session', { sessionId });
       }
     } catch (error) {
-      console.error('⚠️  Failed to sync session:', error.message);
+      log.error('Failed to sync session', { sessionId, error: error.message });
     }
   }
 
@@ -194,6 +547,7 @@ class HybridDatabase {
     if (!this.syncEnabled) return;
 
     try {
+      await this.ensureTable('pending_companies');
       const companies = this.mock.data.pending_companies?.filter(c => c.session_id === sessionId) || [];
       
       for (const company of companies) {
@@ -213,13 +567,13 @@ class HybridDatabase {
             await this.supabase.directInsert('pending_companies', company);
           }
         } catch (error) {
-          console.warn(`   ⚠️  Failed to sync company ${company.company_name}:`, error.message);
+          log.warn('Failed to sync company', { company: company.company_name, error: error.message });
         }
       }
       
-      console.log(`✅ Synced ${companies.length} companies for session ${sessionId}`);
+      log.info('Synced companies', { sessionId, count: companies.length });
     } catch (error) {
-      console.error('⚠️  Failed to sync companies:', error.message);
+      log.error('Failed to sync companies', { sessionId, error: error.message });
     }
   }
 
@@ -232,6 +586,8 @@ class HybridDatabase {
 
   async end() {
     await this.forceSync();
+    if (this.snapshotTimer) clearInterval(this.snapshotTimer);
+    await this.saveSnapshots();
   }
 
   on(event, callback) {
@@ -240,13 +596,15 @@ class HybridDatabase {
     }
   }
 
-  // Прямой доступ к данным MockDatabase
+  // Прямой доступ к данным MockDatabase (ленивые таблицы пусты до ensureTable)
   get data() {
     return this.mock.data;
   }
 
   // Для совместимости с SupabaseClient
   async directSelect(table, filters = {}) {
+    await this.ensureTable(table);
+
     // Пробуем прочитать из MockDatabase
     let rows = this.mock.data[table] || [];
     
@@ -262,7 +620,7 @@ class HybridDatabase {
       try {
         return await this.supabase.directSelect(table, filters);
       } catch (error) {
-        console.warn(`⚠️  Supabase directSelect failed for ${table}:`, error.message);
+        log.warn('Supabase directSelect failed', { table, error: error.message });
       }
     }
     
@@ -1,5 +1,6 @@
 const fs = require('fs').promises;
 const path = require('path');
+const parsePool = require('../services/ParsePool');
 
 /**
  * JsonDatabase - Простая база данных на JSON файлах
@@ -52,7 +53,8 @@ class JsonDatabase {
 
   async save(table) {
     const filePath = path.join(this.dataDir, `${table}.json`);
-    await fs.writeFile(filePath, JSON.stringify(this.data[table], null, 2));
+    // Большие таблицы сериализуются в потоке ParsePool, не блокируя event loop
+    await fs.writeFile(filePath, await parsePool.serializeTable(this.data[table], { space: 2 }));
   }
 
   // Эмуляция SQL query
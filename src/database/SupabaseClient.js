@@ -1,5 +1,20 @@
 const { createClient } = require('@supabase/supabase-js');
 const axios = require('axios');
+const metrics = require('../services/Metrics');
+const log = require('../services/Logger').child('db');
+
+const dbQuerySeconds = metrics.histogram(
+  'db_query_duration_seconds', 'Database query latency', ['backend', 'table', 'operation']
+);
+
+/**
+ * Имя таблицы и операция из SQL текста - для меток метрик
+ */
+function describeQuery(text) {
+  const operation = text.trim().split(/\s+/)[0].toUpperCase();
+  const tableMatch = text.match(/(?:FROM|INTO|UPDATE)\s+(\w+)/i);
+  return { operation, table: tableMatch ? tableMatch[1] : 'unknown' };
+}
 
 /**
  * SupabaseClient - Обертка для работы с Supabase
@@ -27,8 +42,8 @@ class SupabaseClient {
     
     this.initialized = true;
     
-    console.log('✅ Supabase client initialized:', this.supabaseUrl);
-    console.log('⚠️  NOTE: If you see "fetch failed" errors, disable VPN and restart server');
+    log.info('Supabase client initialized', { url: this.supabaseUrl });
+    log.info('NOTE: If you see "fetch failed" errors, disable VPN and restart server');
   }
 
   /**
@@ -41,6 +56,7 @@ class SupabaseClient {
 
     // Определить тип операции
     const operation = text.trim().toUpperCase();
+    const endTimer = dbQuerySeconds.startTimer({ backend: 'supabase', ...describeQuery(text) });
 
     try {
       // SELECT
@@ -68,12 +84,14 @@ class SupabaseClient {
         return { rows: [] };
       }
 
-      console.warn('Unsupported query operation:', operation.substring(0, 50));
+      log.warn('Unsupported query operation', { operation: operation.substring(0, 50) });
       return { rows: [] };
 
     } catch (error) {
-      console.error('Supabase query error:', error.message);
+      log.error('Supabase query error', { error: error.message });
       throw error;
+    } finally {
+      endTimer();
     }
   }
 
@@ -120,7 +138,7 @@ class SupabaseClient {
       const { data, error } = await query;
 
       if (error) {
-        console.warn('Supabase SELECT error:', error.message);
+        log.warn('Supabase SELECT error', { table: tableName, error: error.message });
         throw new Error(`Supabase SELECT error: ${error.message}`);
       }
 
@@ -131,7 +149,7 @@ class SupabaseClient {
 
       return { rows: data || [] };
     } catch (error) {
-      console.error('Supabase query failed, returning empty result:', error.message);
+      log.error('Supabase query failed, returning empty result', { table: tableName, error: error.message });
       // Возвращаем пустой результат вместо ошибки для совместимости
       return { rows: [] };
     }
@@ -189,14 +207,14 @@ class SupabaseClient {
         .select();
 
       if (error) {
-        console.warn('Supabase INSERT error:', error.message);
+        log.warn('Supabase INSERT error', { table: tableName, error: error.message });
         // Для совместимости возвращаем исходную строку
         return { rows: [row] };
       }
 
       return { rows: data || [row] };
     } catch (error) {
-      console.error('Supabase INSERT failed, returning row:', error.message);
+      log.error('Supabase INSERT failed, returning row', { table: tableName, error: error.message });
       // Возвращаем строку для совместимости
       return { rows: [row] };
     }
@@ -260,13 +278,13 @@ class SupabaseClient {
       const { data, error } = await query.select();
 
       if (error) {
-        console.warn('Supabase UPDATE error:', error.message);
+        log.warn('Supabase UPDATE error', { table: tableName, error: error.message });
         return { rows: [] };
       }
 
       return { rows: data || [] };
     } catch (error) {
-      console.error('Supabase UPDATE failed:', error.message);
+      log.error('Supabase UPDATE failed', { table: tableName, error: error.message });
       return { rows: [] };
     }
   }
@@ -338,7 +356,9 @@ class SupabaseClient {
       query = query.eq(key, value);
     });
 
+    const endTimer = dbQuerySeconds.startTimer({ backend: 'supabase', table, operation: 'SELECT' });
     const { data, error } = await query;
+    endTimer();
     
     if (error) {
       throw new Error(`Supabase query error: ${error.message}`);
@@ -348,10 +368,12 @@ class SupabaseClient {
   }
 
   async directInsert(table, row) {
+    const endTimer = dbQuerySeconds.startTimer({ backend: 'supabase', table, operation: 'INSERT' });
     const { data, error } = await this.supabase
       .from(table)
       .insert([row])
       .select();
+    endTimer();
 
     if (error) {
       throw new Error(`Supabase insert error: ${error.message}`);
@@ -367,7 +389,9 @@ class SupabaseClient {
       query = query.eq(key, value);
     });
 
+    const endTimer = dbQuerySeconds.startTimer({ backend: 'supabase', table, operation: 'UPDATE' });
     const { data, error } = await query.select();
+    endTimer();
 
     if (error) {
       throw new Error(`Supabase update error: ${error.message}`);
@@ -378,4 +402,5 @@ class SupabaseClient {
 }
 
 module.exports = SupabaseClient;
+module.exports.describeQuery = describeQuery;
 
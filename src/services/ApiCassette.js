@@ -0,0 +1,274 @@
+const fs = require('fs');
+const path = require('path');
+const zlib = require('zlib');
+const crypto = require('crypto');
+const log = require('./Logger').child('cassette');
+
+/**
+ * ApiCassette - Запись и воспроизведение вызовов AI API (Sonar, DeepSeek)
+ *
+ * Режимы (AI_CASSETTE_MODE):
+ *   off     - обычная работа (по умолчанию)
+ *   record  - каждый успешный ответ API дописывается в кассету
+ *   replay  - ответы берутся только из кассеты, сеть не используется;
+ *             промах - ошибка ECASSETTEMISS (без повторных попыток)
+ *   hybrid  - ответ из кассеты, при промахе - реальный вызов с записью
+ *
+ * Хранилище: AI_CASSETTE_DIR (по умолчанию data/cassettes/default),
+ * один файл <provider>.ndjson.gz на провайдера. Записи буферизуются и
+ * дописываются пачками как отдельные gzip-члены (файл остается валидным gzip).
+ *
+ * Ключ записи - хэш провайдера, модели и сообщений. Одинаковые запросы
+ * воспроизводятся в порядке записи (повторы Stage 1 и т.п. сохраняют последовательность).
+ *
+ * AI_CASSETTE_LATENCY - воспроизведение задержек: 0 - мгновенно (по умолчанию),
+ * 1 - как при записи, 0.25 - в 4 раза быстрее.
+ * В replay режиме клиентская пауза между запросами (rate limit) отключается,
+ * чтобы бенчмарк мерил только собственные накладные расходы: БД, парсинг,
+ * дедупликацию и очередь. AI_CASSETTE_THROTTLE=on возвращает паузы.
+ */
+class ApiCassette {
+  constructor() {
+    this.configure({
+      mode: process.env.AI_CASSETTE_MODE || 'off',
+      dir: process.env.AI_CASSETTE_DIR,
+      latencyFactor: process.env.AI_CASSETTE_LATENCY,
+      throttle: process.env.AI_CASSETTE_THROTTLE
+    });
+  }
+
+  /**
+   * @param {Object} options - { mode, dir, latencyFactor, throttle }
+   */
+  configure(options = {}) {
+    if (this.pending && this.pending.length > 0) {
+      this.flush();
+    }
+
+    this.mode = ['record', 'replay', 'hybrid'].includes(options.mode) ? options.mode : 'off';
+    this.dir = options.dir || path.join(__dirname, '../../data/cassettes/default');
+    this.latencyFactor = parseFloat(options.latencyFactor) || 0;
+    this.throttle = options.throttle === 'on' || options.throttle === true || this.mode !== 'replay';
+
+    this.tapes = new Map();    // provider -> Map(key -> [entries])
+    this.cursors = new Map();  // provider:key -> следующий индекс
+    this.pending = [];
+    this.flushTimer = null;
+    this.stats = { hits: 0, misses: 0, recorded: 0 };
+
+    if (this.mode !== 'off') {
+      log.info('Cassette mode enabled', {
+        mode: this.mode,
+        dir: this.dir,
+        latencyFactor: this.latencyFactor,
+        throttle: this.throttle
+      });
+    }
+  }
+
+  isRecording() {
+    return this.mode === 'record' || this.mode === 'hybrid';
+  }
+
+  isReplaying() {
+    return this.mode === 'replay' || this.mode === 'hybrid';
+  }
+
+  /**
+   * Соблюдать ли клиентские паузы между запросами
+   */
+  shouldThrottle() {
+    return this.throttle;
+  }
+
+  /**
+   * Найти записанный ответ
+   * @param {string} provider - 'sonar' | 'deepseek'
+   * @param {Object} requestBody - тело POST /chat/completions
+   * @returns {Promise<Object|null>} axios-подобный ответ { status, data, request, cassette }
+   *   или null (hybrid, промах). В replay режиме промах - исключение ECASSETTEMISS.
+   */
+  async replay(provider, requestBody) {
+    const key = this._key(provider, requestBody);
+    const entries = this._tape(provider).get(key);
+
+    if (!entries || entries.length === 0) {
+      this.stats.misses++;
+      if (this.mode === 'hybrid') return null;
+
+      const error = new Error(`Cassette miss for ${provider}/${requestBody.model} (key ${key.substring(0, 12)})`);
+      error.code = 'ECASSETTEMISS';
+      throw error;
+    }
+
+    // Повторяющиеся запросы - по порядку, после конца кассеты - последний ответ
+    const cursorKey = `${provider}:${key}`;
+    const index = this.cursors.get(cursorKey) || 0;
+    const entry = entries[Math.min(index, entries.length - 1)];
+    this.cursors.set(cursorKey, index + 1);
+    this.stats.hits++;
+
+    if (this.latencyFactor > 0 && entry.l) {
+      await new Promise(resolve => setTimeout(resolve, entry.l * this.latencyFactor));
+    }
+
+    return {
+      status: entry.s || 200,
+      data: JSON.stringify(entry.r),
+      request: null,
+      cassette: { latencyMs: entry.l, recordedAt: entry.t }
+    };
+  }
+
+  /**
+   * Записать успешный ответ
+   * @param {string} provider
+   * @param {Object} requestBody - тело запроса
+   * @param {Object} data - распарсенный ответ API
+   * @param {Object} meta - { stage, latencyMs, status }
+   */
+  record(provider, requestBody, data, meta = {}) {
+    if (!this.isRecording()) return;
+
+    // Только то, что читают клиенты - без id/created/object
+    const message = data.choices?.[0]?.message || {};
+    const response = {
+      model: data.model,
+      choices: [{
+        message: {
+          content: message.content,
+          ...(message.reasoning_content ? { reasoning_content: message.reasoning_content } : {})
+        }
+      }],
+      usage: data.usage
+    };
+    if (data.citations) response.citations = data.citations;
+
+    const entry = {
+      k: this._key(provider, requestBody),
+      p: provider,
+      m: requestBody.model,
+      st: meta.stage,
+      s: meta.status || 200,
+      l: meta.latencyMs,
+      t: Date.now(),
+      r: response
+    };
+
+    // Запись доступна для воспроизведения в том же процессе (hybrid)
+    const tape = this._tape(provider);
+    if (!tape.has(entry.k)) tape.set(entry.k, []);
+    tape.get(entry.k).push(entry);
+
+    this.pending.push(entry);
+    this.stats.recorded++;
+    this._scheduleFlush();
+  }
+
+  /**
+   * Дописать буфер на диск (синхронно - вызывается и из process.on('exit'))
+   */
+  flush() {
+    if (this.flushTimer) {
+      clearTimeout(this.flushTimer);
+      this.flushTimer = null;
+    }
+    if (this.pending.length === 0) return;
+
+    const byProvider = new Map();
+    this.pending.forEach(entry => {
+      if (!byProvider.has(entry.p)) byProvider.set(entry.p, []);
+      byProvider.get(entry.p).push(JSON.stringify(entry));
+    });
+    this.pending = [];
+
+    try {
+      fs.mkdirSync(this.dir, { recursive: true });
+      for (const [provider, lines] of byProvider) {
+        fs.appendFileSync(this._file(provider), zlib.gzipSync(lines.join('\n') + '\n'));
+      }
+    } catch (error) {
+      log.error('Failed to write cassette', { dir: this.dir, error: error.message });
+    }
+  }
+
+  getStats() {
+    const providers = {};
+    for (const [provider, tape] of this.tapes) {
+      let entries = 0;
+      tape.forEach(list => { entries += list.length; });
+      providers[provider] = { keys: tape.size, entries };
+    }
+
+    return {
+      mode: this.mode,
+      dir: this.dir,
+      latencyFactor: this.latencyFactor,
+      throttle: this.throttle,
+      ...this.stats,
+      providers
+    };
+  }
+
+  _scheduleFlush() {
+    if (this.pending.length >= 50) {
+      this.flush();
+      return;
+    }
+    if (this.flushTimer) return;
+
+    this.flushTimer = setTimeout(() => this.flush(), 1000);
+    if (this.flushTimer.unref) this.flushTimer.unref();
+
+    if (!this.exitHookInstalled) {
+      this.exitHookInstalled = true;
+      process.once('exit', () => this.flush());
+    }
+  }
+
+  /**
+   * Загрузить кассету провайдера (лениво, один раз)
+   */
+  _tape(provider) {
+    if (this.tapes.has(provider)) return this.tapes.get(provider);
+
+    const tape = new Map();
+    this.tapes.set(provider, tape);
+
+    const file = this._file(provider);
+    if (!fs.existsSync(file)) return tape;
+
+    try {
+      const lines = zlib.gunzipSync(fs.readFileSync(file)).toString('utf8').split('\n');
+      lines.forEach(line => {
+        if (!line) return;
+        const entry = JSON.parse(line);
+        if (!tape.has(entry.k)) tape.set(entry.k, []);
+        tape.get(entry.k).push(entry);
+      });
+      log.info('Cassette loaded', { provider, keys: tape.size, file });
+    } catch (error) {
+      log.error('Failed to load cassette', { provider, file, error: error.message });
+    }
+
+    return tape;
+  }
+
+  _file(provider) {
+    return path.join(this.dir, `${provider}.ndjson.gz`);
+  }
+
+  /**
+   * Ключ: провайдер + модель + сообщения. Температура и max_tokens не входят -
+   * повторные попытки с другой температурой должны находить ту же запись
+   */
+  _key(provider, requestBody) {
+    const messages = (requestBody.messages || []).map(m => `${m.role}\u0000${m.content}`).join('\u0001');
+    return crypto.createHash('sha1')
+      .update(`${provider}\u0002${requestBody.model}\u0002${messages}`)
+      .digest('hex');
+  }
+}
+
+// Экспортируем SINGLETON - одна кассета на процесс
+module.exports = new ApiCassette();
@@ -0,0 +1,587 @@
+const fs = require('fs');
+const path = require('path');
+const log = require('./Logger').child('cluster');
+
+/**
+ * ClusterStore - Общее состояние для нескольких процессов (web + stage workers)
+ *
+ * CLUSTER_BACKEND:
+ *   memory - один процесс, поведение как раньше (по умолчанию)
+ *   file   - общий каталог CLUSTER_DIR (по умолчанию data/cluster), блокировка через mkdir;
+ *            для локальных тестов нескольких процессов на одной машине
+ *   redis  - REDIS_URL (зависимость redis уже есть); для реплик Railway
+ *
+ * Что хранится:
+ *   очереди задач  - push / reserve / ack / fail с visibility timeout:
+ *                    зарезервированная задача, которую worker не подтвердил за
+ *                    visibilityMs (упал, OOM), снова становится доступной
+ *   token bucket   - лимит запросов на API ключ для всего кластера
+ *   прогресс       - счетчики по worker'ам, суммируются при чтении
+ */
+
+const DEFAULT_VISIBILITY_MS = parseInt(process.env.CLUSTER_VISIBILITY_MS) || 10 * 60 * 1000;
+const LOCK_STALE_MS = 10000;
+const KEY_PREFIX = 'smart-email:';
+
+/**
+ * Общая логика memory и file backend'ов: состояние - JSON объект,
+ * каждая операция - транзакция над ним
+ */
+class LocalBackend {
+  constructor(dir = null) {
+    this.dir = dir;
+    this.state = new Map(); // только memory
+    if (dir) fs.mkdirSync(dir, { recursive: true });
+  }
+
+  async push(queue, items) {
+    return this._transact(`queue-${queue}`, (state) => {
+      let added = 0;
+      items.forEach(({ id, payload }) => {
+        if (state.items[id]) return; // уже в очереди или в работе
+        state.items[id] = { payload, attempts: 0, deadline: 0 };
+        state.ready.push(id);
+        added++;
+      });
+      return added;
+    });
+  }
+
+  async reserve(queue, workerId, visibilityMs) {
+    return this._transact(`queue-${queue}`, (state) => {
+      const now = Date.now();
+      this._requeueExpired(state, now);
+
+      // В ready может остаться id, уже подтвержденный ack после истечения
+      // visibility timeout (задача вернулась в очередь, но worker ее доделал)
+      let id;
+      let item;
+      do {
+        id = state.ready.shift();
+        if (!id) return null;
+        item = state.items[id];
+      } while (!item);
+
+      item.attempts++;
+      item.deadline = now + visibilityMs;
+      item.worker = workerId;
+      state.inflight[id] = item.deadline;
+      return { id, payload: item.payload, attempts: item.attempts };
+    });
+  }
+
+  async ack(queue, id) {
+    return this._transact(`queue-${queue}`, (state) => {
+      if (!state.items[id]) return false;
+      delete state.items[id];
+      delete state.inflight[id];
+      state.done++;
+      return true;
+    });
+  }
+
+  async fail(queue, id, maxAttempts) {
+    return this._transact(`queue-${queue}`, (state) => {
+      const item = state.items[id];
+      if (!item) return 'gone';
+      delete state.inflight[id];
+
+      if (item.attempts < maxAttempts) {
+        // Уже вернулась в очередь по visibility timeout - без дубля
+        if (!state.ready.includes(id)) state.ready.push(id);
+        return 'requeued';
+      }
+      delete state.items[id];
+      state.failed++;
+      return 'dropped';
+    });
+  }
+
+  async queueStats(queue) {
+    return this._transact(`queue-${queue}`, (state) => {
+      this._requeueExpired(state, Date.now());
+      return {
+        ready: state.ready.length,
+        inflight: Object.keys(state.inflight).length,
+        done: state.done,
+        failed: state.failed
+      };
+    });
+  }
+
+  async purge(queue) {
+    return this._transact(`queue-${queue}`, (state) => {
+      const removed = Object.keys(state.items).length;
+      state.items = {};
+      state.ready = [];
+      state.inflight = {};
+      return removed;
+    });
+  }
+
+  async takeToken(bucket, ratePerMin, burst) {
+    return this._transact('buckets', (state) => {
+      const now = Date.now();
+      const perMs = ratePerMin / 60000;
+      const entry = state[bucket] || { tokens: burst, ts: now };
+
+      entry.tokens = Math.min(burst, entry.tokens + (now - entry.ts) * perMs);
+      entry.ts = now;
+
+      let waitMs = 0;
+      if (entry.tokens >= 1) {
+        entry.tokens -= 1;
+      } else {
+        waitMs = Math.ceil((1 - entry.tokens) / perMs);
+      }
+      state[bucket] = entry;
+      return waitMs;
+    });
+  }
+
+  async reportProgress(key, workerId, processed, current) {
+    return this._transact(`progress-${key}`, (state) => {
+      const entry = state[workerId] || { processed: 0 };
+      entry.processed += processed;
+      entry.current = current;
+      entry.ts = Date.now();
+      state[workerId] = entry;
+    });
+  }
+
+  async getProgress(key) {
+    return this._transact(`progress-${key}`, state => ({ ...state }));
+  }
+
+  async resetProgress(key) {
+    return this._transact(`progress-${key}`, (state) => {
+      Object.keys(state).forEach(k => delete state[k]);
+    });
+  }
+
+  async putResult(key, id, value) {
+    return this._transact(`results-${key}`, (state) => {
+      state[id] = value;
+    });
+  }
+
+  async getResults(key) {
+    return this._transact(`results-${key}`, state => ({ ...state }));
+  }
+
+  async clearResults(key) {
+    return this._transact(`results-${key}`, (state) => {
+      Object.keys(state).forEach(k => delete state[k]);
+    });
+  }
+
+  async close() {}
+
+  _requeueExpired(state, now) {
+    for (const [id, deadline] of Object.entries(state.inflight)) {
+      if (deadline <= now) {
+        delete state.inflight[id];
+        if (state.ready.includes(id)) continue;
+        state.ready.unshift(id);
+        log.warn('Visibility timeout expired, item requeued', { id, worker: state.items[id]?.worker });
+      }
+    }
+  }
+
+  _initial(name) {
+    return name.startsWith('queue-')
+      ? { items: {}, ready: [], inflight: {}, done: 0, failed: 0 }
+      : {};
+  }
+
+  async _transact(name, fn) {
+    if (!this.dir) {
+      if (!this.state.has(name)) this.state.set(name, this._initial(name));
+      return fn(this.state.get(name));
+    }
+
+    const file = path.join(this.dir, `${name.replace(/[^\w.-]/g, '_')}.json`);
+    await this._lock(file);
+    try {
+      const state = fs.existsSync(file)
+        ? JSON.parse(fs.readFileSync(file, 'utf8'))
+        : this._initial(name);
+      const result = fn(state);
+      // Атомарная замена: читатели без блокировки не увидят полуфайл
+      fs.writeFileSync(`${file}.tmp`, JSON.stringify(state));
+      fs.renameSync(`${file}.tmp`, file);
+      return result;
+    } finally {
+      this._unlock(file);
+    }
+  }
+
+  async _lock(file) {
+    const lockDir = `${file}.lock`;
+    for (let attempt = 0; ; attempt++) {
+      try {
+        fs.mkdirSync(lockDir);
+        return;
+      } catch (error) {
+        if (error.code !== 'EEXIST') throw error;
+
+        // Блокировка упавшего процесса
+        try {
+          if (Date.now() - fs.statSync(lockDir).mtimeMs > LOCK_STALE_MS) {
+            fs.rmdirSync(lockDir);
+            continue;
+          }
+        } catch (statError) {
+          continue; // Блокировку только что сняли
+        }
+        await new Promise(resolve => setTimeout(resolve, Math.min(5 + attempt * 5, 50)));
+      }
+    }
+  }
+
+  _unlock(file) {
+    try {
+      fs.rmdirSync(`${file}.lock`);
+    } catch (error) {
+      // уже снята (stale cleanup другим процессом)
+    }
+  }
+}
+
+/**
+ * Redis backend: атомарность через Lua скрипты
+ *   <prefix>q:<queue>:ready     LIST  id
+ *   <prefix>q:<queue>:inflight  ZSET  id -> deadline
+ *   <prefix>q:<queue>:items     HASH  id -> payload (JSON)
+ *   <prefix>q:<queue>:attempts  HASH  id -> attempts
+ *   <prefix>q:<queue>:stats     HASH  done, failed
+ */
+const REDIS_SCRIPTS = {
+  push: `
+    local added = 0
+    for i = 1, #ARGV, 2 do
+      if redis.call('HSETNX', KEYS[3], ARGV[i], ARGV[i + 1]) == 1 then
+        redis.call('RPUSH', KEYS[1], ARGV[i])
+        added = added + 1
+      end
+    end
+    return added`,
+  reserve: `
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, id in ipairs(expired) do
+      redis.call('ZREM', KEYS[2], id)
+      redis.call('LPUSH', KEYS[1], id)
+    end
+    -- id без payload - уже подтвержден ack после visibility timeout: пропускаем
+    local id, payload
+    repeat
+      id = redis.call('LPOP', KEYS[1])
+      if not id then return nil end
+      payload = redis.call('HGET', KEYS[3], id)
+    until payload
+    local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), id)
+    return {id, payload, attempts}`,
+  ack: `
+    if redis.call('HDEL', KEYS[3], ARGV[1]) == 0 then return 0 end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    redis.call('HINCRBY', KEYS[5], 'done', 1)
+    return 1`,
+  fail: `
+    if redis.call('HEXISTS', KEYS[3], ARGV[1]) == 0 then return 'gone' end
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    local attempts = tonumber(redis.call('HGET', KEYS[4], ARGV[1]) or '0')
+    if attempts < tonumber(ARGV[2]) then
+      if not redis.call('LPOS', KEYS[1], ARGV[1]) then
+        redis.call('RPUSH', KEYS[1], ARGV[1])
+      end
+      return 'requeued'
+    end
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    redis.call('HINCRBY', KEYS[5], 'failed', 1)
+    return 'dropped'`,
+  takeToken: `
+    local now = tonumber(ARGV[1])
+    local perMs = tonumber(ARGV[2])
+    local burst = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * perMs)
+    local wait = 0
+    if tokens >= 1 then
+      tokens = tokens - 1
+    else
+      wait = math.ceil((1 - tokens) / perMs)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[1], 3600000)
+    return wait`
+};
+
+class RedisBackend {
+  constructor(url) {
+    // Подключается лениво - memory/file режимы не требуют redis
+    const { createClient } = require('redis');
+    this.client = createClient({ url });
+    this.client.on('error', error => log.error('Redis error', { error: error.message }));
+    this.ready = this.client.connect();
+  }
+
+  _keys(queue) {
+    const base = `${KEY_PREFIX}q:${queue}`;
+    return [`${base}:ready`, `${base}:inflight`, `${base}:items`, `${base}:attempts`, `${base}:stats`];
+  }
+
+  async _eval(script, keys, args) {
+    await this.ready;
+    return this.client.eval(REDIS_SCRIPTS[script], {
+      keys,
+      arguments: args.map(String)
+    });
+  }
+
+  async push(queue, items) {
+    if (items.length === 0) return 0;
+    const args = [];
+    items.forEach(({ id, payload }) => args.push(id, JSON.stringify(payload)));
+    return this._eval('push', this._keys(queue), args);
+  }
+
+  async reserve(queue, workerId, visibilityMs) {
+    const result = await this._eval('reserve', this._keys(queue), [Date.now(), visibilityMs]);
+    if (!result) return null;
+    return { id: result[0], payload: JSON.parse(result[1]), attempts: Number(result[2]) };
+  }
+
+  async ack(queue, id) {
+    return (await this._eval('ack', this._keys(queue), [id])) === 1;
+  }
+
+  async fail(queue, id, maxAttempts) {
+    return this._eval('fail', this._keys(queue), [id, maxAttempts]);
+  }
+
+  async queueStats(queue) {
+    await this.ready;
+    const [ready, inflight, , , stats] = this._keys(queue);
+    const [readyCount, inflightCount, counters] = await Promise.all([
+      this.client.lLen(ready),
+      this.client.zCard(inflight),
+      this.client.hGetAll(stats)
+    ]);
+    return {
+      ready: readyCount,
+      inflight: inflightCount,
+      done: parseInt(counters.done) || 0,
+      failed: parseInt(counters.failed) || 0
+    };
+  }
+
+  async purge(queue) {
+    await this.ready;
+    const keys = this._keys(queue);
+    const removed = await this.client.hLen(keys[2]);
+    await this.client.del(keys.slice(0, 4));
+    return removed;
+  }
+
+  async takeToken(bucket, ratePerMin, burst) {
+    const wait = await this._eval('takeToken', [`${KEY_PREFIX}bucket:${bucket}`], [
+      Date.now(), ratePerMin / 60000, burst
+    ]);
+    return Number(wait);
+  }
+
+  async reportProgress(key, workerId, processed, current) {
+    await this.ready;
+    const hash = `${KEY_PREFIX}progress:${key}`;
+    const raw = await this.client.hGet(hash, workerId);
+    const entry = raw ? JSON.parse(raw) : { processed: 0 };
+    entry.processed += processed; // одно поле на worker'а - гонок между процессами нет
+    entry.current = current;
+    entry.ts = Date.now();
+    await this.client.hSet(hash, workerId, JSON.stringify(entry));
+    await this.client.pExpire(hash, 24 * 3600000);
+  }
+
+  async getProgress(key) {
+    await this.ready;
+    const raw = await this.client.hGetAll(`${KEY_PREFIX}progress:${key}`);
+    const result = {};
+    Object.entries(raw).forEach(([workerId, value]) => { result[workerId] = JSON.parse(value); });
+    return result;
+  }
+
+  async resetProgress(key) {
+    await this.ready;
+    await this.client.del(`${KEY_PREFIX}progress:${key}`);
+  }
+
+  async putResult(key, id, value) {
+    await this.ready;
+    const hash = `${KEY_PREFIX}results:${key}`;
+    await this.client.hSet(hash, id, JSON.stringify(value));
+    await this.client.pExpire(hash, 24 * 3600000);
+  }
+
+  async getResults(key) {
+    await this.ready;
+    const raw = await this.client.hGetAll(`${KEY_PREFIX}results:${key}`);
+    const result = {};
+    Object.entries(raw).forEach(([id, value]) => { result[id] = JSON.parse(value); });
+    return result;
+  }
+
+  async clearResults(key) {
+    await this.ready;
+    await this.client.del(`${KEY_PREFIX}results:${key}`);
+  }
+
+  async close() {
+    await this.ready.catch(() => {});
+    await this.client.quit().catch(() => {});
+  }
+}
+
+class ClusterStore {
+  constructor() {
+    this.configure({
+      backend: process.env.CLUSTER_BACKEND,
+      dir: process.env.CLUSTER_DIR,
+      redisUrl: process.env.REDIS_URL
+    });
+  }
+
+  /**
+   * @param {Object} options - { backend, dir, redisUrl }
+   */
+  configure(options = {}) {
+    this.mode = ['file', 'redis'].includes(options.backend) ? options.backend : 'memory';
+
+    if (this.mode === 'redis') {
+      this.backend = new RedisBackend(options.redisUrl || 'redis://localhost:6379');
+    } else if (this.mode === 'file') {
+      this.dir = options.dir || path.join(__dirname, '../../data/cluster');
+      this.backend = new LocalBackend(this.dir);
+    } else {
+      this.backend = new LocalBackend();
+    }
+
+    if (this.mode !== 'memory') {
+      log.info('Cluster backend enabled', { mode: this.mode, dir: this.dir });
+    }
+  }
+
+  /**
+   * Распределенный режим: stage работа идет через общую очередь stage workers
+   */
+  isDistributed() {
+    return this.mode !== 'memory';
+  }
+
+  /**
+   * Добавить задачи (id уникален - повторный push той же задачи игнорируется)
+   * @param {string} queue
+   * @param {Array<{id: string, payload: Object}>} items
+   * @returns {Promise<number>} сколько добавлено
+   */
+  push(queue, items) {
+    return this.backend.push(queue, items);
+  }
+
+  /**
+   * Взять задачу. Без ack за visibilityMs задача вернется в очередь
+   * @returns {Promise<{id, payload, attempts}|null>}
+   */
+  reserve(queue, workerId, visibilityMs = DEFAULT_VISIBILITY_MS) {
+    return this.backend.reserve(queue, workerId, visibilityMs);
+  }
+
+  ack(queue, id) {
+    return this.backend.ack(queue, id);
+  }
+
+  /**
+   * Задача не выполнена: вернуть в очередь или выбросить после maxAttempts
+   * @returns {Promise<'requeued'|'dropped'|'gone'>}
+   */
+  fail(queue, id, maxAttempts = 3) {
+    return this.backend.fail(queue, id, maxAttempts);
+  }
+
+  /**
+   * @returns {Promise<{ready, inflight, done, failed}>}
+   */
+  queueStats(queue) {
+    return this.backend.queueStats(queue);
+  }
+
+  purge(queue) {
+    return this.backend.purge(queue);
+  }
+
+  /**
+   * Дождаться токена в общем bucket (лимит на API ключ для всего кластера)
+   * @param {string} bucket - например sonar:<хэш ключа>
+   * @param {number} ratePerMin - запросов в минуту на весь кластер
+   * @param {number} burst - сколько запросов можно подряд после простоя
+   */
+  async waitForToken(bucket, ratePerMin, burst = 1) {
+    for (;;) {
+      const waitMs = await this.backend.takeToken(bucket, ratePerMin, burst);
+      if (waitMs <= 0) return;
+      log.debug('Rate limited by cluster bucket', { bucket, waitMs });
+      await new Promise(resolve => setTimeout(resolve, waitMs));
+    }
+  }
+
+  /**
+   * Прогресс worker'а (processed - прирост)
+   */
+  reportProgress(key, workerId, processed, current = null) {
+    return this.backend.reportProgress(key, workerId, processed, current);
+  }
+
+  /**
+   * Сумма по всем worker'ам
+   * @returns {Promise<{processed, current, workers}>}
+   */
+  async getProgress(key) {
+    const entries = Object.values(await this.backend.getProgress(key));
+    const latest = entries.reduce((a, b) => (!a || (b.ts || 0) > (a.ts || 0) ? b : a), null);
+    return {
+      processed: entries.reduce((sum, entry) => sum + (entry.processed || 0), 0),
+      current: latest?.current || null,
+      workers: entries.length
+    };
+  }
+
+  resetProgress(key) {
+    return this.backend.resetProgress(key);
+  }
+
+  /**
+   * Результат задачи для координатора (id задачи -> результат)
+   */
+  putResult(key, id, value) {
+    return this.backend.putResult(key, id, value);
+  }
+
+  getResults(key) {
+    return this.backend.getResults(key);
+  }
+
+  clearResults(key) {
+    return this.backend.clearResults(key);
+  }
+
+  close() {
+    return this.backend.close();
+  }
+}
+
+// Экспортируем SINGLETON - одно подключение на процесс
+module.exports = new ClusterStore();
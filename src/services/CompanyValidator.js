@@ -1,3 +1,5 @@
+const parsePool = require('./ParsePool');
+
 /**
  * CompanyValidator - Валидация компаний на соответствие теме поиска
  * Проверяет соответствие деятельности компании основной теме
@@ -41,7 +43,7 @@ class CompanyValidator {
       });
 
       // Парсить результат
-      const validation = this._parseValidation(response);
+      const validation = await this._parseValidation(response);
 
       this.logger.info('CompanyValidator: Validation completed', {
         company: companyName,
@@ -130,14 +132,18 @@ ${servicesText}
     return parts.join('\n');
   }
 
-  _parseValidation(response) {
+  async _parseValidation(response) {
     try {
-      const jsonMatch = response.match(/\{[\s\S]*\}/);
-      if (!jsonMatch) {
+      // Большие ответы парсятся в потоке ParsePool
+      const parsed = await parsePool.parseResponse(response);
+      if (!parsed.found) {
         throw new Error('No JSON found in response');
       }
+      if (parsed.error) {
+        throw new Error(parsed.error);
+      }
 
-      const data = JSON.parse(jsonMatch[0]);
+      const data = parsed.data;
       
       return {
         is_relevant: data.is_relevant === true,
@@ -1,4 +1,16 @@
 const axios = require('axios');
+const httpAgentPool = require('./HttpAgentPool');
+const apiCassette = require('./ApiCassette');
+const metrics = require('./Metrics');
+const log = require('./Logger').child('deepseek');
+
+// Те же метрики, что регистрирует SonarApiClient (реестр возвращает существующие)
+const apiRequestSeconds = metrics.histogram(
+  'ai_api_request_duration_seconds', 'AI API HTTP attempt latency', ['provider', 'stage', 'model', 'status']
+);
+const apiRetriesTotal = metrics.counter(
+  'ai_api_retries_total', 'AI API retry attempts', ['provider', 'stage', 'model']
+);
 
 /**
  * DeepSeekClient - Клиент для DeepSeek API
@@ -15,7 +27,8 @@ const axios = require('axios');
 class DeepSeekClient {
   constructor(apiKey, logger, modelType = 'chat') {
     this.apiKey = apiKey;
-    this.baseUrl = 'https://api.deepseek.com/v1';
+    // DEEPSEEK_BASE_URL - для локальной заглушки (scripts/stub-ai-server.js)
+    this.baseUrl = process.env.DEEPSEEK_BASE_URL || 'https://api.deepseek.com/v1';
     this.logger = logger;
     
     // Выбор модели в зависимости от типа задачи
@@ -28,6 +41,10 @@ class DeepSeekClient {
     this.maxRetries = 3;
     this.retryDelay = 2000;
     this.timeout = 120000; // 2 минуты для reasoner (он может думать дольше)
+    
+    // Общий keep-alive пул для всех DeepSeek клиентов процесса
+    this.httpAgents = httpAgentPool.getAxiosAgents('deepseek');
+    this.lastTimings = null;
   }
 
   /**
@@ -54,13 +71,14 @@ class DeepSeekClient {
       stage = 'unknown'
     } = options;
 
-    console.log(`\n🟢 DeepSeekClient.query() START`);
-    console.log(`   Stage: ${stage}`);
-    console.log(`   API Key exists: ${!!this.apiKey} (length: ${this.apiKey?.length || 0})`);
-    console.log(`   Model: ${this.model}`);
-    console.log(`   Prompt length: ${prompt?.length || 0} chars`);
-    console.log(`   Max tokens: ${maxTokens}`);
-    console.log(`   Temperature: ${temperature}`);
+    log.debug('query() start', {
+      stage,
+      model: this.model,
+      hasApiKey: !!this.apiKey,
+      promptLength: prompt?.length || 0,
+      maxTokens,
+      temperature
+    });
 
     // ВАЖНО: Проверка длины промпта (DeepSeek Chat имеет лимиты)
     const estimatedInputTokens = Math.ceil(prompt.length / 4); // Примерно 4 символа = 1 токен
@@ -71,7 +89,6 @@ class DeepSeekClient {
         estimatedTokens: estimatedInputTokens,
         stage
       });
-      console.log(`   ⚠️  WARNING: Prompt too long (${estimatedInputTokens} tokens), truncating...`);
       // Обрезать промпт до безопасного размера
       prompt = prompt.substring(0, 12000); // ~3000 токенов
     }
@@ -88,36 +105,46 @@ class DeepSeekClient {
 
     while (attempt < this.maxRetries) {
       attempt++;
-      console.log(`   🔄 DeepSeek Attempt ${attempt}/${this.maxRetries}`);
+      log.debug('Attempt', { stage, attempt, maxRetries: this.maxRetries });
+      if (attempt > 1) {
+        apiRetriesTotal.inc({ provider: 'deepseek', stage, model: this.model });
+      }
+      
+      const startTime = Date.now();
       
       try {
-        const startTime = Date.now();
-        
-        console.log(`   📤 Sending POST to ${this.baseUrl}/chat/completions`);
-
-        const response = await axios.post(
-          `${this.baseUrl}/chat/completions`,
-          {
-            model: this.model,
-            messages: [
-              { role: 'system', content: systemPrompt },
-              { role: 'user', content: prompt }
-            ],
-            temperature,
-            max_tokens: maxTokens,
-            stream: false
-          },
-          {
-            headers: {
-              'Authorization': `Bearer ${this.apiKey}`,
-              'Content-Type': 'application/json'
-            },
-            timeout: this.timeout
-          }
-        );
+        const requestBody = {
+          model: this.model,
+          messages: [
+            { role: 'system', content: systemPrompt },
+            { role: 'user', content: prompt }
+          ],
+          temperature,
+          max_tokens: maxTokens,
+          stream: false
+        };
+        const response = await this._post(requestBody);
 
         const responseTime = Date.now() - startTime;
-        const messageData = response.data.choices[0].message;
+        apiRequestSeconds.observe(
+          { provider: 'deepseek', stage, model: this.model, status: 'success' },
+          responseTime / 1000
+        );
+        const timings = httpAgentPool.getTimings(response.request) || { reused: false, total: responseTime };
+        const parseStart = process.hrtime.bigint();
+        const data = typeof response.data === 'string' ? JSON.parse(response.data) : response.data;
+        timings.parse = Number(process.hrtime.bigint() - parseStart) / 1e6;
+        this.lastTimings = timings;
+
+        if (!response.cassette) {
+          apiCassette.record('deepseek', requestBody, data, {
+            stage,
+            status: response.status,
+            latencyMs: responseTime
+          });
+        }
+
+        const messageData = data.choices[0].message;
         
         // DeepSeek Reasoner может возвращать reasoning_content отдельно
         const content = messageData.content || '';
@@ -126,9 +153,7 @@ class DeepSeekClient {
         // Если content пустой, используем reasoning_content
         const finalContent = content || reasoningContent;
         
-        const usage = response.data.usage;
-
-        console.log(`   ✅ DeepSeek SUCCESS! Got response (${finalContent?.length || 0} chars, ${usage.total_tokens} tokens)`);
+        const usage = data.usage;
 
         // Debug: логируем структуру ответа
         this.logger.debug('DeepSeekClient: Response structure', {
@@ -139,29 +164,35 @@ class DeepSeekClient {
           finalContentLength: finalContent.length
         });
 
-        this.logger.info('DeepSeekClient: Query successful', {
+        log.info('Query successful', {
           stage,
           responseTime,
           inputTokens: usage.prompt_tokens,
           outputTokens: usage.completion_tokens,
           totalTokens: usage.total_tokens,
-          costEstimate: this._estimateCost(usage.prompt_tokens, usage.completion_tokens)
+          costEstimate: this._estimateCost(usage.prompt_tokens, usage.completion_tokens),
+          timings
         });
 
         return finalContent;
 
       } catch (error) {
+        // Промах кассеты в replay режиме - повторять бессмысленно
+        if (error.code === 'ECASSETTEMISS') throw error;
+
         lastError = error;
+        apiRequestSeconds.observe(
+          { provider: 'deepseek', stage, model: this.model, status: this._classifyError(error) },
+          (Date.now() - startTime) / 1000
+        );
         
-        console.log(`   ❌ DeepSeek ERROR: ${error.message}`);
-        console.log(`   HTTP Status: ${error.response?.status || 'N/A'}`);
-
         this.logger.warn('DeepSeekClient: Query failed', {
           stage,
           attempt,
           maxRetries: this.maxRetries,
           error: error.message,
-          status: error.response?.status
+          status: error.response?.status,
+          timings: httpAgentPool.getTimings(error.request)
         });
 
         if (attempt < this.maxRetries) {
@@ -180,6 +211,27 @@ class DeepSeekClient {
     throw new Error(`DeepSeek API request failed after ${this.maxRetries} attempts: ${lastError.message}`);
   }
 
+  /**
+   * POST /chat/completions - из кассеты (replay/hybrid) или по сети
+   */
+  async _post(requestBody) {
+    if (apiCassette.isReplaying()) {
+      const replayed = await apiCassette.replay('deepseek', requestBody);
+      if (replayed) return replayed;
+    }
+
+    return axios.post(`${this.baseUrl}/chat/completions`, requestBody, {
+      headers: {
+        'Authorization': `Bearer ${this.apiKey}`,
+        'Content-Type': 'application/json'
+      },
+      timeout: this.timeout,
+      ...this.httpAgents,
+      // JSON парсим сами, чтобы измерить время парсинга отдельно от сети
+      transformResponse: [data => data]
+    });
+  }
+
   /**
    * Перевести текст с китайского на русский
    * @param {string} text - Текст для перевода
@@ -253,6 +305,17 @@ class DeepSeekClient {
     return `$${totalCost.toFixed(6)}`;
   }
 
+  /**
+   * Тип ошибки в тех же терминах, что status в sonar_api_calls
+   */
+  _classifyError(error) {
+    const httpStatus = error.response?.status || 0;
+    if (error.code === 'ECONNABORTED' || error.message.includes('timeout')) return 'timeout';
+    if (httpStatus === 429) return 'rate_limited';
+    if (httpStatus >= 500) return 'server_error';
+    return 'error';
+  }
+
   _sleep(ms) {
     return new Promise(resolve => setTimeout(resolve, ms));
   }
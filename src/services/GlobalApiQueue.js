@@ -1,3 +1,14 @@
+const metrics = require('./Metrics');
+const apiCassette = require('./ApiCassette');
+const log = require('./Logger').child('queue');
+
+const queueWaitSeconds = metrics.histogram(
+  'api_queue_wait_seconds', 'Time an AI request waited in GlobalApiQueue', ['lane']
+);
+const queueServiceSeconds = metrics.histogram(
+  'api_queue_service_seconds', 'Time an AI request spent executing (incl. retries)', ['lane', 'outcome']
+);
+
 /**
  * Global API Queue Manager
  * Единая глобальная очередь для ВСЕХ AI API запросов
@@ -35,7 +46,7 @@ class GlobalApiQueue {
       });
       
       this.queueLength = this.queue.length;
-      console.log(`📥 [GlobalQueue] Added to queue: ${stage} (${model}) | Queue: ${this.queueLength}`);
+      log.debug('Added to queue', { stage, model, queueLength: this.queueLength });
       
       // Запустить обработку если не идет
       if (!this.isProcessing) {
@@ -60,39 +71,45 @@ class GlobalApiQueue {
 
       const { requestFn, resolve, reject, metadata } = item;
       const waitTime = Date.now() - metadata.enqueuedAt;
+      queueWaitSeconds.observe({ lane: metadata.model }, waitTime / 1000);
+
+      log.debug('Processing', {
+        stage: metadata.stage,
+        model: metadata.model,
+        waitMs: waitTime,
+        remaining: this.queueLength
+      });
 
-      console.log(`📤 [GlobalQueue] Processing: ${metadata.stage} (${metadata.model})`);
-      console.log(`   Queue position: 1 of ${this.queueLength + 1}`);
-      console.log(`   Wait time: ${waitTime}ms`);
-      console.log(`   Remaining in queue: ${this.queueLength}`);
+      let startTime = Date.now();
 
       try {
-        // Соблюдать минимальную задержку между запросами
+        // Соблюдать минимальную задержку между запросами (кроме replay из кассеты)
         const timeSinceLastRequest = Date.now() - this.lastRequestTime;
-        if (timeSinceLastRequest < this.minDelayBetweenRequests) {
+        if (apiCassette.shouldThrottle() && timeSinceLastRequest < this.minDelayBetweenRequests) {
           const delayNeeded = this.minDelayBetweenRequests - timeSinceLastRequest;
-          console.log(`   ⏸️  Throttling: waiting ${delayNeeded}ms...`);
           await this._sleep(delayNeeded);
         }
 
         // Выполнить запрос
-        const startTime = Date.now();
+        startTime = Date.now();
         const result = await requestFn();
         const duration = Date.now() - startTime;
 
         this.lastRequestTime = Date.now();
+        queueServiceSeconds.observe({ lane: metadata.model, outcome: 'success' }, duration / 1000);
 
-        console.log(`   ✅ Completed in ${duration}ms`);
+        log.debug('Completed', { stage: metadata.stage, durationMs: duration });
         resolve(result);
 
       } catch (error) {
-        console.error(`   ❌ Failed: ${error.message}`);
+        queueServiceSeconds.observe({ lane: metadata.model, outcome: 'error' }, (Date.now() - startTime) / 1000);
+        log.warn('Request failed', { stage: metadata.stage, model: metadata.model, error: error.message });
         reject(error);
       }
     }
 
     this.isProcessing = false;
-    console.log(`📭 [GlobalQueue] Queue empty, waiting for new requests...`);
+    log.debug('Queue empty');
   }
 
   /**
@@ -122,5 +139,11 @@ class GlobalApiQueue {
 }
 
 // Экспортируем SINGLETON - одна очередь на весь процесс
-module.exports = new GlobalApiQueue();
+const globalApiQueue = new GlobalApiQueue();
+
+metrics.gauge('api_queue_length', 'Requests waiting in GlobalApiQueue', [], (gauge) => {
+  gauge.set({}, globalApiQueue.queue.length);
+});
+
+module.exports = globalApiQueue;
 
@@ -0,0 +1,514 @@
+const { v4: uuidv4 } = require('uuid');
+const log = require('./Logger').child('global-jobs');
+
+/**
+ * GlobalJobManager - Персистентные задания для global Stage 2/3/4
+ *
+ * Каждый запуск POST /api/sessions/global/stageN становится заданием с job_id:
+ *   global_jobs       - статус, счетчики, heartbeat
+ *   global_job_items  - снимок company_id на момент запуска и отметки по каждой компании
+ *                       (pending -> in_flight -> completed/failed)
+ *
+ * Отметки идемпотентны (upsert по job_id + company_id), поэтому повторная
+ * отметка той же компании после resume ничего не ломает.
+ *
+ * Если процесс упал (редеплой Railway, OOM), задание остается в статусе running
+ * с устаревшим heartbeat - такое задание считается interrupted.
+ * resume берет только компании из снимка, которые еще не отмечены completed/failed.
+ * Компании in_flight перепроверяются: если stage уже записал результат в
+ * pending_companies (компания больше не подходит под выборку stage), она
+ * отмечается completed без повторного вызова API.
+ *
+ * Запись в журнал - best effort: если таблиц нет (миграция не применена),
+ * stage все равно отработает, просто без возможности resume.
+ */
+
+// running задание без heartbeat дольше этого времени считается прерванным
+const HEARTBEAT_STALE_MS = 90000;
+// Фоновый heartbeat (Retry фазы идут долго без батчей)
+const HEARTBEAT_INTERVAL_MS = 30000;
+// Лимит строк Supabase на один select
+const PAGE_SIZE = 1000;
+
+const STAGES = ['stage2', 'stage3', 'stage4'];
+
+/**
+ * GlobalJob - одно задание в текущем процессе
+ * Передается в stage через setJob(); stage вызывает claim / begin / complete
+ */
+class GlobalJob {
+  constructor(manager, row) {
+    this.manager = manager;
+    this.jobId = row.job_id;
+    this.stage = row.stage;
+    this.total = row.total || 0;
+    this.durable = row.durable !== false;
+
+    this.statuses = new Map();   // company_id -> status
+    this.attempts = new Map();   // company_id -> attempts
+    this.fresh = false;          // новое задание - снимок делается в первом claim()
+    this.offset = 0;             // completed + failed до этого запуска
+    this.carriedFailed = 0;      // failed до этого запуска (для Retry)
+  }
+
+  get db() {
+    return this.manager.db;
+  }
+
+  /**
+   * Отобрать компании для обработки в этом запуске
+   * @param {Array} companies - компании, подходящие под выборку stage сейчас
+   * @returns {Promise<Array>} компании из снимка задания без завершенных
+   */
+  async claim(companies) {
+    if (this.fresh) {
+      await this._snapshot(companies);
+    } else if (this.statuses.size === 0) {
+      await this._loadItems();
+    }
+
+    const eligible = new Map(companies.map(c => [c.company_id, c]));
+    const remaining = [];
+    const reconciled = [];
+
+    for (const [companyId, status] of this.statuses) {
+      if (status === 'completed' || status === 'failed') continue;
+
+      if (eligible.has(companyId)) {
+        remaining.push(eligible.get(companyId));
+      } else {
+        // Stage уже записал результат (или компанию обработал другой запуск)
+        reconciled.push(companyId);
+      }
+    }
+
+    if (reconciled.length > 0) {
+      log.info('Reconciled in-flight companies', { jobId: this.jobId, count: reconciled.length });
+      await this._mark(reconciled, 'completed');
+    }
+
+    this.offset = 0;
+    this.carriedFailed = 0;
+    for (const status of this.statuses.values()) {
+      if (status === 'completed' || status === 'failed') this.offset++;
+      if (status === 'failed') this.carriedFailed++;
+    }
+
+    // Порядок снимка = порядок выборки stage
+    const order = new Map(companies.map((c, index) => [c.company_id, index]));
+    remaining.sort((a, b) => order.get(a.company_id) - order.get(b.company_id));
+
+    log.info('Job claimed', {
+      jobId: this.jobId,
+      stage: this.stage,
+      total: this.total,
+      done: this.offset,
+      remaining: remaining.length
+    });
+
+    return remaining;
+  }
+
+  /**
+   * Отметить батч как in_flight (перед вызовами API)
+   */
+  async begin(batch) {
+    const ids = batch.map(c => c.company_id);
+    ids.forEach(id => this.attempts.set(id, (this.attempts.get(id) || 0) + 1));
+    await this._mark(ids, 'in_flight');
+    await this.manager._updateJob(this.jobId, {
+      current_company: batch[0]?.company_name || null,
+      heartbeat_at: new Date().toISOString()
+    });
+  }
+
+  /**
+   * Отметить батч обработанным (после записи результатов stage в БД)
+   * @param {Array} batch - компании
+   * @param {Array<boolean>} outcomes - true = найдено (completed), false = failed
+   */
+  async complete(batch, outcomes) {
+    const completed = batch.filter((c, i) => outcomes[i]).map(c => c.company_id);
+    const failed = batch.filter((c, i) => !outcomes[i]).map(c => c.company_id);
+
+    await this._mark(completed, 'completed');
+    await this._mark(failed, 'failed');
+
+    await this.manager._updateJob(this.jobId, {
+      ...this.counts(),
+      current_company: null,
+      heartbeat_at: new Date().toISOString()
+    });
+  }
+
+  /**
+   * Счетчики для global_jobs
+   */
+  counts() {
+    let completed = 0;
+    let failed = 0;
+    for (const status of this.statuses.values()) {
+      if (status === 'completed') completed++;
+      if (status === 'failed') failed++;
+    }
+    return { completed, failed };
+  }
+
+  /**
+   * Heartbeat без отметок (длинные фазы без батчей, например Retry)
+   */
+  async heartbeat() {
+    await this.manager._updateJob(this.jobId, { heartbeat_at: new Date().toISOString() });
+  }
+
+  async _mark(companyIds, status) {
+    if (companyIds.length === 0) return;
+    companyIds.forEach(id => this.statuses.set(id, status));
+    if (!this.durable) return;
+
+    const now = new Date().toISOString();
+    const rows = companyIds.map(companyId => ({
+      job_id: this.jobId,
+      company_id: companyId,
+      status,
+      attempts: this.attempts.get(companyId) || 0,
+      updated_at: now
+    }));
+
+    const { error } = await this.db.supabase
+      .from('global_job_items')
+      .upsert(rows, { onConflict: 'job_id,company_id' });
+
+    if (error) {
+      log.warn('Failed to mark job items', { jobId: this.jobId, status, error: error.message });
+    }
+  }
+
+  /**
+   * Снимок компаний нового задания (выборка самого stage)
+   */
+  async _snapshot(companies) {
+    this.fresh = false;
+    this.total = companies.length;
+    companies.forEach(c => this.statuses.set(c.company_id, 'pending'));
+    if (!this.durable) return;
+
+    const now = new Date().toISOString();
+    for (let i = 0; i < companies.length; i += PAGE_SIZE) {
+      const items = companies.slice(i, i + PAGE_SIZE).map(c => ({
+        job_id: this.jobId,
+        company_id: c.company_id,
+        status: 'pending',
+        attempts: 0,
+        updated_at: now
+      }));
+
+      const { error } = await this.db.supabase.from('global_job_items').insert(items);
+      if (error) {
+        log.warn('Failed to save job snapshot', { jobId: this.jobId, error: error.message });
+        this.durable = false;
+        return;
+      }
+    }
+
+    await this.manager._updateJob(this.jobId, { total: this.total });
+  }
+
+  async _loadItems() {
+    if (!this.durable) return;
+
+    for (let from = 0; ; from += PAGE_SIZE) {
+      const { data, error } = await this.db.supabase
+        .from('global_job_items')
+        .select('company_id, status, attempts')
+        .eq('job_id', this.jobId)
+        .range(from, from + PAGE_SIZE - 1);
+
+      if (error) {
+        throw new Error(`Failed to load job items: ${error.message}`);
+      }
+
+      (data || []).forEach(item => {
+        this.statuses.set(item.company_id, item.status);
+        this.attempts.set(item.company_id, item.attempts || 0);
+      });
+
+      if (!data || data.length < PAGE_SIZE) break;
+    }
+  }
+}
+
+class GlobalJobManager {
+  constructor() {
+    this.db = null;
+    this.running = new Map(); // job_id -> GlobalJob (задания этого процесса)
+  }
+
+  /**
+   * Подключить БД (вызывается при старте приложения)
+   */
+  init(db) {
+    this.db = db;
+  }
+
+  /**
+   * Создать задание (снимок компаний делает stage в первом claim())
+   * @param {string} stage - stage2 | stage3 | stage4
+   * @returns {Promise<GlobalJob>}
+   */
+  async createJob(stage) {
+    if (!STAGES.includes(stage)) {
+      throw new Error(`Unknown global stage: ${stage}`);
+    }
+
+    const local = Array.from(this.running.values()).find(job => job.stage === stage);
+    const active = local ? { job_id: local.jobId } : await this.findActive(stage);
+    if (active) {
+      const error = new Error(`Global ${stage} is already running (job ${active.job_id})`);
+      error.code = 'EJOBRUNNING';
+      error.jobId = active.job_id;
+      throw error;
+    }
+
+    const now = new Date().toISOString();
+    const row = {
+      job_id: uuidv4(),
+      stage,
+      status: 'running',
+      total: 0,
+      completed: 0,
+      failed: 0,
+      created_at: now,
+      updated_at: now,
+      heartbeat_at: now
+    };
+
+    const { error } = await this.db.supabase.from('global_jobs').insert(row);
+
+    if (error) {
+      log.warn('Job ledger unavailable, running without resume support', {
+        stage,
+        error: error.message
+      });
+      row.durable = false;
+    }
+
+    const job = new GlobalJob(this, row);
+    job.fresh = true;
+
+    this._track(job);
+    log.info('Job created', { jobId: job.jobId, stage, durable: job.durable });
+    return job;
+  }
+
+  /**
+   * Подготовить прерванное задание к продолжению
+   * @returns {Promise<GlobalJob>}
+   */
+  async resumeJob(jobId) {
+    const row = await this.getJob(jobId);
+
+    if (!row) {
+      const error = new Error(`Job ${jobId} not found`);
+      error.code = 'EJOBNOTFOUND';
+      throw error;
+    }
+    if (row.status === 'completed') {
+      const error = new Error(`Job ${jobId} is already completed`);
+      error.code = 'EJOBDONE';
+      throw error;
+    }
+    if (row.status === 'running') {
+      const error = new Error(`Job ${jobId} is still running`);
+      error.code = 'EJOBRUNNING';
+      error.jobId = jobId;
+      throw error;
+    }
+
+    await this._updateJob(jobId, {
+      status: 'running',
+      last_error: null,
+      finished_at: null,
+      resume_count: (row.resume_count || 0) + 1,
+      heartbeat_at: new Date().toISOString()
+    });
+
+    const job = new GlobalJob(this, row);
+    this._track(job);
+    log.info('Job resumed', { jobId, stage: row.stage, resumeCount: (row.resume_count || 0) + 1 });
+    return job;
+  }
+
+  async finishJob(job, result) {
+    await this._updateJob(job.jobId, {
+      ...job.counts(),
+      status: 'completed',
+      result,
+      current_company: null,
+      finished_at: new Date().toISOString()
+    });
+    this._untrack(job);
+    log.info('Job completed', { jobId: job.jobId, stage: job.stage });
+  }
+
+  async failJob(job, error) {
+    await this._updateJob(job.jobId, {
+      status: 'failed',
+      last_error: error.message,
+      current_company: null,
+      finished_at: new Date().toISOString()
+    });
+    this._untrack(job);
+    log.error('Job failed', { jobId: job.jobId, stage: job.stage, error: error.message });
+  }
+
+  /**
+   * Получить задание (статус с учетом устаревшего heartbeat)
+   */
+  async getJob(jobId) {
+    const { data, error } = await this.db.supabase
+      .from('global_jobs')
+      .select('*')
+      .eq('job_id', jobId)
+      .maybeSingle();
+
+    if (error) {
+      throw new Error(`Failed to load job: ${error.message}`);
+    }
+    return data ? this._withEffectiveStatus(data) : null;
+  }
+
+  /**
+   * Последние задания
+   * @param {Object} options - { stage, status, limit }
+   */
+  async listJobs({ stage = null, status = null, limit = 20 } = {}) {
+    let query = this.db.supabase
+      .from('global_jobs')
+      .select('*')
+      .order('created_at', { ascending: false })
+      .limit(limit);
+
+    if (stage) query = query.eq('stage', stage);
+
+    const { data, error } = await query;
+    if (error) {
+      throw new Error(`Failed to list jobs: ${error.message}`);
+    }
+
+    const jobs = (data || []).map(row => this._withEffectiveStatus(row));
+    return status ? jobs.filter(job => job.status === status) : jobs;
+  }
+
+  /**
+   * Активное (живое) задание по stage, если есть
+   */
+  async findActive(stage) {
+    const jobs = await this.listJobs({ stage, status: 'running', limit: 5 }).catch(() => []);
+    return jobs[0] || null;
+  }
+
+  /**
+   * При старте: running задания прошлых процессов -> interrupted
+   * (heartbeat проверяется, чтобы не задеть задания параллельного инстанса)
+   */
+  async recoverInterrupted() {
+    try {
+      const { data, error } = await this.db.supabase
+        .from('global_jobs')
+        .select('job_id, stage, heartbeat_at')
+        .eq('status', 'running');
+
+      if (error) throw new Error(error.message);
+
+      const stale = (data || []).filter(row => this._isStale(row));
+      for (const row of stale) {
+        await this._updateJob(row.job_id, { status: 'interrupted' });
+      }
+
+      if (stale.length > 0) {
+        log.warn('Interrupted global jobs found', {
+          jobs: stale.map(row => ({ jobId: row.job_id, stage: row.stage }))
+        });
+      }
+      return stale.length;
+    } catch (error) {
+      log.warn('Failed to check interrupted jobs', { error: error.message });
+      return 0;
+    }
+  }
+
+  /**
+   * Отметить компании задания из другого процесса (stage worker)
+   */
+  async markItems(jobId, companyIds, status) {
+    const now = new Date().toISOString();
+    const { error } = await this.db.supabase
+      .from('global_job_items')
+      .upsert(companyIds.map(companyId => ({
+        job_id: jobId,
+        company_id: companyId,
+        status,
+        updated_at: now
+      })), { onConflict: 'job_id,company_id' });
+
+    if (error) {
+      log.warn('Failed to mark job items', { jobId, status, error: error.message });
+    }
+  }
+
+  /**
+   * Краткая сводка для /api/debug/queue-status
+   */
+  getRunning() {
+    return Array.from(this.running.values()).map(job => ({
+      job_id: job.jobId,
+      stage: job.stage,
+      total: job.total,
+      durable: job.durable
+    }));
+  }
+
+  _track(job) {
+    this.running.set(job.jobId, job);
+    job.heartbeatTimer = setInterval(() => job.heartbeat(), HEARTBEAT_INTERVAL_MS);
+    if (job.heartbeatTimer.unref) job.heartbeatTimer.unref();
+  }
+
+  _untrack(job) {
+    clearInterval(job.heartbeatTimer);
+    this.running.delete(job.jobId);
+  }
+
+  _withEffectiveStatus(row) {
+    const job = { ...row };
+    if (job.status === 'running' && !this.running.has(job.job_id) && this._isStale(job)) {
+      job.status = 'interrupted';
+    }
+    job.remaining = Math.max(0, (job.total || 0) - (job.completed || 0) - (job.failed || 0));
+    job.resumable = job.status === 'interrupted' || job.status === 'failed';
+    return job;
+  }
+
+  _isStale(row) {
+    const heartbeat = row.heartbeat_at ? new Date(row.heartbeat_at).getTime() : 0;
+    return Date.now() - heartbeat > HEARTBEAT_STALE_MS;
+  }
+
+  async _updateJob(jobId, fields) {
+    const job = this.running.get(jobId);
+    if (job && !job.durable) return;
+
+    const { error } = await this.db.supabase
+      .from('global_jobs')
+      .update({ ...fields, updated_at: new Date().toISOString() })
+      .eq('job_id', jobId);
+
+    if (error) {
+      log.warn('Failed to update job', { jobId, error: error.message });
+    }
+  }
+}
+
+// Экспортируем SINGLETON
+module.exports = new GlobalJobManager();
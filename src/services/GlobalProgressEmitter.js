@@ -7,6 +7,13 @@
  */
 
 const EventEmitter = require('events');
+const metrics = require('./Metrics');
+const log = require('./Logger').child('progress');
+
+// rate(stage_items_processed_total[1m]) = items/sec по каждому stage
+const stageItemsTotal = metrics.counter(
+  'stage_items_processed_total', 'Companies/queries processed by pipeline stage', ['stage', 'mode']
+);
 
 class GlobalProgressEmitter extends EventEmitter {
   constructor() {
@@ -28,7 +35,7 @@ class GlobalProgressEmitter extends EventEmitter {
    * Начать отслеживание прогресса для stage
    */
   startStage(stage, total) {
-    console.log(`🚀 [GlobalProgressEmitter] Starting ${stage} tracking: ${total} items`);
+    log.info('Starting stage tracking', { stage, total });
     this.progress[stage] = {
       total,
       processed: 0,
@@ -43,13 +50,18 @@ class GlobalProgressEmitter extends EventEmitter {
    */
   updateStage(stage, processed, current = null) {
     if (!this.progress[stage].active) {
-      console.log(`⚠️  [GlobalProgressEmitter] Stage ${stage} not active, ignoring update`);
+      log.debug('Stage not active, ignoring update', { stage });
       return;
     }
 
+    const delta = processed - this.progress[stage].processed;
+    if (delta > 0) {
+      stageItemsTotal.inc({ stage, mode: 'global' }, delta);
+    }
+
     this.progress[stage].processed = processed;
     this.progress[stage].current = current;
-    console.log(`📊 [GlobalProgressEmitter] ${stage} update: ${processed}/${this.progress[stage].total} ${current ? `(${current})` : ''}`);
+    log.debug('Stage update', { stage, processed, total: this.progress[stage].total, current });
     this.emit(`${stage}:update`, this.progress[stage]);
   }
 
@@ -58,12 +70,12 @@ class GlobalProgressEmitter extends EventEmitter {
    */
   updateTotal(stage, newTotal) {
     if (!this.progress[stage].active) {
-      console.log(`⚠️  [GlobalProgressEmitter] Stage ${stage} not active, ignoring total update`);
+      log.debug('Stage not active, ignoring total update', { stage });
       return;
     }
 
     this.progress[stage].total = newTotal;
-    console.log(`🔄 [GlobalProgressEmitter] ${stage} total updated: ${newTotal} items`);
+    log.info('Stage total updated', { stage, total: newTotal });
     this.emit(`${stage}:update`, this.progress[stage]);
   }
 
@@ -0,0 +1,166 @@
+const http = require('http');
+const https = require('https');
+const { performance } = require('perf_hooks');
+
+/**
+ * HttpAgentPool - Общие keep-alive агенты для AI API (Sonar, DeepSeek)
+ *
+ * Один агент на провайдера: TCP/TLS соединения переиспользуются между
+ * запросами вместо установки нового соединения на каждый axios.post.
+ * Каждый запрос через агент получает поэтапные тайминги
+ * (DNS, connect, TLS, TTFB, загрузка тела) - см. getTimings().
+ */
+class HttpAgentPool {
+  constructor() {
+    this.agents = new Map();
+    this.stats = new Map();
+  }
+
+  /**
+   * Агенты провайдера в формате конфигурации axios
+   * @returns {{ httpAgent: http.Agent, httpsAgent: https.Agent }}
+   */
+  getAxiosAgents(provider, options = {}) {
+    return {
+      httpAgent: this.getAgent(provider, { ...options, secure: false }),
+      httpsAgent: this.getAgent(provider, { ...options, secure: true })
+    };
+  }
+
+  /**
+   * Получить (или создать) общий агент провайдера
+   * @param {string} provider - 'sonar' | 'deepseek'
+   * @param {Object} options - { maxSockets, maxFreeSockets, keepAliveMsecs, secure }
+   */
+  getAgent(provider, options = {}) {
+    const secure = options.secure !== false;
+    const poolKey = secure ? provider : `${provider}:http`;
+    const envPrefix = provider.toUpperCase();
+    const maxSockets = options.maxSockets
+      || parseInt(process.env[`${envPrefix}_HTTP_MAX_SOCKETS`])
+      || 10;
+    const maxFreeSockets = options.maxFreeSockets || Math.min(maxSockets, 10);
+    const keepAliveMsecs = options.keepAliveMsecs
+      || parseInt(process.env.HTTP_KEEPALIVE_MSECS)
+      || 30000;
+
+    let agent = this.agents.get(poolKey);
+
+    if (!agent) {
+      const AgentClass = secure ? https.Agent : http.Agent;
+      agent = new AgentClass({
+        keepAlive: true,
+        keepAliveMsecs,
+        maxSockets,
+        maxFreeSockets,
+        scheduling: 'lifo' // Переиспользовать самые "теплые" сокеты
+      });
+      this._instrument(poolKey, agent);
+      this.agents.set(poolKey, agent);
+    } else if (options.maxSockets && agent.maxSockets !== maxSockets) {
+      // Размер пула можно менять на лету (например, из настроек)
+      agent.maxSockets = maxSockets;
+      agent.maxFreeSockets = maxFreeSockets;
+    }
+
+    return agent;
+  }
+
+  /**
+   * Поэтапные тайминги запроса (ms)
+   * @param {http.ClientRequest} request - response.request / error.request из axios
+   */
+  getTimings(request) {
+    const t = request?._phaseTimings;
+    if (!t) return null;
+
+    const diff = (from, to) => (from !== undefined && to !== undefined)
+      ? Math.round((to - from) * 100) / 100
+      : null;
+
+    // Для переиспользованного сокета DNS/connect/TLS = 0
+    const socketReady = t.tlsEnd ?? t.connectEnd ?? t.socketAssigned;
+
+    return {
+      reused: !!t.reused,
+      queued: diff(t.start, t.socketAssigned),
+      dns: t.reused ? 0 : diff(t.socketAssigned, t.dnsEnd),
+      connect: t.reused ? 0 : diff(t.dnsEnd ?? t.socketAssigned, t.connectEnd),
+      tls: t.reused ? 0 : diff(t.connectEnd, t.tlsEnd),
+      ttfb: diff(socketReady, t.firstByte),
+      download: diff(t.firstByte, t.end),
+      total: diff(t.start, t.end ?? t.firstByte)
+    };
+  }
+
+  /**
+   * Статистика пулов для мониторинга
+   */
+  getStats() {
+    const result = {};
+
+    for (const [poolKey, agent] of this.agents) {
+      const stats = this.stats.get(poolKey);
+      // Не показывать пустые пулы (например, http-агент при https baseUrl)
+      if (stats.requests === 0 && poolKey.endsWith(':http')) continue;
+      const count = (sockets) => Object.values(sockets).reduce((sum, list) => sum + list.length, 0);
+
+      result[poolKey] = {
+        maxSockets: agent.maxSockets,
+        activeSockets: count(agent.sockets),
+        freeSockets: count(agent.freeSockets),
+        pendingRequests: count(agent.requests),
+        requests: stats.requests,
+        newConnections: stats.newConnections,
+        reusedConnections: stats.reusedConnections,
+        reuseRatio: stats.requests > 0
+          ? Math.round((stats.reusedConnections / stats.requests) * 100) / 100
+          : 0
+      };
+    }
+
+    return result;
+  }
+
+  /**
+   * Подключить сбор таймингов к агенту
+   */
+  _instrument(poolKey, agent) {
+    const stats = { requests: 0, newConnections: 0, reusedConnections: 0 };
+    this.stats.set(poolKey, stats);
+
+    const originalAddRequest = agent.addRequest.bind(agent);
+
+    agent.addRequest = (req, options) => {
+      const timings = { start: performance.now() };
+      req._phaseTimings = timings;
+      stats.requests++;
+
+      req.once('socket', (socket) => {
+        timings.socketAssigned = performance.now();
+
+        if (!socket.connecting) {
+          timings.reused = true;
+          stats.reusedConnections++;
+          return;
+        }
+
+        stats.newConnections++;
+        socket.once('lookup', () => { timings.dnsEnd = performance.now(); });
+        socket.once('connect', () => { timings.connectEnd = performance.now(); });
+        socket.once('secureConnect', () => { timings.tlsEnd = performance.now(); });
+      });
+
+      // prepend - чтобы тайминги были записаны раньше, чем axios разрешит promise
+      req.prependOnceListener('response', (res) => {
+        timings.firstByte = performance.now();
+        res.prependOnceListener('end', () => { timings.end = performance.now(); });
+      });
+
+      return originalAddRequest(req, options);
+    };
+  }
+}
+
+// Экспортируем SINGLETON - агенты общие для всех клиентов процесса
+module.exports = new HttpAgentPool();
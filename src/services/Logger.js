@@ -0,0 +1,247 @@
+const fs = require('fs');
+const util = require('util');
+
+/**
+ * Logger - Единый структурированный логгер для сервисов, стадий и worker'ов
+ *
+ * - Уровни: error < warn < info < debug, отдельно для каждого модуля
+ * - Сэмплирование info/debug по модулю (например, 10% строк очереди)
+ * - Асинхронный транспорт: строки копятся в буфере и пишутся в stdout
+ *   одним write на тик event loop, без синхронного console.log на каждую строку
+ * - Настройка на лету через категорию настроек 'logging'
+ *   (level, level_<module>, sample_<module>) - см. configureFromSettings()
+ *
+ * Использование:
+ *   const log = require('../services/Logger').child('sonar');
+ *   log.debug('Attempt', { attempt, stage });
+ */
+
+const LEVELS = { error: 0, warn: 1, info: 2, debug: 3 };
+
+/**
+ * Неблокирующий транспорт: буфер + один write на setImmediate
+ * При переполнении буфера строки отбрасываются (с подсчетом), а не блокируют процесс
+ */
+class AsyncTransport {
+  constructor(stream, options = {}) {
+    this.stream = stream;
+    this.maxBuffer = options.maxBuffer || 10000;
+    this.buffer = [];
+    this.dropped = 0;
+    this.scheduled = false;
+    this.waitingDrain = false;
+
+    // При выходе процесса дописать буфер синхронно, чтобы не потерять последние строки
+    process.once('exit', () => this.flushSync());
+  }
+
+  write(line) {
+    if (this.buffer.length >= this.maxBuffer) {
+      this.dropped++;
+      return;
+    }
+
+    this.buffer.push(line);
+    this._schedule();
+  }
+
+  flush() {
+    this.scheduled = false;
+    if (this.waitingDrain || this.buffer.length === 0) return;
+
+    const chunk = this._takeChunk();
+    const ok = this.stream.write(chunk);
+
+    if (!ok) {
+      // Поток переполнен - ждать drain, строки продолжают копиться в буфере
+      this.waitingDrain = true;
+      this.stream.once('drain', () => {
+        this.waitingDrain = false;
+        this._schedule();
+      });
+    } else if (this.buffer.length > 0) {
+      this._schedule();
+    }
+  }
+
+  flushSync() {
+    if (this.buffer.length === 0) return;
+    try {
+      fs.writeSync(this.stream.fd ?? 1, this._takeChunk());
+    } catch (error) {
+      // stdout недоступен - ничего не поделать
+    }
+  }
+
+  _takeChunk() {
+    if (this.dropped > 0) {
+      this.buffer.push(JSON.stringify({
+        ts: new Date().toISOString(),
+        level: 'warn',
+        module: 'logger',
+        msg: `Dropped ${this.dropped} log lines (buffer full)`
+      }) + '\n');
+      this.dropped = 0;
+    }
+
+    const chunk = this.buffer.join('');
+    this.buffer = [];
+    return chunk;
+  }
+
+  _schedule() {
+    if (this.scheduled) return;
+    this.scheduled = true;
+    setImmediate(() => this.flush());
+  }
+}
+
+/**
+ * Логгер модуля. Интерфейс совместим с winston (info/warn/error/debug(message, meta))
+ */
+class ModuleLogger {
+  constructor(manager, moduleName) {
+    this.manager = manager;
+    this.module = moduleName;
+  }
+
+  error(message, meta) { this.manager.log('error', this.module, message, meta); }
+  warn(message, meta) { this.manager.log('warn', this.module, message, meta); }
+  info(message, meta) { this.manager.log('info', this.module, message, meta); }
+  debug(message, meta) { this.manager.log('debug', this.module, message, meta); }
+
+  isLevelEnabled(level) {
+    return this.manager.isEnabled(level, this.module);
+  }
+
+  child(moduleName) {
+    return this.manager.child(moduleName);
+  }
+}
+
+class LogManager {
+  constructor() {
+    this.level = LEVELS[process.env.LOG_LEVEL] !== undefined ? process.env.LOG_LEVEL : 'info';
+    this.moduleLevels = new Map();   // module -> level
+    this.sampling = new Map();       // module -> rate 0..1 (только info/debug)
+    this.format = process.env.LOG_FORMAT
+      || (process.env.NODE_ENV === 'production' ? 'json' : 'pretty');
+    this.transport = new AsyncTransport(process.stdout);
+    this.loggers = new Map();
+  }
+
+  /**
+   * Логгер для модуля (кешируется)
+   */
+  child(moduleName) {
+    if (!this.loggers.has(moduleName)) {
+      this.loggers.set(moduleName, new ModuleLogger(this, moduleName));
+    }
+    return this.loggers.get(moduleName);
+  }
+
+  /**
+   * Включен ли уровень для модуля - проверяется ДО форматирования строки
+   */
+  isEnabled(level, moduleName) {
+    const threshold = this.moduleLevels.get(moduleName) ?? this.level;
+    return LEVELS[level] <= LEVELS[threshold];
+  }
+
+  log(level, moduleName, message, meta) {
+    if (!this.isEnabled(level, moduleName)) return;
+
+    if (LEVELS[level] >= LEVELS.info) {
+      const rate = this.sampling.get(moduleName);
+      if (rate !== undefined && Math.random() >= rate) return;
+    }
+
+    this.transport.write(this._format(level, moduleName, message, meta));
+  }
+
+  /**
+   * Программная настройка
+   * @param {Object} config - { level, modules: { sonar: 'debug' }, sampling: { queue: 0.1 } }
+   */
+  configure(config = {}) {
+    if (config.level && LEVELS[config.level] !== undefined) {
+      this.level = config.level;
+    }
+
+    Object.entries(config.modules || {}).forEach(([moduleName, level]) => {
+      if (!level || level === 'default') {
+        this.moduleLevels.delete(moduleName);
+      } else if (LEVELS[level] !== undefined) {
+        this.moduleLevels.set(moduleName, level);
+      }
+    });
+
+    Object.entries(config.sampling || {}).forEach(([moduleName, rate]) => {
+      const value = parseFloat(rate);
+      if (Number.isNaN(value) || value >= 1) {
+        this.sampling.delete(moduleName);
+      } else {
+        this.sampling.set(moduleName, Math.max(0, value));
+      }
+    });
+  }
+
+  /**
+   * Настройка из категории 'logging' system_settings:
+   *   level         -> уровень по умолчанию
+   *   level_<mod>   -> уровень модуля
+   *   sample_<mod>  -> доля info/debug строк модуля (0..1)
+   */
+  configureFromSettings(loggingSettings = {}) {
+    const config = { modules: {}, sampling: {} };
+
+    Object.entries(loggingSettings).forEach(([key, value]) => {
+      if (key === 'level') config.level = String(value);
+      else if (key.startsWith('level_')) config.modules[key.substring(6)] = String(value);
+      else if (key.startsWith('sample_')) config.sampling[key.substring(7)] = value;
+    });
+
+    this.configure(config);
+  }
+
+  getConfig() {
+    return {
+      level: this.level,
+      format: this.format,
+      modules: Object.fromEntries(this.moduleLevels),
+      sampling: Object.fromEntries(this.sampling)
+    };
+  }
+
+  _format(level, moduleName, message, meta) {
+    const data = this._normalizeMeta(meta);
+
+    if (this.format === 'json') {
+      const entry = { ts: new Date().toISOString(), level, module: moduleName, msg: String(message) };
+      if (data !== undefined) entry.data = data;
+      try {
+        return JSON.stringify(entry) + '\n';
+      } catch (error) {
+        entry.data = util.inspect(data, { depth: 3 });
+        return JSON.stringify(entry) + '\n';
+      }
+    }
+
+    const suffix = data === undefined || (typeof data === 'object' && Object.keys(data).length === 0)
+      ? ''
+      : ' ' + util.inspect(data, { depth: 3, breakLength: Infinity, compact: true });
+    return `${new Date().toISOString()} [${level.toUpperCase()}] [${moduleName}] ${message}${suffix}\n`;
+  }
+
+  _normalizeMeta(meta) {
+    if (meta === undefined || meta === null) return undefined;
+    if (meta instanceof Error) {
+      return { error: meta.message, stack: meta.stack };
+    }
+    return meta;
+  }
+}
+
+// Экспортируем SINGLETON - один транспорт и одна конфигурация на процесс
+module.exports = new LogManager();
+module.exports.LEVELS = LEVELS;
@@ -0,0 +1,239 @@
+const { monitorEventLoopDelay } = require('perf_hooks');
+
+/**
+ * Metrics - Счетчики, gauges и гистограммы в формате Prometheus
+ *
+ * Без внешних зависимостей. Запись метрики - это поиск по Map и
+ * инкремент числа, поэтому подсистему можно держать включенной в production.
+ * Экспорт: GET /metrics (см. app-simple.js)
+ */
+
+// Бакеты по умолчанию (секунды): от 5ms до 2 минут - покрывают и БД, и AI API
+const DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120];
+
+function labelKey(labelNames, labels) {
+  if (labelNames.length === 0) return '';
+  return labelNames.map(name => String(labels[name] ?? '')).join('\u0001');
+}
+
+function formatLabels(labelNames, values, extra = '') {
+  const parts = labelNames.map((name, i) => {
+    const value = String(values[i]).replace(/\\/g, '\\\\').replace(/\n/g, '\\n').replace(/"/g, '\\"');
+    return `${name}="${value}"`;
+  });
+  if (extra) parts.push(extra);
+  return parts.length > 0 ? `{${parts.join(',')}}` : '';
+}
+
+function formatNumber(value) {
+  if (value === Infinity) return '+Inf';
+  if (value === -Infinity) return '-Inf';
+  return String(value);
+}
+
+class Counter {
+  constructor(name, help, labelNames = []) {
+    this.name = name;
+    this.help = help;
+    this.type = 'counter';
+    this.labelNames = labelNames;
+    this.values = new Map();
+  }
+
+  inc(labels = {}, value = 1) {
+    const key = labelKey(this.labelNames, labels);
+    this.values.set(key, (this.values.get(key) || 0) + value);
+  }
+
+  render() {
+    const lines = [];
+    for (const [key, value] of this.values) {
+      lines.push(`${this.name}${formatLabels(this.labelNames, key.split('\u0001'))} ${formatNumber(value)}`);
+    }
+    return lines;
+  }
+}
+
+class Gauge {
+  constructor(name, help, labelNames = [], collect = null) {
+    this.name = name;
+    this.help = help;
+    this.type = 'gauge';
+    this.labelNames = labelNames;
+    this.values = new Map();
+    this.collect = collect; // Вычисляется в момент scrape
+  }
+
+  set(labels = {}, value) {
+    this.values.set(labelKey(this.labelNames, labels), value);
+  }
+
+  inc(labels = {}, value = 1) {
+    const key = labelKey(this.labelNames, labels);
+    this.values.set(key, (this.values.get(key) || 0) + value);
+  }
+
+  dec(labels = {}, value = 1) {
+    this.inc(labels, -value);
+  }
+
+  render() {
+    if (this.collect) {
+      try {
+        this.collect(this);
+      } catch (error) {
+        // Ошибка сборщика не должна ломать весь /metrics
+      }
+    }
+
+    const lines = [];
+    for (const [key, value] of this.values) {
+      lines.push(`${this.name}${formatLabels(this.labelNames, key.split('\u0001'))} ${formatNumber(value)}`);
+    }
+    return lines;
+  }
+}
+
+class Histogram {
+  constructor(name, help, labelNames = [], buckets = DEFAULT_BUCKETS) {
+    this.name = name;
+    this.help = help;
+    this.type = 'histogram';
+    this.labelNames = labelNames;
+    this.buckets = [...buckets].sort((a, b) => a - b);
+    this.series = new Map();
+  }
+
+  observe(labels = {}, value) {
+    const key = labelKey(this.labelNames, labels);
+    let series = this.series.get(key);
+
+    if (!series) {
+      series = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+      this.series.set(key, series);
+    }
+
+    // Счетчики хранятся не-кумулятивно, суммируются при render
+    const index = this.buckets.findIndex(bound => value <= bound);
+    if (index !== -1) series.counts[index]++;
+    series.sum += value;
+    series.count++;
+  }
+
+  /**
+   * Таймер: const end = histogram.startTimer(labels); ... end();
+   */
+  startTimer(labels = {}) {
+    const start = process.hrtime.bigint();
+    return (extraLabels = {}) => {
+      const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+      this.observe({ ...labels, ...extraLabels }, seconds);
+      return seconds;
+    };
+  }
+
+  render() {
+    const lines = [];
+
+    for (const [key, series] of this.series) {
+      const values = key.split('\u0001');
+      let cumulative = 0;
+
+      this.buckets.forEach((bound, i) => {
+        cumulative += series.counts[i];
+        lines.push(`${this.name}_bucket${formatLabels(this.labelNames, values, `le="${bound}"`)} ${cumulative}`);
+      });
+      lines.push(`${this.name}_bucket${formatLabels(this.labelNames, values, 'le="+Inf"')} ${series.count}`);
+      lines.push(`${this.name}_sum${formatLabels(this.labelNames, values)} ${series.sum}`);
+      lines.push(`${this.name}_count${formatLabels(this.labelNames, values)} ${series.count}`);
+    }
+
+    return lines;
+  }
+}
+
+class Metrics {
+  constructor() {
+    this.registry = new Map();
+    this.eventLoopDelay = null;
+
+    this._registerDefaults();
+  }
+
+  counter(name, help, labelNames = []) {
+    return this._register(name, () => new Counter(name, help, labelNames));
+  }
+
+  gauge(name, help, labelNames = [], collect = null) {
+    return this._register(name, () => new Gauge(name, help, labelNames, collect));
+  }
+
+  histogram(name, help, labelNames = [], buckets = DEFAULT_BUCKETS) {
+    return this._register(name, () => new Histogram(name, help, labelNames, buckets));
+  }
+
+  /**
+   * Текст в формате Prometheus exposition 0.0.4
+   */
+  render() {
+    const lines = [];
+
+    for (const metric of this.registry.values()) {
+      const body = metric.render();
+      if (body.length === 0) continue;
+
+      lines.push(`# HELP ${metric.name} ${metric.help}`);
+      lines.push(`# TYPE ${metric.name} ${metric.type}`);
+      lines.push(...body);
+    }
+
+    return lines.join('\n') + '\n';
+  }
+
+  get contentType() {
+    return 'text/plain; version=0.0.4; charset=utf-8';
+  }
+
+  _register(name, factory) {
+    // Повторная регистрация возвращает существующую метрику (модули могут
+    // загружаться несколько раз, например require внутри роутов)
+    if (!this.registry.has(name)) {
+      this.registry.set(name, factory());
+    }
+    return this.registry.get(name);
+  }
+
+  _registerDefaults() {
+    // Лаг event loop - по гистограмме perf_hooks, сбрасывается на каждый scrape
+    // Гистограмма включает сам интервал таймера (resolution) - вычитаем его
+    const resolutionMs = 20;
+    this.eventLoopDelay = monitorEventLoopDelay({ resolution: resolutionMs });
+    this.eventLoopDelay.enable();
+
+    const lagSeconds = (ns) => Math.max(0, ns / 1e6 - resolutionMs) / 1000;
+
+    this.gauge('nodejs_eventloop_lag_seconds', 'Event loop delay since last scrape', ['quantile'], (gauge) => {
+      const h = this.eventLoopDelay;
+      if (h.count === 0) return;
+      gauge.set({ quantile: '0.5' }, lagSeconds(h.percentile(50)));
+      gauge.set({ quantile: '0.99' }, lagSeconds(h.percentile(99)));
+      gauge.set({ quantile: 'max' }, lagSeconds(h.max));
+      h.reset();
+    });
+
+    this.gauge('process_resident_memory_bytes', 'Resident memory size in bytes', [], (gauge) => {
+      gauge.set({}, process.memoryUsage().rss);
+    });
+
+    this.gauge('nodejs_heap_used_bytes', 'V8 heap used in bytes', [], (gauge) => {
+      gauge.set({}, process.memoryUsage().heapUsed);
+    });
+
+    this.gauge('process_uptime_seconds', 'Process uptime in seconds', [], (gauge) => {
+      gauge.set({}, Math.round(process.uptime()));
+    });
+  }
+}
+
+// Экспортируем SINGLETON - один реестр метрик на процесс
+module.exports = new Metrics();
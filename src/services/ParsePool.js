@@ -0,0 +1,202 @@
+const os = require('os');
+const path = require('path');
+const { Worker } = require('worker_threads');
+const tasks = require('../utils/ParseTasks');
+const metrics = require('./Metrics');
+const log = require('./Logger').child('parse-pool');
+
+const parseTaskSeconds = metrics.histogram(
+  'parse_task_duration_seconds', 'Response parsing / serialization time', ['task', 'mode'],
+  [0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]
+);
+const parseQueueLength = metrics.gauge(
+  'parse_pool_queue_length', 'Parse tasks waiting for a free worker thread'
+);
+
+const WORKER_FILE = path.join(__dirname, '../workers/parseWorker.js');
+
+/**
+ * ParsePool - Пул worker_threads для разбора ответов AI и сериализации таблиц
+ *
+ * Парсинг больших ответов Sonar/DeepSeek и JSON.stringify больших таблиц
+ * блокируют event loop: SSE прогресс и HTTP ответы ждут. Пул выносит эти
+ * операции в потоки. Маленькие входные данные обрабатываются сразу в
+ * основном потоке - передача в поток (structured clone) дороже самого парсинга.
+ *
+ * Задачи (src/utils/ParseTasks.js):
+ *   parseResponse(text, options)   - JSON из ответа AI (в т.ч. из ```json блоков)
+ *   extractContacts(text)          - email / URL из текста
+ *   extractTags(description)       - tag1..tag20 + services
+ *   serializeTable(value, options) - JSON / CSV для файлов и выгрузок
+ *
+ * Настройки (env):
+ *   PARSE_POOL_SIZE          - число потоков (0 = все в основном потоке)
+ *   PARSE_POOL_INLINE_BYTES  - текст короче -> основной поток (по умолчанию 64KB)
+ *   PARSE_POOL_INLINE_ROWS   - таблица меньше -> основной поток (по умолчанию 2000 строк)
+ */
+class ParsePool {
+  constructor() {
+    const size = parseInt(process.env.PARSE_POOL_SIZE);
+    this.size = Number.isInteger(size) && size >= 0 ? size : Math.max(1, Math.min(4, os.cpus().length - 1));
+    this.inlineBytes = parseInt(process.env.PARSE_POOL_INLINE_BYTES) || 64 * 1024;
+    this.inlineRows = parseInt(process.env.PARSE_POOL_INLINE_ROWS) || 2000;
+
+    this.workers = [];   // { worker, busy: task|null }
+    this.queue = [];     // задачи, ждущие свободный поток
+    this.nextId = 1;
+    this.stats = { inline: 0, pooled: 0, failed: 0, restarts: 0 };
+  }
+
+  // ========== Типизированный API ==========
+
+  /**
+   * @returns {Promise<{found: boolean, data: any, error: string|null, json: string|null}>}
+   */
+  parseResponse(text, options = {}) {
+    return this.run('parseResponse', text, options, this._textSize(text));
+  }
+
+  /**
+   * @returns {Promise<{emails: string[], websites: string[]}>}
+   */
+  extractContacts(text) {
+    return this.run('extractContacts', text, {}, this._textSize(text));
+  }
+
+  /**
+   * @returns {Promise<{tags: Object, services: string|null}>}
+   */
+  extractTags(description) {
+    return this.run('extractTags', description, {}, this._textSize(description));
+  }
+
+  /**
+   * @param {Object|Array} value
+   * @param {Object} options - { format: 'json'|'csv', space, rows }
+   *   rows - число строк для порога (по умолчанию длина массива)
+   * @returns {Promise<string>}
+   */
+  serializeTable(value, options = {}) {
+    const rows = options.rows ?? (Array.isArray(value) ? value.length : 0);
+    // Порог таблиц в строках, приводим к порогу в байтах
+    const size = rows >= this.inlineRows ? this.inlineBytes : 0;
+    return this.run('serializeTable', value, options, size);
+  }
+
+  // ========== Выполнение ==========
+
+  /**
+   * Выполнить задачу: в основном потоке (size < порога) или в пуле
+   * @param {string} task
+   * @param {any} input
+   * @param {Object} options
+   * @param {number} size - размер входных данных для порога
+   */
+  async run(task, input, options = {}, size = 0) {
+    if (this.size === 0 || size < this.inlineBytes) {
+      const end = parseTaskSeconds.startTimer({ task, mode: 'inline' });
+      this.stats.inline++;
+      try {
+        return tasks[task](input, options);
+      } finally {
+        end();
+      }
+    }
+
+    const end = parseTaskSeconds.startTimer({ task, mode: 'pool' });
+    this.stats.pooled++;
+    try {
+      return await new Promise((resolve, reject) => {
+        this.queue.push({ id: this.nextId++, task, input, options, resolve, reject });
+        this._drain();
+      });
+    } finally {
+      end();
+    }
+  }
+
+  getStats() {
+    return {
+      size: this.size,
+      threads: this.workers.length,
+      busy: this.workers.filter(slot => slot.busy).length,
+      queued: this.queue.length,
+      inlineBytes: this.inlineBytes,
+      inlineRows: this.inlineRows,
+      ...this.stats
+    };
+  }
+
+  /**
+   * Завершить потоки (graceful shutdown, тесты)
+   */
+  async close() {
+    const workers = this.workers.splice(0);
+    await Promise.all(workers.map(slot => slot.worker.terminate()));
+  }
+
+  _drain() {
+    while (this.queue.length > 0) {
+      const slot = this.workers.find(s => !s.busy) || this._spawn();
+      if (!slot) break;
+
+      const job = this.queue.shift();
+      slot.busy = job;
+      slot.worker.ref();
+      slot.worker.postMessage({ id: job.id, task: job.task, input: job.input, options: job.options });
+    }
+    parseQueueLength.set({}, this.queue.length);
+  }
+
+  _spawn() {
+    if (this.workers.length >= this.size) return null;
+
+    const worker = new Worker(WORKER_FILE);
+    const slot = { worker, busy: null };
+
+    worker.on('message', ({ id, result, error }) => {
+      const job = slot.busy;
+      if (!job || job.id !== id) return;
+
+      slot.busy = null;
+      worker.unref(); // Свободный поток не держит процесс
+      if (error) {
+        this.stats.failed++;
+        job.reject(new Error(error));
+      } else {
+        job.resolve(result);
+      }
+      this._drain();
+    });
+
+    // Поток упал (OOM и т.п.) - текущая задача с ошибкой, поток пересоздается по требованию
+    const onExit = (reason) => {
+      const index = this.workers.indexOf(slot);
+      if (index === -1) return;
+      this.workers.splice(index, 1);
+      this.stats.restarts++;
+      log.error('Parse worker thread exited', { reason });
+
+      if (slot.busy) {
+        this.stats.failed++;
+        slot.busy.reject(new Error(`Parse worker failed: ${reason}`));
+        slot.busy = null;
+      }
+      this._drain();
+    };
+    worker.on('error', error => onExit(error.message));
+    worker.on('exit', code => onExit(`exit code ${code}`));
+
+    worker.unref();
+    this.workers.push(slot);
+    return slot;
+  }
+
+  _textSize(text) {
+    // Длина строки в UTF-16 единицах - достаточно для порога, без Buffer.byteLength
+    return typeof text === 'string' ? text.length : 0;
+  }
+}
+
+// Экспортируем SINGLETON - один пул потоков на процесс
+module.exports = new ParsePool();
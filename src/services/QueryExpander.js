@@ -1,7 +1,13 @@
+const querySimilarityIndex = require('./QuerySimilarityIndex');
+
 /**
  * QueryExpander - Генератор под-запросов из темы
  * Создает множество релевантных запросов на основе одной темы
  * Может использовать DeepSeek или Perplexity API
+ *
+ * Повторы отсекаются по QuerySimilarityIndex: точные и похожие (порядок слов,
+ * лишнее слово) запросы из истории с низким выходом компаний не сохраняются,
+ * остальные похожие помечаются near_duplicate с историческим выходом.
  */
 class QueryExpander {
   constructor(apiClient, settingsManager, database, logger) {
@@ -26,6 +32,8 @@ class QueryExpander {
     try {
       let allQueries = [];
       let attempts = 0;
+      // Отчет по повторам: запрос -> { action, reason, match }
+      const duplicateReport = new Map();
       const maxAttempts = 10; // Увеличено до 10 попыток для гарантии получения нужного количества
       
       // Продолжать генерацию пока не достигнем целевого количества
@@ -98,7 +106,7 @@ class QueryExpander {
         allQueries = this._removeDuplicates(allQueries);
         
         // ✨ ПРОВЕРИТЬ СУЩЕСТВУЮЩИЕ ЗАПРОСЫ В БД
-        allQueries = await this._filterExistingQueries(allQueries);
+        allQueries = await this._filterExistingQueries(allQueries, duplicateReport);
         
         this.logger.info('QueryExpander: After deduplication', {
           attempt: attempts,
@@ -147,13 +155,25 @@ class QueryExpander {
         savedAll: true // Сохранили все уникальные
       });
 
+      const nearDuplicates = [...duplicateReport.entries()].map(([query_cn, result]) => ({
+        query_cn,
+        action: result.action,
+        reason: result.reason,
+        similar_to: result.match.query_cn,
+        similarity: result.match.similarity,
+        historical_runs: result.match.runs,
+        historical_yield: result.match.avg_yield
+      }));
+
       return {
         success: true,
         main_topic: mainTopic,
         queries: finalQueries,
         total: finalQueries.length,
         attempts: attempts,
-        wasFiltered: false // Больше не фильтруем
+        wasFiltered: false, // Больше не фильтруем
+        nearDuplicates,
+        skipped: nearDuplicates.filter(item => item.action === 'skip').length
       };
 
     } catch (error) {
@@ -331,61 +351,65 @@ JSON формат: queries с полями query_cn, query_ru, relevance.`,
     }
   }
 
+  /**
+   * Удалить повторы внутри сгенерированного пула: точные и похожие
+   * (порог QUERY_SIMILARITY_THRESHOLD), из похожих остается более релевантный
+   */
   _removeDuplicates(queries) {
-    const seen = new Set();
-    return queries.filter(query => {
-      const key = query.query_cn.toLowerCase();
-      if (seen.has(key)) {
-        return false;
-      }
-      seen.add(key);
-      return true;
+    const kept = [];
+    const byRelevance = [...queries].sort((a, b) => (b.relevance || 50) - (a.relevance || 50));
+
+    byRelevance.forEach(query => {
+      const duplicate = kept.some(other =>
+        querySimilarityIndex.similarity(query.query_cn, other.query_cn) >= querySimilarityIndex.threshold
+      );
+      if (!duplicate) kept.push(query);
     });
+
+    // Исходный порядок пула
+    return queries.filter(query => kept.includes(query));
   }
 
   /**
-   * Проверить и отфильтровать запросы, которые уже существуют в БД
+   * Проверить запросы по истории (QuerySimilarityIndex)
+   * Пропускаются точные повторы и похожие запросы с низким историческим выходом,
+   * остальные похожие помечаются near_duplicate
    * @param {Array} queries - Массив новых запросов
-   * @returns {Array} Отфильтрованный массив запросов без дубликатов из БД
+   * @param {Map} report - сюда записываются найденные повторы
+   * @returns {Array} Отфильтрованный массив запросов
    */
-  async _filterExistingQueries(queries) {
+  async _filterExistingQueries(queries, report = new Map()) {
     try {
-      // Получить все существующие подзапросы из БД через Supabase
-      const { data, error } = await this.db.supabase
-        .from('session_queries')
-        .select('query_cn');
-      
-      if (error) {
-        this.logger.error('QueryExpander: Failed to fetch existing queries', {
-          error: error.message
-        });
-        // В случае ошибки возвращаем все запросы
-        return queries;
-      }
-      
-      const existingQueries = new Set(
-        (data || []).map(row => row.query_cn.toLowerCase().trim())
-      );
-      
-      this.logger.debug('QueryExpander: Checking against existing queries', {
-        existingCount: existingQueries.size,
-        newQueriesCount: queries.length
-      });
-      
-      // Фильтровать новые запросы
+      // Первый вызов - загрузка истории, дальше только новые строки
+      await querySimilarityIndex.refresh();
+
       const filtered = queries.filter(query => {
-        const key = query.query_cn.toLowerCase().trim();
-        const isDuplicate = existingQueries.has(key);
-        if (isDuplicate) {
+        const result = querySimilarityIndex.check(query.query_cn);
+        if (!result.match) return true;
+
+        report.set(query.query_cn, result);
+        if (result.action === 'skip') {
           this.logger.debug('QueryExpander: Duplicate found', {
-            query: query.query_cn
+            query: query.query_cn,
+            reason: result.reason,
+            similarTo: result.match.query_cn,
+            similarity: result.match.similarity,
+            historicalYield: result.match.avg_yield
           });
+          return false;
         }
-        return !isDuplicate;
+
+        query.near_duplicate = {
+          query_cn: result.match.query_cn,
+          similarity: result.match.similarity,
+          runs: result.match.runs,
+          avg_yield: result.match.avg_yield
+        };
+        return true;
       });
-      
+
       const duplicatesCount = queries.length - filtered.length;
-      
+
       if (duplicatesCount > 0) {
         this.logger.info('QueryExpander: Filtered existing queries from DB', {
           total: queries.length,
@@ -397,9 +421,9 @@ JSON формат: queries с полями query_cn, query_ru, relevance.`,
             .map(q => q.query_cn)
         });
       }
-      
+
       return filtered;
-      
+
     } catch (error) {
       this.logger.error('QueryExpander: Failed to check existing queries', {
         error: error.message,
@@ -435,6 +459,9 @@ JSON формат: queries с полями query_cn, query_ru, relevance.`,
         throw new Error(`Supabase insert error: ${error.message}`);
       }
 
+      // Индекс похожих запросов обновляется сразу, без перечитывания БД
+      querySimilarityIndex.add(queries);
+
       this.logger.info('QueryExpander: Queries saved to DB', {
         sessionId,
         count: queries.length
@@ -1,3 +1,13 @@
+const metrics = require('./Metrics');
+
+const stageItemsTotal = metrics.counter(
+  'stage_items_processed_total', 'Companies/queries processed by pipeline stage', ['stage', 'mode']
+);
+const stageDurationSeconds = metrics.histogram(
+  'stage_duration_seconds', 'Wall time of one stage run for a session', ['stage'],
+  [1, 5, 15, 30, 60, 120, 300, 600, 1200, 3600]
+);
+
 /**
  * Query Orchestrator - Управление всеми этапами обработки
  * Координирует выполнение Stage 1-6 для сессии поиска
@@ -53,7 +63,10 @@ class QueryOrchestrator {
       }
       
       this.logger.info('Orchestrator: Stage 1 - Finding companies');
+      let endTimer = stageDurationSeconds.startTimer({ stage: 'stage1' });
       const stage1Result = await this.stage1.execute(searchQuery, sessionId);
+      endTimer();
+      stageItemsTotal.inc({ stage: 'stage1', mode: 'session' }, stage1Result.count || 0);
       
       if (!stage1Result.success || stage1Result.count === 0) {
         if (this.progressTracker) {
@@ -76,7 +89,10 @@ class QueryOrchestrator {
       }
       
       this.logger.info('Orchestrator: Stage 2 - Finding websites');
+      endTimer = stageDurationSeconds.startTimer({ stage: 'stage2' });
       const stage2Result = await this.stage2.execute(sessionId);
+      endTimer();
+      stageItemsTotal.inc({ stage: 'stage2', mode: 'session' }, stage2Result.total || 0);
       
       if (this.progressTracker) {
         await this.progressTracker.completeStage(sessionId, `Найдено сайтов: ${stage2Result.found}/${stage2Result.total}`);
@@ -93,7 +109,10 @@ class QueryOrchestrator {
       }
       
       this.logger.info('Orchestrator: Stage 3 - Analyzing contacts');
+      endTimer = stageDurationSeconds.startTimer({ stage: 'stage3' });
       const stage3Result = await this.stage3.execute(sessionId);
+      endTimer();
+      stageItemsTotal.inc({ stage: 'stage3', mode: 'session' }, stage3Result.processed || 0);
       
       if (this.progressTracker) {
         await this.progressTracker.completeStage(sessionId, `Email найдено: ${stage3Result.found} из ${stage3Result.processed}`);
@@ -110,7 +129,10 @@ class QueryOrchestrator {
       }
       
       this.logger.info('Orchestrator: Stage 4 - Validating data');
+      endTimer = stageDurationSeconds.startTimer({ stage: 'stage4' });
       const stage4Result = await this.stage4.execute(sessionId);
+      endTimer();
+      stageItemsTotal.inc({ stage: 'stage4', mode: 'session' }, stage4Result.total || 0);
       
       if (this.progressTracker) {
         await this.progressTracker.completeStage(
@@ -131,7 +153,10 @@ class QueryOrchestrator {
       }
       
       this.logger.info('Orchestrator: Stage 6 - Finalization');
+      endTimer = stageDurationSeconds.startTimer({ stage: 'stage6' });
       const stage6Result = await this.stage6.execute(sessionId);
+      endTimer();
+      stageItemsTotal.inc({ stage: 'stage6', mode: 'session' }, stage6Result.finalized || 0);
       
       if (this.progressTracker) {
         await this.progressTracker.completeStage(
@@ -372,7 +397,7 @@ class QueryOrchestrator {
     }
   }
 
-  async runStage2Only(sessionId, globalProgressCallback = null) {
+  async runStage2Only(sessionId, globalProgressCallback = null, job = null) {
     this.logger.info('Running Stage 2 only', { sessionId });
     
     // Получить компании для обработки
@@ -429,6 +454,11 @@ class QueryOrchestrator {
       this.logger.info('Stage 2: Global progress callback set');
     }
     
+    // Персистентное задание global запуска (журнал компаний для resume)
+    if (job) {
+      this.stage2.setJob(job);
+    }
+    
     try {
       // Запустить полный Stage 2
       const result = await this.stage2.execute(sessionId === 'global' ? null : sessionId);
@@ -469,6 +499,7 @@ class QueryOrchestrator {
     } finally {
       // Очистить callback
       this.stage2.setProgressCallback(null);
+      this.stage2.setJob(null);
     }
   }
 
@@ -0,0 +1,351 @@
+const log = require('./Logger').child('query-index');
+
+// MinHash: 60 хешей = 20 полос LSH по 3 строки.
+// Вероятность стать кандидатом: J=0.6 -> 99%, J=0.3 -> 42% (кандидаты проверяются точным Jaccard)
+const NUM_HASHES = 60;
+const BANDS = 20;
+const ROWS = NUM_HASHES / BANDS;
+const SHINGLE_SIZE = 2;
+const PAGE_SIZE = 1000;
+
+// Соли хеш-функций MinHash - фиксированы, чтобы сигнатуры совпадали между процессами
+const SEEDS = Array.from({ length: NUM_HASHES }, (_, i) => mix32(0x9e3779b9 ^ Math.imul(i + 1, 0x85ebca6b)));
+
+function mix32(h) {
+  h ^= h >>> 16;
+  h = Math.imul(h, 0x7feb352d);
+  h ^= h >>> 15;
+  h = Math.imul(h, 0x846ca68b);
+  h ^= h >>> 16;
+  return h >>> 0;
+}
+
+function fnv1a(text) {
+  let h = 0x811c9dc5;
+  for (let i = 0; i < text.length; i++) {
+    h ^= text.charCodeAt(i);
+    h = Math.imul(h, 0x01000193);
+  }
+  return h >>> 0;
+}
+
+/**
+ * Нормализация запроса: регистр, пробелы и пунктуация не различают запросы
+ */
+function normalize(text) {
+  return String(text || '').toLowerCase().replace(/[\s\p{P}\p{S}]+/gu, '');
+}
+
+/**
+ * Символьные n-граммы (для китайского - биграммы иероглифов)
+ */
+function shingles(text) {
+  const normalized = normalize(text);
+  const chars = Array.from(normalized);
+  if (chars.length <= SHINGLE_SIZE) return new Set(normalized ? [normalized] : []);
+
+  const result = new Set();
+  for (let i = 0; i <= chars.length - SHINGLE_SIZE; i++) {
+    result.add(chars.slice(i, i + SHINGLE_SIZE).join(''));
+  }
+  return result;
+}
+
+function jaccard(a, b) {
+  if (a.size === 0 || b.size === 0) return 0;
+  const [small, large] = a.size <= b.size ? [a, b] : [b, a];
+  let intersection = 0;
+  small.forEach(item => { if (large.has(item)) intersection++; });
+  return intersection / (a.size + b.size - intersection);
+}
+
+function signature(shingleSet) {
+  const sig = new Uint32Array(NUM_HASHES).fill(0xffffffff);
+  shingleSet.forEach(shingle => {
+    const base = fnv1a(shingle);
+    for (let i = 0; i < NUM_HASHES; i++) {
+      const h = mix32(base ^ SEEDS[i]);
+      if (h < sig[i]) sig[i] = h;
+    }
+  });
+  return sig;
+}
+
+function bandKeys(sig) {
+  const keys = [];
+  for (let band = 0; band < BANDS; band++) {
+    let key = `${band}`;
+    for (let row = 0; row < ROWS; row++) key += `:${sig[band * ROWS + row].toString(36)}`;
+    keys.push(key);
+  }
+  return keys;
+}
+
+/**
+ * QuerySimilarityIndex - Индекс похожих поисковых запросов (MinHash + LSH)
+ *
+ * QueryExpander раньше скачивал все session_queries.query_cn при каждой
+ * генерации и убирал только точные совпадения. Запросы, отличающиеся порядком
+ * слов или одним словом ("服务" / "加工服务"), каждый раз стоили вызова Sonar
+ * в Stage 1 и находили те же компании.
+ *
+ * Индекс живет в памяти процесса: загружается из session_queries один раз
+ * (постранично), дальше обновляется инкрементально - add() при сохранении
+ * запросов, recordRuns() после Stage 1, дельта из БД по created_at/executed_at
+ * (запросы и запуски других процессов).
+ *
+ * Для каждого запроса хранится его история: сколько раз выполнялся и сколько
+ * новых компаний принес (new_companies после дедупликации Stage 1).
+ *
+ * Настройки (env):
+ *   QUERY_SIMILARITY_THRESHOLD - порог похожести, Jaccard по биграммам (по умолчанию 0.6)
+ *   QUERY_MIN_YIELD            - средний выход новых компаний за запуск, ниже которого
+ *                                похожий запрос пропускается (по умолчанию 1)
+ */
+class QuerySimilarityIndex {
+  constructor() {
+    this.db = null;
+    this.threshold = parseFloat(process.env.QUERY_SIMILARITY_THRESHOLD) || 0.6;
+    this.minYield = process.env.QUERY_MIN_YIELD !== undefined ? parseFloat(process.env.QUERY_MIN_YIELD) : 1;
+
+    this.entries = new Map();  // нормализованный запрос -> entry
+    this.buckets = new Map();  // ключ полосы LSH -> Set(нормализованный запрос)
+    this.loaded = false;
+    this.loading = null;
+    this.highWaterMark = null; // max(created_at, executed_at) загруженных строк
+    this.recordedRuns = new Set(); // запуски, записанные этим процессом (не считать повторно из дельты)
+    this.stats = { loadedRows: 0, lookups: 0, candidates: 0, nearDuplicates: 0 };
+  }
+
+  init(db) {
+    this.db = db;
+  }
+
+  isEnabled() {
+    return !!(this.db && this.db.supabase);
+  }
+
+  /**
+   * Загрузить историю (первый вызов) или только изменения с прошлого раза
+   */
+  async refresh() {
+    if (!this.isEnabled()) return;
+    if (this.loading) return this.loading;
+
+    this.loading = this._load().finally(() => { this.loading = null; });
+    return this.loading;
+  }
+
+  /**
+   * Добавить сохраненные запросы (QueryExpander.saveQueries)
+   * @param {Array<{query_cn: string}>} queries
+   */
+  add(queries) {
+    queries.forEach(query => this._upsert(query.query_cn, null));
+  }
+
+  /**
+   * Записать результаты выполнения запросов (Stage 1): session_queries + индекс
+   * @param {Array<{query_id, query_cn, found: number, newCompanies: number}>} runs
+   */
+  async recordRuns(runs) {
+    const executedAt = new Date().toISOString();
+
+    for (const run of runs) {
+      this._upsert(run.query_cn, { found: run.found, newCompanies: run.newCompanies });
+      if (!this.isEnabled() || !run.query_id) continue;
+
+      this.recordedRuns.add(`${run.query_id}@${Date.parse(executedAt)}`);
+      const { error } = await this.db.supabase
+        .from('session_queries')
+        .update({ companies_found: run.found, new_companies: run.newCompanies, executed_at: executedAt })
+        .eq('query_id', run.query_id);
+
+      if (error) {
+        log.warn('Failed to save query yield', { queryId: run.query_id, error: error.message });
+      }
+    }
+  }
+
+  /**
+   * Найти похожие запросы из истории
+   * @param {string} queryText
+   * @param {Object} options - { threshold, limit }
+   * @returns {Array<{query_cn, similarity, exact, runs, companies_found, new_companies, avg_yield}>}
+   *   по убыванию похожести
+   */
+  findSimilar(queryText, { threshold = this.threshold, limit = 5 } = {}) {
+    const key = normalize(queryText);
+    if (!key) return [];
+    this.stats.lookups++;
+
+    const querySet = shingles(queryText);
+    const candidates = new Set();
+    if (this.entries.has(key)) candidates.add(key);
+    bandKeys(signature(querySet)).forEach(bandKey => {
+      const bucket = this.buckets.get(bandKey);
+      if (bucket) bucket.forEach(candidate => candidates.add(candidate));
+    });
+    this.stats.candidates += candidates.size;
+
+    const matches = [];
+    candidates.forEach(candidate => {
+      const entry = this.entries.get(candidate);
+      const similarity = candidate === key ? 1 : jaccard(querySet, entry.shingles);
+      if (similarity >= threshold) {
+        matches.push(this._describe(entry, similarity, candidate === key));
+      }
+    });
+
+    return matches.sort((a, b) => b.similarity - a.similarity).slice(0, limit);
+  }
+
+  /**
+   * Проверка нового запроса перед сохранением
+   * @returns {{action: 'keep'|'skip', reason: string|null, match: Object|null}}
+   *   skip - точный повтор или похожий запрос с низким историческим выходом
+   */
+  check(queryText) {
+    const matches = this.findSimilar(queryText);
+    if (matches.length === 0) {
+      return { action: 'keep', reason: null, match: null };
+    }
+
+    this.stats.nearDuplicates++;
+    const exact = matches.find(match => match.exact);
+    if (exact) {
+      return { action: 'skip', reason: 'exact', match: exact };
+    }
+
+    // Худший из выполнявшихся похожих запросов определяет решение
+    const executed = matches.filter(match => match.runs > 0);
+    const lowYield = executed.find(match => match.avg_yield < this.minYield);
+    if (lowYield) {
+      return { action: 'skip', reason: 'low_yield', match: lowYield };
+    }
+
+    return { action: 'keep', reason: 'near_duplicate', match: matches[0] };
+  }
+
+  /**
+   * Прогноз выхода запроса по похожим выполненным запросам (взвешенный по похожести)
+   * @returns {number|null} null - похожих выполненных запросов нет
+   */
+  predictYield(queryText) {
+    const executed = this.findSimilar(queryText, { limit: 10 }).filter(match => match.runs > 0);
+    if (executed.length === 0) return null;
+
+    let weighted = 0;
+    let weights = 0;
+    executed.forEach(match => {
+      weighted += match.avg_yield * match.similarity;
+      weights += match.similarity;
+    });
+    return weighted / weights;
+  }
+
+  /**
+   * Похожесть двух запросов (Jaccard по биграммам) - для проверки внутри одной генерации
+   */
+  similarity(a, b) {
+    if (normalize(a) === normalize(b)) return 1;
+    return jaccard(shingles(a), shingles(b));
+  }
+
+  getStats() {
+    return {
+      enabled: this.isEnabled(),
+      loaded: this.loaded,
+      queries: this.entries.size,
+      buckets: this.buckets.size,
+      threshold: this.threshold,
+      minYield: this.minYield,
+      highWaterMark: this.highWaterMark,
+      ...this.stats
+    };
+  }
+
+  async _load() {
+    let from = 0;
+    let maxSeen = this.highWaterMark;
+
+    for (;;) {
+      let query = this.db.supabase
+        .from('session_queries')
+        .select('query_id, query_cn, companies_found, new_companies, created_at, executed_at')
+        .order('query_id', { ascending: true })
+        .range(from, from + PAGE_SIZE - 1);
+
+      // Дельта: новые запросы и новые результаты выполнения
+      if (this.highWaterMark) {
+        const mark = `"${this.highWaterMark}"`;
+        query = query.or(`created_at.gt.${mark},executed_at.gt.${mark}`);
+      }
+
+      const { data, error } = await query;
+      if (error) {
+        log.warn('Failed to load session queries', { error: error.message });
+        return;
+      }
+
+      (data || []).forEach(row => {
+        // Строка с executed_at = один запуск. В дельте - только запуски после
+        // прошлой загрузки и не записанные этим процессом (recordRuns)
+        const executed = row.executed_at
+          && (!this.highWaterMark || row.executed_at > this.highWaterMark)
+          && !this.recordedRuns.delete(`${row.query_id}@${Date.parse(row.executed_at)}`);
+        this._upsert(row.query_cn, executed ? { found: row.companies_found || 0, newCompanies: row.new_companies || 0 } : null);
+        [row.created_at, row.executed_at].forEach(ts => {
+          if (ts && (!maxSeen || ts > maxSeen)) maxSeen = ts;
+        });
+      });
+      this.stats.loadedRows += (data || []).length;
+
+      if (!data || data.length < PAGE_SIZE) break;
+      from += PAGE_SIZE;
+    }
+
+    this.highWaterMark = maxSeen;
+    if (!this.loaded) {
+      this.loaded = true;
+      log.info('Query similarity index loaded', { queries: this.entries.size, rows: this.stats.loadedRows });
+    }
+  }
+
+  _upsert(queryText, run) {
+    const key = normalize(queryText);
+    if (!key) return;
+
+    let entry = this.entries.get(key);
+    if (!entry) {
+      const set = shingles(queryText);
+      entry = { query_cn: queryText, shingles: set, runs: 0, found: 0, newCompanies: 0 };
+      this.entries.set(key, entry);
+      bandKeys(signature(set)).forEach(bandKey => {
+        if (!this.buckets.has(bandKey)) this.buckets.set(bandKey, new Set());
+        this.buckets.get(bandKey).add(key);
+      });
+    }
+
+    if (run) {
+      entry.runs++;
+      entry.found += run.found;
+      entry.newCompanies += run.newCompanies;
+    }
+  }
+
+  _describe(entry, similarity, exact) {
+    return {
+      query_cn: entry.query_cn,
+      similarity: Math.round(similarity * 100) / 100,
+      exact,
+      runs: entry.runs,
+      companies_found: entry.found,
+      new_companies: entry.newCompanies,
+      avg_yield: entry.runs > 0 ? Math.round(entry.newCompanies / entry.runs * 10) / 10 : null
+    };
+  }
+}
+
+// Экспортируем SINGLETON
+module.exports = new QuerySimilarityIndex();
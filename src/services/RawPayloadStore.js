@@ -0,0 +1,267 @@
+const crypto = require('crypto');
+const zlib = require('zlib');
+const { promisify } = require('util');
+const log = require('./Logger').child('raw-payloads');
+
+const brotliCompress = promisify(zlib.brotliCompress);
+const brotliDecompress = promisify(zlib.brotliDecompress);
+const gzip = promisify(zlib.gzip);
+const gunzip = promisify(zlib.gunzip);
+
+// Ссылки хранятся рядом с исходным полем: full_response -> full_response_ref
+const REF_SUFFIX = '_ref';
+// Колонки pending_companies с сырыми ответами AI
+const RAW_COLUMNS = ['stage1_raw_data', 'stage2_raw_data', 'stage3_raw_data'];
+// Сколько хешей помнить как уже сохраненные (дедупликация без запроса к БД)
+const KNOWN_HASHES_LIMIT = 10000;
+// Сколько распакованных текстов держать в памяти (Stage 4 читает один ответ Stage 1 для 10+ компаний)
+const TEXT_CACHE_LIMIT = 200;
+const FETCH_CHUNK = 100;
+
+/**
+ * RawPayloadStore - Сжатое content-addressed хранилище сырых ответов AI
+ *
+ * stage1/2/3_raw_data в pending_companies содержали полный ответ AI (до 10KB)
+ * и возвращались каждым select('*'). Теперь большие текстовые поля payload
+ * уходят в таблицу raw_payloads (brotli/gzip, ключ - sha256 текста), а в строке
+ * остается ссылка:
+ *   { query, full_response: null, full_response_ref: '<sha256>', timestamp, ... }
+ * Одинаковый текст хранится один раз (все компании одного запроса Stage 1
+ * ссылаются на один ответ).
+ *
+ * Запись: pack() перед insert/update. Чтение: только там, где нужен сырой
+ * ответ (Stage 4, include_raw_data=true) - resolve() / resolveRows().
+ * Без init() или без таблицы raw_payloads payload сохраняется как раньше (inline).
+ *
+ * Миграция старых строк: node scripts/migrate-raw-payloads.js
+ */
+class RawPayloadStore {
+  constructor() {
+    this.db = null;
+    this.rawColumns = RAW_COLUMNS;
+    this.minBytes = parseInt(process.env.RAW_PAYLOAD_MIN_BYTES) || 1024;
+    this.encoding = process.env.RAW_PAYLOAD_ENCODING === 'gzip' ? 'gzip' : 'br';
+    this.knownHashes = new Set();
+    this.pendingPuts = new Map();
+    this.textCache = new Map();
+    this.stats = { puts: 0, dedupHits: 0, originalBytes: 0, compressedBytes: 0, fetched: 0, inlineFallbacks: 0 };
+  }
+
+  init(db) {
+    this.db = db;
+  }
+
+  isEnabled() {
+    return !!(this.db && this.db.supabase);
+  }
+
+  /**
+   * Вынести большие текстовые поля payload в хранилище
+   * @param {Object|null} payload - stageN_raw_data
+   * @returns {Promise<Object|null>} payload со ссылками (или исходный при ошибке)
+   */
+  async pack(payload) {
+    if (!this.isEnabled() || !payload || typeof payload !== 'object') {
+      return payload;
+    }
+
+    const packed = { ...payload };
+    try {
+      for (const [field, value] of Object.entries(payload)) {
+        if (typeof value !== 'string' || value.length < this.minBytes) continue;
+        packed[`${field}${REF_SUFFIX}`] = await this.put(value);
+        packed[field] = null;
+      }
+      return packed;
+    } catch (error) {
+      // Хранилище недоступно (нет таблицы, сеть) - не теряем данные, пишем inline
+      this.stats.inlineFallbacks++;
+      log.warn('Raw payload store unavailable, keeping payload inline', { error: error.message });
+      return payload;
+    }
+  }
+
+  /**
+   * Сохранить текст, вернуть его хеш
+   */
+  async put(text) {
+    const hash = crypto.createHash('sha256').update(text).digest('hex');
+
+    if (this.knownHashes.has(hash)) {
+      this.stats.dedupHits++;
+      return hash;
+    }
+    // Параллельная запись того же текста (батч Stage 1) - ждем первую
+    if (this.pendingPuts.has(hash)) {
+      this.stats.dedupHits++;
+      return this.pendingPuts.get(hash);
+    }
+
+    const promise = this._upload(hash, text).finally(() => this.pendingPuts.delete(hash));
+    this.pendingPuts.set(hash, promise);
+    return promise;
+  }
+
+  /**
+   * Заменить ссылки payload на исходный текст
+   * @param {Object|null} payload
+   * @returns {Promise<Object|null>} новый объект (исходный не меняется)
+   */
+  async resolve(payload) {
+    const [resolved] = await this._resolveMany([payload]);
+    return resolved;
+  }
+
+  /**
+   * Подставить сырые ответы в строки pending_companies (для include_raw_data=true)
+   * @param {Array<Object>} rows
+   * @param {Array<string>} columns - по умолчанию stage1/2/3_raw_data
+   * @returns {Promise<Array<Object>>} те же строки с распакованными колонками
+   */
+  async resolveRows(rows, columns = RAW_COLUMNS) {
+    const payloads = [];
+    rows.forEach(row => columns.forEach(column => payloads.push(row[column])));
+
+    const resolved = await this._resolveMany(payloads);
+
+    let i = 0;
+    rows.forEach(row => columns.forEach(column => {
+      const value = resolved[i++];
+      if (column in row) row[column] = value;
+    }));
+    return rows;
+  }
+
+  /**
+   * Ссылки payload (для отчетов и миграции)
+   */
+  refsOf(payload) {
+    if (!payload || typeof payload !== 'object') return [];
+    return Object.entries(payload)
+      .filter(([key, value]) => key.endsWith(REF_SUFFIX) && typeof value === 'string')
+      .map(([key, value]) => ({ field: key.slice(0, -REF_SUFFIX.length), hash: value }));
+  }
+
+  getStats() {
+    return {
+      enabled: this.isEnabled(),
+      encoding: this.encoding,
+      minBytes: this.minBytes,
+      knownHashes: this.knownHashes.size,
+      cachedTexts: this.textCache.size,
+      ...this.stats
+    };
+  }
+
+  async _upload(hash, text) {
+    const original = Buffer.from(text, 'utf8');
+    // zlib выполняется в пуле потоков libuv - event loop не блокируется
+    const compressed = this.encoding === 'gzip'
+      ? await gzip(original)
+      : await brotliCompress(original, {
+        params: {
+          [zlib.constants.BROTLI_PARAM_MODE]: zlib.constants.BROTLI_MODE_TEXT,
+          [zlib.constants.BROTLI_PARAM_QUALITY]: 9,
+          [zlib.constants.BROTLI_PARAM_SIZE_HINT]: original.length
+        }
+      });
+
+    const { error } = await this.db.supabase
+      .from('raw_payloads')
+      .upsert({
+        hash,
+        encoding: this.encoding,
+        data: compressed.toString('base64'),
+        original_bytes: original.length,
+        compressed_bytes: compressed.length
+      }, { onConflict: 'hash', ignoreDuplicates: true });
+
+    if (error) {
+      throw new Error(`raw_payloads upsert failed: ${error.message}`);
+    }
+
+    this.stats.puts++;
+    this.stats.originalBytes += original.length;
+    this.stats.compressedBytes += compressed.length;
+    this._rememberHash(hash);
+    this._cacheText(hash, text);
+    return hash;
+  }
+
+  async _resolveMany(payloads) {
+    const hashes = new Set();
+    payloads.forEach(payload => this.refsOf(payload).forEach(ref => hashes.add(ref.hash)));
+
+    const texts = await this._fetchTexts([...hashes]);
+
+    return payloads.map(payload => {
+      const refs = this.refsOf(payload);
+      if (refs.length === 0) return payload;
+
+      // Порядок ключей сохраняется: поле на своем месте, ссылка удаляется
+      const resolved = { ...payload };
+      refs.forEach(({ field, hash }) => {
+        if (texts.has(hash)) {
+          resolved[field] = texts.get(hash);
+          delete resolved[`${field}${REF_SUFFIX}`];
+        }
+      });
+      return resolved;
+    });
+  }
+
+  async _fetchTexts(hashes) {
+    const texts = new Map();
+    const missing = [];
+
+    hashes.forEach(hash => {
+      if (this.textCache.has(hash)) texts.set(hash, this.textCache.get(hash));
+      else missing.push(hash);
+    });
+
+    if (missing.length === 0 || !this.isEnabled()) return texts;
+
+    for (let i = 0; i < missing.length; i += FETCH_CHUNK) {
+      const chunk = missing.slice(i, i + FETCH_CHUNK);
+      const { data, error } = await this.db.supabase
+        .from('raw_payloads')
+        .select('hash, encoding, data')
+        .in('hash', chunk);
+
+      if (error) {
+        // Ссылки останутся в payload - вызывающий код видит *_ref вместо текста
+        log.error('Failed to fetch raw payloads', { count: chunk.length, error: error.message });
+        continue;
+      }
+
+      for (const row of data || []) {
+        const buffer = Buffer.from(row.data, 'base64');
+        const text = (row.encoding === 'gzip' ? await gunzip(buffer) : await brotliDecompress(buffer)).toString('utf8');
+        texts.set(row.hash, text);
+        this._cacheText(row.hash, text);
+        this._rememberHash(row.hash);
+        this.stats.fetched++;
+      }
+    }
+
+    return texts;
+  }
+
+  _cacheText(hash, text) {
+    this.textCache.delete(hash);
+    this.textCache.set(hash, text);
+    if (this.textCache.size > TEXT_CACHE_LIMIT) {
+      this.textCache.delete(this.textCache.keys().next().value);
+    }
+  }
+
+  _rememberHash(hash) {
+    this.knownHashes.add(hash);
+    if (this.knownHashes.size > KNOWN_HASHES_LIMIT) {
+      this.knownHashes.delete(this.knownHashes.values().next().value);
+    }
+  }
+}
+
+// Экспортируем SINGLETON
+module.exports = new RawPayloadStore();
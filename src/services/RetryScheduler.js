@@ -0,0 +1,274 @@
+const log = require('./Logger').child('retry-scheduler');
+
+// Каналы повторного поиска: провайдер + вариант промпта, по возрастанию цены.
+// cost - относительная цена вызова (DeepSeek Chat ~ $0.0003, Sonar Pro ~ $0.005)
+const CHANNELS = [
+  { provider: 'deepseek', strategy: 1, cost: 1 },
+  { provider: 'deepseek', strategy: 2, cost: 1 },
+  { provider: 'sonar', strategy: 1, cost: 15 }
+];
+
+// Временные ошибки (те же статусы, что в sonar_api_calls): канал не считается
+// опробованным, пауза короче
+const TRANSIENT = new Set(['timeout', 'rate_limited', 'server_error', 'error']);
+
+// Априорная вероятность успеха канала и ее вес (псевдо-попытки) до накопления статистики
+const PRIOR_RATE = 0.3;
+const PRIOR_WEIGHT = 10;
+// Каждая предыдущая неудача снижает ожидаемый успех
+const FAILURE_DECAY = 0.6;
+const HISTORY_CHUNK = 200;
+
+/**
+ * RetryScheduler - Журнал попыток и планировщик Stage 2/3 Retry
+ *
+ * Stage2Retry / Stage3Retry выбирали все компании без сайта / email, и каждый
+ * перезапуск (или reset-stage* скрипт) снова тратил вызовы DeepSeek на те же
+ * компании, что не нашлись вчера.
+ *
+ * Журнал company_attempts: одна строка на попытку
+ *   (company_id, stage, provider, strategy, outcome, failure_class, created_at)
+ * strategy 0 - основной проход Stage 2/3 (Sonar), 1/2 - промпты Retry.
+ *
+ * plan() по журналу для каждого кандидата:
+ *   - бюджет: не больше RETRY_ATTEMPT_BUDGET попыток на компанию и этап
+ *   - экспоненциальная пауза после последней неудачной попытки Retry (временные ошибки -
+ *     короче); неудача основного прохода паузу не запускает
+ *   - самый дешевый канал, который еще не пробовали; все опробованы - компания исчерпана
+ *   - ожидаемый успех = доля успехов канала (по журналу) * FAILURE_DECAY^неудач * prior(company),
+ *     порядок - по ожидаемому успеху на единицу цены
+ *
+ * Настройки (env):
+ *   RETRY_ATTEMPT_BUDGET            - попыток на компанию и этап (по умолчанию 4)
+ *   RETRY_BACKOFF_HOURS             - пауза после первой неудачи (по умолчанию 6, дальше x2)
+ *   RETRY_BACKOFF_MAX_HOURS         - максимальная пауза (по умолчанию 168 = неделя)
+ *   RETRY_TRANSIENT_BACKOFF_MINUTES - пауза после временной ошибки (по умолчанию 15, дальше x2)
+ */
+class RetryScheduler {
+  constructor() {
+    this.db = null;
+    this.budget = parseInt(process.env.RETRY_ATTEMPT_BUDGET) || 4;
+    this.backoffMs = (parseFloat(process.env.RETRY_BACKOFF_HOURS) || 6) * 3600 * 1000;
+    this.maxBackoffMs = (parseFloat(process.env.RETRY_BACKOFF_MAX_HOURS) || 168) * 3600 * 1000;
+    this.transientBackoffMs = (parseFloat(process.env.RETRY_TRANSIENT_BACKOFF_MINUTES) || 15) * 60 * 1000;
+    this.channels = CHANNELS;
+    this.stats = { recorded: 0, recordFailures: 0, planned: 0 };
+  }
+
+  init(db) {
+    this.db = db;
+  }
+
+  isEnabled() {
+    return !!(this.db && this.db.supabase);
+  }
+
+  /**
+   * Тип ошибки API в терминах sonar_api_calls.status
+   */
+  classifyError(error) {
+    const httpStatus = error?.response?.status || 0;
+    const message = error?.message || '';
+    if (error?.code === 'ECONNABORTED' || /timeout/i.test(message)) return 'timeout';
+    if (httpStatus === 429 || /\b429\b|rate limit/i.test(message)) return 'rate_limited';
+    if (httpStatus >= 500 || /\b5\d\d\b/.test(message)) return 'server_error';
+    return 'error';
+  }
+
+  /**
+   * Записать попытку в журнал (ошибка записи не прерывает этап)
+   * @param {Object} attempt
+   * @param {string} attempt.companyId
+   * @param {string} attempt.stage - stage2 | stage3
+   * @param {string} attempt.provider - sonar | deepseek
+   * @param {number} attempt.strategy - 0 основной проход, 1/2 - промпты Retry
+   * @param {string} attempt.outcome - found | not_found | error
+   * @param {string|null} attempt.failureClass - no_result | invalid_result | timeout | rate_limited | server_error | error
+   */
+  async record({ companyId, stage, provider, strategy = 0, outcome, failureClass = null }) {
+    if (!this.isEnabled() || !companyId) return;
+
+    try {
+      const { error } = await this.db.supabase
+        .from('company_attempts')
+        .insert({
+          company_id: companyId,
+          stage,
+          provider,
+          strategy,
+          outcome,
+          failure_class: failureClass,
+          created_at: new Date().toISOString()
+        });
+      if (error) throw new Error(error.message);
+      this.stats.recorded++;
+    } catch (error) {
+      this.stats.recordFailures++;
+      log.warn('Failed to record attempt', { companyId, stage, error: error.message });
+    }
+  }
+
+  /**
+   * Спланировать повторные попытки
+   * @param {string} stage - stage2 | stage3
+   * @param {Array<Object>} companies - кандидаты (company_id обязателен)
+   * @param {Object} options
+   * @param {Array<string>} options.providers - доступные провайдеры
+   * @param {Function} options.prior - company => множитель 0..1 (полнота данных компании)
+   * @param {number} options.now
+   * @returns {Promise<{scheduled: Array<{company, channel, expectedSuccess, score}>,
+   *   skipped: {budget: number, backoff: number, exhausted: number}, nextRetryAt: string|null}>}
+   */
+  async plan(stage, companies, { providers = ['deepseek'], prior = () => 1, now = Date.now() } = {}) {
+    const channels = this.channels.filter(channel => providers.includes(channel.provider));
+    const history = await this._loadHistory(stage, companies.map(company => company.company_id));
+    const rates = await this._channelRates(stage, channels);
+
+    const scheduled = [];
+    const skipped = { budget: 0, backoff: 0, exhausted: 0 };
+    let nextRetryAt = null;
+
+    for (const company of companies) {
+      const attempts = history.get(company.company_id) || [];
+
+      if (attempts.length >= this.budget) {
+        skipped.budget++;
+        continue;
+      }
+
+      // Пауза - только после попыток Retry: Stage2Retry/Stage3Retry запускаются
+      // сразу после основного прохода (strategy 0), его неудача идет только в бюджет
+      const retries = attempts.filter(attempt => attempt.strategy > 0);
+      if (retries.length > 0) {
+        const last = retries[retries.length - 1];
+        const readyAt = Date.parse(last.created_at) + this._backoff(retries);
+        if (readyAt > now) {
+          skipped.backoff++;
+          if (!nextRetryAt || readyAt < nextRetryAt) nextRetryAt = readyAt;
+          continue;
+        }
+      }
+
+      // Опробованный канал - попытка без временной ошибки
+      const tried = new Set(attempts
+        .filter(attempt => !TRANSIENT.has(attempt.failure_class))
+        .map(attempt => this._channelKey(attempt)));
+      const channel = channels.find(candidate => !tried.has(this._channelKey(candidate)));
+      if (!channel) {
+        skipped.exhausted++;
+        continue;
+      }
+
+      const failures = attempts.filter(attempt => attempt.outcome !== 'found' && !TRANSIENT.has(attempt.failure_class)).length;
+      const expectedSuccess = rates.get(this._channelKey(channel)) * Math.pow(FAILURE_DECAY, failures) * prior(company);
+      scheduled.push({
+        company,
+        channel,
+        attempts: attempts.length,
+        expectedSuccess: Math.round(expectedSuccess * 1000) / 1000,
+        score: expectedSuccess / channel.cost
+      });
+    }
+
+    scheduled.sort((a, b) => b.score - a.score);
+    this.stats.planned += scheduled.length;
+
+    log.info('Retry plan', {
+      stage,
+      candidates: companies.length,
+      scheduled: scheduled.length,
+      ...skipped
+    });
+
+    return {
+      scheduled,
+      skipped,
+      nextRetryAt: nextRetryAt ? new Date(nextRetryAt).toISOString() : null
+    };
+  }
+
+  getStats() {
+    return {
+      enabled: this.isEnabled(),
+      budget: this.budget,
+      backoffHours: this.backoffMs / 3600000,
+      channels: this.channels.map(channel => `${this._channelKey(channel)} (cost ${channel.cost})`),
+      ...this.stats
+    };
+  }
+
+  /**
+   * Пауза после последней попытки: base * 2^(подряд неудач - 1)
+   */
+  _backoff(attempts) {
+    const last = attempts[attempts.length - 1];
+    const base = TRANSIENT.has(last.failure_class) ? this.transientBackoffMs : this.backoffMs;
+    let streak = 0;
+    for (let i = attempts.length - 1; i >= 0 && attempts[i].outcome !== 'found'; i--) streak++;
+    return Math.min(this.maxBackoffMs, base * Math.pow(2, Math.max(0, streak - 1)));
+  }
+
+  _channelKey({ provider, strategy }) {
+    return `${provider}#${strategy}`;
+  }
+
+  async _loadHistory(stage, companyIds) {
+    const history = new Map();
+    if (!this.isEnabled() || companyIds.length === 0) return history;
+
+    for (let i = 0; i < companyIds.length; i += HISTORY_CHUNK) {
+      const chunk = companyIds.slice(i, i + HISTORY_CHUNK);
+      const { data, error } = await this.db.supabase
+        .from('company_attempts')
+        .select('company_id, provider, strategy, outcome, failure_class, created_at')
+        .eq('stage', stage)
+        .in('company_id', chunk)
+        .order('created_at', { ascending: true });
+
+      if (error) {
+        // Без журнала (нет таблицы) - план как для новых компаний
+        log.warn('Failed to load attempt history', { stage, error: error.message });
+        return history;
+      }
+
+      (data || []).forEach(attempt => {
+        if (!history.has(attempt.company_id)) history.set(attempt.company_id, []);
+        history.get(attempt.company_id).push(attempt);
+      });
+    }
+
+    return history;
+  }
+
+  /**
+   * Доля успехов каждого канала по журналу (сглаженная априорной оценкой)
+   */
+  async _channelRates(stage, channels) {
+    const rates = new Map();
+
+    for (const channel of channels) {
+      const key = this._channelKey(channel);
+      rates.set(key, PRIOR_RATE);
+      if (!this.isEnabled()) continue;
+
+      // Временные ошибки (outcome = error) в долю успеха не входят
+      const count = (outcomes) => this.db.supabase
+        .from('company_attempts')
+        .select('attempt_id', { count: 'exact', head: true })
+        .eq('stage', stage)
+        .eq('provider', channel.provider)
+        .eq('strategy', channel.strategy)
+        .in('outcome', outcomes);
+
+      const [total, found] = await Promise.all([count(['found', 'not_found']), count(['found'])]);
+      if (total.error || found.error) continue;
+
+      rates.set(key, ((found.count || 0) + PRIOR_RATE * PRIOR_WEIGHT) / ((total.count || 0) + PRIOR_WEIGHT));
+    }
+
+    return rates;
+  }
+}
+
+// Экспортируем SINGLETON
+module.exports = new RetryScheduler();
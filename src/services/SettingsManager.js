@@ -1,11 +1,19 @@
+const EventEmitter = require('events');
 const winston = require('winston');
 
 /**
  * SettingsManager - Управление настройками системы
  * Загружает, кеширует и обновляет все 117 параметров конфигурации
+ *
+ * Настройки хранятся в неизменяемом версионированном снимке (snapshot),
+ * который атомарно заменяется при setSetting/importSettings.
+ * Другие процессы (translationWorker) узнают об изменениях через
+ * опрос таблицы settings_version (см. database/add-settings-version.sql)
+ * и событие 'change'.
  */
-class SettingsManager {
+class SettingsManager extends EventEmitter {
   constructor(database, logger = null) {
+    super();
     this.db = database;
     this.logger = logger || winston.createLogger({
       level: 'info',
@@ -15,32 +23,129 @@ class SettingsManager {
     
     this.cachedSettings = null;
     this.lastCacheTime = 0;
-    this.CACHE_DURATION = 5 * 60 * 1000; // 5 минут
+    this.CACHE_DURATION = 5 * 60 * 1000; // 5 минут (fallback если нет settings_version)
+
+    // Версионированный снимок: { version, dbVersion, loadedAt, settings }
+    this.snapshot = null;
+    this.loadingPromise = null;
+
+    // Опрос версии настроек для межпроцессных уведомлений
+    this.pollIntervalMs = parseInt(process.env.SETTINGS_POLL_INTERVAL_MS) || 1000;
+    this.pollTimer = null;
+    this.isPolling = false;
+    this.versionTracking = false; // true если таблица settings_version доступна
+    this.lastVersionCheck = 0;
   }
 
   /**
-   * Получить все настройки (с кешем)
+   * Загрузить снимок и запустить отслеживание изменений
+   * Вызывается один раз при старте процесса
+   */
+  async startWatching() {
+    await this.reload();
+
+    if (this.pollTimer) return;
+
+    this.pollTimer = setInterval(() => this._pollVersion(), this.pollIntervalMs);
+    // Не держать процесс живым только ради опроса
+    if (this.pollTimer.unref) this.pollTimer.unref();
+
+    this.logger.info('Settings watcher started', {
+      pollIntervalMs: this.pollIntervalMs,
+      versionTracking: this.versionTracking
+    });
+  }
+
+  /**
+   * Остановить отслеживание изменений
+   */
+  stopWatching() {
+    if (this.pollTimer) {
+      clearInterval(this.pollTimer);
+      this.pollTimer = null;
+    }
+  }
+
+  /**
+   * Получить все настройки (из снимка)
    */
   async getAllSettings() {
-    const now = Date.now();
-    
-    // Проверить кеш
-    if (this.cachedSettings && (now - this.lastCacheTime) < this.CACHE_DURATION) {
-      this.logger.debug('Settings loaded from cache');
-      return this.cachedSettings;
+    if (this.snapshot && !this._isSnapshotStale()) {
+      return this.snapshot.settings;
     }
 
-    this.logger.debug('Loading settings from database');
-    
-    const result = await this.db.query(
-      'SELECT category, key, value FROM system_settings ORDER BY category, key'
-    );
+    const snapshot = await this.reload();
+    return snapshot.settings;
+  }
 
-    this.cachedSettings = this._parseSettings(result.rows);
-    this.lastCacheTime = now;
-    
-    this.logger.info(`Loaded ${result.rows.length} settings from database`);
-    return this.cachedSettings;
+  /**
+   * Текущий снимок (без обращения к БД)
+   */
+  getSnapshot() {
+    return this.snapshot;
+  }
+
+  /**
+   * Перечитать настройки из БД и атомарно заменить снимок
+   * Параллельные вызовы используют один и тот же запрос
+   */
+  async reload() {
+    if (this.loadingPromise) {
+      return this.loadingPromise;
+    }
+
+    this.loadingPromise = (async () => {
+      this.logger.debug('Loading settings from database');
+
+      const dbVersion = await this._fetchVersion();
+      const result = await this.db.query(
+        'SELECT category, key, value FROM system_settings ORDER BY category, key'
+      );
+
+      const snapshot = this._swapSnapshot(this._parseSettings(result.rows), dbVersion);
+      this.logger.info(`Loaded ${result.rows.length} settings from database`, {
+        version: snapshot.version,
+        dbVersion
+      });
+      return snapshot;
+    })();
+
+    try {
+      return await this.loadingPromise;
+    } finally {
+      this.loadingPromise = null;
+    }
+  }
+
+  /**
+   * Типизированные accessors - O(1), только из снимка, без обращения к БД
+   * Если значения нет - берется дефолт из кода, затем fallback
+   */
+  getString(category, settingKey, fallback = '') {
+    const value = this._rawValue(category, settingKey);
+    return value === undefined || value === null ? fallback : String(value);
+  }
+
+  getInt(category, settingKey, fallback = 0) {
+    const value = parseInt(this._rawValue(category, settingKey));
+    return Number.isNaN(value) ? fallback : value;
+  }
+
+  getNumber(category, settingKey, fallback = 0) {
+    const value = parseFloat(this._rawValue(category, settingKey));
+    return Number.isNaN(value) ? fallback : value;
+  }
+
+  getBool(category, settingKey, fallback = false) {
+    const value = this._rawValue(category, settingKey);
+    if (value === undefined || value === null || value === '') return fallback;
+    return value === true || value === 'true' || value === '1';
+  }
+
+  _rawValue(category, settingKey) {
+    const value = this.snapshot?.settings[category]?.[settingKey];
+    if (value !== undefined) return value;
+    return this._getDefaultSettings(category)[settingKey];
   }
 
   /**
@@ -90,6 +195,10 @@ class SettingsManager {
       processing_stages: {
         stage1_max_companies: 12,
         stage1_min_companies: 8,
+        stage1_adaptive_queries: true,
+        stage1_target_companies: 0,
+        stage1_min_marginal_yield: 1,
+        stage1_yield_window: 5,
         stage2_timeout: 30000,
         stage3_max_emails: 5,
         stage4_max_services: 10,
@@ -159,8 +268,8 @@ class SettingsManager {
       this.logger.warn('Failed to save settings history (table may not exist)', { error: historyError.message });
     }
 
-    // Очистить кеш
-    this.cachedSettings = null;
+    // Атомарно заменить снимок новой версией
+    await this._applyLocalChange(category, settingKey, String(newValue));
 
     this.logger.info(`Setting changed: ${category}.${settingKey}`, {
       oldValue,
@@ -268,6 +377,11 @@ class SettingsManager {
       }
     }
 
+    // Один полный reload после импорта, чтобы снимок совпал с БД
+    if (results.some(r => r.success)) {
+      await this.reload();
+    }
+
     return results;
   }
 
@@ -364,10 +478,115 @@ class SettingsManager {
     return value;
   }
 
+  /**
+   * Создать новый неизменяемый снимок и уведомить подписчиков
+   */
+  _swapSnapshot(settings, dbVersion = null) {
+    Object.values(settings).forEach(categorySettings => Object.freeze(categorySettings));
+
+    const previous = this.snapshot;
+    const snapshot = Object.freeze({
+      version: (previous?.version || 0) + 1,
+      dbVersion: dbVersion ?? previous?.dbVersion ?? null,
+      loadedAt: Date.now(),
+      settings: Object.freeze(settings)
+    });
+
+    this.snapshot = snapshot;
+    // Совместимость со старым кодом, который читал cachedSettings напрямую
+    this.cachedSettings = snapshot.settings;
+    this.lastCacheTime = snapshot.loadedAt;
+
+    if (previous) {
+      this.emit('change', snapshot, previous);
+    }
+
+    return snapshot;
+  }
+
+  /**
+   * Применить изменение одного параметра к снимку (copy-on-write)
+   */
+  async _applyLocalChange(category, settingKey, value) {
+    if (!this.snapshot) {
+      await this.reload();
+      return;
+    }
+
+    const settings = { ...this.snapshot.settings };
+    settings[category] = { ...(settings[category] || {}), [settingKey]: value };
+
+    // Версия в БД увеличивается триггером - перечитать её,
+    // чтобы собственный опрос не вызвал лишний reload.
+    // Если версия выросла больше чем на 1 - параллельно менял другой процесс
+    const previousDbVersion = this.snapshot.dbVersion;
+    const dbVersion = await this._fetchVersion();
+    if (dbVersion !== null && previousDbVersion !== null && dbVersion - previousDbVersion > 1) {
+      await this.reload();
+      return;
+    }
+    this._swapSnapshot(settings, dbVersion);
+  }
+
+  /**
+   * Прочитать текущую версию настроек из settings_version
+   * Возвращает null если таблица не создана
+   */
+  async _fetchVersion() {
+    this.lastVersionCheck = Date.now();
+    try {
+      const result = await this.db.query('SELECT version FROM settings_version');
+      const row = result.rows[0];
+      if (!row || row.version === undefined || row.version === null) {
+        this.versionTracking = false;
+        return null;
+      }
+      this.versionTracking = true;
+      return Number(row.version);
+    } catch (error) {
+      this.versionTracking = false;
+      return null;
+    }
+  }
+
+  /**
+   * Проверить версию в БД и перечитать снимок если она изменилась
+   */
+  async _pollVersion() {
+    if (this.isPolling || this.loadingPromise) return;
+    // Без таблицы settings_version не опрашивать БД каждую секунду
+    if (!this.versionTracking && (Date.now() - this.lastVersionCheck) < this.CACHE_DURATION) return;
+    this.isPolling = true;
+
+    try {
+      const dbVersion = await this._fetchVersion();
+      if (dbVersion !== null && dbVersion !== this.snapshot?.dbVersion) {
+        this.logger.info('Settings version changed, reloading', {
+          from: this.snapshot?.dbVersion,
+          to: dbVersion
+        });
+        await this.reload();
+      }
+    } catch (error) {
+      this.logger.warn('Settings version poll failed', { error: error.message });
+    } finally {
+      this.isPolling = false;
+    }
+  }
+
+  /**
+   * Без settings_version снимок считается устаревшим по TTL (старое поведение)
+   */
+  _isSnapshotStale() {
+    if (this.pollTimer && this.versionTracking) return false;
+    return (Date.now() - this.snapshot.loadedAt) >= this.CACHE_DURATION;
+  }
+
   /**
    * Очистить кеш (принудительно)
    */
   clearCache() {
+    this.snapshot = null;
     this.cachedSettings = null;
     this.lastCacheTime = 0;
     this.logger.debug('Settings cache cleared');
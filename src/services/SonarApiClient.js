@@ -1,6 +1,26 @@
 const axios = require('axios');
 const crypto = require('crypto');
 const globalQueue = require('./GlobalApiQueue');
+const httpAgentPool = require('./HttpAgentPool');
+const apiCassette = require('./ApiCassette');
+const clusterStore = require('./ClusterStore');
+const metrics = require('./Metrics');
+const log = require('./Logger').child('sonar');
+
+const apiRequestSeconds = metrics.histogram(
+  'ai_api_request_duration_seconds', 'AI API HTTP attempt latency', ['provider', 'stage', 'model', 'status']
+);
+const apiRetriesTotal = metrics.counter(
+  'ai_api_retries_total', 'AI API retry attempts', ['provider', 'stage', 'model']
+);
+const apiCacheTotal = metrics.counter(
+  'ai_api_cache_requests_total', 'AI API response cache lookups', ['provider', 'result']
+);
+
+// Нет колонки: PostgREST (supabase-js) / PostgreSQL
+const MISSING_COLUMN_CODES = ['PGRST204', '42703'];
+// Нарушение CHECK (status вне допустимых значений)
+const CHECK_VIOLATION_CODE = '23514';
 
 /**
  * SonarApiClient - Клиент для Perplexity Sonar API
@@ -19,6 +39,10 @@ class SonarApiClient {
     this.requestQueue = [];
     this.activeRequests = 0;
     this.lastRequestTime = 0;
+    // false - в sonar_api_calls нет колонок таймингов, пишем без них
+    this.timingColumns = null;
+    // false - CHECK на sonar_api_calls.status не пускает 'replayed'
+    this.replayRows = null;
     this.requestInProgress = false; // Глобальная блокировка для последовательных запросов
     this.requestPromise = null; // Promise текущего запроса
     this.queueLength = 0; // Счетчик очереди для мониторинга
@@ -83,7 +107,8 @@ class SonarApiClient {
     const apiSettings = await this.settingsManager.getCategory('api');
     
     this.apiKey = apiSettings.api_key;
-    this.baseUrl = apiSettings.api_base_url || 'https://api.perplexity.ai';
+    // SONAR_BASE_URL - для локальной заглушки (scripts/stub-ai-server.js)
+    this.baseUrl = process.env.SONAR_BASE_URL || apiSettings.api_base_url || 'https://api.perplexity.ai';
     // Использовать указанную модель или из настроек
     this.model = this.modelType || apiSettings.model_name;
     this.temperature = parseFloat(apiSettings.temperature) || 0.3;
@@ -94,6 +119,11 @@ class SonarApiClient {
     this.rateLimit = parseInt(apiSettings.rate_limit_requests_per_min) || 20;
     this.retryDelay = (parseInt(apiSettings.retry_delay_seconds) || 10) * 1000;
     
+    // Общий keep-alive пул для всех Sonar клиентов (basic + pro)
+    this.httpAgents = httpAgentPool.getAxiosAgents('sonar', {
+      maxSockets: parseInt(apiSettings.http_max_sockets) || undefined
+    });
+    
     this.logger.info('SonarApiClient initialized', {
       modelType: this.modelType,
       model: this.model,
@@ -120,12 +150,13 @@ class SonarApiClient {
       maxTokens = this.maxTokens
     } = options;
 
-    console.log(`\n🔵 SonarApiClient.query() START`);
-    console.log(`   Stage: ${stage}`);
-    console.log(`   Model: ${this.model}`);
-    console.log(`   API Key exists: ${!!this.apiKey} (length: ${this.apiKey?.length || 0})`);
-    console.log(`   Use cache: ${useCache}`);
-    console.log(`   Prompt length: ${prompt?.length || 0} chars`);
+    log.debug('query() start', {
+      stage,
+      model: this.model,
+      hasApiKey: !!this.apiKey,
+      useCache,
+      promptLength: prompt?.length || 0
+    });
 
     // Обернуть запрос для глобальной очереди
     const requestFn = async () => {
@@ -164,80 +195,87 @@ class SonarApiClient {
     // Проверить кеш
     if (useCache) {
       const cached = await this._checkCache(prompt, stage);
+      apiCacheTotal.inc({ provider: 'sonar', result: cached ? 'hit' : 'miss' });
       if (cached) {
         this.logger.debug(`Cache HIT for stage: ${stage}`);
-        console.log(`   💾 Using cached response`);
         await this._logApiCall(sessionId, stage, 'success', 0, Date.now() - startTime, 0, true);
         
         return cached;
       } else {
-        console.log(`   ⚠️  Cache MISS`);
+        log.debug('Cache MISS', { stage });
       }
     }
 
     // Ожидать rate limit
-    console.log(`   ⏳ Checking rate limit...`);
     await this._enforceRateLimit();
-    console.log(`   ✓ Rate limit OK, starting attempts...`);
-    console.log(`   📊 maxRetries = ${this.maxRetries}`);
 
     let attempt = 0;
     let lastError = null;
+    let requestStartedAt = Date.now();
 
     while (attempt < this.maxRetries) {
       attempt++;
       
-      console.log(`   🔄 Attempt ${attempt}/${this.maxRetries}`);
+      log.debug('Attempt', { stage, attempt, maxRetries: this.maxRetries });
+      if (attempt > 1) {
+        apiRetriesTotal.inc({ provider: 'sonar', stage, model: this.model });
+      }
       
       try {
         this.logger.debug(`Sonar API request (attempt ${attempt}/${this.maxRetries})`, { stage });
         
-        console.log(`   📤 Sending POST to ${this.baseUrl}/chat/completions`);
-        
-        const response = await axios.post(
-          `${this.baseUrl}/chat/completions`,
-          {
-            model: this.model,
-            messages: [
-              {
-                role: 'system',
-                content: 'You are a helpful assistant that ALWAYS returns valid JSON. Never include explanatory text outside the JSON structure.'
-              },
-              {
-                role: 'user',
-                content: prompt
-              }
-            ],
-            temperature,
-            top_p: this.topP,
-            max_tokens: maxTokens,
-            stream: false
-            // Note: Perplexity does not support response_format parameter
-          },
-          {
-            headers: {
-              'Authorization': `Bearer ${this.apiKey}`,
-              'Content-Type': 'application/json'
+        requestStartedAt = Date.now();
+        const requestBody = {
+          model: this.model,
+          messages: [
+            {
+              role: 'system',
+              content: 'You are a helpful assistant that ALWAYS returns valid JSON. Never include explanatory text outside the JSON structure.'
             },
-            timeout: this.timeout
-          }
+            {
+              role: 'user',
+              content: prompt
+            }
+          ],
+          temperature,
+          top_p: this.topP,
+          max_tokens: maxTokens,
+          stream: false
+          // Note: Perplexity does not support response_format parameter
+        };
+        const response = await this._post(requestBody);
+
+        apiRequestSeconds.observe(
+          { provider: 'sonar', stage, model: this.model, status: 'success' },
+          (Date.now() - requestStartedAt) / 1000
         );
+        const timings = this._collectTimings(response.request, requestStartedAt);
+        const parseStart = process.hrtime.bigint();
+        const data = typeof response.data === 'string' ? JSON.parse(response.data) : response.data;
+        timings.parse = Number(process.hrtime.bigint() - parseStart) / 1e6;
 
-        const result = response.data.choices[0].message.content;
-        const tokensUsed = response.data.usage?.total_tokens || 0;
+        if (!response.cassette) {
+          apiCassette.record('sonar', requestBody, data, {
+            stage,
+            status: response.status,
+            latencyMs: Date.now() - requestStartedAt
+          });
+        }
+
+        const result = data.choices[0].message.content;
+        const tokensUsed = data.usage?.total_tokens || 0;
         const responseTime = Date.now() - startTime;
         
-        console.log(`   ✅ SUCCESS! Got response (${result?.length || 0} chars, ${tokensUsed} tokens)`);
-        
         // Логировать полный ответ для отладки (первые 500 символов)
         this.logger.debug('Sonar API full response preview', {
           content_preview: result.substring(0, 500),
-          has_citations: !!response.data.citations,
-          has_usage: !!response.data.usage,
+          has_citations: !!data.citations,
+          has_usage: !!data.usage,
           metadata: {
-            model: response.data.model,
+            model: data.model,
             tokensUsed,
-            responseTime
+            responseTime,
+            timings
           }
         });
 
@@ -246,24 +284,33 @@ class SonarApiClient {
           await this._saveToCache(prompt, stage, result, tokensUsed);
         }
 
-        // Логировать вызов
-        await this._logApiCall(sessionId, stage, 'success', tokensUsed, responseTime, attempt - 1, false, response.status);
+        // Логировать вызов: ответ из кассеты - не реальный вызов API (status replayed, без расходов)
+        await this._logApiCall(sessionId, stage, response.cassette ? 'replayed' : 'success', tokensUsed, responseTime, attempt - 1, false, response.status, null, timings);
 
-        this.logger.info(`Sonar API success`, {
+        log.info('Sonar API success', {
           stage,
           tokensUsed,
           responseTime,
-          attempts: attempt
+          attempts: attempt,
+          connectionReused: timings.reused,
+          ttfb: timings.ttfb
         });
 
         return result;
 
       } catch (error) {
+        // Промах кассеты в replay режиме - повторять бессмысленно
+        if (error.code === 'ECASSETTEMISS') throw error;
+
         lastError = error;
         const responseTime = Date.now() - startTime;
         
-        console.log(`   ❌ ERROR: ${error.message}`);
-        console.log(`   HTTP Status: ${error.response?.status || 'N/A'}`);
+        log.debug('Attempt failed', {
+          stage,
+          attempt,
+          error: error.message,
+          httpStatus: error.response?.status || null
+        });
 
         // Определить тип ошибки
         let status = 'error';
@@ -287,6 +334,11 @@ class SonarApiClient {
           });
         }
 
+        apiRequestSeconds.observe(
+          { provider: 'sonar', stage, model: this.model, status },
+          (Date.now() - requestStartedAt) / 1000
+        );
+
         // Логировать неудачную попытку
         await this._logApiCall(
           sessionId,
@@ -297,7 +349,8 @@ class SonarApiClient {
           attempt - 1,
           false,
           httpStatus,
-          error.message
+          error.message,
+          this._collectTimings(error.request, requestStartedAt)
         );
 
         // Если это последняя попытка, бросить ошибку
@@ -369,15 +422,15 @@ class SonarApiClient {
   async _saveToCache(prompt, stage, response, tokensUsed) {
     const promptHash = this._hashPrompt(prompt);
     
-    // Получить TTL для этапа
-    const settings = await this.settingsManager.getCategory('processing_stages');
+    // Получить TTL для этапа (из снимка настроек, без обращения к БД)
+    const settings = this.settingsManager;
     let ttlHours = 24;
     
-    if (stage.startsWith('stage1')) ttlHours = settings.stage1_cache_ttl_hours;
-    if (stage.startsWith('stage2')) ttlHours = settings.stage2_cache_ttl_days * 24;
-    if (stage.startsWith('stage3')) ttlHours = settings.stage3_cache_ttl_days * 24;
-    if (stage.startsWith('stage4')) ttlHours = settings.stage4_cache_ttl_days * 24;
-    if (stage.startsWith('stage5')) ttlHours = settings.stage5_cache_ttl_days * 24;
+    if (stage.startsWith('stage1')) ttlHours = settings.getInt('processing_stages', 'stage1_cache_ttl_hours', 24);
+    if (stage.startsWith('stage2')) ttlHours = settings.getInt('processing_stages', 'stage2_cache_ttl_days', 1) * 24;
+    if (stage.startsWith('stage3')) ttlHours = settings.getInt('processing_stages', 'stage3_cache_ttl_days', 1) * 24;
+    if (stage.startsWith('stage4')) ttlHours = settings.getInt('processing_stages', 'stage4_cache_ttl_days', 1) * 24;
+    if (stage.startsWith('stage5')) ttlHours = settings.getInt('processing_stages', 'stage5_cache_ttl_days', 1) * 24;
 
     try {
       await this.db.query(
@@ -397,20 +450,89 @@ class SonarApiClient {
     }
   }
 
+  /**
+   * POST /chat/completions - из кассеты (replay/hybrid) или по сети
+   */
+  async _post(requestBody) {
+    if (apiCassette.isReplaying()) {
+      const replayed = await apiCassette.replay('sonar', requestBody);
+      if (replayed) return replayed;
+    }
+
+    return axios.post(`${this.baseUrl}/chat/completions`, requestBody, {
+      headers: {
+        'Authorization': `Bearer ${this.apiKey}`,
+        'Content-Type': 'application/json'
+      },
+      timeout: this.timeout,
+      ...this.httpAgents,
+      // JSON парсим сами, чтобы измерить время парсинга отдельно от сети
+      transformResponse: [data => data]
+    });
+  }
+
+  /**
+   * Поэтапные тайминги попытки (DNS, connect, TLS, TTFB, download)
+   * Если запрос не дошел до агента - только общее время
+   */
+  _collectTimings(request, requestStartedAt) {
+    return httpAgentPool.getTimings(request) || {
+      reused: false,
+      total: Date.now() - requestStartedAt
+    };
+  }
+
   /**
    * Логировать вызов API
    */
-  async _logApiCall(sessionId, stage, status, tokensUsed, responseTime, retryCount, fromCache, httpStatus = null, errorMessage = null) {
+  async _logApiCall(sessionId, stage, status, tokensUsed, responseTime, retryCount, fromCache, httpStatus = null, errorMessage = null, timings = null) {
+    const row = {
+      session_id: sessionId,
+      stage,
+      status,
+      tokens_used: tokensUsed,
+      response_time_ms: responseTime,
+      retry_count: retryCount,
+      from_cache: fromCache,
+      http_status: httpStatus,
+      error_message: errorMessage
+    };
+
     try {
-      await this.db.query(
-        `INSERT INTO sonar_api_calls 
-         (session_id, stage, status, tokens_used, response_time_ms, retry_count, from_cache, http_status, error_message)
-         VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)`,
-        [sessionId, stage, status, tokensUsed, responseTime, retryCount, fromCache, httpStatus, errorMessage]
-      );
+      if (status === 'replayed' && this.replayRows === false) {
+        // CHECK на status без 'replayed' - строку кассеты не записать
+      } else if (this.timingColumns === false) {
+        await this._insertApiCall(row);
+      } else {
+        try {
+          await this._insertApiCall({
+            ...row,
+            phase_timings: timings,
+            connection_reused: timings ? timings.reused : null
+          });
+        } catch (error) {
+          // Нет колонок phase_timings / connection_reused (database/add-api-call-timings.sql
+          // не применен): PostgREST - PGRST204, PostgreSQL - 42703. Пишем без таймингов
+          if (!MISSING_COLUMN_CODES.includes(error.code)) throw error;
+          this.timingColumns = false;
+          this.logger.warn('sonar_api_calls has no timing columns, logging without timings', { error: error.message });
+          await this._insertApiCall(row);
+        }
+      }
+    } catch (error) {
+      if (status === 'replayed' && error.code === CHECK_VIOLATION_CODE) {
+        // database/add-api-call-status-values.sql не применен
+        this.replayRows = false;
+        this.logger.warn('sonar_api_calls.status does not allow replayed, replays are not logged', { error: error.message });
+      } else {
+        this.logger.error('Failed to log API call', { error: error.message, code: error.code });
+      }
+    }
 
-      // Если есть creditsTracker и запрос успешный (не из кеша), логировать расходы
-      if (this.creditsTracker && sessionId && !fromCache && tokensUsed > 0) {
+    // Расходы - отдельно от журнала: ошибка записи в sonar_api_calls их не теряет.
+    // Если есть creditsTracker и запрос успешный (не из кеша и не из кассеты), логировать расходы
+    if (this.creditsTracker && sessionId && status === 'success' && !fromCache && tokensUsed > 0) {
+      try {
         // Предполагаем 50/50 распределение request/response токенов
         const requestTokens = Math.floor(tokensUsed / 2);
         const responseTokens = tokensUsed - requestTokens;
@@ -422,16 +544,51 @@ class SonarApiClient {
           responseTokens,
           this.model
         );
+      } catch (error) {
+        this.logger.error('Failed to log API credits', { error: error.message });
       }
-    } catch (error) {
-      this.logger.error('Failed to log API call', { error: error.message });
     }
   }
 
+  /**
+   * Записать строку sonar_api_calls. Через supabase-js напрямую, а не db.query:
+   * SupabaseClient.query глотает ошибки INSERT, и по коду ошибки нельзя понять,
+   * что не хватает колонок
+   */
+  async _insertApiCall(row) {
+    if (this.db.supabase?.from) {
+      const { error } = await this.db.supabase.from('sonar_api_calls').insert(row);
+      if (error) {
+        throw Object.assign(new Error(error.message), { code: error.code });
+      }
+      return;
+    }
+
+    // MockDatabase / HybridDatabase - SQL через db.query
+    const columns = Object.keys(row);
+    await this.db.query(
+      `INSERT INTO sonar_api_calls 
+       (${columns.join(', ')})
+       VALUES (${columns.map((column, index) => `$${index + 1}`).join(', ')})`,
+      columns.map(column => row[column])
+    );
+  }
+
   /**
    * Соблюдать rate limit
+   * В распределенном режиме - общий token bucket на API ключ для всех процессов
+   * (basic и pro клиенты с одним ключом делят один лимит)
    */
   async _enforceRateLimit() {
+    if (!apiCassette.shouldThrottle()) return;
+
+    if (clusterStore.isDistributed()) {
+      const keyId = crypto.createHash('sha1').update(this.apiKey || '').digest('hex').substring(0, 12);
+      await clusterStore.waitForToken(`sonar:${keyId}`, this.rateLimit);
+      this.lastRequestTime = Date.now();
+      return;
+    }
+
     const minInterval = (60 * 1000) / this.rateLimit; // миллисекунды между запросами
     const timeSinceLastRequest = Date.now() - this.lastRequestTime;
     
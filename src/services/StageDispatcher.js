@@ -0,0 +1,101 @@
+const clusterStore = require('./ClusterStore');
+const log = require('./Logger').child('dispatcher');
+
+/**
+ * StageDispatcher - Координатор распределенного режима (CLUSTER_BACKEND=file|redis)
+ *
+ * Stage в web процессе отбирает работу как обычно (компании / запросы),
+ * но вместо своего цикла батчей кладет задачи в общую очередь и ждет,
+ * пока stage worker'ы (src/workers/stageWorker.js) вернут результаты.
+ * Результаты приходят в том же формате, что и у локального цикла,
+ * поэтому подсчет, отчеты и Retry после dispatch() работают без изменений.
+ *
+ * Очереди: stage1 (запросы), stage2 / stage3 / stage4 (компании), translation.
+ */
+
+const POLL_INTERVAL_MS = 2000;
+// Сколько ждать без единого результата, прежде чем предупредить, что worker'ов нет
+const STALL_WARN_MS = 60000;
+
+class StageDispatcher {
+  /**
+   * Отправить задачи worker'ам и дождаться всех результатов
+   * @param {string} queue - stage1 | stage2 | stage3 | stage4
+   * @param {string} groupKey - ключ группы (job_id или stage1:<sessionId>)
+   * @param {Array<{id: string, payload: Object}>} items
+   * @param {Function|null} onProgress - (done, current) => void
+   * @returns {Promise<Array>} результаты в порядке items
+   */
+  async dispatch(queue, groupKey, items, onProgress = null) {
+    if (items.length === 0) return [];
+
+    const added = await clusterStore.push(queue, items.map(item => ({
+      id: `${groupKey}:${item.id}`,
+      payload: { ...item.payload, groupKey, itemId: item.id }
+    })));
+
+    log.info('Dispatched to stage workers', { queue, groupKey, items: items.length, added });
+
+    let lastDone = -1;
+    let lastChange = Date.now();
+    let results = {};
+
+    for (;;) {
+      results = await clusterStore.getResults(groupKey);
+      const done = items.filter(item => item.id in results).length;
+
+      if (done !== lastDone) {
+        lastDone = done;
+        lastChange = Date.now();
+        if (onProgress) {
+          const progress = await clusterStore.getProgress(groupKey);
+          onProgress(done, progress.current);
+        }
+      }
+
+      if (done >= items.length) break;
+
+      if (Date.now() - lastChange > STALL_WARN_MS) {
+        const stats = await clusterStore.queueStats(queue);
+        log.warn('No progress from stage workers', { queue, groupKey, done, total: items.length, ...stats });
+        lastChange = Date.now();
+      }
+
+      await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+    }
+
+    const progress = await clusterStore.getProgress(groupKey);
+    log.info('Stage workers finished', { queue, groupKey, items: items.length, workers: progress.workers });
+
+    await clusterStore.clearResults(groupKey);
+    await clusterStore.resetProgress(groupKey);
+    return items.map(item => results[item.id]);
+  }
+
+  /**
+   * Компании global задания (GlobalJobManager) -> очередь stage worker'ов
+   * Worker'ы сами отмечают компании в журнале задания; после возврата
+   * отметки и счетчики задания обновляются еще раз (upsert идемпотентен)
+   * @param {GlobalJob} job
+   * @param {Array} companies
+   * @param {Function|null} onProgress
+   * @param {Function} isSuccess - результат -> completed (true) / failed (false)
+   */
+  async dispatchCompanies(job, companies, onProgress, isSuccess) {
+    const results = await this.dispatch(
+      job.stage,
+      job.jobId,
+      companies.map(company => ({
+        id: company.company_id,
+        payload: { jobId: job.jobId, companyId: company.company_id }
+      })),
+      onProgress
+    );
+
+    await job.complete(companies, results.map(isSuccess));
+    return results;
+  }
+}
+
+// Экспортируем SINGLETON
+module.exports = new StageDispatcher();
@@ -4,6 +4,18 @@
  */
 const TagExtractor = require('../utils/TagExtractor');
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const clusterStore = require('../services/ClusterStore');
+const stageDispatcher = require('../services/StageDispatcher');
+const parsePool = require('../services/ParsePool');
+const rawPayloadStore = require('../services/RawPayloadStore');
+const querySimilarityIndex = require('../services/QuerySimilarityIndex');
+const QueryYieldScheduler = require('../utils/QueryYieldScheduler');
+const log = require('../services/Logger').child('stage1');
+
+// Страница чтения компаний из БД (не больше max-rows PostgREST)
+const EXISTING_PAGE_SIZE = 1000;
+// Запас при дочитывании измененных компаний (расхождение часов)
+const EXISTING_REFRESH_OVERLAP_MS = 60 * 1000;
 
 class Stage1FindCompanies {
   constructor(sonarClient, settingsManager, database, logger) {
@@ -24,13 +36,13 @@ class Stage1FindCompanies {
   }
 
   async execute(sessionId) {
-    this.logger.info('Stage 1: Starting company search', { sessionId });
+    log.info('Stage 1: Starting company search', { sessionId });
 
     try {
       // Получить topic_description и запросы из сессии
       const { data: sessionData } = await this.db.supabase
         .from('search_sessions')
-        .select('topic_description, search_query')
+        .select('topic_description, search_query, target_count')
         .eq('session_id', sessionId)
         .single();
       
@@ -48,7 +60,7 @@ class Stage1FindCompanies {
           ? `Ошибка при загрузке запросов: ${queriesError.message}`
           : 'Для этой темы не найдено ни одного подзапроса. Пожалуйста, сгенерируйте и сохраните подзапросы в шаге 0.';
         
-        this.logger.error('Stage 1: No queries found for session', { 
+        log.error('Stage 1: No queries found for session', { 
           sessionId, 
           error: queriesError?.message,
           queriesCount: queries?.length || 0
@@ -58,7 +70,7 @@ class Stage1FindCompanies {
         throw new Error(errorMsg);
       }
       
-      this.logger.info('Stage 1: Processing queries', { 
+      log.info('Stage 1: Processing queries', { 
         sessionId, 
         queriesCount: queries.length 
       });
@@ -68,78 +80,126 @@ class Stage1FindCompanies {
       const concurrentRequests = 5; // Обрабатывать по 5 запросов параллельно
       let processedCount = 0;
       const totalQueries = queries.length;
+      let executedQueries = queries;
+      let scheduling = null;
+      let existingDomains = null;
+      let existingDomainsLoadedAt = null;
       
-      for (let i = 0; i < queries.length; i += concurrentRequests) {
-        const batch = queries.slice(i, i + concurrentRequests);
-        
-        // Обновить прогресс перед обработкой батча
-        if (this.progressCallback) {
-          await this.progressCallback({
-            processed: processedCount,
-            total: totalQueries,
-            currentQuery: batch[0]?.query_cn || batch[0]?.query_ru
-          });
-        }
-        
-        this.logger.info('Stage 1: Processing batch', { 
-          batchSize: batch.length,
-          progress: `${processedCount}/${totalQueries}`,
-          batchNumber: Math.floor(i / concurrentRequests) + 1
-        });
-        
-        // Обработать батч параллельно
-        const batchResults = await Promise.all(
-          batch.map(async (query) => {
-            const searchQuery = query.query_cn || query.query_ru;
-            this.logger.info('Stage 1: Processing query', { 
-              query: searchQuery,
-              queryId: query.query_id,
-              progress: `${processedCount + 1}/${totalQueries}`
+      // Распределенный режим: запросы обрабатывают stage worker'ы, локальный цикл пропускается
+      if (clusterStore.isDistributed()) {
+        allCompanies = await this._dispatchQueries(queries, sessionId, topicDescription);
+        processedCount = queries.length;
+      } else {
+        const scheduler = await this._createYieldScheduler(queries, sessionData);
+        // Домены компаний из БД - для подсчета новых компаний по ходу запуска
+        // (та же карта потом дочитывается в _checkExistingCompanies)
+        existingDomainsLoadedAt = new Date(Date.now() - EXISTING_REFRESH_OVERLAP_MS).toISOString();
+        existingDomains = await this._loadExistingDomains();
+        const seen = { names: new Set(), domains: new Set() };
+        executedQueries = [];
+        let batchNumber = 0;
+        let batch;
+
+        // Порядок и остановка - по выходу новых компаний (QueryYieldScheduler)
+        while ((batch = scheduler.nextBatch(concurrentRequests))) {
+          batchNumber++;
+
+          // Обновить прогресс перед обработкой батча
+          if (this.progressCallback) {
+            await this.progressCallback({
+              processed: processedCount,
+              total: totalQueries,
+              currentQuery: batch[0]?.text
             });
-            
-            try {
-              const companies = await this._processQuery(searchQuery, sessionId, topicDescription);
-              return companies;
-            } catch (error) {
-              this.logger.error('Stage 1: Query failed', { 
+          }
+          
+          log.info('Stage 1: Processing batch', { 
+            batchSize: batch.length,
+            progress: `${processedCount}/${totalQueries}`,
+            batchNumber
+          });
+          
+          // Обработать батч параллельно
+          const batchResults = await Promise.all(
+            batch.map(async (item) => {
+              const searchQuery = item.text;
+              log.info('Stage 1: Processing query', { 
                 query: searchQuery,
-                error: error.message
+                queryId: item.query.query_id,
+                predictedYield: item.predicted,
+                progress: `${processedCount + 1}/${totalQueries}`
               });
-              return []; // Вернуть пустой массив при ошибке
+              
+              try {
+                const companies = await this._processQuery(searchQuery, sessionId, topicDescription);
+                return companies;
+              } catch (error) {
+                log.error('Stage 1: Query failed', { 
+                  query: searchQuery,
+                  error: error.message
+                });
+                return null; // Ошибка - не нулевой выход для планировщика
+              }
+            })
+          );
+          
+          // Собрать результаты батча и выход каждого запроса
+          batchResults.forEach((companies, index) => {
+            executedQueries.push(batch[index].query);
+            if (!companies) {
+              scheduler.record(batch[index], { found: 0, newUnique: 0, calls: 1, error: true });
+              return;
             }
-          })
-        );
-        
-        // Собрать результаты батча
-        batchResults.forEach(companies => {
-          allCompanies.push(...companies);
-        });
-        
-        processedCount += batch.length;
-        
-        // Обновить прогресс после обработки батча
-        if (this.progressCallback) {
-          await this.progressCallback({
-            processed: processedCount,
-            total: totalQueries,
-            currentQuery: null
+            allCompanies.push(...companies);
+            scheduler.record(batch[index], {
+              found: companies.length,
+              newUnique: this._countNewUnique(companies, seen, existingDomains),
+              calls: Math.max(1, new Set(companies.map(company => company.rawResponse)).size)
+            });
           });
+          
+          processedCount += batch.length;
+          
+          // Обновить прогресс после обработки батча
+          if (this.progressCallback) {
+            await this.progressCallback({
+              processed: processedCount,
+              total: totalQueries,
+              currentQuery: null
+            });
+          }
+
+          const stopReason = scheduler.checkStop();
+          if (stopReason) {
+            log.info('Stage 1: Early stop', {
+              reason: stopReason,
+              newUnique: scheduler.uniqueTotal,
+              target: scheduler.target,
+              executed: processedCount,
+              skipped: scheduler.remaining
+            });
+            break;
+          }
+          
+          // Небольшая задержка между батчами (не между отдельными запросами)
+          if (scheduler.remaining > 0) {
+            await this._sleep(1000);
+          }
         }
-        
-        // Небольшая задержка между батчами (не между отдельными запросами)
-        if (i + concurrentRequests < queries.length) {
-          await this._sleep(1000);
-        }
+
+        scheduling = scheduler.getSummary();
       }
       
-      this.logger.info('Stage 1: All queries processed', { 
+      log.info('Stage 1: All queries processed', { 
         totalCompanies: allCompanies.length,
-        queries: queries.length
+        queries: executedQueries.length,
+        skipped: queries.length - executedQueries.length,
+        stopReason: scheduling?.stopReason
       });
       
       // Удалить дубликаты между всеми запросами
       const uniqueCompanies = this._removeDuplicates(allCompanies);
-      this.logger.info('Stage 1: After deduplication', {
+      log.info('Stage 1: After deduplication', {
         before: allCompanies.length,
         after: uniqueCompanies.length,
         removed: allCompanies.length - uniqueCompanies.length,
@@ -147,8 +207,8 @@ class Stage1FindCompanies {
       });
 
       // Проверить существующие компании в БД (между сессиями)
-      const newCompanies = await this._checkExistingCompanies(uniqueCompanies, sessionId);
-      this.logger.info('Stage 1: After existing companies check', {
+      const newCompanies = await this._checkExistingCompanies(uniqueCompanies, sessionId, existingDomains, existingDomainsLoadedAt);
+      log.info('Stage 1: After existing companies check', {
         before: uniqueCompanies.length,
         after: newCompanies.length,
         removed: uniqueCompanies.length - newCompanies.length,
@@ -157,7 +217,7 @@ class Stage1FindCompanies {
 
       // Фильтровать маркетплейсы
       const filteredCompanies = this._filterMarketplaces(newCompanies);
-      this.logger.info('Stage 1: After marketplace filtering', {
+      log.info('Stage 1: After marketplace filtering', {
         before: newCompanies.length,
         after: filteredCompanies.length,
         removed: newCompanies.length - filteredCompanies.length,
@@ -166,7 +226,7 @@ class Stage1FindCompanies {
 
       // Нормализовать email и website (один домен = один адрес)
       const normalizedCompanies = this._normalizeCompanyData(filteredCompanies);
-      this.logger.info('Stage 1: After normalization', {
+      log.info('Stage 1: After normalization', {
         before: filteredCompanies.length,
         after: normalizedCompanies.length,
         removed: filteredCompanies.length - normalizedCompanies.length
@@ -175,17 +235,21 @@ class Stage1FindCompanies {
       // Сохранить ВСЕ компании без ограничения (уже заплатили за данные!)
       const finalCompanies = normalizedCompanies;
       
-      this.logger.info('Stage 1: Final companies summary', {
+      log.info('Stage 1: Final companies summary', {
         initial: allCompanies.length,
         final: finalCompanies.length,
         totalLoss: allCompanies.length - finalCompanies.length,
         efficiencyRate: `${(finalCompanies.length / allCompanies.length * 100).toFixed(1)}%`
       });
 
+      // Выход каждого запроса - для отсева похожих малополезных запросов в QueryExpander
+      await this._recordQueryYield(executedQueries, allCompanies, finalCompanies);
+
       // Сохранить детальный отчет в файл
       await this._saveDetailedReport({
         sessionId,
-        queries: queries.length,
+        queries: executedQueries.length,
+        scheduling,
         initial: allCompanies.length,
         afterDedup: uniqueCompanies.length,
         afterExisting: newCompanies.length,
@@ -210,7 +274,7 @@ class Stage1FindCompanies {
         })
         .eq('session_id', sessionId);
 
-      this.logger.info('Stage 1: Completed', {
+      log.info('Stage 1: Completed', {
         found: finalCompanies.length,
         sessionId
       });
@@ -224,7 +288,7 @@ class Stage1FindCompanies {
         .limit(finalCompanies.length);
 
       if (selectError) {
-        this.logger.error('Stage 1: Failed to fetch saved companies', { 
+        log.error('Stage 1: Failed to fetch saved companies', { 
           error: selectError.message 
         });
       }
@@ -233,11 +297,15 @@ class Stage1FindCompanies {
         success: true,
         companies: savedCompanies || finalCompanies,
         count: finalCompanies.length,
-        total: finalCompanies.length
+        total: finalCompanies.length,
+        queries_executed: executedQueries.length,
+        queries_skipped: queries.length - executedQueries.length,
+        stop_reason: scheduling?.stopReason || 'completed',
+        saved_calls: scheduling?.savedCalls || 0
       };
 
     } catch (error) {
-      this.logger.error('Stage 1: Failed', {
+      log.error('Stage 1: Failed', {
         error: error.message,
         stack: error.stack,
         errorName: error.name,
@@ -263,7 +331,7 @@ class Stage1FindCompanies {
     const minCompanies = 5;
     const maxCompanies = 15;  // Уменьшено с 50 до 15 для оптимизации
 
-    this.logger.info('Stage 1: Starting query processing', {
+    log.info('Stage 1: Starting query processing', {
       query: searchQuery,
       minCompanies,
       maxCompanies
@@ -280,9 +348,9 @@ class Stage1FindCompanies {
     });
 
     // Парсить результат
-    const companies = this._parseResponse(response);
+    const companies = await this._parseResponse(response);
     
-    this.logger.info('Stage 1: AI response parsed', {
+    log.info('Stage 1: AI response parsed', {
       query: searchQuery,
       companiesFound: companies.length,
       meetsMinimum: companies.length >= minCompanies
@@ -297,7 +365,7 @@ class Stage1FindCompanies {
 
     // Валидация
     if (companies.length < minCompanies) {
-      this.logger.warn('Stage 1: Too few companies found, retrying', {
+      log.warn('Stage 1: Too few companies found, retrying', {
         found: companies.length,
         required: minCompanies,
         query: searchQuery
@@ -311,9 +379,9 @@ class Stage1FindCompanies {
         useCache: false  // КЭШ ОТКЛЮЧЕН
       });
 
-      const moreCompanies = this._parseResponse(retryResponse);
+      const moreCompanies = await this._parseResponse(retryResponse);
       
-      this.logger.info('Stage 1: Retry completed', {
+      log.info('Stage 1: Retry completed', {
         query: searchQuery,
         additionalCompanies: moreCompanies.length,
         totalNow: companies.length + moreCompanies.length
@@ -329,7 +397,7 @@ class Stage1FindCompanies {
       companies.push(...moreCompanies);
     }
 
-    this.logger.info('Stage 1: Query processed successfully', { 
+    log.info('Stage 1: Query processed successfully', { 
       query: searchQuery,
       companiesFound: companies.length,
       hadRetry: companies.length > 0 && companies.length < minCompanies
@@ -338,6 +406,145 @@ class Stage1FindCompanies {
     return companies;
   }
 
+  /**
+   * Сохранить выход запросов: сколько компаний вернул Sonar и сколько из них новых
+   */
+  async _recordQueryYield(queries, allCompanies, finalCompanies) {
+    const countByQuery = (companies) => {
+      const counts = new Map();
+      companies.forEach(company => counts.set(company.rawQuery, (counts.get(company.rawQuery) || 0) + 1));
+      return counts;
+    };
+    const found = countByQuery(allCompanies);
+    const added = countByQuery(finalCompanies);
+
+    // Запрос без компаний чаще всего - ошибка API, а не плохой запрос: не записываем
+    const runs = queries
+      .map(query => {
+        const searchQuery = query.query_cn || query.query_ru;
+        return {
+          query_id: query.query_id,
+          query_cn: searchQuery,
+          found: found.get(searchQuery) || 0,
+          newCompanies: added.get(searchQuery) || 0
+        };
+      })
+      .filter(run => run.found > 0);
+
+    try {
+      await querySimilarityIndex.recordRuns(runs);
+    } catch (error) {
+      log.warn('Stage 1: Failed to record query yield', { error: error.message });
+    }
+  }
+
+  /**
+   * Планировщик запросов запуска: прогноз выхода по истории, цель и порог выхода
+   * Настройки processing_stages:
+   *   stage1_adaptive_queries   - порядок по прогнозу и ранняя остановка (true)
+   *   stage1_target_companies   - цель по новым компаниям (0 - target_count сессии)
+   *   stage1_min_marginal_yield - минимальный средний выход на запрос (1)
+   *   stage1_yield_window       - по скольким последним запросам считать выход (5)
+   */
+  async _createYieldScheduler(queries, sessionData) {
+    if (!this.settings.getBool('processing_stages', 'stage1_adaptive_queries', true)) {
+      // Как раньше: все запросы по порядку relevance
+      return new QueryYieldScheduler(queries, { minMarginalYield: 0 });
+    }
+
+    try {
+      await querySimilarityIndex.refresh();
+    } catch (error) {
+      log.warn('Stage 1: Failed to load query history', { error: error.message });
+    }
+
+    // target_count сессий из шага 0 (topics / queries API) - число подзапросов, а не компаний:
+    // целью считается только значение больше числа запросов
+    const configuredTarget = this.settings.getInt('processing_stages', 'stage1_target_companies', 0);
+    const sessionTarget = sessionData?.target_count > queries.length ? sessionData.target_count : null;
+
+    return new QueryYieldScheduler(queries, {
+      predict: text => querySimilarityIndex.predictYield(text),
+      target: configuredTarget > 0 ? configuredTarget : sessionTarget,
+      minMarginalYield: this.settings.getNumber('processing_stages', 'stage1_min_marginal_yield', 1),
+      window: this.settings.getInt('processing_stages', 'stage1_yield_window', 5)
+    });
+  }
+
+  /**
+   * Сколько компаний ответа новые: нет в этом запуске (название, base_domain) и в БД
+   * Маркетплейсы не считаются доменом компании (как в _filterMarketplaces)
+   */
+  _countNewUnique(companies, seen, existingDomains) {
+    let count = 0;
+
+    companies.forEach(company => {
+      const name = this._normalizeCompanyName(company?.name);
+      if (!name || seen.names.has(name)) return;
+      seen.names.add(name);
+
+      const baseDomain = company.website && !this._isMarketplace(company.website)
+        ? this.domainPriority.extractBaseDomain(company.website)
+        : null;
+      if (baseDomain) {
+        if (seen.domains.has(baseDomain) || existingDomains?.has(baseDomain)) return;
+        seen.domains.add(baseDomain);
+      }
+
+      count++;
+    });
+
+    return count;
+  }
+
+  /**
+   * Отправить запросы stage worker'ам (CLUSTER_BACKEND=file|redis)
+   * Дедупликация и сохранение - как обычно, в этом процессе
+   */
+  async _dispatchQueries(queries, sessionId, topicDescription) {
+    const onProgress = this.progressCallback
+      ? (done, current) => this.progressCallback({ processed: done, total: queries.length, currentQuery: current })
+      : null;
+
+    const results = await stageDispatcher.dispatch(
+      'stage1',
+      `stage1:${sessionId}`,
+      queries.map(query => ({
+        id: String(query.query_id),
+        payload: { sessionId, searchQuery: query.query_cn || query.query_ru, topicDescription }
+      })),
+      onProgress
+    );
+
+    return results.flatMap(packed => this.unpackQueryResult(packed));
+  }
+
+  /**
+   * Результат _processQuery для передачи между процессами:
+   * сырой ответ Sonar хранится один раз, а не в каждой компании
+   */
+  packQueryResult(companies) {
+    const responses = [];
+    return {
+      responses,
+      companies: companies.map(({ rawResponse, ...company }) => {
+        let index = responses.indexOf(rawResponse);
+        if (index === -1) {
+          responses.push(rawResponse);
+          index = responses.length - 1;
+        }
+        return { ...company, rawResponse: index };
+      })
+    };
+  }
+
+  unpackQueryResult(packed) {
+    return (packed?.companies || []).map(company => ({
+      ...company,
+      rawResponse: packed.responses[company.rawResponse]
+    }));
+  }
+
   /**
    * Вспомогательная функция для задержки
    */
@@ -413,27 +620,22 @@ Return JSON with 5-8 more companies in same format.
 STRICT JSON OUTPUT ONLY.`;
   }
 
-  _parseResponse(response) {
+  async _parseResponse(response) {
     try {
-      // Убрать markdown code blocks (```json ... ```)
-      let cleanResponse = response.replace(/```json\s*/g, '').replace(/```\s*/g, '');
-      
-      // Попытка распарсить JSON
-      const jsonMatch = cleanResponse.match(/\{[\s\S]*\}/);
-      if (!jsonMatch) {
-        this.logger.error('No JSON found in response', { preview: response.substring(0, 500) });
+      // Убрать markdown code blocks (```json ... ```) и распарсить JSON
+      // (большие ответы - в потоке ParsePool)
+      const parsed = await parsePool.parseResponse(response, { stripFences: true });
+      if (!parsed.found) {
+        log.error('No JSON found in response', { preview: response.substring(0, 500) });
         throw new Error('No JSON found in response');
       }
 
-      let jsonString = jsonMatch[0];
-      let data;
+      let data = parsed.data;
 
-      // Попытка парсинга с автоматической починкой усечённого JSON
-      try {
-        data = JSON.parse(jsonString);
-      } catch (parseError) {
-        this.logger.warn('JSON truncated, attempting to fix', {
-          error: parseError.message,
+      if (parsed.error) {
+        let jsonString = parsed.json;
+        log.warn('JSON truncated, attempting to fix', {
+          error: parsed.error,
           preview: jsonString.substring(0, 300)
         });
 
@@ -462,10 +664,10 @@ STRICT JSON OUTPUT ONLY.`;
           // 3. Собрать валидный JSON с правильным названием поля
           jsonString = `{"${fieldName}": [${companiesText}], "total": 0}`;
           
-          this.logger.info('JSON fixed successfully', { preview: jsonString.substring(0, 200) });
+          log.info('JSON fixed successfully', { preview: jsonString.substring(0, 200) });
           data = JSON.parse(jsonString);
         } else {
-          this.logger.error('Cannot fix truncated JSON - no companies array found');
+          log.error('Cannot fix truncated JSON - no companies array found');
           throw new Error('Cannot fix truncated JSON');
         }
       }
@@ -474,12 +676,12 @@ STRICT JSON OUTPUT ONLY.`;
       let companies = data.companies || data.companies_found || data.results || [];
       
       if (!Array.isArray(companies)) {
-        this.logger.error('Invalid companies array in response', { data });
+        log.error('Invalid companies array in response', { data });
         throw new Error('Invalid companies array');
       }
 
       if (companies.length === 0) {
-        this.logger.warn('Empty companies array in response');
+        log.warn('Empty companies array in response');
       }
 
       return companies.map(c => {
@@ -488,7 +690,7 @@ STRICT JSON OUTPUT ONLY.`;
         // Если website это блог/статья - извлечь главный домен
         if (website && this._isBlogOrArticle(website)) {
           const mainDomain = this._extractMainDomain(website);
-          this.logger.debug('Stage 1: Website is blog/article, extracting main domain', {
+          log.debug('Stage 1: Website is blog/article, extracting main domain', {
             original: website,
             mainDomain: mainDomain
           });
@@ -505,7 +707,7 @@ STRICT JSON OUTPUT ONLY.`;
       });
 
     } catch (error) {
-      this.logger.error('Failed to parse Stage 1 response', {
+      log.error('Failed to parse Stage 1 response', {
         error: error.message,
         response: response.substring(0, 500)
       });
@@ -527,7 +729,7 @@ STRICT JSON OUTPUT ONLY.`;
     return companies.filter(company => {
       // Защита от undefined/null company или name
       if (!company || !company.name || typeof company.name !== 'string') {
-        this.logger.warn('Stage 1: Company with invalid name filtered', { company });
+        log.warn('Stage 1: Company with invalid name filtered', { company });
         return false;
       }
       
@@ -535,14 +737,14 @@ STRICT JSON OUTPUT ONLY.`;
       const normalizedName = this._normalizeCompanyName(company.name);
       
       if (!normalizedName) {
-        this.logger.warn('Stage 1: Company with empty normalized name filtered', { 
+        log.warn('Stage 1: Company with empty normalized name filtered', { 
           original: company.name 
         });
         return false;
       }
       
       if (seenNames.has(normalizedName)) {
-        this.logger.debug('Stage 1: Duplicate name filtered', { 
+        log.debug('Stage 1: Duplicate name filtered', { 
           original: company.name,
           normalized: normalizedName
         });
@@ -566,7 +768,7 @@ STRICT JSON OUTPUT ONLY.`;
             
             if (comparison < 0) {
               // Новая компания имеет лучший TLD (например .cn vs .com)
-              this.logger.info('Stage 1: Better TLD found, replacing', {
+              log.info('Stage 1: Better TLD found, replacing', {
                 baseDomain,
                 oldName: existingCompany.name,
                 oldDomain: existingCompany.website,
@@ -589,7 +791,7 @@ STRICT JSON OUTPUT ONLY.`;
               return true; // Добавить новую
             } else {
               // Старая компания имеет лучший или равный TLD
-              this.logger.debug('Stage 1: Duplicate base_domain filtered (worse TLD)', {
+              log.debug('Stage 1: Duplicate base_domain filtered (worse TLD)', {
                 baseDomain,
                 keptDomain: existingCompany.website,
                 keptTLD: this.domainPriority.extractTld(existingCompany.website),
@@ -621,35 +823,44 @@ STRICT JSON OUTPUT ONLY.`;
   }
 
   /**
-   * Проверяет существующие компании в БД по домену (между всеми сессиями)
-   * Фильтрует компании, которые уже есть в базе данных
+   * Компании с сайтом из БД (между всеми сессиями): base_domain → лучшая по TLD
+   * Читается постранично (keyset по company_id) - без обрезки по max-rows
+   * @param {Map} existingBaseDomainMap - дополнить эту карту
+   * @param {string|null} since - только компании, измененные после (дочитывание)
+   * @returns {Promise<Map|null>} null - ошибка чтения
    */
+  async _loadExistingDomains(existingBaseDomainMap = new Map(), since = null) {
+    let lastCompanyId = null;
+
+    for (;;) {
+      let query = this.db.supabase
+        .from('pending_companies')
+        .select('company_id, company_name, website, normalized_domain, email, validation_score, created_at')
+        .not('website', 'is', null)
+        .order('company_id', { ascending: true })
+        .limit(EXISTING_PAGE_SIZE);
+      if (since) query = query.gte('updated_at', since);
+      if (lastCompanyId) query = query.gt('company_id', lastCompanyId);
+
+      const { data: existing, error } = await query;
+      if (error) {
+        log.error('Stage 1: Failed to check existing companies', { error: error.message });
+        return null;
+      }
+
+      this._addExistingDomains(existingBaseDomainMap, existing || []);
+      if (!existing || existing.length < EXISTING_PAGE_SIZE) break;
+      lastCompanyId = existing[existing.length - 1].company_id;
+    }
+
+    return existingBaseDomainMap;
+  }
+
   /**
-   * Проверяет существующие компании в БД по base_domain (между всеми сессиями)
-   * Фильтрует компании, которые уже есть в базе данных
-   * С учетом TLD приоритетов: если в БД есть wayken.com, а найден wayken.cn → оставить .cn
+   * Дополнить карту base_domain → существующая компания в БД
    */
-  async _checkExistingCompanies(companies, sessionId) {
-    const companiesWithWebsite = companies.filter(c => c.website);
-    
-    if (companiesWithWebsite.length === 0) {
-      return companies; // Нет сайтов для проверки
-    }
-    
-    // Получаем все компании с website из БД
-    const { data: existing, error } = await this.db.supabase
-      .from('pending_companies')
-      .select('company_id, company_name, website, normalized_domain, email, validation_score, created_at')
-      .not('website', 'is', null);
-    
-    if (error) {
-      this.logger.error('Stage 1: Failed to check existing companies', { error: error.message });
-      return companies; // В случае ошибки пропускаем проверку
-    }
-    
-    // Создать карту: base_domain → существующая компания в БД
-    const existingBaseDomainMap = new Map();
-    for (const existingCompany of (existing || [])) {
+  _addExistingDomains(existingBaseDomainMap, existing) {
+    for (const existingCompany of existing) {
       if (!existingCompany.website) continue;
       
       const baseDomain = this.domainPriority.extractBaseDomain(existingCompany.website);
@@ -669,7 +880,33 @@ STRICT JSON OUTPUT ONLY.`;
         }
       }
     }
+  }
+
+  /**
+   * Проверяет существующие компании в БД по домену (между всеми сессиями)
+   * Фильтрует компании, которые уже есть в базе данных
+   */
+  /**
+   * Проверяет существующие компании в БД по base_domain (между всеми сессиями)
+   * Фильтрует компании, которые уже есть в базе данных
+   * С учетом TLD приоритетов: если в БД есть wayken.com, а найден wayken.cn → оставить .cn
+   */
+  async _checkExistingCompanies(companies, sessionId, existingDomains = null, loadedAt = null) {
+    const companiesWithWebsite = companies.filter(c => c.website);
     
+    if (companiesWithWebsite.length === 0) {
+      return companies; // Нет сайтов для проверки
+    }
+    
+    // Карта base_domain → компания в БД: загруженную в начале запуска дочитываем
+    // компаниями, измененными с тех пор (другие сессии могли добавить компании)
+    const existingBaseDomainMap = existingDomains
+      ? (await this._loadExistingDomains(existingDomains, loadedAt)) || existingDomains
+      : await this._loadExistingDomains();
+    if (!existingBaseDomainMap) {
+      return companies; // В случае ошибки пропускаем проверку
+    }
+
     // Фильтровать компании
     const filtered = [];
     
@@ -697,7 +934,7 @@ STRICT JSON OUTPUT ONLY.`;
         
         if (comparison < 0) {
           // Новая компания имеет лучший TLD → обновить существующую запись
-          this.logger.warn('Stage 1: Found better TLD for existing company, updating', {
+          log.warn('Stage 1: Found better TLD for existing company, updating', {
             baseDomain,
             existingId: existingCompany.company_id,
             existingName: existingCompany.company_name,
@@ -720,7 +957,7 @@ STRICT JSON OUTPUT ONLY.`;
           continue;
         } else {
           // Существующая компания имеет лучший или равный TLD
-          this.logger.info('Stage 1: Company already exists in DB', {
+          log.info('Stage 1: Company already exists in DB', {
             name: company.name,
             website: company.website,
             baseDomain: baseDomain,
@@ -735,7 +972,7 @@ STRICT JSON OUTPUT ONLY.`;
       filtered.push(company);
     }
     
-    this.logger.info('Stage 1: Filtered existing companies', {
+    log.info('Stage 1: Filtered existing companies', {
       total: companies.length,
       existing: companies.length - filtered.length,
       remaining: filtered.length
@@ -779,7 +1016,7 @@ STRICT JSON OUTPUT ONLY.`;
     const filtered = companies.map(company => {
       if (this._isMarketplace(company.website)) {
         marketplacesFound++;
-        this.logger.debug('Stage 1: Marketplace URL filtered', {
+        log.debug('Stage 1: Marketplace URL filtered', {
           company: company.name,
           marketplace: company.website
         });
@@ -794,7 +1031,7 @@ STRICT JSON OUTPUT ONLY.`;
     });
     
     if (marketplacesFound > 0) {
-      this.logger.info('Stage 1: Marketplaces filtered', {
+      log.info('Stage 1: Marketplaces filtered', {
         count: marketplacesFound
       });
     }
@@ -824,7 +1061,7 @@ STRICT JSON OUTPUT ONLY.`;
           emails = this._filterEmailsByDomain(emails);
           normalizedCompany.email = emails[0]; // Взять первый (приоритетный)
           
-          this.logger.debug('Stage 1: Multiple emails normalized', {
+          log.debug('Stage 1: Multiple emails normalized', {
             company: company.name,
             original: company.email,
             selected: normalizedCompany.email
@@ -836,7 +1073,7 @@ STRICT JSON OUTPUT ONLY.`;
       if (company.website && Array.isArray(company.website)) {
         normalizedCompany.website = this._selectBestWebsite(company.website);
         
-        this.logger.debug('Stage 1: Multiple websites normalized', {
+        log.debug('Stage 1: Multiple websites normalized', {
           company: company.name,
           original: company.website,
           selected: normalizedCompany.website
@@ -866,7 +1103,7 @@ STRICT JSON OUTPUT ONLY.`;
     for (const email of validEmails) {
       // Валидация email
       if (!this._isValidEmail(email)) {
-        this.logger.debug('Stage 1: Invalid email skipped in filtering', { value: email });
+        log.debug('Stage 1: Invalid email skipped in filtering', { value: email });
         continue;
       }
       
@@ -951,7 +1188,7 @@ STRICT JSON OUTPUT ONLY.`;
     
     for (const pattern of phonePatterns) {
       if (pattern.test(email)) {
-        this.logger.debug('Stage 1: Filtered out phone number', { value: email });
+        log.debug('Stage 1: Filtered out phone number', { value: email });
         return false;
       }
     }
@@ -989,7 +1226,7 @@ STRICT JSON OUTPUT ONLY.`;
     
     for (const prefix of genericPrefixes) {
       if (localPart === prefix || localPart.startsWith(prefix + '.') || localPart.startsWith(prefix + '_')) {
-        this.logger.debug('Stage 1: Filtered out generic email', { value: email, reason: prefix });
+        log.debug('Stage 1: Filtered out generic email', { value: email, reason: prefix });
         return false;
       }
     }
@@ -1056,7 +1293,7 @@ STRICT JSON OUTPUT ONLY.`;
         // Убрать точки в конце
         .replace(/\.+$/g, '');
     } catch (error) {
-      this.logger.error('Stage 1: Failed to normalize company name', { 
+      log.error('Stage 1: Failed to normalize company name', { 
         name, 
         error: error.message 
       });
@@ -1101,7 +1338,7 @@ STRICT JSON OUTPUT ONLY.`;
       
       return domain.toLowerCase(); // Возвращаем только домен
     } catch (error) {
-      this.logger.error('Stage 1: Failed to extract domain', { url, error: error.message });
+      log.error('Stage 1: Failed to extract domain', { url, error: error.message });
       return null;
     }
   }
@@ -1117,7 +1354,7 @@ STRICT JSON OUTPUT ONLY.`;
         const mainDomain = this._extractMainDomain(normalizedWebsite);
         if (mainDomain) {
           normalizedWebsite = `https://${mainDomain}`; // Сохранить только основной домен
-          this.logger.debug('Stage 1: Normalized blog URL to main domain', {
+          log.debug('Stage 1: Normalized blog URL to main domain', {
             original: company.website,
             normalized: normalizedWebsite
           });
@@ -1139,7 +1376,7 @@ STRICT JSON OUTPUT ONLY.`;
         currentStage = 2; // Готов для Stage 3
         legacyStage = 'website_found';
         
-        this.logger.info('Stage 1: Website found, Stage 2 will be skipped', {
+        log.info('Stage 1: Website found, Stage 2 will be skipped', {
           company: company.name,
           website: normalizedWebsite
         });
@@ -1150,7 +1387,7 @@ STRICT JSON OUTPUT ONLY.`;
           currentStage = 3; // Готов для Stage 4
           legacyStage = 'contacts_found';
           
-          this.logger.info('Stage 1: Email found, Stage 3 will be skipped', {
+          log.info('Stage 1: Email found, Stage 3 will be skipped', {
             company: company.name,
             email: company.email
           });
@@ -1158,8 +1395,7 @@ STRICT JSON OUTPUT ONLY.`;
       }
       
       // Извлечь теги и сервисы из описания
-      const tagData = this.tagExtractor.extractTagsForDB(company.description);
-      const services = this.tagExtractor.extractServices(company.description);
+      const { tags: tagData, services } = await parsePool.extractTags(company.description);
       
       // Подготовить сырые данные для сохранения
       // ВАЖНО: Сохраняем ПОЛНЫЙ оригинальный ответ от Perplexity, а не только парсированный JSON
@@ -1192,7 +1428,7 @@ STRICT JSON OUTPUT ONLY.`;
           matchedBy = 'normalized_domain';
           
           if (!checkError && existing && existing.length > 0) {
-            this.logger.debug('Stage 1: Duplicate detected by domain', {
+            log.debug('Stage 1: Duplicate detected by domain', {
               newCompany: company.name,
               existingCompany: existing[0].company_name,
               domain: normalizedDomain,
@@ -1232,7 +1468,7 @@ STRICT JSON OUTPUT ONLY.`;
             }
             
             if (existing && existing.length > 0) {
-              this.logger.debug('Stage 1: Duplicate detected by normalized name', {
+              log.debug('Stage 1: Duplicate detected by normalized name', {
                 newCompany: company.name,
                 normalizedNew: normalizedName,
                 existingCompany: existing[0].company_name,
@@ -1256,7 +1492,7 @@ STRICT JSON OUTPUT ONLY.`;
           services: services,
           search_query_text: company.rawQuery || null, // Поисковый запрос
           topic_description: company.topicDescription || null, // НОВОЕ: Главная тема
-          stage1_raw_data: rawData, // Сырые данные
+          stage1_raw_data: await rawPayloadStore.pack(rawData), // Сырые данные (полный ответ - в raw_payloads)
           tag1: tagData.tag1,
           tag2: tagData.tag2,
           tag3: tagData.tag3,
@@ -1292,7 +1528,7 @@ STRICT JSON OUTPUT ONLY.`;
         // Проверить на duplicate key violation (PostgreSQL error code 23505)
         if (error.code === '23505' || error.message?.includes('duplicate') || error.message?.includes('unique')) {
           duplicateCount++;
-          this.logger.info('Stage 1: Company already exists (concurrent insert blocked)', {
+          log.info('Stage 1: Company already exists (concurrent insert blocked)', {
             name: company.name,
             domain: normalizedDomain,
             sessionId
@@ -1301,7 +1537,7 @@ STRICT JSON OUTPUT ONLY.`;
         }
         
         // Другие ошибки - пробросить
-        this.logger.error('Stage 1: Failed to save company', {
+        log.error('Stage 1: Failed to save company', {
           error: error.message,
           code: error.code,
           company: company.name
@@ -1310,7 +1546,7 @@ STRICT JSON OUTPUT ONLY.`;
       }
     }
     
-    this.logger.info('Stage 1: Save summary', {
+    log.info('Stage 1: Save summary', {
       total: companies.length,
       saved: savedCount,
       duplicates: duplicateCount
@@ -1321,7 +1557,7 @@ STRICT JSON OUTPUT ONLY.`;
       return tags.length > 0;
     }).length;
     
-    this.logger.info('Stage 1: Companies saved', {
+    log.info('Stage 1: Companies saved', {
       total: companies.length,
       withWebsite: companies.filter(c => c.website).length,
       withEmail: companies.filter(c => c.email).length,
@@ -1395,16 +1631,52 @@ Main Loss Factors:
 Overall Efficiency: ${stats.efficiencyRate} - ${this._analyzeEfficiency(stats.efficiencyRate)}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-`;
+${this._formatScheduling(stats.scheduling)}`;
 
     try {
       await fs.writeFile(reportPath, report, 'utf8');
-      this.logger.info(`Stage 1: Detailed report saved to ${reportPath}`);
+      log.info(`Stage 1: Detailed report saved to ${reportPath}`);
     } catch (error) {
-      this.logger.error(`Stage 1: Failed to save report: ${error.message}`);
+      log.error(`Stage 1: Failed to save report: ${error.message}`);
     }
   }
 
+  /**
+   * Раздел отчета о порядке запросов и ранней остановке
+   */
+  _formatScheduling(scheduling) {
+    if (!scheduling) return '';
+
+    const reasons = {
+      completed: 'all queries executed',
+      target_reached: `target reached (${scheduling.target} new companies)`,
+      low_marginal_yield: `marginal yield below ${scheduling.minMarginalYield} new companies per query`
+    };
+    const runs = scheduling.runs
+      .map((run, index) => `${String(index + 1).padStart(3)}. new ${String(run.newUnique).padStart(3)} / found ${String(run.found).padStart(3)}  (predicted ${run.predicted === null ? '-' : run.predicted})  ${run.query}`)
+      .join('\n');
+    const skipped = scheduling.skippedQueries.map(query => `     - ${query}`).join('\n');
+    const failed = scheduling.failedQueries.map(query => `     - ${query}`).join('\n');
+
+    return `
+🧭 QUERY SCHEDULING:
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+Stop Reason:              ${reasons[scheduling.stopReason] || scheduling.stopReason}
+Queries Executed:         ${scheduling.executed}
+Queries Failed:           ${scheduling.failed}
+Queries Skipped:          ${scheduling.skipped}
+Sonar Calls:              ${scheduling.sonarCalls}
+Sonar Calls Saved:        ~${scheduling.savedCalls}
+New Unique Companies:     ${scheduling.newUnique}
+
+Execution order (new unique / found):
+${runs}
+${failed ? `\nFailed queries (not counted in yield):\n${failed}\n` : ''}${skipped ? `\nSkipped queries:\n${skipped}\n` : ''}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+`;
+  }
+
   _analyzeLoss(rateStr) {
     const rate = parseFloat(rateStr);
     if (rate < 10) return '✅ Minimal loss';
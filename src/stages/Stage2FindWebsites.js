@@ -4,6 +4,12 @@
  */
 const TagExtractor = require('../utils/TagExtractor');
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const log = require('../services/Logger').child('stage2');
+const clusterStore = require('../services/ClusterStore');
+const stageDispatcher = require('../services/StageDispatcher');
+const parsePool = require('../services/ParsePool');
+const rawPayloadStore = require('../services/RawPayloadStore');
+const retryScheduler = require('../services/RetryScheduler');
 
 class Stage2FindWebsites {
   constructor(sonarClient, settingsManager, database, logger) {
@@ -15,6 +21,7 @@ class Stage2FindWebsites {
     this.domainPriority = domainPriorityManager;
     this.progressCallback = null; // Callback для обновления прогресса (session-based)
     this.globalProgressCallback = null; // Callback для global прогресса (SSE)
+    this.job = null; // Персистентное задание (global режим)
   }
 
   /**
@@ -31,6 +38,13 @@ class Stage2FindWebsites {
     this.globalProgressCallback = callback;
   }
 
+  /**
+   * Установить персистентное задание (global режим, см. GlobalJobManager)
+   */
+  setJob(job) {
+    this.job = job;
+  }
+
   async execute(sessionId = null) {
     // sessionId теперь опциональный - если не указан, обрабатываем ВСЕ компании
     this.logger.info('Stage 2: Starting website search', { 
@@ -40,9 +54,15 @@ class Stage2FindWebsites {
 
     try {
       // Получить компании для обработки
-      const companies = await this._getCompanies(sessionId);
+      let companies = await this._getCompanies(sessionId);
+      
+      // Задание: только компании снимка, еще не отмеченные в журнале
+      if (this.job) {
+        companies = await this.job.claim(companies);
+      }
+      const carriedFailed = this.job ? this.job.carriedFailed : 0;
       
-      if (companies.length === 0) {
+      if (companies.length === 0 && carriedFailed === 0) {
         this.logger.info('Stage 2: No companies need processing');
         return {
           success: true,
@@ -69,7 +89,15 @@ class Stage2FindWebsites {
       let processedCount = 0;
       const totalCompanies = companies.length;
       
-      for (let i = 0; i < companies.length; i += concurrentRequests) {
+      // Распределенный режим: компании обрабатывают stage worker'ы, локальный цикл пропускается
+      if (this.job && clusterStore.isDistributed()) {
+        results.push(...await stageDispatcher.dispatchCompanies(
+          this.job, companies, this.globalProgressCallback, r => r.success
+        ));
+        processedCount = companies.length;
+      }
+      
+      for (let i = processedCount; i < companies.length; i += concurrentRequests) {
         const batch = companies.slice(i, i + concurrentRequests);
         
         // Обновить прогресс перед обработкой батча (session-based)
@@ -91,11 +119,19 @@ class Stage2FindWebsites {
           progress: `${processedCount}/${totalCompanies}`
         });
 
+        if (this.job) {
+          await this.job.begin(batch);
+        }
+
         // Параллельная обработка батча (sessionId НЕ нужен)
         const batchResults = await Promise.all(
           batch.map(company => this._findWebsite(company))
         );
 
+        if (this.job) {
+          await this.job.complete(batch, batchResults.map(r => r.success));
+        }
+
         results.push(...batchResults);
         processedCount += batch.length;
         
@@ -144,53 +180,41 @@ class Stage2FindWebsites {
 
       // 🔄 АВТОМАТИЧЕСКИЙ ЗАПУСК STAGE 2 RETRY
       // Если есть компании без website - запустить Stage 2 Retry автоматически
-      console.log(`\n🔍 DEBUG: Checking if Stage 2 Retry should run...`);
-      console.log(`   Failed count: ${failed}`);
-      console.log(`   Condition (failed > 0): ${failed > 0}`);
+      log.debug('Stage 2 Retry check', { failed });
       
-      if (failed > 0) {
-        console.log('\n🔄 Starting Stage 2 Retry automatically...');
-        console.log(`   Companies without website: ${failed}`);
+      // После resume не найденные в прошлых запусках тоже идут в Retry
+      if (failed + carriedFailed > 0) {
+        log.info('Starting Stage 2 Retry automatically', { companiesWithoutWebsite: failed + carriedFailed });
         
         try {
-          console.log('   Loading Stage2Retry class...');
           const Stage2Retry = require('./Stage2Retry');
           const DeepSeekClient = require('../services/DeepSeekClient');
           
-          console.log('   Creating DeepSeek client...');
           // Создать DeepSeek клиент
           const deepseekApiKey = process.env.DEEPSEEK_API_KEY || 'sk-85323bc753cb4b25b02a2664e9367f8a';
-          console.log(`   DeepSeek API key exists: ${!!deepseekApiKey} (length: ${deepseekApiKey?.length || 0})`);
+          log.debug('DeepSeek client for Stage 2 Retry', { hasApiKey: !!deepseekApiKey });
           const deepseekClient = new DeepSeekClient(deepseekApiKey, this.logger, 'chat');
           
-          console.log('   Creating Stage2Retry instance...');
           // Создать Stage2Retry
           const stage2Retry = new Stage2Retry(
             this.db,
             this.logger,
             this.settings,
-            deepseekClient
+            deepseekClient,
+            this.sonar
           );
           
           // Передать globalProgressCallback в Stage2Retry
           if (this.globalProgressCallback) {
-            console.log('   Setting global progress callback for Stage2Retry...');
             stage2Retry.setGlobalProgressCallback(this.globalProgressCallback);
             // Передать текущий прогресс (processedCount) как offset
-            console.log(`   Setting progress offset to ${processedCount} (already processed in Stage 2)`);
+            log.debug('Stage 2 Retry progress offset', { offset: processedCount });
             stage2Retry.setProgressOffset(processedCount);
           }
           
-          console.log('   Executing Stage 2 Retry...');
           // Запустить retry
           const retryResult = await stage2Retry.execute();
           
-          console.log('\n========== STAGE 2 RETRY RESULTS ==========');
-          console.log(`Total Companies Retried: ${retryResult.total}`);
-          console.log(`Additional Websites Found: ${retryResult.found}`);
-          console.log(`Still No Website: ${retryResult.total - retryResult.found}`);
-          console.log('===========================================\n');
-          
           this.logger.info('Stage 2 Retry: Completed automatically', {
             retriedCompanies: retryResult.total,
             additionalWebsitesFound: retryResult.found
@@ -212,12 +236,10 @@ class Stage2FindWebsites {
             error: retryError.message,
             stack: retryError.stack
           });
-          console.error('❌ Stage 2 Retry failed:', retryError.message);
-          console.error('   Stack trace:', retryError.stack);
           // Продолжаем даже если retry упал
         }
       } else {
-        console.log('   ℹ️ Skipping Stage 2 Retry - all companies have website');
+        log.debug('Skipping Stage 2 Retry - all companies have website');
       }
 
       return {
@@ -237,7 +259,7 @@ class Stage2FindWebsites {
     }
   }
 
-  async _getCompanies(sessionId = null) {
+  async _getCompanies(sessionId = null, companyIds = null) {
     // НОВОЕ: Получить ВСЕ компании готовые для Stage 2 (независимо от сессии)
     // stage2_status должен быть NULL (не 'skipped', не 'completed', не 'failed')
     // current_stage должен быть >= 1
@@ -254,6 +276,11 @@ class Stage2FindWebsites {
       query = query.eq('session_id', sessionId);
     }
     
+    // Только указанные компании (stage worker перепроверяет, что компания еще не обработана)
+    if (companyIds) {
+      query = query.in('company_id', companyIds);
+    }
+    
     const { data, error } = await query;
     
     if (error) {
@@ -334,7 +361,7 @@ class Stage2FindWebsites {
         hasResponse: !!response
       });
 
-      const result = this._parseResponse(response);
+      const result = await this._parseResponse(response);
 
       this.logger.info('Stage 2: Response parsed', {
         company: company.company_name,
@@ -397,8 +424,7 @@ class Stage2FindWebsites {
         let services = null;
         
         if (result.description) {
-          tagData = this.tagExtractor.extractTagsForDB(result.description);
-          services = this.tagExtractor.extractServices(result.description);
+          ({ tags: tagData, services } = await parsePool.extractTags(result.description));
         }
 
         // Подготовить raw data для Stage 2
@@ -482,7 +508,7 @@ class Stage2FindWebsites {
           stage2_status: 'completed',
           stage3_status: stage3Status,
           current_stage: currentStage,
-          stage2_raw_data: rawData,
+          stage2_raw_data: await rawPayloadStore.pack(rawData),
           updated_at: new Date().toISOString(),
           ...tagData // tag1, tag2, ... tag20
         };
@@ -504,6 +530,15 @@ class Stage2FindWebsites {
           });
         }
 
+        // Журнал попыток для Stage2Retry (основной проход - strategy 0)
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage2',
+          provider: 'sonar',
+          outcome: result.website ? 'found' : 'not_found',
+          failureClass: result.website ? null : 'no_result'
+        });
+
         this.logger.info('Stage 2: Data found', {
           company: company.company_name,
           website: result.website || 'not found',
@@ -538,7 +573,7 @@ class Stage2FindWebsites {
             website_status: 'not_found',
             stage2_status: 'failed',
             current_stage: 1, // Остается на Stage 1
-            stage2_raw_data: rawDataNotFound,
+            stage2_raw_data: await rawPayloadStore.pack(rawDataNotFound),
             updated_at: new Date().toISOString()
           })
           .eq('company_id', company.company_id);
@@ -550,6 +585,14 @@ class Stage2FindWebsites {
           });
         }
 
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage2',
+          provider: 'sonar',
+          outcome: 'not_found',
+          failureClass: 'no_result'
+        });
+
         this.logger.warn('Stage 2: Nothing found', {
           company: company.company_name
         });
@@ -568,6 +611,13 @@ class Stage2FindWebsites {
         company: company.company_name,
         error: error.message
       });
+      await retryScheduler.record({
+        companyId: company.company_id,
+        stage: 'stage2',
+        provider: 'sonar',
+        outcome: 'error',
+        failureClass: retryScheduler.classifyError(error)
+      });
       return { 
         success: false, 
         company: company.company_name,
@@ -603,11 +653,11 @@ class Stage2FindWebsites {
     }
   }
 
-  _parseResponse(response) {
+  async _parseResponse(response) {
     try {
-      // Попытка распарсить JSON
-      const jsonMatch = response.match(/\{[\s\S]*\}/);
-      if (!jsonMatch) {
+      // Попытка распарсить JSON (большие ответы - в потоке ParsePool)
+      const parsed = await parsePool.parseResponse(response);
+      if (!parsed.found) {
         // Fallback: попытка найти URL напрямую в тексте
         const urlMatch = response.match(/(https?:\/\/[^\s]+)/);
         return {
@@ -617,8 +667,11 @@ class Stage2FindWebsites {
           source: null
         };
       }
+      if (parsed.error) {
+        throw new Error(parsed.error);
+      }
 
-      const data = JSON.parse(jsonMatch[0]);
+      const data = parsed.data;
       
       // Валидация email
       let validEmail = null;
@@ -928,8 +981,7 @@ Stage 3 Workload: ${websiteFound - bothFound} companies need email search
    * Автоматический запуск Stage 2 Retry с DeepSeek
    */
   async _runStage2Retry(failed) {
-    console.log('\n🔄 Starting Stage 2 Retry automatically...');
-    console.log(`   Companies without website: ${failed}`);
+    log.info('Starting Stage 2 Retry automatically', { companiesWithoutWebsite: failed });
     
     try {
       const Stage2Retry = require('./Stage2Retry');
@@ -938,7 +990,6 @@ Stage 3 Workload: ${websiteFound - bothFound} companies need email search
       const deepseekApiKey = process.env.DEEPSEEK_API_KEY;
       if (!deepseekApiKey) {
         this.logger.warn('Stage 2 Retry: DEEPSEEK_API_KEY not found in environment');
-        console.log('⚠️  DEEPSEEK_API_KEY not found - skipping Stage 2 Retry');
         return null;
       }
       
@@ -948,17 +999,12 @@ Stage 3 Workload: ${websiteFound - bothFound} companies need email search
         this.db,
         this.logger,
         this.settings,
-        deepseekClient
+        deepseekClient,
+        this.sonar
       );
       
       const retryResult = await stage2Retry.execute();
       
-      console.log('\n========== STAGE 2 RETRY RESULTS ==========');
-      console.log(`Total Companies Retried: ${retryResult.total}`);
-      console.log(`Additional Websites Found: ${retryResult.found}`);
-      console.log(`Still No Website: ${retryResult.total - retryResult.found}`);
-      console.log('===========================================\n');
-      
       this.logger.info('Stage 2 Retry: Completed automatically', {
         retriedCompanies: retryResult.total,
         additionalWebsitesFound: retryResult.found
@@ -971,7 +1017,6 @@ Stage 3 Workload: ${websiteFound - bothFound} companies need email search
         error: retryError.message,
         stack: retryError.stack
       });
-      console.error('❌ Stage 2 Retry failed:', retryError.message);
       return null;
     }
   }
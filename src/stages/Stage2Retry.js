@@ -1,18 +1,26 @@
 const axios = require('axios');
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const log = require('../services/Logger').child('stage2-retry');
+const parsePool = require('../services/ParsePool');
+const retryScheduler = require('../services/RetryScheduler');
 
 /**
  * Stage2Retry - Повторный поиск веб-сайтов используя DeepSeek
  * 
  * Для компаний, которые прошли Stage 2, но не получили website.
  * Использует DeepSeek Chat с более агрессивным промптом для поиска через китайские каталоги.
+ *
+ * Кого и каким провайдером повторять решает RetryScheduler по журналу попыток:
+ * одна попытка на компанию за запуск, самый дешевый еще не опробованный канал
+ * (DeepSeek промпт 1 -> промпт 2 -> Sonar), пауза и бюджет попыток на компанию.
  */
 class Stage2Retry {
-  constructor(db, logger, settings, deepseek) {
+  constructor(db, logger, settings, deepseek, sonar = null) {
     this.db = db;
     this.logger = logger;
     this.settings = settings;
     this.deepseek = deepseek;
+    this.sonar = sonar; // Последний, самый дорогой канал (если передан)
     this.domainPriority = domainPriorityManager;
     this.globalProgressCallback = null; // Callback для global прогресса (SSE)
     this.progressOffset = 0; // Начальный offset для прогресса
@@ -34,37 +42,44 @@ class Stage2Retry {
 
   async execute() {
     this.logger.info('Stage 2 Retry: Starting retry for companies without website');
-    console.log('\n════════════════════════════════════════════');
-    console.log('🔄 STAGE 2 RETRY: DeepSeek Website Search');
-    console.log('════════════════════════════════════════════\n');
 
     try {
       // Получить компании готовые для повторного поиска
-      const companies = await this._getCompanies();
+      const candidates = await this._getCompanies();
+
+      // План по журналу попыток: пауза, бюджет, канал, порядок по ожидаемому успеху
+      const plan = await retryScheduler.plan('stage2', candidates, {
+        providers: this.sonar ? ['deepseek', 'sonar'] : ['deepseek'],
+        prior: company => (company.description ? 1 : 0.7)
+      });
+      const companies = plan.scheduled.map(item => item.company);
       
       if (companies.length === 0) {
-        this.logger.info('Stage 2 Retry: No companies need retry');
-        console.log('ℹ️  No companies found for retry');
-        console.log('   All companies either have website or lack sufficient data\n');
+        this.logger.info('Stage 2 Retry: No companies need retry', {
+          candidates: candidates.length,
+          ...plan.skipped,
+          nextRetryAt: plan.nextRetryAt
+        });
         return {
           success: true,
           total: 0,
-          found: 0
+          found: 0,
+          skipped: plan.skipped,
+          nextRetryAt: plan.nextRetryAt
         };
       }
 
       this.logger.info('Stage 2 Retry: Processing companies', {
-        count: companies.length
+        count: companies.length,
+        candidates: candidates.length,
+        ...plan.skipped
       });
 
-      console.log(`\n✅ Found ${companies.length} companies to retry`);
-      console.log('   Starting website search with DeepSeek...\n');
-
       // Обновить total в GlobalProgressEmitter (если callback установлен)
       // Новый total = offset (уже обработано в Stage 2) + companies.length (будет обработано в retry)
       if (this.globalProgressCallback && this.globalProgressCallback.updateTotal) {
         const newTotal = this.progressOffset + companies.length;
-        console.log(`   Updating total: ${newTotal} (${this.progressOffset} + ${companies.length})`);
+        log.debug('Updating total', { total: newTotal, offset: this.progressOffset, retry: companies.length });
         this.globalProgressCallback.updateTotal(newTotal);
       }
 
@@ -72,21 +87,37 @@ class Stage2Retry {
       let processedCount = this.progressOffset; // Начать с offset
 
       // Обрабатывать последовательно (DeepSeek медленнее)
-      for (let i = 0; i < companies.length; i++) {
-        const company = companies[i];
-        console.log(`   [${i + 1}/${companies.length}] ${company.company_name}...`);
+      for (let i = 0; i < plan.scheduled.length; i++) {
+        const { company, channel, expectedSuccess } = plan.scheduled[i];
+        log.debug('Retrying company', {
+          index: i + 1,
+          total: companies.length,
+          company: company.company_name,
+          provider: channel.provider,
+          strategy: channel.strategy,
+          expectedSuccess
+        });
         
         // Обновить global прогресс ПЕРЕД обработкой
         if (this.globalProgressCallback) {
           this.globalProgressCallback(processedCount, company.company_name);
         }
         
-        const result = await this._retryWebsiteSearch(company);
+        const result = await this._attemptWebsiteSearch(company, channel);
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage2',
+          provider: channel.provider,
+          strategy: channel.strategy,
+          outcome: result.outcome,
+          failureClass: result.failureClass
+        });
+
         if (result.success && result.website) {
           found++;
-          console.log(`      ✅ Website found: ${result.website}`);
+          log.debug('Website found', { company: company.company_name, website: result.website });
         } else {
-          console.log(`      ❌ No website found`);
+          log.debug('No website found', { company: company.company_name });
         }
         
         processedCount++;
@@ -103,21 +134,16 @@ class Stage2Retry {
       this.logger.info('Stage 2 Retry: Completed', {
         total: companies.length,
         found,
-        notFound: companies.length - found
+        notFound: companies.length - found,
+        ...plan.skipped
       });
 
-      console.log('\n════════════════════════════════════════════');
-      console.log('📊 STAGE 2 RETRY SUMMARY');
-      console.log('════════════════════════════════════════════');
-      console.log(`Total Retried: ${companies.length}`);
-      console.log(`Websites Found: ${found} (${(found/companies.length*100).toFixed(1)}%)`);
-      console.log(`Still Missing: ${companies.length - found}`);
-      console.log('════════════════════════════════════════════\n');
-
       return {
         success: true,
         total: companies.length,
-        found
+        found,
+        skipped: plan.skipped,
+        nextRetryAt: plan.nextRetryAt
       };
 
     } catch (error) {
@@ -125,8 +151,6 @@ class Stage2Retry {
         error: error.message,
         stack: error.stack
       });
-      console.error('❌ Stage 2 Retry ERROR:', error.message);
-      console.error('   Stack:', error.stack);
       throw error;
     }
   }
@@ -137,8 +161,6 @@ class Stage2Retry {
     // 2. НЕ имеют website
     // 3. Имеют хоть какую-то информацию (описание или тема)
     
-    console.log('\n🔍 Stage 2 Retry: Searching for companies...');
-    
     const { data, error } = await this.db.supabase
       .from('pending_companies')
       .select('company_id, company_name, description, topic_description, stage2_status, current_stage, website')
@@ -149,11 +171,10 @@ class Stage2Retry {
       this.logger.error('Stage 2 Retry: Failed to get companies', { 
         error: error.message 
       });
-      console.error('❌ Stage 2 Retry: Database error:', error.message);
       throw error;
     }
     
-    console.log(`   Found ${data?.length || 0} companies matching criteria`);
+    log.debug('Companies matching criteria', { count: data?.length || 0 });
     
     // Фильтровать компании с минимальной информацией
     const filtered = (data || []).filter(company => {
@@ -161,8 +182,6 @@ class Stage2Retry {
       return company.description || company.topic_description || company.company_name;
     });
     
-    console.log(`   After filtering: ${filtered.length} companies`);
-    
     this.logger.info(`Stage 2 Retry: Found ${filtered.length} companies for retry`, {
       totalMatched: data?.length || 0,
       afterFiltering: filtered.length
@@ -171,29 +190,21 @@ class Stage2Retry {
     return filtered;
   }
 
-  async _retryWebsiteSearch(company) {
-    this.logger.info('Stage 2 Retry: Searching website with DeepSeek', {
+  /**
+   * Одна попытка поиска сайта через канал из плана RetryScheduler
+   * @param {Object} company
+   * @param {Object} channel - { provider: deepseek|sonar, strategy: 1|2 }
+   * @returns {Promise<{success, website, outcome, failureClass}>}
+   */
+  async _attemptWebsiteSearch(company, channel) {
+    const attemptNumber = channel.strategy;
+    this.logger.info('Stage 2 Retry: Searching website', {
       company: company.company_name,
+      provider: channel.provider,
+      attempt: attemptNumber,
       hasDescription: !!company.description
     });
 
-    // ПОПЫТКА 1
-    let result = await this._attemptWebsiteSearch(company, 1);
-    if (result.success) {
-      return result;
-    }
-
-    // ПОПЫТКА 2: Если первая не удалась
-    console.log(`      🔄 Attempt 2/2 with alternative prompt...`);
-    this.logger.info('Stage 2 Retry: Second attempt', {
-      company: company.company_name
-    });
-    
-    result = await this._attemptWebsiteSearch(company, 2);
-    return result;
-  }
-
-  async _attemptWebsiteSearch(company, attemptNumber) {
     try {
       // Разные промпты для разных попыток
       const searchHint = attemptNumber === 1
@@ -244,8 +255,9 @@ class Stage2Retry {
 
 Верни ТОЛЬКО JSON, без комментариев!`;
 
-      // Использовать DeepSeek Chat для поиска
-      const response = await this.deepseek.query(prompt, {
+      // DeepSeek Chat (или Sonar - последний канал) для поиска
+      const client = channel.provider === 'sonar' ? this.sonar : this.deepseek;
+      const response = await client.query(prompt, {
         maxTokens: 500,
         temperature: attemptNumber === 1 ? 0.3 : 0.5, // Больше креативности во 2-й попытке
         systemPrompt: 'You are an expert at finding Chinese company websites using Chinese search engines and business directories. You have access to web search.',
@@ -253,7 +265,7 @@ class Stage2Retry {
       });
 
       // Парсить JSON ответ
-      const result = this._parseResponse(response);
+      const result = await this._parseResponse(response);
       
       if (result.website) {
         // Валидировать URL
@@ -311,7 +323,7 @@ class Stage2Retry {
             stage2_status: 'completed',
             current_stage: 2, // Готов для Stage 3
             stage2_raw_data: {
-              source: 'deepseek_retry',
+              source: `${channel.provider}_retry`,
               response: response.substring(0, 1000),
               confidence: result.confidence,
               timestamp: new Date().toISOString()
@@ -342,12 +354,13 @@ class Stage2Retry {
             confidence: result.confidence
           });
 
-          return { success: true, website: finalWebsite, email: result.email };
+          return { success: true, website: finalWebsite, email: result.email, outcome: 'found', failureClass: null };
         } else {
           this.logger.warn('Stage 2 Retry: Invalid or marketplace website', {
             company: company.company_name,
             website: result.website
           });
+          return { success: true, website: null, outcome: 'not_found', failureClass: 'invalid_result' };
         }
       }
 
@@ -355,26 +368,25 @@ class Stage2Retry {
         company: company.company_name
       });
 
-      return { success: true, website: null };
+      return { success: true, website: null, outcome: 'not_found', failureClass: 'no_result' };
 
     } catch (error) {
       this.logger.error('Stage 2 Retry: Error searching website', {
         company: company.company_name,
         error: error.message
       });
-      return { success: false, error: error.message };
+      return { success: false, error: error.message, outcome: 'error', failureClass: retryScheduler.classifyError(error) };
     }
   }
 
-  _parseResponse(response) {
+  async _parseResponse(response) {
     try {
-      // Убрать markdown если есть
-      let jsonText = response.trim();
-      if (jsonText.startsWith('```')) {
-        jsonText = jsonText.replace(/```json\n?/g, '').replace(/```\n?/g, '');
+      // Убрать markdown если есть (большие ответы - в потоке ParsePool)
+      const { data: parsed, error } = await parsePool.parseResponse(response, { stripFences: true, whole: true });
+      if (error) {
+        throw new Error(error);
       }
 
-      const parsed = JSON.parse(jsonText);
       return {
         website: parsed.website || null,
         email: parsed.email || null,
@@ -387,9 +399,9 @@ class Stage2Retry {
       });
       
       // Попытка извлечь URL из текста
-      const urlMatch = response.match(/https?:\/\/[^\s"<>]+/);
+      const { websites } = await parsePool.extractContacts(response);
       return {
-        website: urlMatch ? urlMatch[0] : null,
+        website: websites[0] || null,
         source: 'text_extraction',
         confidence: 'low'
       };
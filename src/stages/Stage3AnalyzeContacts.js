@@ -4,6 +4,12 @@
  */
 const TagExtractor = require('../utils/TagExtractor');
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const log = require('../services/Logger').child('stage3');
+const clusterStore = require('../services/ClusterStore');
+const stageDispatcher = require('../services/StageDispatcher');
+const parsePool = require('../services/ParsePool');
+const rawPayloadStore = require('../services/RawPayloadStore');
+const retryScheduler = require('../services/RetryScheduler');
 
 class Stage3AnalyzeContacts {
   constructor(sonarClient, settingsManager, database, logger) {
@@ -14,6 +20,7 @@ class Stage3AnalyzeContacts {
     this.tagExtractor = new TagExtractor();
     this.domainPriority = domainPriorityManager;
     this.globalProgressCallback = null; // Callback для global прогресса (SSE)
+    this.job = null; // Персистентное задание (global режим)
   }
 
   /**
@@ -23,6 +30,13 @@ class Stage3AnalyzeContacts {
     this.globalProgressCallback = callback;
   }
 
+  /**
+   * Установить персистентное задание (global режим, см. GlobalJobManager)
+   */
+  setJob(job) {
+    this.job = job;
+  }
+
   async execute(sessionId = null) {
     // sessionId теперь опциональный - если не указан, обрабатываем ВСЕ компании
     this.logger.info('Stage 3: Starting contact analysis', { 
@@ -30,28 +44,27 @@ class Stage3AnalyzeContacts {
       mode: sessionId ? 'session' : 'global'
     });
     
-    console.log('\n========== STAGE 3 STARTING ==========');
-    console.log(`Mode: ${sessionId ? 'Session-based' : 'Global'}`);
-    console.log(`Session ID: ${sessionId || 'ALL'}`);
-    console.log('======================================\n');
-
     try {
       // Получить компании с найденными сайтами
-      const companies = await this._getCompanies(sessionId);
+      let companies = await this._getCompanies(sessionId);
       
-      console.log(`\n✅ Found ${companies.length} companies ready for Stage 3`);
-      if (companies.length > 0) {
-        console.log('First 3 companies:', companies.slice(0, 3).map(c => ({
+      // Задание: только компании снимка, еще не отмеченные в журнале
+      if (this.job) {
+        companies = await this.job.claim(companies);
+      }
+      const carriedFailed = this.job ? this.job.carriedFailed : 0;
+      
+      log.debug('Companies ready for Stage 3', {
+        count: companies.length,
+        sample: companies.slice(0, 3).map(c => ({
           name: c.company_name,
           website: c.website,
           stage2_status: c.stage2_status
-        })));
-      }
-      console.log('');
+        }))
+      });
       
-      if (companies.length === 0) {
+      if (companies.length === 0 && carriedFailed === 0) {
         this.logger.info('Stage 3: No companies need email search');
-        console.log('⚠️  No companies need email search\n');
         return { success: true, processed: 0, found: 0 };
       }
 
@@ -71,7 +84,16 @@ class Stage3AnalyzeContacts {
       let processedCount = 0;
       const totalCompanies = companies.length;
       
-      for (let i = 0; i < companies.length; i += concurrentRequests) {
+      // Распределенный режим: компании обрабатывают stage worker'ы, локальный цикл пропускается
+      if (this.job && clusterStore.isDistributed()) {
+        results.push(...await stageDispatcher.dispatchCompanies(
+          this.job, companies, this.globalProgressCallback,
+          r => !!(r.skipped || (r.success && r.emails && r.emails.length > 0))
+        ));
+        processedCount = companies.length;
+      }
+      
+      for (let i = processedCount; i < companies.length; i += concurrentRequests) {
         const batch = companies.slice(i, i + concurrentRequests);
         
         // Обновить global прогресс перед обработкой
@@ -83,11 +105,19 @@ class Stage3AnalyzeContacts {
           progress: `${processedCount}/${totalCompanies}`
         });
 
+        if (this.job) {
+          await this.job.begin(batch);
+        }
+
         // sessionId больше не нужен в _analyzeContacts
         const batchResults = await Promise.all(
           batch.map(company => this._analyzeContacts(company))
         );
 
+        if (this.job) {
+          await this.job.complete(batch, batchResults.map(r => !!(r.success && r.emails && r.emails.length > 0)));
+        }
+
         results.push(...batchResults);
         processedCount += batch.length;
         
@@ -113,14 +143,6 @@ class Stage3AnalyzeContacts {
         sessionId: sessionId || 'ALL'
       });
 
-      // Вывести результаты в консоль для немедленной диагностики
-      console.log('\n========== STAGE 3 RESULTS ==========');
-      console.log(`Total Companies: ${companies.length}`);
-      console.log(`Email Found: ${successful} (${(successful/companies.length*100).toFixed(1)}%)`);
-      console.log(`Email NOT Found: ${failed} (${(failed/companies.length*100).toFixed(1)}%)`);
-      console.log(`Used Fallback: ${hadFallback}`);
-      console.log('====================================\n');
-
       // Сохранить детальный отчет в файл
       try {
         await this._saveDetailedReport({
@@ -136,58 +158,45 @@ class Stage3AnalyzeContacts {
           error: reportError.message,
           stack: reportError.stack
         });
-        console.error('❌ Failed to save Stage 3 report:', reportError.message);
       }
 
       // 🔄 АВТОМАТИЧЕСКИЙ ЗАПУСК STAGE 3 RETRY
       // Если есть компании без email - запустить Stage 3 Retry автоматически
-      console.log(`\n🔍 DEBUG: Checking if Stage 3 Retry should run...`);
-      console.log(`   Failed count: ${failed}`);
-      console.log(`   Condition (failed > 0): ${failed > 0}`);
+      log.debug('Stage 3 Retry check', { failed });
       
-      if (failed > 0) {
-        console.log('\n🔄 Starting Stage 3 Retry automatically...');
-        console.log(`   Companies without email: ${failed}`);
+      // После resume компании без email из прошлых запусков тоже идут в Retry
+      if (failed + carriedFailed > 0) {
+        log.info('Starting Stage 3 Retry automatically', { companiesWithoutEmail: failed + carriedFailed });
         
         try {
-          console.log('   Loading Stage3Retry class...');
           const Stage3Retry = require('./Stage3Retry');
           const DeepSeekClient = require('../services/DeepSeekClient');
           
-          console.log('   Creating DeepSeek client...');
           // Создать DeepSeek клиент
           const deepseekApiKey = process.env.DEEPSEEK_API_KEY || 'sk-85323bc753cb4b25b02a2664e9367f8a';
-          console.log(`   DeepSeek API key exists: ${!!deepseekApiKey} (length: ${deepseekApiKey?.length || 0})`);
+          log.debug('DeepSeek client for Stage 3 Retry', { hasApiKey: !!deepseekApiKey });
           const deepseekClient = new DeepSeekClient(deepseekApiKey, this.logger, 'chat');
           
-          console.log('   Creating Stage3Retry instance...');
           // Создать Stage3Retry
           const stage3Retry = new Stage3Retry(
             this.db,
             this.logger,
             this.settings,
-            deepseekClient
+            deepseekClient,
+            this.sonar
           );
           
           // Передать globalProgressCallback в Stage3Retry
           if (this.globalProgressCallback) {
-            console.log('   Setting global progress callback for Stage3Retry...');
             stage3Retry.setGlobalProgressCallback(this.globalProgressCallback);
             // Передать текущий прогресс (processedCount) как offset
-            console.log(`   Setting progress offset to ${processedCount} (already processed in Stage 3)`);
+            log.debug('Stage 3 Retry progress offset', { offset: processedCount });
             stage3Retry.setProgressOffset(processedCount);
           }
           
-          console.log('   Executing Stage 3 Retry...');
           // Запустить retry
           const retryResult = await stage3Retry.execute();
           
-          console.log('\n========== STAGE 3 RETRY RESULTS ==========');
-          console.log(`Total Companies Retried: ${retryResult.total}`);
-          console.log(`Additional Emails Found: ${retryResult.found}`);
-          console.log(`Still No Email: ${retryResult.total - retryResult.found}`);
-          console.log('===========================================\n');
-          
           this.logger.info('Stage 3 Retry: Completed automatically', {
             retriedCompanies: retryResult.total,
             additionalEmailsFound: retryResult.found
@@ -208,12 +217,10 @@ class Stage3AnalyzeContacts {
             error: retryError.message,
             stack: retryError.stack
           });
-          console.error('❌ Stage 3 Retry failed:', retryError.message);
-          console.error('   Stack trace:', retryError.stack);
           // Продолжаем даже если retry упал
         }
       } else {
-        console.log('   ℹ️ Skipping Stage 3 Retry - all companies have email');
+        log.debug('Skipping Stage 3 Retry - all companies have email');
       }
 
       return {
@@ -231,7 +238,7 @@ class Stage3AnalyzeContacts {
     }
   }
 
-  async _getCompanies(sessionId = null) {
+  async _getCompanies(sessionId = null, companyIds = null) {
     // ИСПРАВЛЕНО: Получить компании готовые для Stage 3
     // Условия:
     // 1. Есть сайт (website IS NOT NULL)
@@ -252,6 +259,11 @@ class Stage3AnalyzeContacts {
       query = query.eq('session_id', sessionId);
     }
     
+    // Только указанные компании (stage worker перепроверяет, что компания еще не обработана)
+    if (companyIds) {
+      query = query.in('company_id', companyIds);
+    }
+    
     const { data, error } = await query;
     
     if (error) {
@@ -270,12 +282,11 @@ class Stage3AnalyzeContacts {
   async _analyzeContacts(company) {
     // sessionId больше не нужен - компания уже имеет session_id
     try {
-      console.log(`\n🔍 Processing company: ${company.company_name}`);
-      console.log(`   Website: ${company.website}`);
+      log.debug('Processing company', { company: company.company_name, website: company.website });
       
       // Извлекаем главный домен из URL
       const mainDomain = this._extractMainDomain(company.website);
-      console.log(`   Main domain: ${mainDomain}`);
+      log.debug('Main domain', { company: company.company_name, mainDomain });
       
       const prompt = `Найди EMAIL-АДРЕС (НЕ ТЕЛЕФОН!) для этой компании через поиск в интернете:
 
@@ -326,41 +337,35 @@ class Stage3AnalyzeContacts {
 
 ВЕРНИ ТОЛЬКО JSON, без дополнительного текста.`;
 
-      console.log(`   🤖 Sending query to Perplexity AI...`);
-      
       const response = await this.sonar.query(prompt, {
         stage: 'stage3_analyze_contacts',
         useCache: false  // Отключаем кэш для свежих результатов
       });
       
       if (!response) {
-        console.log(`   ⚠️  WARNING: Got empty response from Perplexity!`);
         this.logger.warn('Stage 3: Empty response from Perplexity', {
           company: company.company_name,
           website: company.website
         });
       }
       
-      console.log(`   ✅ Got AI response (${response ? response.length : 0} chars)`);
-
       this.logger.info('Stage 3: Sonar response received', {
         company: company.company_name,
         responseLength: response ? response.length : 0,
         hasResponse: !!response
       });
 
-      const result = this._parseResponse(response);
+      const result = await this._parseResponse(response);
       
-      console.log(`   📧 Emails found: ${result.emails.length}`);
-      if (result.emails.length > 0) {
-        console.log(`   ✉️  ${result.emails.join(', ')}`);
-      } else {
-        console.log(`   ❌ No emails: ${result.note || 'Unknown reason'}`);
-      }
+      log.debug('Emails parsed', {
+        company: company.company_name,
+        emails: result.emails,
+        note: result.emails.length === 0 ? (result.note || 'Unknown reason') : undefined
+      });
       
       // 🎁 BONUS: Проверка на случайно найденный website
       if (result.website) {
-        console.log(`   🌐 BONUS: Website found: ${result.website}`);
+        log.debug('BONUS: website found', { company: company.company_name, website: result.website });
       }
 
       this.logger.info('Stage 3: Response parsed', {
@@ -391,7 +396,7 @@ class Stage3AnalyzeContacts {
           stage: 'contacts_found',
           stage3_status: 'completed',
           current_stage: 3, // Готов для Stage 4
-          stage3_raw_data: rawData,
+          stage3_raw_data: await rawPayloadStore.pack(rawData),
           updated_at: new Date().toISOString()
         };
         
@@ -489,6 +494,14 @@ class Stage3AnalyzeContacts {
           });
         }
 
+        // Журнал попыток для Stage3Retry (основной проход - strategy 0)
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage3',
+          provider: 'sonar',
+          outcome: 'found'
+        });
+
         this.logger.info('Stage 3: Email found', {
           company: company.company_name,
           email: primaryEmail,
@@ -524,7 +537,7 @@ class Stage3AnalyzeContacts {
             stage: 'site_analyzed',
             stage3_status: 'failed',
             current_stage: 2, // Остается на Stage 2 (нет email)
-            stage3_raw_data: rawDataNoEmail,
+            stage3_raw_data: await rawPayloadStore.pack(rawDataNoEmail),
             updated_at: new Date().toISOString()
           })
           .eq('company_id', company.company_id);
@@ -536,6 +549,14 @@ class Stage3AnalyzeContacts {
           });
         }
 
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage3',
+          provider: 'sonar',
+          outcome: 'not_found',
+          failureClass: 'no_result'
+        });
+
         this.logger.warn('Stage 3: No email found', {
           company: company.company_name,
           website: company.website,
@@ -556,6 +577,13 @@ class Stage3AnalyzeContacts {
         company: company.company_name,
         error: error.message
       });
+      await retryScheduler.record({
+        companyId: company.company_id,
+        stage: 'stage3',
+        provider: 'sonar',
+        outcome: 'error',
+        failureClass: retryScheduler.classifyError(error)
+      });
       return { 
         success: false, 
         emails: [], 
@@ -604,7 +632,7 @@ class Stage3AnalyzeContacts {
         useCache: false  // КЭШ ОТКЛЮЧЕН
       });
 
-      const result = this._parseResponse(response);
+      const result = await this._parseResponse(response);
 
       if (result.emails.length > 0) {
         const primaryEmail = result.emails[0];
@@ -624,7 +652,7 @@ class Stage3AnalyzeContacts {
             email: primaryEmail,
             contacts_json: { ...result, fallback: true },
             stage: 'contacts_found',
-            stage3_raw_data: rawData,
+            stage3_raw_data: await rawPayloadStore.pack(rawData),
             updated_at: new Date().toISOString()
           })
           .eq('company_id', company.company_id);
@@ -686,14 +714,18 @@ class Stage3AnalyzeContacts {
     }
   }
 
-  _parseResponse(response) {
+  async _parseResponse(response) {
     try {
-      const jsonMatch = response.match(/\{[\s\S]*\}/);
-      if (!jsonMatch) {
+      // Большие ответы парсятся в потоке ParsePool
+      const parsed = await parsePool.parseResponse(response);
+      if (!parsed.found) {
         return { emails: [], note: 'Invalid response format' };
       }
+      if (parsed.error) {
+        throw new Error(parsed.error);
+      }
 
-      const data = JSON.parse(jsonMatch[0]);
+      const data = parsed.data;
       
       // Фильтровать emails, удаляя телефоны и невалидные адреса
       let emails = Array.isArray(data.emails) ? data.emails : [];
@@ -1,18 +1,25 @@
 const axios = require('axios');
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const log = require('../services/Logger').child('stage3-retry');
+const parsePool = require('../services/ParsePool');
+const retryScheduler = require('../services/RetryScheduler');
 
 /**
  * Stage3Retry - Повторный поиск email используя DeepSeek
  * 
  * Для компаний, которые прошли Stage 3, но не получили email.
  * Использует DeepSeek Chat с более агрессивным промптом.
+ *
+ * Очередь и канал (DeepSeek промпт 1 -> промпт 2 -> Sonar) для каждой компании
+ * выбирает RetryScheduler по журналу попыток company_attempts.
  */
 class Stage3Retry {
-  constructor(db, logger, settings, deepseek) {
+  constructor(db, logger, settings, deepseek, sonar = null) {
     this.db = db;
     this.logger = logger;
     this.settings = settings;
     this.deepseek = deepseek;
+    this.sonar = sonar; // Последний, самый дорогой канал (если передан)
     this.domainPriority = domainPriorityManager;
     this.globalProgressCallback = null; // Callback для global прогресса (SSE)
     this.progressOffset = 0; // Начальный offset для прогресса
@@ -34,37 +41,44 @@ class Stage3Retry {
 
   async execute() {
     this.logger.info('Stage 3 Retry: Starting retry for companies without email');
-    console.log('\n════════════════════════════════════════════');
-    console.log('🔄 STAGE 3 RETRY: DeepSeek Email Search');
-    console.log('════════════════════════════════════════════\n');
 
     try {
       // Получить компании готовые для повторного поиска
-      const companies = await this._getCompanies();
+      const candidates = await this._getCompanies();
+
+      // План по журналу попыток: пауза, бюджет, канал, порядок по ожидаемому успеху
+      const plan = await retryScheduler.plan('stage3', candidates, {
+        providers: this.sonar ? ['deepseek', 'sonar'] : ['deepseek'],
+        prior: company => (company.website ? 1 : 0.6)
+      });
+      const companies = plan.scheduled.map(item => item.company);
       
       if (companies.length === 0) {
-        this.logger.info('Stage 3 Retry: No companies need retry');
-        console.log('ℹ️  No companies found for retry');
-        console.log('   All companies either have email or lack sufficient data\n');
+        this.logger.info('Stage 3 Retry: No companies need retry', {
+          candidates: candidates.length,
+          ...plan.skipped,
+          nextRetryAt: plan.nextRetryAt
+        });
         return {
           success: true,
           total: 0,
-          found: 0
+          found: 0,
+          skipped: plan.skipped,
+          nextRetryAt: plan.nextRetryAt
         };
       }
 
       this.logger.info('Stage 3 Retry: Processing companies', {
-        count: companies.length
+        count: companies.length,
+        candidates: candidates.length,
+        ...plan.skipped
       });
 
-      console.log(`\n✅ Found ${companies.length} companies to retry`);
-      console.log('   Starting email search with DeepSeek...\n');
-
       // Обновить total в GlobalProgressEmitter (если callback установлен)
       // Новый total = offset (уже обработано в Stage 3) + companies.length (будет обработано в retry)
       if (this.globalProgressCallback && this.globalProgressCallback.updateTotal) {
         const newTotal = this.progressOffset + companies.length;
-        console.log(`   Updating total: ${newTotal} (${this.progressOffset} + ${companies.length})`);
+        log.debug('Updating total', { total: newTotal, offset: this.progressOffset, retry: companies.length });
         this.globalProgressCallback.updateTotal(newTotal);
       }
 
@@ -72,21 +86,37 @@ class Stage3Retry {
       let processedCount = this.progressOffset; // Начать с offset
 
       // Обрабатывать последовательно (DeepSeek медленнее)
-      for (let i = 0; i < companies.length; i++) {
-        const company = companies[i];
-        console.log(`   [${i + 1}/${companies.length}] ${company.company_name}...`);
+      for (let i = 0; i < plan.scheduled.length; i++) {
+        const { company, channel, expectedSuccess } = plan.scheduled[i];
+        log.debug('Retrying company', {
+          index: i + 1,
+          total: companies.length,
+          company: company.company_name,
+          provider: channel.provider,
+          strategy: channel.strategy,
+          expectedSuccess
+        });
         
         // Обновить global прогресс ПЕРЕД обработкой
         if (this.globalProgressCallback) {
           this.globalProgressCallback(processedCount, company.company_name);
         }
         
-        const result = await this._retryEmailSearch(company);
+        const result = await this._attemptEmailSearch(company, channel);
+        await retryScheduler.record({
+          companyId: company.company_id,
+          stage: 'stage3',
+          provider: channel.provider,
+          strategy: channel.strategy,
+          outcome: result.outcome,
+          failureClass: result.failureClass
+        });
+
         if (result.success && result.email) {
           found++;
-          console.log(`      ✅ Email found: ${result.email}`);
+          log.debug('Email found', { company: company.company_name, email: result.email });
         } else {
-          console.log(`      ❌ No email found`);
+          log.debug('No email found', { company: company.company_name });
         }
         
         processedCount++;
@@ -103,21 +133,16 @@ class Stage3Retry {
       this.logger.info('Stage 3 Retry: Completed', {
         total: companies.length,
         found,
-        notFound: companies.length - found
+        notFound: companies.length - found,
+        ...plan.skipped
       });
 
-      console.log('\n════════════════════════════════════════════');
-      console.log('📊 STAGE 3 RETRY SUMMARY');
-      console.log('════════════════════════════════════════════');
-      console.log(`Total Retried: ${companies.length}`);
-      console.log(`Emails Found: ${found} (${(found/companies.length*100).toFixed(1)}%)`);
-      console.log(`Still Missing: ${companies.length - found}`);
-      console.log('════════════════════════════════════════════\n');
-
       return {
         success: true,
         total: companies.length,
-        found
+        found,
+        skipped: plan.skipped,
+        nextRetryAt: plan.nextRetryAt
       };
 
     } catch (error) {
@@ -125,8 +150,6 @@ class Stage3Retry {
         error: error.message,
         stack: error.stack
       });
-      console.error('❌ Stage 3 Retry ERROR:', error.message);
-      console.error('   Stack:', error.stack);
       throw error;
     }
   }
@@ -137,8 +160,6 @@ class Stage3Retry {
     // 2. НЕ имеют email
     // 3. Имеют хоть какую-то информацию (описание или тема)
     
-    console.log('\n🔍 Stage 3 Retry: Searching for companies...');
-    
     const { data, error } = await this.db.supabase
       .from('pending_companies')
       .select('company_id, company_name, website, description, topic_description, stage3_status, current_stage, email')
@@ -156,11 +177,10 @@ class Stage3Retry {
       this.logger.error('Stage 3 Retry: Failed to get companies', { 
         error: error.message 
       });
-      console.error('❌ Stage 3 Retry: Database error:', error.message);
       throw error;
     }
     
-    console.log(`   Found ${data?.length || 0} companies matching criteria`);
+    log.debug('Companies matching criteria', { count: data?.length || 0 });
     
     // Фильтровать компании с минимальной информацией
     const filtered = (data || []).filter(company => {
@@ -168,10 +188,6 @@ class Stage3Retry {
       return company.website || company.description || company.topic_description;
     });
     
-    console.log(`   After filtering: ${filtered.length} companies`);
-    console.log(`   - With website: ${filtered.filter(c => c.website).length}`);
-    console.log(`   - Without website: ${filtered.filter(c => !c.website).length}`);
-    
     this.logger.info(`Stage 3 Retry: Found ${filtered.length} companies for retry`, {
       totalMatched: data?.length || 0,
       withWebsite: filtered.filter(c => c.website).length,
@@ -181,30 +197,22 @@ class Stage3Retry {
     return filtered;
   }
 
-  async _retryEmailSearch(company) {
-    this.logger.info('Stage 3 Retry: Searching email with DeepSeek', {
+  /**
+   * Одна попытка поиска email через канал из плана RetryScheduler
+   * @param {Object} company
+   * @param {Object} channel - { provider: deepseek|sonar, strategy: 1|2 }
+   * @returns {Promise<{success, email, outcome, failureClass}>}
+   */
+  async _attemptEmailSearch(company, channel) {
+    const attemptNumber = channel.strategy;
+    this.logger.info('Stage 3 Retry: Searching email', {
       company: company.company_name,
+      provider: channel.provider,
+      attempt: attemptNumber,
       website: company.website || 'NO WEBSITE',
       hasDescription: !!company.description
     });
 
-    // ПОПЫТКА 1
-    let result = await this._attemptEmailSearch(company, 1);
-    if (result.success) {
-      return result;
-    }
-
-    // ПОПЫТКА 2: Если первая не удалась
-    console.log(`      🔄 Attempt 2/2 with aggressive search...`);
-    this.logger.info('Stage 3 Retry: Second attempt', {
-      company: company.company_name
-    });
-    
-    result = await this._attemptEmailSearch(company, 2);
-    return result;
-  }
-
-  async _attemptEmailSearch(company, attemptNumber) {
     try {
       // Разный промпт для компаний с сайтом и без
       let prompt;
@@ -306,8 +314,9 @@ ${searchStrategy}
 Верни ТОЛЬКО JSON, без комментариев!`;
       }
 
-      // Использовать DeepSeek Chat для поиска
-      const response = await this.deepseek.query(prompt, {
+      // DeepSeek Chat (или Sonar - последний канал) для поиска
+      const client = channel.provider === 'sonar' ? this.sonar : this.deepseek;
+      const response = await client.query(prompt, {
         maxTokens: 500,
         temperature: attemptNumber === 1 ? 0.3 : 0.6, // Больше креативности во 2-й попытке
         systemPrompt: 'You are an expert at finding corporate contact information. You have access to web search and can find emails on company websites and business directories.',
@@ -315,7 +324,7 @@ ${searchStrategy}
       });
 
       // Парсить JSON ответ
-      const result = this._parseResponse(response);
+      const result = await this._parseResponse(response);
       
       if (result.email) {
         // Валидировать email
@@ -326,7 +335,7 @@ ${searchStrategy}
             stage3_status: 'completed',
             current_stage: 3,
             stage3_raw_data: {
-              source: 'deepseek_retry',
+              source: `${channel.provider}_retry`,
               response: response.substring(0, 1000),
               confidence: result.confidence,
               timestamp: new Date().toISOString()
@@ -429,12 +438,13 @@ ${searchStrategy}
             confidence: result.confidence
           });
 
-          return { success: true, email: result.email, website: result.website };
+          return { success: true, email: result.email, website: result.website, outcome: 'found', failureClass: null };
         } else {
           this.logger.warn('Stage 3 Retry: Invalid email format', {
             company: company.company_name,
             email: result.email
           });
+          return { success: true, email: null, outcome: 'not_found', failureClass: 'invalid_result' };
         }
       }
 
@@ -442,26 +452,25 @@ ${searchStrategy}
         company: company.company_name
       });
 
-      return { success: true, email: null };
+      return { success: true, email: null, outcome: 'not_found', failureClass: 'no_result' };
 
     } catch (error) {
       this.logger.error('Stage 3 Retry: Error searching email', {
         company: company.company_name,
         error: error.message
       });
-      return { success: false, error: error.message };
+      return { success: false, error: error.message, outcome: 'error', failureClass: retryScheduler.classifyError(error) };
     }
   }
 
-  _parseResponse(response) {
+  async _parseResponse(response) {
     try {
-      // Убрать markdown если есть
-      let jsonText = response.trim();
-      if (jsonText.startsWith('```')) {
-        jsonText = jsonText.replace(/```json\n?/g, '').replace(/```\n?/g, '');
+      // Убрать markdown если есть (большие ответы - в потоке ParsePool)
+      const { data: parsed, error } = await parsePool.parseResponse(response, { stripFences: true, whole: true });
+      if (error) {
+        throw new Error(error);
       }
 
-      const parsed = JSON.parse(jsonText);
       return {
         email: parsed.email || null,
         website: parsed.website || null,
@@ -474,9 +483,9 @@ ${searchStrategy}
       });
       
       // Попытка извлечь email из текста
-      const emailMatch = response.match(/[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}/);
+      const { emails } = await parsePool.extractContacts(response);
       return {
-        email: emailMatch ? emailMatch[0] : null,
+        email: emails[0] || null,
         source: 'text_extraction',
         confidence: 'low'
       };
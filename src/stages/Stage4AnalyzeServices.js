@@ -7,6 +7,11 @@
  * 4. Оценки уверенности в данных
  */
 const domainPriorityManager = require('../utils/DomainPriorityManager');
+const clusterStore = require('../services/ClusterStore');
+const stageDispatcher = require('../services/StageDispatcher');
+const parsePool = require('../services/ParsePool');
+const rawPayloadStore = require('../services/RawPayloadStore');
+const log = require('../services/Logger').child('stage4');
 
 class Stage4AnalyzeServices {
   constructor(deepseekClient, settingsManager, database, logger) {
@@ -16,6 +21,7 @@ class Stage4AnalyzeServices {
     this.logger = logger;
     this.domainPriority = domainPriorityManager;
     this.globalProgressCallback = null; // Callback для global прогресса (SSE)
+    this.job = null; // Персистентное задание (global режим)
   }
 
   /**
@@ -25,42 +31,31 @@ class Stage4AnalyzeServices {
     this.globalProgressCallback = callback;
   }
 
+  /**
+   * Установить персистентное задание (global режим, см. GlobalJobManager)
+   */
+  setJob(job) {
+    this.job = job;
+  }
+
   async execute(sessionId = null) {
     // sessionId теперь опциональный - если не указан, обрабатываем ВСЕ компании
-    this.logger.info('Stage 4: Starting AI enrichment and validation', { 
+    log.info('Stage 4: Starting AI enrichment and validation', { 
       sessionId: sessionId || 'ALL',
       mode: sessionId ? 'session' : 'global'
     });
 
     try {
       // Получить компании готовые для Stage 4
-      let query = this.db.supabase
-        .from('pending_companies')
-        .select(`
-          company_id, company_name, website, email, description, services, 
-          session_id, search_query_text, topic_description,
-          tag1, tag2, tag3, tag4, tag5, tag6, tag7, tag8, tag9, tag10,
-          tag11, tag12, tag13, tag14, tag15, tag16, tag17, tag18, tag19, tag20,
-          stage1_raw_data, stage2_raw_data, stage3_raw_data, stage,
-          current_stage, stage4_status
-        `)
-        .gte('current_stage', 3) // Минимум Stage 3 завершен
-        .is('stage4_status', null); // Только те у кого Stage 4 еще не обработан
+      let companies = await this._getCompanies(sessionId);
       
-      // Если указан sessionId, фильтруем только эту сессию
-      if (sessionId) {
-        query = query.eq('session_id', sessionId);
-      }
-
-      const { data: companies, error: companiesError } = await query;
-
-      if (companiesError) {
-        this.logger.error('Stage 4: Failed to get companies', { error: companiesError.message });
-        throw companiesError;
+      // Задание: только компании снимка, еще не отмеченные в журнале
+      if (this.job) {
+        companies = await this.job.claim(companies || []);
       }
       
       if (!companies || companies.length === 0) {
-        this.logger.info('Stage 4: No companies ready for validation', {
+        log.info('Stage 4: No companies ready for validation', {
           sessionId: sessionId || 'ALL',
           reason: 'Either all processed or none passed Stage 3'
         });
@@ -73,7 +68,7 @@ class Stage4AnalyzeServices {
         };
       }
       
-      this.logger.info('Stage 4: Loaded companies with topics', {
+      log.info('Stage 4: Loaded companies with topics', {
         companies: companies.length,
         mode: sessionId ? 'session-based' : 'all-companies'
       });
@@ -81,8 +76,9 @@ class Stage4AnalyzeServices {
       let validated = 0;
       let rejected = 0;
       let needsReview = 0;
+      let failed = 0;
 
-      this.logger.info('Stage 4: Processing companies with DeepSeek Chat', {
+      log.info('Stage 4: Processing companies with DeepSeek Chat', {
         total: companies.length,
         sessionId: sessionId || 'ALL'
       });
@@ -97,7 +93,25 @@ class Stage4AnalyzeServices {
       let processedCount = 0;
       const totalCompanies = companies.length;
       
-      for (let i = 0; i < companies.length; i += BATCH_SIZE) {
+      // Распределенный режим: компании обрабатывают stage worker'ы (processCompany)
+      if (this.job && clusterStore.isDistributed()) {
+        // Задача, отброшенная после MAX_ATTEMPTS ({success: false, error}), вердикта
+        // не записала - в журнале failed, resume обработает ее снова
+        const results = await stageDispatcher.dispatchCompanies(
+          this.job, companies, this.globalProgressCallback, r => r.success !== false && !r.error
+        );
+        results.forEach(result => {
+          // skipped - вердикт записан раньше, в статистику этого запуска не входит
+          if (result.skipped) return;
+          if (result.success === false || result.error) failed++;
+          else if (result.stage === 'completed') validated++;
+          else if (result.stage === 'rejected') rejected++;
+          else needsReview++;
+        });
+        processedCount = companies.length;
+      }
+      
+      for (let i = processedCount; i < companies.length; i += BATCH_SIZE) {
         const batch = companies.slice(i, i + BATCH_SIZE);
         
         // Обновить global прогресс перед обработкой батча
@@ -105,13 +119,17 @@ class Stage4AnalyzeServices {
           this.globalProgressCallback(processedCount, batch[0]?.company_name);
         }
         
-        this.logger.debug('Stage 4: Processing batch', {
+        log.debug('Stage 4: Processing batch', {
           batch: Math.floor(i / BATCH_SIZE) + 1,
           total: Math.ceil(companies.length / BATCH_SIZE),
           companies: batch.length,
           progress: `${processedCount}/${totalCompanies}`
         });
         
+        if (this.job) {
+          await this.job.begin(batch);
+        }
+        
         // Обработать батч параллельно, каждая компания использует свою topic_description
         const batchResults = await Promise.all(
           batch.map(company => {
@@ -133,135 +151,7 @@ class Stage4AnalyzeServices {
           const company = batch[j];
           const result = batchResults[j];
           
-          const updateData = {
-            stage: result.stage,
-            stage4_status: result.stage === 'completed' ? 'completed' : 
-                           result.stage === 'rejected' ? 'rejected' : 'needs_review',
-            current_stage: 4, // Финальный этап
-            validation_score: result.score,
-            validation_reason: result.reason,
-            ai_generated_description: result.aiDescription,
-            ai_confidence_score: result.confidence,
-            updated_at: new Date().toISOString()
-          };
-          
-          // Добавляем services если есть
-          if (result.services) {
-            updateData.services = result.services;
-          }
-          
-          // Добавляем теги если есть
-          for (let k = 1; k <= 20; k++) {
-            const tagKey = `tag${k}`;
-            if (result.tags && result.tags[tagKey]) {
-              updateData[tagKey] = result.tags[tagKey];
-            }
-          }
-          
-          // 🎁 BONUS: Если DeepSeek нашел website в raw_data
-          let websiteWasAdded = false;
-          if (result.website) {
-            let finalWebsite = result.website;
-            let normalizedDomain = this._extractMainDomain(result.website);
-            let shouldUpdate = false;
-            
-            if (!company.website) {
-              // У компании нет website → добавить
-              shouldUpdate = true;
-              this.logger.warn('🎁 BONUS: Website found opportunistically in Stage 4', {
-                company: company.company_name,
-                website: result.website,
-                normalized_domain: normalizedDomain
-              });
-            } else {
-              // У компании уже есть website → проверить TLD
-              const isSameCompany = this.domainPriority.isSameCompany(
-                company.website,
-                result.website
-              );
-              
-              if (isSameCompany) {
-                // Та же компания → сравнить TLD
-                const comparison = this.domainPriority.compare(
-                  result.website,
-                  company.website
-                );
-                
-                if (comparison < 0) {
-                  // Новый TLD лучше
-                  shouldUpdate = true;
-                  finalWebsite = result.website;
-                  normalizedDomain = this._extractMainDomain(result.website);
-                  this.logger.info('Stage 4: Better TLD found opportunistically', {
-                    company: company.company_name,
-                    oldDomain: company.website,
-                    oldTLD: this.domainPriority.extractTld(company.website),
-                    newDomain: result.website,
-                    newTLD: this.domainPriority.extractTld(result.website),
-                    decision: 'UPDATE to better TLD'
-                  });
-                } else {
-                  // Старый TLD лучше или равен
-                  this.logger.debug('Stage 4: Keeping existing TLD', {
-                    company: company.company_name,
-                    existingDomain: company.website,
-                    foundDomain: result.website,
-                    decision: 'KEEP existing TLD'
-                  });
-                }
-              } else {
-                // Разные компании → обновить
-                shouldUpdate = true;
-                this.logger.info('Stage 4: Different domain found opportunistically', {
-                  company: company.company_name,
-                  oldBaseDomain: this.domainPriority.extractBaseDomain(company.website),
-                  newBaseDomain: this.domainPriority.extractBaseDomain(result.website),
-                  decision: 'UPDATE to new domain'
-                });
-              }
-            }
-            
-            if (shouldUpdate) {
-              updateData.website = finalWebsite;
-              updateData.normalized_domain = normalizedDomain;
-              websiteWasAdded = true;
-            }
-          }
-          
-          // 🎁 BONUS: Если DeepSeek нашел email в raw_data И у компании его еще нет
-          let emailWasAdded = false;
-          if (result.email && !company.email) {
-            updateData.email = result.email;
-            emailWasAdded = true;
-            this.logger.warn('🎁 BONUS: Email found opportunistically in Stage 4', {
-              company: company.company_name,
-              email: result.email
-            });
-          }
-          
-          // ВАЖНО: Если нашли website, но НЕ нашли email
-          // Нужно вернуть компанию на Stage 3 для поиска email
-          if (websiteWasAdded && !result.email && !company.email) {
-            updateData.stage3_status = null;      // Сбросить Stage 3
-            updateData.current_stage = 2;         // Вернуть на Stage 2 (готов для Stage 3)
-            updateData.stage4_status = 'pending'; // Stage 4 будет позже
-            this.logger.info('🔄 Stage 4: Website added without email, will retry Stage 3 then Stage 4', {
-              company: company.company_name,
-              newWebsite: result.website
-            });
-          }
-          
-          const { error: updateError } = await this.db.supabase
-            .from('pending_companies')
-            .update(updateData)
-            .eq('company_id', company.company_id);
-          
-          if (updateError) {
-            this.logger.error('Stage 4: Failed to update company', {
-              company: company.company_name,
-              error: updateError.message
-            });
-          }
+          await this._saveResult(company, result);
           
           if (result.stage === 'completed') {
             validated++;
@@ -272,17 +162,23 @@ class Stage4AnalyzeServices {
           }
         }
         
+        // Вердикт (validated/rejected/needs_review) записан - компания завершена
+        if (this.job) {
+          await this.job.complete(batch, batch.map(() => true));
+        }
+        
         // Задержка между батчами
         if (i + BATCH_SIZE < companies.length) {
           await this._sleep(DELAY_BETWEEN_BATCHES);
         }
       }
 
-      this.logger.info('Stage 4: AI enrichment completed', {
+      log.info('Stage 4: AI enrichment completed', {
         total: companies.length,
         validated,
         rejected,
         needsReview,
+        failed,
         sessionId: sessionId || 'ALL'
       });
 
@@ -291,11 +187,12 @@ class Stage4AnalyzeServices {
         total: companies.length,
         validated,
         rejected,
-        needsReview
+        needsReview,
+        failed
       };
 
     } catch (error) {
-      this.logger.error('Stage 4: AI enrichment failed', {
+      log.error('Stage 4: AI enrichment failed', {
         error: error.message,
         sessionId: sessionId || 'ALL'
       });
@@ -303,6 +200,188 @@ class Stage4AnalyzeServices {
     }
   }
 
+  /**
+   * Компании готовые для Stage 4
+   * @param {string|null} sessionId - только эта сессия
+   * @param {Array<string>|null} companyIds - только эти компании (stage worker)
+   */
+  async _getCompanies(sessionId = null, companyIds = null) {
+    let query = this.db.supabase
+      .from('pending_companies')
+      .select(`
+        company_id, company_name, website, email, description, services, 
+        session_id, search_query_text, topic_description,
+        tag1, tag2, tag3, tag4, tag5, tag6, tag7, tag8, tag9, tag10,
+        tag11, tag12, tag13, tag14, tag15, tag16, tag17, tag18, tag19, tag20,
+        stage1_raw_data, stage2_raw_data, stage3_raw_data, stage,
+        current_stage, stage4_status
+      `)
+      .gte('current_stage', 3) // Минимум Stage 3 завершен
+      .is('stage4_status', null); // Только те у кого Stage 4 еще не обработан
+    
+    // Если указан sessionId, фильтруем только эту сессию
+    if (sessionId) {
+      query = query.eq('session_id', sessionId);
+    }
+    if (companyIds) {
+      query = query.in('company_id', companyIds);
+    }
+
+    const { data, error } = await query;
+
+    if (error) {
+      log.error('Stage 4: Failed to get companies', { error: error.message });
+      throw error;
+    }
+    return data || [];
+  }
+
+  /**
+   * Обработать одну компанию целиком: AI валидация + запись результата
+   * (используется stage worker'ом в распределенном режиме)
+   */
+  async processCompany(company) {
+    const mainTopic = company.topic_description || company.search_query_text || 'Unknown topic';
+    const result = await this._enrichAndValidateCompany(company, mainTopic);
+    await this._saveResult(company, result);
+    return result;
+  }
+
+  /**
+   * Записать результат валидации компании
+   */
+  async _saveResult(company, result) {
+    const updateData = {
+      stage: result.stage,
+      stage4_status: result.stage === 'completed' ? 'completed' : 
+                     result.stage === 'rejected' ? 'rejected' : 'needs_review',
+      current_stage: 4, // Финальный этап
+      validation_score: result.score,
+      validation_reason: result.reason,
+      ai_generated_description: result.aiDescription,
+      ai_confidence_score: result.confidence,
+      updated_at: new Date().toISOString()
+    };
+    
+    // Добавляем services если есть
+    if (result.services) {
+      updateData.services = result.services;
+    }
+    
+    // Добавляем теги если есть
+    for (let k = 1; k <= 20; k++) {
+      const tagKey = `tag${k}`;
+      if (result.tags && result.tags[tagKey]) {
+        updateData[tagKey] = result.tags[tagKey];
+      }
+    }
+    
+    // 🎁 BONUS: Если DeepSeek нашел website в raw_data
+    let websiteWasAdded = false;
+    if (result.website) {
+      let finalWebsite = result.website;
+      let normalizedDomain = this._extractMainDomain(result.website);
+      let shouldUpdate = false;
+      
+      if (!company.website) {
+        // У компании нет website → добавить
+        shouldUpdate = true;
+        log.warn('🎁 BONUS: Website found opportunistically in Stage 4', {
+          company: company.company_name,
+          website: result.website,
+          normalized_domain: normalizedDomain
+        });
+      } else {
+        // У компании уже есть website → проверить TLD
+        const isSameCompany = this.domainPriority.isSameCompany(
+          company.website,
+          result.website
+        );
+        
+        if (isSameCompany) {
+          // Та же компания → сравнить TLD
+          const comparison = this.domainPriority.compare(
+            result.website,
+            company.website
+          );
+          
+          if (comparison < 0) {
+            // Новый TLD лучше
+            shouldUpdate = true;
+            finalWebsite = result.website;
+            normalizedDomain = this._extractMainDomain(result.website);
+            log.info('Stage 4: Better TLD found opportunistically', {
+              company: company.company_name,
+              oldDomain: company.website,
+              oldTLD: this.domainPriority.extractTld(company.website),
+              newDomain: result.website,
+              newTLD: this.domainPriority.extractTld(result.website),
+              decision: 'UPDATE to better TLD'
+            });
+          } else {
+            // Старый TLD лучше или равен
+            log.debug('Stage 4: Keeping existing TLD', {
+              company: company.company_name,
+              existingDomain: company.website,
+              foundDomain: result.website,
+              decision: 'KEEP existing TLD'
+            });
+          }
+        } else {
+          // Разные компании → обновить
+          shouldUpdate = true;
+          log.info('Stage 4: Different domain found opportunistically', {
+            company: company.company_name,
+            oldBaseDomain: this.domainPriority.extractBaseDomain(company.website),
+            newBaseDomain: this.domainPriority.extractBaseDomain(result.website),
+            decision: 'UPDATE to new domain'
+          });
+        }
+      }
+      
+      if (shouldUpdate) {
+        updateData.website = finalWebsite;
+        updateData.normalized_domain = normalizedDomain;
+        websiteWasAdded = true;
+      }
+    }
+    
+    // 🎁 BONUS: Если DeepSeek нашел email в raw_data И у компании его еще нет
+    let emailWasAdded = false;
+    if (result.email && !company.email) {
+      updateData.email = result.email;
+      emailWasAdded = true;
+      log.warn('🎁 BONUS: Email found opportunistically in Stage 4', {
+        company: company.company_name,
+        email: result.email
+      });
+    }
+    
+    // ВАЖНО: Если нашли website, но НЕ нашли email
+    // Нужно вернуть компанию на Stage 3 для поиска email
+    if (websiteWasAdded && !result.email && !company.email) {
+      updateData.stage3_status = null;      // Сбросить Stage 3
+      updateData.current_stage = 2;         // Вернуть на Stage 2 (готов для Stage 3)
+      updateData.stage4_status = 'pending'; // Stage 4 будет позже
+      log.info('🔄 Stage 4: Website added without email, will retry Stage 3 then Stage 4', {
+        company: company.company_name,
+        newWebsite: result.website
+      });
+    }
+    
+    const { error: updateError } = await this.db.supabase
+      .from('pending_companies')
+      .update(updateData)
+      .eq('company_id', company.company_id);
+    
+    if (updateError) {
+      log.error('Stage 4: Failed to update company', {
+        company: company.company_name,
+        error: updateError.message
+      });
+    }
+  }
+
   /**
    * Обогатить и валидировать компанию через DeepSeek Reasoner
    * Собирает ВСЮ информацию от всех этапов
@@ -314,6 +393,9 @@ class Stage4AnalyzeServices {
         return this._basicValidation(company);
       }
 
+      // Сырые ответы Stage 1-3 хранятся в raw_payloads - подгрузить для промпта
+      await rawPayloadStore.resolveRows([company]);
+
       // Собрать ВСЮ информацию от всех этапов
       const allData = this._collectAllData(company);
       
@@ -342,9 +424,9 @@ class Stage4AnalyzeServices {
       });
       
       // Парсить ответ
-      const result = this._parseEnrichmentResponse(response, company);
+      const result = await this._parseEnrichmentResponse(response, company);
       
-      this.logger.debug('Stage 4: Company enriched', {
+      log.debug('Stage 4: Company enriched', {
         company: company.company_name,
         relevance: result.score,
         confidence: result.confidence
@@ -353,7 +435,7 @@ class Stage4AnalyzeServices {
       return result;
 
     } catch (error) {
-      this.logger.error('Stage 4: Company enrichment error', {
+      log.error('Stage 4: Company enrichment error', {
         company: company.company_name,
         error: error.message
       });
@@ -475,7 +557,7 @@ Return JSON:
   /**
    * Парсить ответ от DeepSeek Reasoner
    */
-  _parseEnrichmentResponse(response, company) {
+  async _parseEnrichmentResponse(response, company) {
     try {
       // Проверить что response не пустой
       if (!response || response.trim().length === 0) {
@@ -483,14 +565,14 @@ Return JSON:
       }
       
       // DeepSeek Reasoner может возвращать рассуждения перед JSON
-      // Ищем JSON блок в любой части ответа
-      const jsonMatch = response.match(/\{[\s\S]*\}/);
-      if (!jsonMatch) {
+      // Ищем JSON блок в любой части ответа (большие ответы - в потоке ParsePool)
+      const parsed = await parsePool.parseResponse(response);
+      if (!parsed.found) {
         // Если нет полного JSON, попробуем найти начало
         const partialMatch = response.match(/\{\s*"relevance"[\s\S]*/);
         if (partialMatch) {
           // Есть начало JSON, но он обрезан - попробуем восстановить
-          this.logger.warn('Partial JSON detected, attempting to reconstruct', {
+          log.warn('Partial JSON detected, attempting to reconstruct', {
             preview: partialMatch[0].substring(0, 200)
           });
           
@@ -509,21 +591,11 @@ Return JSON:
         throw new Error('No JSON in response');
       }
 
-      let jsonText = jsonMatch[0];
-      
-      // Проверить закрыт ли JSON
-      if (!jsonText.endsWith('}')) {
-        this.logger.warn('JSON appears truncated, attempting to fix');
-        // Попробуем закрыть незакрытые структуры
-        const openBraces = (jsonText.match(/\{/g) || []).length;
-        const closeBraces = (jsonText.match(/\}/g) || []).length;
-        
-        if (openBraces > closeBraces) {
-          jsonText += '}'.repeat(openBraces - closeBraces);
-        }
+      if (parsed.error) {
+        throw new Error(parsed.error);
       }
 
-      const data = JSON.parse(jsonText);
+      const data = parsed.data;
       
       // Убрали деление на категории - теперь все компании просто 'completed'
       // Главный параметр - это рейтинг релевантности (score)
@@ -550,7 +622,7 @@ Return JSON:
       };
 
     } catch (error) {
-      this.logger.error('Failed to parse enrichment response', {
+      log.error('Failed to parse enrichment response', {
         error: error.message,
         responseLength: response ? response.length : 0,
         responsePreview: response ? response.substring(0, 500) : 'empty'
@@ -654,7 +726,7 @@ Return JSON:
       
       return hostname;
     } catch (error) {
-      this.logger.warn('Stage 4: Failed to extract domain', { url, error: error.message });
+      log.warn('Stage 4: Failed to extract domain', { url, error: error.message });
       return null;
     }
   }
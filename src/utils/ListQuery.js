@@ -0,0 +1,200 @@
+const crypto = require('crypto');
+
+/**
+ * ListQuery - Общие части списочных эндпоинтов (компании и т.п.)
+ *
+ *   limit   - размер страницы (ограничен сверху, limit=0 - только total)
+ *   cursor  - keyset курсор: next_cursor из предыдущего ответа
+ *   fields  - проекция: fields=company_id,website,email
+ *   count   - как считать total: estimated (по умолчанию) | exact | planned | none
+ *
+ * Keyset пагинация идет по стабильному порядку (например created_at, company_id):
+ * следующая страница - строки "после" последней строки предыдущей. В отличие
+ * от offset, стоимость запроса не растет с номером страницы и размером таблицы.
+ *
+ * Ответ отдается с weak ETag: повторный запрос с If-None-Match получает 304.
+ */
+
+const COUNT_MODES = ['exact', 'planned', 'estimated', 'none'];
+const FIELD_REGEX = /^[a-z][a-z0-9_]*$/;
+
+function badRequest(message) {
+  const error = new Error(message);
+  error.statusCode = 400;
+  return error;
+}
+
+/**
+ * Разобрать общие параметры запроса
+ * @param {Object} query - req.query
+ * @param {Object} options
+ * @param {number} options.defaultLimit
+ * @param {number} options.maxLimit
+ * @param {Array<string>} options.keyColumns - колонки порядка, всегда попадают в проекцию
+ * @returns {{limit: number, cursor: Array|null, fields: Array<string>|null, count: string|null}}
+ */
+function parseListParams(query, options) {
+  const { defaultLimit = 100, maxLimit = 1000, keyColumns = [] } = options;
+
+  let limit = query.limit === undefined ? defaultLimit : parseInt(query.limit);
+  if (!Number.isInteger(limit) || limit < 0) {
+    throw badRequest('limit must be a non-negative integer');
+  }
+  limit = Math.min(limit, maxLimit);
+
+  let fields = null;
+  if (query.fields) {
+    fields = String(query.fields).split(',').map(field => field.trim()).filter(Boolean);
+    const invalid = fields.find(field => !FIELD_REGEX.test(field));
+    if (invalid) {
+      throw badRequest(`Invalid field: ${invalid}`);
+    }
+    // Колонки порядка нужны для next_cursor
+    keyColumns.forEach(column => {
+      if (!fields.includes(column)) fields.push(column);
+    });
+  }
+
+  const count = query.count || 'estimated';
+  if (!COUNT_MODES.includes(count)) {
+    throw badRequest(`count must be one of: ${COUNT_MODES.join(', ')}`);
+  }
+
+  return {
+    limit,
+    cursor: query.cursor ? decodeCursor(query.cursor, keyColumns.length) : null,
+    fields,
+    count: count === 'none' ? null : count
+  };
+}
+
+/**
+ * Курсор - значения колонок порядка последней строки страницы (base64url JSON)
+ */
+function encodeCursor(row, keyColumns) {
+  return Buffer.from(JSON.stringify(keyColumns.map(column => row[column]))).toString('base64url');
+}
+
+function decodeCursor(cursor, size) {
+  try {
+    const values = JSON.parse(Buffer.from(String(cursor), 'base64url').toString('utf8'));
+    if (Array.isArray(values) && values.length === size && values.every(value => value !== null && value !== undefined)) {
+      return values;
+    }
+  } catch (error) {
+    // ниже - общая ошибка
+  }
+  throw badRequest('Invalid cursor');
+}
+
+/**
+ * Условие "строка после курсора" для порядка (a, b):
+ *   по возрастанию: a > $a OR (a = $a AND b > $b)
+ *   по убыванию:    a < $a OR (a = $a AND b < $b)
+ */
+function applyKeyset(query, cursor, keyColumns, { ascending = true } = {}) {
+  if (!cursor) return query;
+
+  const op = ascending ? 'gt' : 'lt';
+  const [first, second] = keyColumns;
+  const [firstValue, secondValue] = cursor.map(quote);
+  return query.or(`${first}.${op}.${firstValue},and(${first}.eq.${firstValue},${second}.${op}.${secondValue})`);
+}
+
+/**
+ * Значение для or()/and() фильтров PostgREST: в кавычках можно передавать
+ * ',', '.', ':', '(' (timestamp, поисковая строка)
+ */
+function quote(value) {
+  return `"${String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"')}"`;
+}
+
+/**
+ * next_cursor для ответа: null на последней странице
+ */
+function nextCursor(rows, limit, keyColumns) {
+  if (!rows || rows.length === 0 || rows.length < limit) return null;
+  return encodeCursor(rows[rows.length - 1], keyColumns);
+}
+
+/**
+ * Фильтр "колонка заполнена" (не NULL и не пустая строка)
+ * @param {string} value - 'true' | 'false' | undefined
+ */
+function applyPresence(query, column, value) {
+  if (value === 'true') {
+    return query.not(column, 'is', null).neq(column, '');
+  }
+  if (value === 'false') {
+    return query.or(`${column}.is.null,${column}.eq.""`);
+  }
+  return query;
+}
+
+/**
+ * supabase-js клиент для списков: SupabaseClient (app-simple) - db.supabase,
+ * HybridDatabase (app.js) - db.supabase.supabase, MockDatabase - null
+ * (тогда эндпоинт читает через db.query / directSelect)
+ */
+function supabaseClient(db) {
+  if (db?.supabase?.from) return db.supabase;
+  if (db?.supabase?.supabase?.from) return db.supabase.supabase;
+  return null;
+}
+
+/**
+ * Страница из уже загруженных строк (без supabase-js): тот же порядок,
+ * курсор и проекция, что и в запросе к БД
+ */
+function pageRows(rows, { limit, cursor, fields, keyColumns, ascending = true }) {
+  const compare = (a, b) => {
+    for (const column of keyColumns) {
+      if (a[column] < b[column]) return ascending ? -1 : 1;
+      if (a[column] > b[column]) return ascending ? 1 : -1;
+    }
+    return 0;
+  };
+  const cursorRow = cursor ? Object.fromEntries(keyColumns.map((column, index) => [column, cursor[index]])) : null;
+
+  const page = rows
+    .slice()
+    .sort(compare)
+    .filter(row => !cursorRow || compare(row, cursorRow) > 0)
+    .slice(0, limit);
+
+  return fields
+    ? page.map(row => Object.fromEntries(fields.map(field => [field, row[field]])))
+    : page;
+}
+
+/**
+ * Отправить JSON с weak ETag, 304 если клиент прислал тот же ETag
+ */
+function sendWithETag(req, res, body) {
+  const json = JSON.stringify(body);
+  const etag = `W/"${crypto.createHash('sha1').update(json).digest('base64url')}"`;
+
+  res.set('ETag', etag);
+  // Данные меняются во время обработки - клиент всегда перепроверяет
+  res.set('Cache-Control', 'private, no-cache');
+
+  const ifNoneMatch = req.get('If-None-Match');
+  if (ifNoneMatch && ifNoneMatch.split(',').map(tag => tag.trim()).includes(etag)) {
+    return res.status(304).end();
+  }
+
+  return res.type('json').send(json);
+}
+
+module.exports = {
+  parseListParams,
+  encodeCursor,
+  decodeCursor,
+  applyKeyset,
+  nextCursor,
+  applyPresence,
+  quote,
+  supabaseClient,
+  pageRows,
+  sendWithETag
+};
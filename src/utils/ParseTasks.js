@@ -0,0 +1,114 @@
+const TagExtractor = require('./TagExtractor');
+
+/**
+ * ParseTasks - CPU-тяжелые операции над ответами AI и таблицами
+ *
+ * Чистые функции без доступа к БД и логгеру: один и тот же код выполняется
+ * и в основном потоке (маленькие входные данные), и в worker_threads
+ * (src/workers/parseWorker.js). Вызывать через ParsePool, а не напрямую.
+ *
+ * Результат любой задачи должен быть structured-clone совместимым.
+ */
+
+const EMAIL_REGEX = /[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}/g;
+const URL_REGEX = /https?:\/\/[^\s"<>]+/g;
+
+const tagExtractor = new TagExtractor();
+
+/**
+ * Найти и распарсить JSON в ответе AI
+ * @param {string} text
+ * @param {Object} options
+ * @param {boolean} options.stripFences - убрать ```json ... ``` блоки
+ * @param {boolean} options.whole - парсить весь текст, а не первый {...} блок
+ * @returns {{found: boolean, data: any, error: string|null, json: string|null}}
+ *   json возвращается только при ошибке парсинга - для починки усеченного JSON
+ */
+function parseResponse(text, options = {}) {
+  let source = typeof text === 'string' ? text : '';
+
+  if (options.whole) {
+    source = source.trim();
+    if (options.stripFences && source.startsWith('```')) {
+      source = source.replace(/```json\n?/g, '').replace(/```\n?/g, '');
+    }
+  } else if (options.stripFences) {
+    source = source.replace(/```json\s*/g, '').replace(/```\s*/g, '');
+  }
+
+  let json = source;
+  if (!options.whole) {
+    const jsonMatch = source.match(/\{[\s\S]*\}/);
+    if (!jsonMatch) {
+      return { found: false, data: null, error: 'No JSON found in response', json: null };
+    }
+    json = jsonMatch[0];
+  }
+
+  try {
+    return { found: true, data: JSON.parse(json), error: null, json: null };
+  } catch (error) {
+    return { found: true, data: null, error: error.message, json };
+  }
+}
+
+/**
+ * Найти email и URL в произвольном тексте
+ * @param {string} text
+ * @returns {{emails: string[], websites: string[]}} в порядке появления, без повторов
+ */
+function extractContacts(text) {
+  const source = typeof text === 'string' ? text : '';
+  return {
+    emails: [...new Set(source.match(EMAIL_REGEX) || [])],
+    websites: [...new Set(source.match(URL_REGEX) || [])]
+  };
+}
+
+/**
+ * Теги и сервисы из описания компании (см. TagExtractor)
+ * @param {string} description
+ * @returns {{tags: Object, services: string|null}} tags - поля tag1..tag20
+ */
+function extractTags(description) {
+  return {
+    tags: tagExtractor.extractTagsForDB(description),
+    services: tagExtractor.extractServices(description)
+  };
+}
+
+/**
+ * Сериализовать таблицу для файла / скачивания
+ * @param {Object|Array} value
+ * @param {Object} options
+ * @param {string} options.format - json | csv (csv - только массив строк)
+ * @param {number} options.space - отступ JSON
+ * @returns {string}
+ */
+function serializeTable(value, options = {}) {
+  if (options.format === 'csv') {
+    const rows = Array.isArray(value) ? value : [];
+    const headers = Object.keys(rows[0] || {});
+    return [
+      headers.join(','),
+      ...rows.map(row =>
+        headers.map(header => {
+          const cell = row[header];
+          if (Array.isArray(cell)) {
+            return `"${cell.join('; ')}"`;
+          }
+          return `"${String(cell || '').replace(/"/g, '""')}"`;
+        }).join(',')
+      )
+    ].join('\n');
+  }
+
+  return JSON.stringify(value, null, options.space);
+}
+
+module.exports = {
+  parseResponse,
+  extractContacts,
+  extractTags,
+  serializeTable
+};
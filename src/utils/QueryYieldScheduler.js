@@ -0,0 +1,140 @@
+/**
+ * QueryYieldScheduler - Порядок и ранняя остановка запросов Stage 1
+ *
+ * Stage 1 выполнял все запросы сессии по порядку, даже когда нужное число
+ * компаний уже набрано или последние запросы возвращают только дубликаты.
+ *
+ * Планировщик одного запуска Stage 1:
+ *   - оценка запроса - прогноз новых компаний по похожим выполненным запросам
+ *     (QuerySimilarityIndex.predictYield); без истории - текущий выход этого запуска
+ *     (средний по последним window запросам, до первого батча - порог minMarginalYield)
+ *   - следующий батч - запросы с лучшей оценкой (при равенстве - исходный порядок по relevance)
+ *   - после батча фиксируется фактический выход: новые уникальные компании запроса
+ *   - остановка: набрано target компаний (target_reached) или средний выход последних
+ *     window запросов и лучшая оценка оставшихся ниже minMarginalYield (low_marginal_yield)
+ *   - запрос с ошибкой API (timeout, 429) - не нулевой выход: в выход и остановку не входит
+ */
+class QueryYieldScheduler {
+  /**
+   * @param {Array<Object>} queries - session_queries (query_id, query_cn, query_ru)
+   * @param {Object} options
+   * @param {Function} options.predict - queryText => прогноз новых компаний | null
+   * @param {number|null} options.target - нужное число новых компаний (null - без цели)
+   * @param {number} options.minMarginalYield - минимальный средний выход на запрос
+   * @param {number} options.window - по скольким последним запросам считать выход
+   */
+  constructor(queries, { predict = () => null, target = null, minMarginalYield = 1, window = 5 } = {}) {
+    this.target = target;
+    this.minMarginalYield = minMarginalYield;
+    this.window = Math.max(1, window);
+
+    this.pending = queries.map((query, index) => {
+      const text = query.query_cn || query.query_ru;
+      return { query, text, index, predicted: predict(text) };
+    });
+    this.executed = [];
+    this.failed = [];
+    this.uniqueTotal = 0;
+    this.stopReason = null;
+  }
+
+  get remaining() {
+    return this.pending.length;
+  }
+
+  /**
+   * Следующий батч - лучшие по оценке запросы; null - выполнять больше нечего
+   */
+  nextBatch(size) {
+    if (this.stopReason || this.pending.length === 0) return null;
+
+    this.pending.sort((a, b) => this._estimate(b) - this._estimate(a) || a.index - b.index);
+    return this.pending.splice(0, size);
+  }
+
+  /**
+   * Фактический результат запроса
+   * @param {Object} item - элемент батча
+   * @param {number} found - компаний в ответах Sonar
+   * @param {number} newUnique - из них новых (нет в этом запуске и в БД)
+   * @param {number} calls - вызовов Sonar (с повторным промптом - 2)
+   * @param {boolean} error - запрос упал (ошибка API)
+   */
+  record(item, { found, newUnique, calls, error = false }) {
+    if (error) {
+      this.failed.push(item);
+      return;
+    }
+    this.executed.push({ ...item, found, newUnique, calls });
+    this.uniqueTotal += newUnique;
+  }
+
+  /**
+   * Проверка после батча: причина остановки или null
+   */
+  checkStop() {
+    if (this.stopReason) return this.stopReason;
+    if (this.pending.length === 0) return null;
+
+    if (this.target && this.uniqueTotal >= this.target) {
+      this.stopReason = 'target_reached';
+    } else if (this.executed.length >= this.window) {
+      const bestRemaining = Math.max(...this.pending.map(item => this._estimate(item)));
+      if (this._marginalYield() < this.minMarginalYield && bestRemaining < this.minMarginalYield) {
+        this.stopReason = 'low_marginal_yield';
+      }
+    }
+
+    return this.stopReason;
+  }
+
+  /**
+   * Итог для отчета: сколько запросов выполнено и сколько вызовов Sonar сэкономлено
+   */
+  getSummary() {
+    const calls = this.executed.reduce((sum, run) => sum + run.calls, 0);
+    const callsPerQuery = this.executed.length ? calls / this.executed.length : 1;
+
+    return {
+      stopReason: this.stopReason || 'completed',
+      target: this.target,
+      minMarginalYield: this.minMarginalYield,
+      executed: this.executed.length,
+      failed: this.failed.length,
+      skipped: this.pending.length,
+      sonarCalls: calls,
+      // Пропущенный запрос - в среднем столько же вызовов, сколько выполненный
+      savedCalls: Math.round(this.pending.length * callsPerQuery),
+      newUnique: this.uniqueTotal,
+      runs: this.executed.map(run => ({
+        query: run.text,
+        predicted: run.predicted === null ? null : Math.round(run.predicted * 10) / 10,
+        found: run.found,
+        newUnique: run.newUnique
+      })),
+      failedQueries: this.failed.map(item => item.text),
+      skippedQueries: this.pending.map(item => item.text)
+    };
+  }
+
+  /**
+   * Средний выход последних window запросов: по мере насыщения темы падает
+   */
+  _marginalYield() {
+    const recent = this.executed.slice(-this.window);
+    return recent.reduce((sum, run) => sum + run.newUnique, 0) / recent.length;
+  }
+
+  /**
+   * Оценка выхода: прогноз по истории или текущий выход этого запуска.
+   * Пока ничего не выполнено, запрос без истории оценивается порогом: после
+   * запросов с хорошим прогнозом, но раньше запросов с прогнозом ниже порога
+   */
+  _estimate(item) {
+    if (item.predicted !== null && item.predicted !== undefined) return item.predicted;
+    if (this.executed.length === 0) return this.minMarginalYield;
+    return this._marginalYield();
+  }
+}
+
+module.exports = QueryYieldScheduler;
@@ -0,0 +1,21 @@
+/**
+ * Parse Worker - поток worker_threads для ParsePool
+ *
+ * Не запускается отдельно: ParsePool создает несколько таких потоков и
+ * отправляет задачи { id, task, input, options }. Ответ: { id, result }
+ * или { id, error }.
+ */
+
+const { parentPort } = require('worker_threads');
+const tasks = require('../utils/ParseTasks');
+
+parentPort.on('message', ({ id, task, input, options }) => {
+  try {
+    if (!tasks[task]) {
+      throw new Error(`Unknown parse task: ${task}`);
+    }
+    parentPort.postMessage({ id, result: tasks[task](input, options) });
+  } catch (error) {
+    parentPort.postMessage({ id, error: error.message });
+  }
+});
@@ -0,0 +1,291 @@
+#!/usr/bin/env node
+
+/**
+ * Stage Worker - Обработчик общей очереди задач в распределенном режиме
+ *
+ * Web процесс (app-simple.js) при CLUSTER_BACKEND=file|redis не обрабатывает
+ * компании сам, а кладет задачи в очередь (см. StageDispatcher). Этот процесс
+ * забирает задачи, выполняет их теми же методами stage и возвращает результат.
+ * Worker'ов можно запускать сколько угодно (ядра, реплики Railway) -
+ * лимит Sonar API общий для кластера (token bucket в ClusterStore).
+ *
+ * Очереди:
+ *   stage1      - один поисковый запрос (Stage1FindCompanies._processQuery)
+ *   stage2      - одна компания (Stage2FindWebsites._findWebsite)
+ *   stage3      - одна компания (Stage3AnalyzeContacts._analyzeContacts)
+ *   stage4      - одна компания (Stage4AnalyzeServices.processCompany)
+ *   translation - одна компания (TranslationService.translateCompany)
+ *
+ * Компания перед обработкой перечитывается выборкой stage: если ее уже
+ * обработали (повторная доставка после падения worker'а), API не вызывается.
+ *
+ * Запуск:
+ *   CLUSTER_BACKEND=redis REDIS_URL=redis://... node src/workers/stageWorker.js
+ *   CLUSTER_BACKEND=file node src/workers/stageWorker.js --queues stage2,stage3 --concurrency 2
+ *
+ * Без CLUSTER_BACKEND worker завершается с ошибкой, поэтому в Procfile его нет:
+ * для Railway сначала задать CLUSTER_BACKEND=redis и REDIS_URL (web и worker),
+ * затем добавить в Procfile строку
+ *   stage-worker: node src/workers/stageWorker.js
+ */
+
+const path = require('path');
+const os = require('os');
+require('dotenv').config({ path: path.join(__dirname, '../../.env') });
+
+const SupabaseClient = require('../database/SupabaseClient');
+const SettingsManager = require('../services/SettingsManager');
+const DeepSeekClient = require('../services/DeepSeekClient');
+const SonarApiClient = require('../services/SonarApiClient');
+const TranslationService = require('../services/TranslationService');
+const Stage1FindCompanies = require('../stages/Stage1FindCompanies');
+const Stage2FindWebsites = require('../stages/Stage2FindWebsites');
+const Stage3AnalyzeContacts = require('../stages/Stage3AnalyzeContacts');
+const Stage4AnalyzeServices = require('../stages/Stage4AnalyzeServices');
+const clusterStore = require('../services/ClusterStore');
+const globalJobManager = require('../services/GlobalJobManager');
+const rawPayloadStore = require('../services/RawPayloadStore');
+const retryScheduler = require('../services/RetryScheduler');
+const logManager = require('../services/Logger');
+
+const ALL_QUEUES = ['stage1', 'stage2', 'stage3', 'stage4', 'translation'];
+const IDLE_SLEEP_MS = 1000;
+const MAX_ATTEMPTS = 3;
+
+class StageWorker {
+  constructor(options = {}) {
+    this.logger = logManager.child('stage-worker');
+    this.workerId = `${os.hostname()}:${process.pid}`;
+    this.queues = options.queues || ALL_QUEUES;
+    this.concurrency = options.concurrency || 3;
+    this.isStopping = false;
+    this.stats = { processed: 0, failed: 0, redelivered: 0 };
+  }
+
+  async initialize() {
+    if (!clusterStore.isDistributed()) {
+      throw new Error('Stage worker requires CLUSTER_BACKEND=file or CLUSTER_BACKEND=redis');
+    }
+
+    this.db = new SupabaseClient(
+      process.env.SUPABASE_URL,
+      process.env.SUPABASE_ANON_KEY,
+      this.logger
+    );
+    await this.db.initialize();
+    globalJobManager.init(this.db);
+    rawPayloadStore.init(this.db);
+    retryScheduler.init(this.db);
+
+    this.settingsManager = new SettingsManager(this.db, this.logger);
+    await this.settingsManager.startWatching();
+    const settings = await this.settingsManager.getAllSettings();
+    logManager.configureFromSettings(settings.logging);
+    this.settingsManager.on('change', (snapshot) => {
+      logManager.configureFromSettings(snapshot.settings.logging);
+    });
+
+    // Клиенты - как в app-simple.js
+    const perplexityApiKey = process.env.PERPLEXITY_API_KEY || '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';
+    const deepseek = new DeepSeekClient(
+      process.env.DEEPSEEK_API_KEY || 'sk-85323bc753cb4b25b02a2664e9367f8a',
+      this.logger
+    );
+    const sonarBasic = new SonarApiClient(this.db, this.settingsManager, this.logger, 'sonar');
+    const sonarPro = new SonarApiClient(this.db, this.settingsManager, this.logger, 'sonar-pro');
+    await sonarBasic.initialize();
+    await sonarPro.initialize();
+    sonarBasic.apiKey = perplexityApiKey;
+    sonarPro.apiKey = perplexityApiKey;
+
+    this.stages = {
+      stage1: new Stage1FindCompanies(sonarPro, this.settingsManager, this.db, this.logger),
+      stage2: new Stage2FindWebsites(sonarBasic, this.settingsManager, this.db, this.logger),
+      stage3: new Stage3AnalyzeContacts(sonarBasic, this.settingsManager, this.db, this.logger),
+      stage4: new Stage4AnalyzeServices(deepseek, this.settingsManager, this.db, this.logger)
+    };
+    // Как в Stage4AnalyzeServices.execute()
+    deepseek.setModel('deepseek-chat');
+    this.translationService = new TranslationService(this.db, this.logger, settings);
+
+    this._setupShutdownHandlers();
+    this.logger.info('Stage worker ready', {
+      workerId: this.workerId,
+      backend: clusterStore.mode,
+      queues: this.queues,
+      concurrency: this.concurrency
+    });
+  }
+
+  async start() {
+    // Несколько независимых циклов = несколько задач параллельно
+    await Promise.all(
+      Array.from({ length: this.concurrency }, (_, slot) => this._runLoop(slot))
+    );
+    this.logger.info('Stage worker stopped', this.stats);
+  }
+
+  async _runLoop(slot) {
+    // Разные слоты начинают с разных очередей, чтобы не голодала ни одна
+    let next = slot % this.queues.length;
+
+    while (!this.isStopping) {
+      let task = null;
+      let queue = null;
+
+      for (let i = 0; i < this.queues.length && !task; i++) {
+        queue = this.queues[(next + i) % this.queues.length];
+        task = await clusterStore.reserve(queue, this.workerId).catch((error) => {
+          this.logger.error('Failed to reserve task', { queue, error: error.message });
+          return null;
+        });
+      }
+      next = (next + 1) % this.queues.length;
+
+      if (!task) {
+        await this._sleep(IDLE_SLEEP_MS);
+        continue;
+      }
+
+      await this._runTask(queue, task);
+    }
+  }
+
+  async _runTask(queue, task) {
+    const { payload } = task;
+    if (task.attempts > 1) this.stats.redelivered++;
+
+    try {
+      const result = await this._handlers()[queue](payload);
+
+      if (payload.groupKey) {
+        await clusterStore.putResult(payload.groupKey, payload.itemId, result);
+        await clusterStore.reportProgress(payload.groupKey, this.workerId, 1, result?.company || result?.company_name || null);
+      }
+      await clusterStore.ack(queue, task.id);
+      this.stats.processed++;
+
+    } catch (error) {
+      this.stats.failed++;
+      const outcome = await clusterStore.fail(queue, task.id, MAX_ATTEMPTS);
+      this.logger.error('Task failed', { queue, id: task.id, attempts: task.attempts, outcome, error: error.message });
+
+      // Больше попыток не будет - координатор не должен ждать вечно
+      if (outcome === 'dropped' && payload.groupKey) {
+        await clusterStore.putResult(payload.groupKey, payload.itemId, {
+          success: false,
+          error: error.message,
+          emails: []
+        });
+      }
+    }
+  }
+
+  _handlers() {
+    return {
+      stage1: async ({ searchQuery, sessionId, topicDescription }) => {
+        const stage1 = this.stages.stage1;
+        try {
+          const companies = await stage1._processQuery(searchQuery, sessionId, topicDescription);
+          return stage1.packQueryResult(companies);
+        } catch (error) {
+          // Как в локальном цикле: ошибка запроса = пустой результат
+          this.logger.error('Stage 1: Query failed', { query: searchQuery, error: error.message });
+          return stage1.packQueryResult([]);
+        }
+      },
+
+      stage2: payload => this._processCompany('stage2', payload,
+        company => this.stages.stage2._findWebsite(company), r => r.success),
+
+      stage3: payload => this._processCompany('stage3', payload,
+        company => this.stages.stage3._analyzeContacts(company),
+        r => !!(r.success && r.emails && r.emails.length > 0)),
+
+      stage4: payload => this._processCompany('stage4', payload,
+        company => this.stages.stage4.processCompany(company), r => r.success !== false && !r.error),
+
+      translation: ({ companyId }) => this.translationService.translateCompany(companyId)
+    };
+  }
+
+  /**
+   * Компания global задания: перепроверить, обработать, отметить в журнале
+   */
+  async _processCompany(stage, { jobId, companyId }, handler, isSuccess) {
+    const [company] = await this.stages[stage]._getCompanies(null, [companyId]);
+
+    if (!company) {
+      // Уже обработана (повторная доставка или параллельный запуск)
+      this.logger.info('Company already processed, skipping', { stage, companyId });
+      await globalJobManager.markItems(jobId, [companyId], 'completed');
+      return { success: true, skipped: true, emails: [] };
+    }
+
+    await globalJobManager.markItems(jobId, [companyId], 'in_flight');
+    const result = await handler(company);
+    await globalJobManager.markItems(jobId, [companyId], isSuccess(result) ? 'completed' : 'failed');
+    return result;
+  }
+
+  stop() {
+    this.logger.info('Stopping stage worker...');
+    this.isStopping = true;
+    this.settingsManager?.stopWatching();
+  }
+
+  _setupShutdownHandlers() {
+    const gracefulShutdown = (signal) => {
+      this.logger.info(`Received ${signal}, finishing current tasks...`);
+      this.stop();
+
+      // Незавершенные задачи вернутся в очередь по visibility timeout
+      setTimeout(async () => {
+        await clusterStore.close();
+        process.exit(0);
+      }, 5000);
+    };
+
+    process.on('SIGTERM', () => gracefulShutdown('SIGTERM'));
+    process.on('SIGINT', () => gracefulShutdown('SIGINT'));
+  }
+
+  _sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+  }
+}
+
+function parseArgs(argv) {
+  const options = {};
+  for (let i = 0; i < argv.length; i++) {
+    if (argv[i] === '--queues') options.queues = argv[++i].split(',').filter(q => ALL_QUEUES.includes(q));
+    if (argv[i] === '--concurrency') options.concurrency = parseInt(argv[++i]) || undefined;
+  }
+  if (!options.queues && process.env.STAGE_WORKER_QUEUES) {
+    options.queues = process.env.STAGE_WORKER_QUEUES.split(',').filter(q => ALL_QUEUES.includes(q));
+  }
+  if (!options.concurrency && process.env.STAGE_WORKER_CONCURRENCY) {
+    options.concurrency = parseInt(process.env.STAGE_WORKER_CONCURRENCY) || undefined;
+  }
+  return options;
+}
+
+// Запуск worker
+async function main() {
+  const worker = new StageWorker(parseArgs(process.argv.slice(2)));
+
+  try {
+    await worker.initialize();
+    await worker.start();
+  } catch (error) {
+    console.error('❌ Fatal error:', error);
+    process.exit(1);
+  }
+}
+
+// Запуск только если это главный модуль
+if (require.main === module) {
+  main();
+}
+
+module.exports = StageWorker;
@@ -17,55 +17,18 @@ require('dotenv').config({ path: path.join(__dirname, '../../.env') });
 const SupabaseClient = require('../database/SupabaseClient');
 const TranslationService = require('../services/TranslationService');
 const SettingsManager = require('../services/SettingsManager');
+const clusterStore = require('../services/ClusterStore');
 
-// Простой logger для worker
-class WorkerLogger {
-  constructor() {
-    this.startTime = Date.now();
-  }
-
-  _timestamp() {
-    const now = new Date();
-    return now.toISOString();
-  }
-
-  _uptime() {
-    const ms = Date.now() - this.startTime;
-    const seconds = Math.floor(ms / 1000);
-    const minutes = Math.floor(seconds / 60);
-    const hours = Math.floor(minutes / 60);
-    
-    if (hours > 0) {
-      return `${hours}h ${minutes % 60}m`;
-    } else if (minutes > 0) {
-      return `${minutes}m ${seconds % 60}s`;
-    } else {
-      return `${seconds}s`;
-    }
-  }
-
-  info(message, data = {}) {
-    console.log(`[${this._timestamp()}] [INFO] [${this._uptime()}] ${message}`, data);
-  }
+const logManager = require('../services/Logger');
 
-  warn(message, data = {}) {
-    console.log(`[${this._timestamp()}] [WARN] [${this._uptime()}] ${message}`, data);
-  }
-
-  error(message, data = {}) {
-    console.error(`[${this._timestamp()}] [ERROR] [${this._uptime()}] ${message}`, data);
-  }
-
-  debug(message, data = {}) {
-    if (process.env.DEBUG === 'true') {
-      console.log(`[${this._timestamp()}] [DEBUG] [${this._uptime()}] ${message}`, data);
-    }
-  }
+// Совместимость: DEBUG=true включает debug-логи worker'а
+if (process.env.DEBUG === 'true') {
+  logManager.configure({ modules: { 'translation-worker': 'debug' } });
 }
 
 class TranslationWorker {
   constructor() {
-    this.logger = new WorkerLogger();
+    this.logger = logManager.child('translation-worker');
     this.isRunning = false;
     this.isStopping = false;
     
@@ -100,16 +63,25 @@ class TranslationWorker {
       await this.db.initialize();
       this.logger.info('✅ Database connected');
       
-      // Загрузка настроек
+      // Загрузка настроек (снимок + уведомления об изменениях из API процесса)
       this.settingsManager = new SettingsManager(this.db, this.logger);
+      await this.settingsManager.startWatching();
       const settings = await this.settingsManager.getAllSettings();
       
       // Обновляем конфигурацию из settings
       // Настройки теперь в settings.translation объекте
-      const translationSettings = settings.translation || {};
-      this.config.batchSize = parseInt(translationSettings.batch_size) || 5;
-      this.config.intervalMs = parseInt(translationSettings.interval_ms) || 30000;
-      this.config.enabled = translationSettings.enabled === 'true';
+      this._applyTranslationSettings(settings);
+      logManager.configureFromSettings(settings.logging);
+      this.settingsManager.on('change', (snapshot) => {
+        this._applyTranslationSettings(snapshot.settings);
+        logManager.configureFromSettings(snapshot.settings.logging);
+        this.logger.info('📝 Settings updated', {
+          version: snapshot.version,
+          batchSize: this.config.batchSize,
+          intervalMs: this.config.intervalMs,
+          enabled: this.config.enabled
+        });
+      });
       
       this.logger.info('📝 Settings loaded', {
         batchSize: this.config.batchSize,
@@ -169,6 +141,13 @@ class TranslationWorker {
         
         if (companyIds.length === 0) {
           this.logger.info('✨ No companies need translation, sleeping...');
+        } else if (clusterStore.isDistributed()) {
+          // Распределенный режим: переводят stage worker'ы (очередь translation)
+          const added = await clusterStore.push('translation', companyIds.map(companyId => ({
+            id: String(companyId),
+            payload: { companyId }
+          })));
+          this.logger.info(`📤 Queued ${added} of ${companyIds.length} companies for stage workers`);
         } else {
           this.logger.info(`📋 Found ${companyIds.length} companies to translate`);
           
@@ -234,13 +213,10 @@ class TranslationWorker {
       
       try {
         const settings = await this.settingsManager.getAllSettings();
-        const translationSettings = settings.translation || {};
+        this._applyTranslationSettings(settings);
         
-        if (translationSettings.enabled === 'true') {
+        if (this.config.enabled) {
           this.logger.info('✅ Translation enabled, starting...');
-          this.config.enabled = true;
-          this.config.batchSize = parseInt(translationSettings.batch_size) || 5;
-          this.config.intervalMs = parseInt(translationSettings.interval_ms) || 30000;
           await this._runLoop();
           return;
         }
@@ -250,6 +226,13 @@ class TranslationWorker {
     }
   }
 
+  _applyTranslationSettings(settings) {
+    const translationSettings = settings.translation || {};
+    this.config.batchSize = parseInt(translationSettings.batch_size) || 5;
+    this.config.intervalMs = parseInt(translationSettings.interval_ms) || 30000;
+    this.config.enabled = translationSettings.enabled === 'true';
+  }
+
   stop() {
     if (!this.isRunning) {
       this.logger.warn('⚠️ Worker not running');
@@ -259,6 +242,7 @@ class TranslationWorker {
     this.logger.info('🛑 Stopping Translation Worker...');
     this.isStopping = true;
     this.isRunning = false;
+    this.settingsManager?.stopWatching();
     
     this._logStats();
   }
@@ -11,6 +11,19 @@ def log(emoji, msg, data=None):
     if data and isinstance(data, dict):
         print(json.dumps(data, indent=2, ensure_ascii=False))
 
+def count_companies(**filters):
+    """Количество компаний по фильтрам - считается в БД, без выгрузки списка"""
+    params = {"limit": 0, "count": "exact", "include_translations": "false", **filters}
+    response = requests.get(f"{BASE_URL}/api/debug/companies", params=params)
+    return response.json().get('total') or 0
+
+def list_companies(limit, **filters):
+    """Первые limit компаний по фильтрам, только нужные поля"""
+    params = {"limit": limit, "count": "none", "include_translations": "false",
+              "fields": "company_name,website,email,validation_score", **filters}
+    response = requests.get(f"{BASE_URL}/api/debug/companies", params=params)
+    return response.json().get('companies', [])
+
 def test_all_stages():
     print("\n" + "="*70)
     print("🧪 ПОЛНЫЙ ТЕСТ ВСЕХ ЭТАПОВ")
@@ -66,22 +79,21 @@ def test_all_stages():
     time.sleep(2)
     
     # Проверка базы после Stage 1
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
-    companies = response.json().get('companies', [])
+    total = count_companies()
     
-    print(f"  💾 В базе: {len(companies)} компаний")
-    with_website = sum(1 for c in companies if c.get('website'))
-    with_email = sum(1 for c in companies if c.get('email'))
-    print(f"  🌐 С сайтом: {with_website} ({with_website*100//len(companies) if companies else 0}%)")
-    print(f"  📧 С email: {with_email} ({with_email*100//len(companies) if companies else 0}%)")
+    print(f"  💾 В базе: {total} компаний")
+    with_website = count_companies(has_website="true")
+    with_email = count_companies(has_email="true")
+    print(f"  🌐 С сайтом: {with_website} ({with_website*100//total if total else 0}%)")
+    print(f"  📧 С email: {with_email} ({with_email*100//total if total else 0}%)")
     
-    if len(companies) == 0:
+    if total == 0:
         log("❌", "ОШИБКА: Компании не сохранились!")
         return False
     
     # Показать первые 3 компании
     print("\n  Первые 3 компании:")
-    for i, comp in enumerate(companies[:3], 1):
+    for i, comp in enumerate(list_companies(3), 1):
         print(f"  {i}. {comp.get('company_name')}")
         print(f"     🌐 {comp.get('website') or '❌ НЕТ'}")
         print(f"     📧 {comp.get('email') or '❌ НЕТ'}")
@@ -90,7 +102,7 @@ def test_all_stages():
     log("🌐", "═══ STAGE 2: Поиск сайтов ═══")
     
     # Проверим сколько компаний без сайтов
-    without_website = sum(1 for c in companies if not c.get('website'))
+    without_website = count_companies(has_website="false")
     print(f"  📊 Компаний БЕЗ сайта: {without_website}")
     
     if without_website > 0:
@@ -122,11 +134,8 @@ def test_all_stages():
     log("📧", "═══ STAGE 3: Поиск контактов ═══")
     
     # Обновим данные
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
-    companies = response.json().get('companies', [])
-    
-    with_website = sum(1 for c in companies if c.get('website'))
-    without_email = sum(1 for c in companies if c.get('website') and not c.get('email'))
+    with_website = count_companies(has_website="true")
+    without_email = count_companies(has_website="true", has_email="false")
     
     print(f"  📊 С сайтом: {with_website}")
     print(f"  📊 БЕЗ email: {without_email}")
@@ -159,10 +168,8 @@ def test_all_stages():
     log("🤖", "═══ STAGE 4: AI Валидация ═══")
     
     # Обновим данные
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
-    companies = response.json().get('companies', [])
-    
-    for_validation = sum(1 for c in companies if c.get('website') or c.get('email'))
+    # website ИЛИ email = все - (без сайта и без email)
+    for_validation = count_companies() - count_companies(has_website="false", has_email="false")
     print(f"  📊 Компаний для валидации: {for_validation}")
     
     if for_validation > 0:
@@ -193,13 +200,10 @@ def test_all_stages():
     # 7. ФИНАЛЬНАЯ СТАТИСТИКА
     log("📊", "═══ ФИНАЛЬНАЯ СТАТИСТИКА ═══")
     
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
-    companies = response.json().get('companies', [])
-    
-    total = len(companies)
-    with_website = sum(1 for c in companies if c.get('website'))
-    with_email = sum(1 for c in companies if c.get('email'))
-    validated = sum(1 for c in companies if c.get('validation_score'))
+    total = count_companies()
+    with_website = count_companies(has_website="true")
+    with_email = count_companies(has_email="true")
+    validated = count_companies(min_score=1)
     
     print(f"\n  📦 Всего компаний: {total}")
     print(f"  🌐 С сайтом: {with_website} ({with_website*100//total if total else 0}%)")
@@ -207,7 +211,7 @@ def test_all_stages():
     print(f"  ✅ Валидировано: {validated} ({validated*100//total if total else 0}%)")
     
     # Показать компании с email
-    companies_with_email = [c for c in companies if c.get('email')]
+    companies_with_email = list_companies(5, has_email="true")
     if companies_with_email:
         print(f"\n  📧 Компании с email:")
         for i, comp in enumerate(companies_with_email[:5], 1):
@@ -25,11 +25,12 @@ def test_full_flow():
     time.sleep(1)
     
     # Проверка что база пуста
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
-    companies = response.json().get('companies', [])
-    log("📊", f"Компаний в базе ПОСЛЕ очистки: {len(companies)}")
+    response = requests.get(f"{BASE_URL}/api/debug/companies",
+                            params={"limit": 0, "count": "exact", "include_translations": "false"})
+    remaining = response.json().get('total') or 0
+    log("📊", f"Компаний в базе ПОСЛЕ очистки: {remaining}")
     
-    if len(companies) > 0:
+    if remaining > 0:
         log("❌", "ОШИБКА: База не очищена!")
         return False
     
@@ -79,7 +80,8 @@ def test_full_flow():
     
     # Проверка базы после Stage 1
     time.sleep(2)
-    response = requests.get(f"{BASE_URL}/api/debug/companies")
+    response = requests.get(f"{BASE_URL}/api/debug/companies",
+                            params={"include_translations": "false", "fields": "company_name,website,email"})
     companies = response.json().get('companies', [])
     
     log("📊", f"Компаний сохранено в базу: {len(companies)}")
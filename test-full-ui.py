@@ -65,12 +65,12 @@ print("\n" + "="*70)
 print("📊 ПРОВЕРКА РЕЗУЛЬТАТОВ")
 print("="*70)
 
-response = requests.get(f"{BASE_URL}/api/debug/companies")
-all_companies = response.json().get('companies', [])
-
 for session_id, name in [(session1_id, "Сессия 1 (полностью обработана)"), 
                           (session2_id, "Сессия 2 (только Stage 1)")]:
-    companies = [c for c in all_companies if c.get('session_id') == session_id]
+    response = requests.get(f"{BASE_URL}/api/debug/companies", params={
+        "session_id": session_id, "include_translations": "false", "fields": "stage,website"
+    })
+    companies = response.json().get('companies', [])
     
     by_stage = {}
     for c in companies:
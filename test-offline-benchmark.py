@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк полного пайплайна против локальной заглушки AI API
+
+Запускает N сессий (тема -> под-запросы -> Stage 1..6) параллельно через
+ThreadPoolExecutor, как test-rate-limit-fix.py, но против scripts/stub-ai-server.js
+вместо реальных Sonar/DeepSeek. Результат - машиночитаемый JSON отчет:
+companies/min, p50/p95/p99 по стадиям (из /metrics), API вызовов на компанию,
+пиковый RSS процесса приложения, лаг event loop во время прогона.
+
+Лаг event loop до/после ParsePool (потоки разбора ответов):
+  PARSE_POOL_SIZE=0 npm start   -> отчет "до" (все в основном потоке)
+  npm start                     -> отчет "после", сравнить event_loop_lag_seconds
+
+Подготовка:
+  node scripts/stub-ai-server.js --port 8787 &
+  SONAR_BASE_URL=http://127.0.0.1:8787 DEEPSEEK_BASE_URL=http://127.0.0.1:8787/v1 npm start
+
+Запуск:
+  python3 test-offline-benchmark.py --sessions 4 --concurrency 2 --output benchmark.json
+  python3 test-offline-benchmark.py --start-stub --stub-args "--latency lognormal:300:0.5 --error-429 0.02"
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import requests
+
+# ===== НАСТРОЙКИ ПО УМОЛЧАНИЮ =====
+BASE_URL = "http://localhost:3030"
+STUB_URL = "http://127.0.0.1:8787"
+DEFAULT_TOPIC = "小批量数控加工服务"
+
+# Цвета для консоли
+GREEN = '\033[92m'
+RED = '\033[91m'
+YELLOW = '\033[93m'
+BLUE = '\033[94m'
+RESET = '\033[0m'
+
+
+def log(emoji, message, color=""):
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"{color}[{timestamp}] {emoji} {message}{RESET}", file=sys.stderr)
+
+
+# ============================================
+# Prometheus /metrics
+# ============================================
+
+METRIC_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL_PAIR = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape_metrics(base_url):
+    """Снимок /metrics: {(name, frozenset(labels)): value}"""
+    response = requests.get(f"{base_url}/metrics", timeout=10)
+    response.raise_for_status()
+
+    samples = {}
+    for line in response.text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels_text, value = match.groups()
+        labels = frozenset(LABEL_PAIR.findall(labels_text or ''))
+        try:
+            samples[(name, labels)] = float(value.replace('+Inf', 'inf'))
+        except ValueError:
+            continue
+    return samples
+
+
+def metric_delta(before, after, name):
+    """Прирост метрики между двумя снимками (для counter/histogram)"""
+    result = {}
+    for (metric, labels), value in after.items():
+        if metric == name:
+            result[labels] = value - before.get((metric, labels), 0.0)
+    return result
+
+
+def histogram_quantiles(before, after, name, group_label, quantiles=(0.5, 0.95, 0.99)):
+    """
+    Квантили гистограммы за время прогона (как histogram_quantile в Prometheus:
+    линейная интерполяция внутри бакета)
+    """
+    buckets = {}
+    for labels, count in metric_delta(before, after, f"{name}_bucket").items():
+        labels = dict(labels)
+        group = labels.get(group_label, 'all')
+        le = float(labels['le'].replace('+Inf', 'inf'))
+        buckets.setdefault(group, {})
+        buckets[group][le] = buckets[group].get(le, 0.0) + count
+
+    sums = {dict(l).get(group_label, 'all'): v for l, v in metric_delta(before, after, f"{name}_sum").items()}
+
+    result = {}
+    for group, by_le in buckets.items():
+        bounds = sorted(by_le.items())
+        total = bounds[-1][1] if bounds else 0
+        if total <= 0:
+            continue
+
+        stats = {"count": int(total), "mean": round(sums.get(group, 0.0) / total, 4)}
+        for q in quantiles:
+            rank = q * total
+            prev_bound, prev_count = 0.0, 0.0
+            value = None
+            for bound, cumulative in bounds:
+                if cumulative >= rank:
+                    if bound == float('inf'):
+                        value = prev_bound
+                    elif cumulative == prev_count:
+                        value = bound
+                    else:
+                        value = prev_bound + (bound - prev_bound) * (rank - prev_count) / (cumulative - prev_count)
+                    break
+                prev_bound, prev_count = bound, cumulative
+            stats[f"p{int(q * 100)}"] = round(value, 4) if value is not None else None
+        result[group] = stats
+
+    return result
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(q * len(ordered)))
+    return round(ordered[index], 3)
+
+
+# ============================================
+# Пиковый RSS
+# ============================================
+
+class RssSampler(threading.Thread):
+    """
+    Раз в interval секунд читает RSS приложения:
+    /proc/<pid>/status (если указан --app-pid) или gauge из /metrics.
+    Заодно собирает лаг event loop - gauge сбрасывается на каждом scrape,
+    поэтому каждый снимок = лаг за последний interval
+    """
+
+    def __init__(self, base_url, pid=None, interval=1.0):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.samples = 0
+        self.lag_p99 = []
+        self.lag_max = 0.0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            rss = self._read()
+            if rss:
+                self.peak = max(self.peak, rss)
+                self.samples += 1
+            self.stop_event.wait(self.interval)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=5)
+
+    def _read(self):
+        try:
+            samples = scrape_metrics(self.base_url)
+            p99 = samples.get(('nodejs_eventloop_lag_seconds', frozenset({('quantile', '0.99')})))
+            if p99 is not None:
+                self.lag_p99.append(p99)
+                lag_max = samples.get(('nodejs_eventloop_lag_seconds', frozenset({('quantile', 'max')})), 0)
+                self.lag_max = max(self.lag_max, lag_max)
+
+            if self.pid:
+                with open(f"/proc/{self.pid}/status") as status:
+                    for line in status:
+                        # VmHWM - пик RSS за жизнь процесса
+                        if line.startswith('VmHWM:'):
+                            return int(line.split()[1]) * 1024
+            return int(samples.get(('process_resident_memory_bytes', frozenset()), 0))
+        except Exception:
+            return 0
+
+
+# ============================================
+# Сессии
+# ============================================
+
+def run_session(base_url, session_num, topic, queries_per_session, timeout):
+    """Полная сессия: тема -> выбор запросов -> обработка -> ожидание завершения"""
+    start_time = time.time()
+    log("🔵", f"Session #{session_num} START", BLUE)
+
+    try:
+        response = requests.post(
+            f"{base_url}/api/topics",
+            json={"main_topic": f"{topic} #{session_num}", "target_count": queries_per_session},
+            timeout=timeout
+        )
+        data = response.json()
+        if not data.get('success'):
+            raise RuntimeError(f"topic creation failed: {data.get('error')}")
+        session_id = data['data']['session_id']
+
+        queries = requests.get(f"{base_url}/api/topics/{session_id}/queries", timeout=30).json()
+        query_ids = [q['query_id'] for q in queries.get('data', []) if q.get('query_id')]
+        requests.post(f"{base_url}/api/topics/{session_id}/select", json={"query_ids": query_ids}, timeout=30)
+
+        requests.post(f"{base_url}/api/sessions/{session_id}/process", json={}, timeout=30).raise_for_status()
+
+        status = None
+        session = {}
+        while time.time() - start_time < timeout:
+            time.sleep(2)
+            session = requests.get(f"{base_url}/api/sessions/{session_id}", timeout=30).json().get('data', {})
+            status = session.get('status')
+            if status in ('completed', 'failed', 'cancelled'):
+                break
+
+        elapsed = time.time() - start_time
+        ok = status == 'completed'
+        log("✅" if ok else "❌", f"Session #{session_num} {status or 'timeout'} in {elapsed:.1f}s",
+            GREEN if ok else RED)
+
+        return {
+            "success": ok,
+            "session_num": session_num,
+            "session_id": session_id,
+            "status": status or 'timeout',
+            "elapsed": elapsed,
+            "queries": len(query_ids),
+            "companies": int(session.get('companies_found') or 0)
+        }
+
+    except Exception as e:
+        elapsed = time.time() - start_time
+        log("❌", f"Session #{session_num} ERROR: {e}", RED)
+        return {
+            "success": False,
+            "session_num": session_num,
+            "elapsed": elapsed,
+            "error": str(e),
+            "companies": 0
+        }
+
+
+def start_stub(stub_url, stub_args):
+    port = stub_url.rsplit(':', 1)[-1].strip('/')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts', 'stub-ai-server.js')
+    process = subprocess.Popen(
+        ['node', script, '--port', port] + shlex.split(stub_args or ''),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.STDOUT
+    )
+
+    for _ in range(50):
+        try:
+            if requests.get(f"{stub_url}/health", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("Stub AI server did not start")
+
+
+def run_benchmark(args):
+    if args.start_stub:
+        log("🧪", f"Starting stub AI server at {args.stub_url}", YELLOW)
+        stub_process = start_stub(args.stub_url, args.stub_args)
+    else:
+        stub_process = None
+
+    try:
+        requests.get(f"{args.stub_url}/health", timeout=5).raise_for_status()
+        requests.get(f"{args.base_url}/health", timeout=5).raise_for_status()
+        requests.post(f"{args.stub_url}/stats/reset", timeout=5)
+
+        metrics_before = scrape_metrics(args.base_url)
+        sampler = RssSampler(args.base_url, args.app_pid)
+        sampler.start()
+
+        log("🚀", f"Running {args.sessions} sessions, concurrency {args.concurrency}...", YELLOW)
+        started = time.time()
+        results = []
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_session, args.base_url, i + 1, args.topic, args.queries, args.timeout)
+                for i in range(args.sessions)
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+        wall_seconds = time.time() - started
+        time.sleep(1)  # Дать последним метрикам записаться
+        sampler.stop()
+
+        metrics_after = scrape_metrics(args.base_url)
+        stub_stats = requests.get(f"{args.stub_url}/stats", timeout=5).json()
+    finally:
+        if stub_process:
+            stub_process.terminate()
+
+    companies = sum(r.get('companies', 0) for r in results)
+    successful = [r for r in results if r['success']]
+    app_api_calls = sum(metric_delta(metrics_before, metrics_after, 'ai_api_request_duration_seconds_count').values())
+
+    report = {
+        "generated_at": datetime.now().isoformat(),
+        "config": {
+            "base_url": args.base_url,
+            "stub_url": args.stub_url,
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "queries_per_session": args.queries,
+            "stub_args": args.stub_args
+        },
+        "sessions": {
+            "total": len(results),
+            "successful": len(successful),
+            "failed": len(results) - len(successful),
+            "wall_seconds": round(wall_seconds, 2),
+            "duration_p50": percentile([r['elapsed'] for r in results], 0.5),
+            "duration_p95": percentile([r['elapsed'] for r in results], 0.95),
+            "duration_p99": percentile([r['elapsed'] for r in results], 0.99)
+        },
+        "throughput": {
+            "companies": companies,
+            "companies_per_min": round(companies / (wall_seconds / 60), 2) if wall_seconds > 0 else 0
+        },
+        "stage_latency_seconds": histogram_quantiles(
+            metrics_before, metrics_after, 'stage_duration_seconds', 'stage'
+        ),
+        "db_latency_seconds": histogram_quantiles(
+            metrics_before, metrics_after, 'db_query_duration_seconds', 'backend'
+        ),
+        "api": {
+            "stub_requests": stub_stats.get('requests', 0),
+            "app_attempts": int(app_api_calls),
+            "calls_per_company": round(stub_stats.get('requests', 0) / companies, 2) if companies else None,
+            "by_kind": stub_stats.get('byKind', {}),
+            "injected_429": stub_stats.get('injected429', 0),
+            "injected_5xx": stub_stats.get('injected5xx', 0),
+            "rate_limited": stub_stats.get('rateLimited', 0),
+            "stub_latency_ms": stub_stats.get('latencyMs', {})
+        },
+        "memory": {
+            "peak_rss_bytes": sampler.peak,
+            "peak_rss_mb": round(sampler.peak / 1024 / 1024, 1),
+            "source": f"/proc/{args.app_pid}" if args.app_pid else "/metrics",
+            "samples": sampler.samples
+        },
+        "event_loop_lag_seconds": {
+            # p99 за каждый интервал сэмплера -> распределение по прогону
+            "p99_median": percentile(sampler.lag_p99, 0.5),
+            "p99_worst": max(sampler.lag_p99) if sampler.lag_p99 else None,
+            "max": round(sampler.lag_max, 4),
+            "samples": len(sampler.lag_p99)
+        },
+        "parse_latency_seconds": histogram_quantiles(
+            metrics_before, metrics_after, 'parse_task_duration_seconds', 'mode'
+        ),
+        "results": sorted(results, key=lambda r: r['session_num'])
+    }
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against stub AI server")
+    parser.add_argument('--base-url', default=BASE_URL, help="URL приложения")
+    parser.add_argument('--stub-url', default=STUB_URL, help="URL заглушки AI API")
+    parser.add_argument('--start-stub', action='store_true', help="Запустить заглушку самому")
+    parser.add_argument('--stub-args', default='', help="Аргументы для scripts/stub-ai-server.js")
+    parser.add_argument('--sessions', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--queries', type=int, default=3, help="Под-запросов на сессию")
+    parser.add_argument('--topic', default=DEFAULT_TOPIC)
+    parser.add_argument('--timeout', type=int, default=1800, help="Таймаут одной сессии, сек")
+    parser.add_argument('--app-pid', type=int, default=None, help="PID приложения для точного пика RSS")
+    parser.add_argument('--output', default=None, help="Файл для JSON отчета (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    log("🔧", "Offline benchmark", YELLOW)
+    report = run_benchmark(args)
+
+    log("📈", f"Companies/min: {report['throughput']['companies_per_min']}", BLUE)
+    log("📞", f"API calls per company: {report['api']['calls_per_company']}", BLUE)
+    log("💾", f"Peak RSS: {report['memory']['peak_rss_mb']} MB", BLUE)
+    lag = report['event_loop_lag_seconds']
+    log("🐢", f"Event loop lag: p99 median={lag['p99_median']}s worst={lag['p99_worst']}s max={lag['max']}s", BLUE)
+    for stage, stats in sorted(report['stage_latency_seconds'].items()):
+        log("⏱️", f"{stage}: p50={stats['p50']}s p95={stats['p95']}s p99={stats['p99']}s (n={stats['count']})", BLUE)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        log("✅", f"Report saved to {args.output}", GREEN)
+    else:
+        print(output)
+
+    return 0 if report['sessions']['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        log("\n⚠️", "Benchmark interrupted by user", YELLOW)
+        sys.exit(130)
@@ -34,9 +34,10 @@ time.sleep(2)
 
 # 3. Проверить компании в базе
 print("\n📊 Шаг 3: Проверка компаний в базе...")
-response = requests.get(f"{BASE_URL}/api/debug/companies")
-companies = response.json().get('companies', [])
-session_companies = [c for c in companies if c.get('session_id') == session_id]
+response = requests.get(f"{BASE_URL}/api/debug/companies", params={
+    "session_id": session_id, "include_translations": "false", "fields": "company_name,website,stage"
+})
+session_companies = response.json().get('companies', [])
 
 print(f"   Всего компаний в сессии: {len(session_companies)}")
 
@@ -29,12 +29,19 @@ requests.post(f"{BASE_URL}/api/sessions/{session_id}/process-stage/1", timeout=1
 time.sleep(2)
 
 # Проверить компании без сайта
-response = requests.get(f"{BASE_URL}/api/debug/companies")
-companies = response.json()['companies']
-without_website = [c for c in companies if not c.get('website')]
+response = requests.get(f"{BASE_URL}/api/debug/companies", params={
+    "session_id": session_id, "has_website": "false", "include_translations": "false", "count": "exact",
+    "fields": "company_id,company_name,website,stage,stage2_raw_data"
+})
+companies_data = response.json()
+without_website = companies_data['companies']
 
-print(f"✅ Найдено {len(companies)} компаний")
-print(f"   БЕЗ сайта: {len(without_website)}")
+total = requests.get(f"{BASE_URL}/api/debug/companies", params={
+    "session_id": session_id, "limit": 0, "count": "exact", "include_translations": "false"
+}).json()['total']
+
+print(f"✅ Найдено {total} компаний")
+print(f"   БЕЗ сайта: {companies_data['total']}")
 
 if len(without_website) == 0:
     print("\n⚠️  Нет компаний без сайта для теста. Пропускаем.")
@@ -51,8 +58,11 @@ print("\n🌐 Stage 2: Поиск сайтов...")
 requests.post(f"{BASE_URL}/api/sessions/{session_id}/process-stage/2", timeout=120)
 time.sleep(2)
 
-# Проверить результат
-response = requests.get(f"{BASE_URL}/api/debug/companies")
+# Проверить результат (include_raw_data - полный ответ AI вместо ссылки *_ref)
+response = requests.get(f"{BASE_URL}/api/debug/companies", params={
+    "session_id": session_id, "include_translations": "false", "include_raw_data": "true",
+    "fields": "company_id,company_name,website,stage,stage2_raw_data"
+})
 companies = response.json()['companies']
 
 # Найти ту же компанию
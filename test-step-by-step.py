@@ -29,7 +29,8 @@ print(f"✅ Сессий в API: {len(sessions)}")
 
 # 3. Симулировать загрузку статистики (как в UI)
 print("\n📊 Шаг 3: Загрузка статистики (как в step-by-step.html)...")
-response = requests.get(f"{BASE_URL}/api/debug/companies")
+response = requests.get(f"{BASE_URL}/api/debug/companies",
+                        params={"include_translations": "false", "fields": "session_id,stage"})
 companies_data = response.json()
 all_companies = companies_data.get('companies', [])
 
@@ -63,9 +64,10 @@ time.sleep(2)
 
 # 5. Проверить компании после Stage 1
 print("\n📊 Шаг 5: Проверка компаний после Stage 1...")
-response = requests.get(f"{BASE_URL}/api/debug/companies")
-all_companies = response.json().get('companies', [])
-session_companies = [c for c in all_companies if c.get('session_id') == session_id]
+response = requests.get(f"{BASE_URL}/api/debug/companies", params={
+    "session_id": session_id, "include_translations": "false", "fields": "company_name,website,email,stage"
+})
+session_companies = response.json().get('companies', [])
 
 print(f"   Всего компаний: {len(session_companies)}")
 